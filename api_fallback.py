@@ -21,13 +21,27 @@ API Fallback Module for Speech-to-Text
 """
 
 import os
+import re
 import time
 import json
-import base64
+import random
 import asyncio
-import requests
+import wave
+import http_client
+import deadlines
+import retry_policy
+import provider_errors
+import provider_pacing
+import provider_concurrency
+import state_backend
+import google_streaming
+import transcription_jobs
+import upload_intake
+import request_bodies
 from typing import Tuple, Dict, Any, Optional
 from logging_helper import TranscriptionLogger
+from provider_health import COOLDOWNS, PROVIDER_STATS, duration_bucket, get_breaker, shared_call, shared_get
+from provider_pacing import PACING
 
 
 def get_audio_content_type(filename: str) -> str:
@@ -47,7 +61,7 @@ def get_audio_content_type(filename: str) -> str:
         return 'audio/wav'
 
 
-def detect_google_encoding(audio_content: bytes, filename: str) -> tuple:
+def detect_google_encoding(audio_content: upload_intake.AudioLike, filename: str) -> tuple:
     """
     根据音频内容和文件名检测 Google STT 所需的编码格式。
     返回 (encoding, sample_rate_hertz)，sample_rate_hertz 为 None 时不设置该字段。
@@ -84,7 +98,8 @@ API_FALLBACK_STATUS = {
         "deepgram": 0,  # v111: Deepgram
         "google": 0,
         "openai_diarize": 0  # v111: OpenAI 多说话人模型
-    }
+    },
+    "race_wins": {}  # v128: 系统音频竞速模式各 provider 胜出次数
 }
 
 # 每小时检查一次主 API 是否恢复（秒）
@@ -99,6 +114,9 @@ def is_quota_exceeded(status_code: Optional[int], error_message: str) -> bool:
     """
     判断是否是 quota 耗尽错误
     
+    🆕 v143: 只认真正的余额/额度耗尽（insufficient_quota、402、billing…）；429 突发限流、
+    "rate limit reached" 归为 rate_limited，按 Retry-After 短暂冷却，不再锁一小时。分类见 provider_errors。
+    
     Args:
         status_code: HTTP 状态码
         error_message: 错误信息
@@ -108,35 +126,15 @@ def is_quota_exceeded(status_code: Optional[int], error_message: str) -> bool:
     """
     if not error_message:
         return False
-    
-    error_lower = str(error_message).lower()
-    
-    # 常见的 quota 耗尽指示符
-    quota_keywords = [
-        "quota",
-        "exceeded",
-        "insufficient",
-        "limit reached",
-        "out of credits",
-        "insufficient_quota",
-        "rate_limit_exceeded",
-        "billing",
-        "payment required"
-    ]
-    
-    # 检查关键词
-    has_quota_keyword = any(keyword in error_lower for keyword in quota_keywords)
-    
-    # 检查 HTTP 状态码
-    is_quota_status = status_code in [402, 429]  # 402: Payment Required, 429: Too Many Requests
-    
-    return has_quota_keyword or is_quota_status
+    return provider_errors.classify(status_code, error_message) == provider_errors.QUOTA_EXHAUSTED
 
 
 def is_temporary_error(status_code: Optional[int], error_message: str) -> bool:
     """
     判断是否是临时错误（值得重试）
     
+    🆕 v143: 即 provider_errors 的 transient 类：5xx / 408、网络层超时与连接错误。
+    
     Args:
         status_code: HTTP 状态码
         error_message: 错误信息
@@ -146,70 +144,120 @@ def is_temporary_error(status_code: Optional[int], error_message: str) -> bool:
     """
     if not error_message:
         return False
-    
-    error_lower = str(error_message).lower()
-    
-    # 临时错误关键词
-    temp_keywords = [
-        "timeout",
-        "connection",
-        "network",
-        "temporary",
-        "unavailable",
-        "try again"
-    ]
-    
-    # 检查关键词
-    has_temp_keyword = any(keyword in error_lower for keyword in temp_keywords)
-    
-    # 检查 HTTP 状态码
-    is_temp_status = status_code in [500, 502, 503, 504]  # 服务器错误
-    
-    return has_temp_keyword or is_temp_status
+    return provider_errors.classify(status_code, error_message) == provider_errors.TRANSIENT
+
+
+def extract_status_code(error_message: str) -> Optional[int]:
+    """从适配器的错误文本里取出 HTTP 状态码（格式统一为 "XXX API 错误 [503]: ..."）"""
+    return provider_errors.extract_status_code(error_message)
+
+
+def is_provider_health_failure(error_message: str) -> bool:
+    """
+    🆕 v129: 该错误是否说明 provider 本身不健康（计入熔断器错误率）。
+
+    超时、连接错误、5xx 算；空文本/幻觉/4xx 参数错误是这段音频的问题，不算。
+    v143: 429 限流、鉴权错误也不算——它们有各自的冷却（_apply_error_class）。
+    """
+    return is_temporary_error(extract_status_code(error_message), error_message)
 
 
 def should_retry_api(api_name: str) -> bool:
     """
     判断是否应该重试某个 API
     
+    🆕 v129: 除配额标记外，还要问该 provider 的熔断器（provider_health.CircuitBreaker）——
+    provider 只是慢或持续 5xx 时，熔断期间直接跳过，不再每个请求都白等一次。
+    这里只做只读判断，不占用 half-open 的探测名额（名额在 _attempt_provider 真正调用前才占）。
+    
     Args:
-        api_name: API 名称 ("deepgram", "ai_builder", "openai")
+        api_name: API 名称 ("deepgram", "ai_builder", "openai", "google", "openai_diarize")
     
     Returns:
         bool: True 表示应该重试
     """
-    # 🆕 v111: Deepgram
-    if api_name == "deepgram":
-        if API_FALLBACK_STATUS["deepgram_quota_exceeded"]:
-            last_check = API_FALLBACK_STATUS["deepgram_last_check"]
-            if last_check and (time.time() - last_check) < QUOTA_RECHECK_INTERVAL:
-                return False
-            print(f"[v111-FALLBACK] Deepgram quota 检查间隔已过，尝试重新检测")
-            return True
-        return True
-    
-    elif api_name == "ai_builder":
-        # 如果标记为 quota 耗尽
-        if API_FALLBACK_STATUS["ai_builder_quota_exceeded"]:
-            # 检查是否过了重新检查间隔
-            last_check = API_FALLBACK_STATUS["ai_builder_last_check"]
-            if last_check and (time.time() - last_check) < QUOTA_RECHECK_INTERVAL:
-                return False  # 还没到重新检查的时间
-            # 过了间隔，可以重试一次
-            print(f"[FALLBACK] AI Builder Space quota 检查间隔已过，尝试重新检测")
-            return True
-        return True
-    
-    elif api_name == "openai":
-        if API_FALLBACK_STATUS["openai_quota_exceeded"]:
-            last_check = API_FALLBACK_STATUS["openai_last_check"]
-            if last_check and (time.time() - last_check) < QUOTA_RECHECK_INTERVAL:
-                return False
-            print(f"[FALLBACK] OpenAI quota 检查间隔已过，尝试重新检测")
-            return True
+    if _quota_locked(api_name):
+        return False  # 还没到重新检查的时间
+    if COOLDOWNS.remaining(api_name) > 0:
+        return False  # 🆕 v143: 限流 / 鉴权冷却中
+    if API_FALLBACK_STATUS.get(f"{api_name}_quota_exceeded"):
+        # 过了间隔，可以重试一次
+        print(f"[FALLBACK] {api_name} quota 检查间隔已过，尝试重新检测")
+
+    return get_breaker(api_name).allow_request()
+
+
+# v143: 各类错误的冷却时长（限流优先按响应头；没给头时用默认值）
+RATE_LIMIT_DEFAULT_COOLDOWN_SECONDS = float(os.environ.get("RATE_LIMIT_DEFAULT_COOLDOWN_SECONDS", "15"))
+RATE_LIMIT_MAX_COOLDOWN_SECONDS = float(os.environ.get("RATE_LIMIT_MAX_COOLDOWN_SECONDS", "300"))
+AUTH_COOLDOWN_SECONDS = float(os.environ.get("AUTH_COOLDOWN_SECONDS", "300"))
+_COOLDOWN_LABELS = {
+    provider_errors.RATE_LIMITED: "限流",
+    provider_errors.AUTH: "鉴权失败",
+    provider_errors.QUOTA_EXHAUSTED: "配额耗尽",
+}
+
+
+def _apply_error_class(provider: str, error_class: Optional[str], retry_after: Optional[float]) -> None:
+    """
+    🆕 v143: 按错误类别更新 provider 状态。
+    - quota_exhausted：有配额标记的 provider 置 *_quota_exceeded（锁 QUOTA_RECHECK_INTERVAL），其余冷却同样时长；
+    - rate_limited：按 Retry-After / 限流头冷却（缺省 RATE_LIMIT_DEFAULT_COOLDOWN_SECONDS，封顶 RATE_LIMIT_MAX_COOLDOWN_SECONDS）；
+    - auth：冷却 AUTH_COOLDOWN_SECONDS；
+    - bad_input / transient：不冷却（transient 交给熔断器）。
+    """
+    if error_class == provider_errors.QUOTA_EXHAUSTED:
+        # v121：配额状态键统一由 provider 名拼出（原先手写 API_BUILDER_STATUS 笔误导致 NameError）
+        if f"{provider}_quota_exceeded" in API_FALLBACK_STATUS:
+            API_FALLBACK_STATUS[f"{provider}_quota_exceeded"] = True
+            API_FALLBACK_STATUS[f"{provider}_last_check"] = time.time()
+            # v147：告诉别的 worker / 副本，省得它们各自再撞一次
+            shared_call("set", f"quota:{provider}", time.time(), ttl=QUOTA_RECHECK_INTERVAL)
+        else:
+            COOLDOWNS.set(provider, QUOTA_RECHECK_INTERVAL, error_class)
+        print(f"[v143-ERRORS] 💳 {provider} 配额耗尽，{QUOTA_RECHECK_INTERVAL}s 后再检测")
+    elif error_class == provider_errors.RATE_LIMITED:
+        seconds = RATE_LIMIT_DEFAULT_COOLDOWN_SECONDS if retry_after is None else retry_after
+        seconds = min(RATE_LIMIT_MAX_COOLDOWN_SECONDS, seconds)
+        COOLDOWNS.set(provider, seconds, error_class)
+        print(f"[v143-ERRORS] 🚦 {provider} 被限流，冷却 {seconds:.1f}s"
+              f"{'（按响应头）' if retry_after is not None else ''}")
+    elif error_class == provider_errors.AUTH:
+        COOLDOWNS.set(provider, AUTH_COOLDOWN_SECONDS, error_class)
+        print(f"[v143-ERRORS] 🔑 {provider} 鉴权失败，冷却 {AUTH_COOLDOWN_SECONDS:.0f}s")
+
+
+def _quota_shared(api_name: str) -> bool:
+    """v147：别的进程判定配额耗尽、且仍在 QUOTA_RECHECK_INTERVAL 之内（共享状态里的键按它过期）"""
+    return f"{api_name}_quota_exceeded" in API_FALLBACK_STATUS and shared_get(f"quota:{api_name}") is not None
+
+
+def _quota_locked(api_name: str) -> bool:
+    """配额耗尽且仍在 QUOTA_RECHECK_INTERVAL 之内"""
+    if _quota_shared(api_name):
         return True
-    
-    return True
+    if not API_FALLBACK_STATUS.get(f"{api_name}_quota_exceeded"):
+        return False
+    last_check = API_FALLBACK_STATUS.get(f"{api_name}_last_check")
+    return bool(last_check and (time.time() - last_check) < QUOTA_RECHECK_INTERVAL)
+
+
+def _count_usage(api_name: str) -> None:
+    """用量计数：本进程一份，共享状态里再累加一份（v147，多 worker 合计）"""
+    API_FALLBACK_STATUS["api_usage_count"][api_name] += 1
+    shared_call("incr", f"usage:{api_name}")
+
+
+def skip_reason(api_name: str) -> str:
+    """should_retry_api 返回 False 时的原因（日志/错误汇总用）"""
+    if API_FALLBACK_STATUS.get(f"{api_name}_quota_exceeded") or _quota_shared(api_name):
+        return "配额已耗尽"
+    cooldown = COOLDOWNS.describe(api_name)
+    if cooldown:
+        label = _COOLDOWN_LABELS.get(cooldown["reason"], cooldown["reason"])
+        return f"{label}冷却中（还剩 {cooldown['remaining']:.0f}s）"
+    breaker = get_breaker(api_name)
+    return f"熔断中（{breaker.last_trip_reason}）"
 
 
 # ================================================================================
@@ -217,7 +265,7 @@ def should_retry_api(api_name: str) -> bool:
 # ================================================================================
 
 async def _transcribe_openai_diarize(
-    audio_content: bytes,
+    audio_content: upload_intake.AudioLike,
     filename: str,
     language: Optional[str] = None,
     duration: Optional[int] = None,
@@ -233,7 +281,7 @@ async def _transcribe_openai_diarize(
     - ✅ 确保所有说话人的话都被转录
     
     Args:
-        audio_content: 音频文件的二进制内容
+        audio_content: 音频内容（bytes / memoryview / upload_intake.AudioSource）
         filename: 音频文件名
         language: 语言代码（可选）
         duration: 音频时长（秒）
@@ -257,10 +305,6 @@ async def _transcribe_openai_diarize(
     api_url = "https://api.openai.com/v1/audio/transcriptions"
     
     # 准备请求
-    files = {
-        'file': (filename, audio_content, get_audio_content_type(filename))
-    }
-    
     # 🔥 v112: 使用 diarized_json 格式以获取完整的多说话人转录
     # 参考文档: https://platform.openai.com/docs/api-reference/audio/createTranscription
     data = {
@@ -276,27 +320,29 @@ async def _transcribe_openai_diarize(
     else:
         print(f"[v112-OPENAI-DIARIZE] 🌍 使用自动语言识别")
     
+    # v136: multipart 请求体一次拼好，音频部分直接切 memoryview 发送
+    body = request_bodies.MultipartBody(data, 'file', filename, get_audio_content_type(filename), audio_content)
+    
     print(f"[v112-OPENAI-DIARIZE] 📤 发送转录请求（diarized_json 格式）...")
     start_time = time.time()
     
-    # 发送请求
-    response = requests.post(
+    # 发送请求（v126: 异步连接池，不再阻塞事件循环）
+    response = await http_client.post(
         api_url,
         headers={
-            "Authorization": f"Bearer {openai_api_key}"
+            "Authorization": f"Bearer {openai_api_key}",
+            **body.headers,
         },
-        files=files,
-        data=data,
-        timeout=300
+        content=body
     )
     
     api_time = time.time() - start_time
     print(f"[v112-OPENAI-DIARIZE] ⏱️ API 响应耗时: {api_time:.2f}秒")
     
     # 检查响应
+    PACING.observe("openai_diarize", response.headers)  # v144: 记下剩余限额，供主动节流
     if response.status_code != 200:
-        error_msg = f"OpenAI Diarize API 错误 [{response.status_code}]: {response.text}"
-        raise Exception(error_msg)
+        raise provider_errors.ProviderError.from_response("OpenAI Diarize", response)
     
     # 解析响应
     result = response.json()
@@ -363,7 +409,7 @@ async def _transcribe_openai_diarize(
         )
     
     # 更新全局状态
-    API_FALLBACK_STATUS["api_usage_count"]["openai_diarize"] += 1
+    _count_usage("openai_diarize")
     API_FALLBACK_STATUS["last_successful_api"] = "openai_diarize"
     
     return transcription_text, metadata
@@ -374,7 +420,7 @@ async def _transcribe_openai_diarize(
 # ================================================================================
 
 async def _transcribe_deepgram(
-    audio_content: bytes,
+    audio_content: upload_intake.AudioLike,
     filename: str,
     language: Optional[str] = None,
     duration: Optional[int] = None,
@@ -391,7 +437,7 @@ async def _transcribe_deepgram(
     - 快速响应
     
     Args:
-        audio_content: 音频文件的二进制内容
+        audio_content: 音频内容（bytes / memoryview / upload_intake.AudioSource）
         filename: 音频文件名
         language: 语言代码（可选，Deepgram 支持自动检测）
         duration: 音频时长（秒）
@@ -448,27 +494,28 @@ async def _transcribe_deepgram(
         
         headers = {
             "Authorization": f"Token {DEEPGRAM_API_KEY}",
-            "Content-Type": "audio/wav"
+            "Content-Type": "audio/wav",
+            # v135: 请求体按块流式发送，显式给长度，避免退化成 chunked 编码
+            "Content-Length": str(len(audio_content))
         }
         
         print(f"[v111-DEEPGRAM] 📤 发送转录请求...")
         start_time = time.time()
         
         # 发送请求
-        response = requests.post(
+        response = await http_client.post(
             api_url,
             headers=headers,
             params=params,
-            data=audio_content,
-            timeout=300
+            content=upload_intake.as_content(audio_content)
         )
         
         api_time = time.time() - start_time
         print(f"[v111-DEEPGRAM] ⏱️ API 响应耗时: {api_time:.2f}秒")
         
+        PACING.observe("deepgram", response.headers)  # v144: 记下剩余限额，供主动节流
         if response.status_code != 200:
-            error_msg = f"Deepgram API 错误 [{response.status_code}]: {response.text}"
-            raise Exception(error_msg)
+            raise provider_errors.ProviderError.from_response("Deepgram", response)
         
         # 解析响应
         result = response.json()
@@ -550,7 +597,7 @@ async def _transcribe_deepgram(
             )
         
         # 更新全局状态
-        API_FALLBACK_STATUS["api_usage_count"]["deepgram"] += 1
+        _count_usage("deepgram")
         API_FALLBACK_STATUS["last_successful_api"] = "deepgram"
         
         return transcription_text, metadata
@@ -654,7 +701,7 @@ def _filter_hallucinated_segments(segments, log_tag='FILTER'):
 # ================================================================================
 
 async def _transcribe_ai_builder(
-    audio_content: bytes,
+    audio_content: upload_intake.AudioLike,
     filename: str,
     language: Optional[str] = None,
     duration: Optional[int] = None,
@@ -688,11 +735,6 @@ async def _transcribe_ai_builder(
     # 准备请求
     api_url = f"{AI_BUILDER_API_BASE}/audio/transcriptions"
     
-    # 🔥 AI Builder Space 使用 'audio_file' 作为字段名（不是 'file'）
-    files = {
-        'audio_file': (filename, audio_content, get_audio_content_type(filename))
-    }
-    
     form_data = {
         'model': 'whisper-1',
         'response_format': 'verbose_json',
@@ -706,6 +748,10 @@ async def _transcribe_ai_builder(
     else:
         print(f"[v110-WHISPER] 🌍 使用自动语言识别")
     
+    # 🔥 AI Builder Space 使用 'audio_file' 作为字段名（不是 'file'）
+    # v136: 请求体只拼一次，下面冷启动重试时原样再发一遍
+    body = request_bodies.MultipartBody(form_data, 'audio_file', filename, get_audio_content_type(filename), audio_content)
+    
     # 解析转录文本 - 健壮处理 AI Builder 的多种响应格式
     # AI Builder 可能返回: dict, 双重编码的 JSON 字符串, 或纯文本字符串
     import json as _json, re as _re
@@ -762,21 +808,19 @@ async def _transcribe_ai_builder(
             print(f"[AI-BUILDER-RETRY] ⚠️ 第一次返回空文本（可能是冷启动），等待3秒后重试...")
             await asyncio.sleep(3)
 
-        response = requests.post(
+        response = await http_client.post(
             api_url,
             headers={
                 "Authorization": f"Bearer {AI_BUILDER_TOKEN}",
-                "Accept": "application/json"
+                "Accept": "application/json",
+                **body.headers,
             },
-            files=files,
-            data=form_data,
-            timeout=300
+            content=body
         )
 
         # 检查响应状态
         if response.status_code != 200:
-            error_msg = f"AI Builder Space API 错误 [{response.status_code}]: {response.text}"
-            raise Exception(error_msg)
+            raise provider_errors.ProviderError.from_response("AI Builder Space", response)
 
         # 解析响应
         raw_text = response.text
@@ -816,7 +860,7 @@ async def _transcribe_ai_builder(
 # ================================================================================
 
 async def _transcribe_openai(
-    audio_content: bytes,
+    audio_content: upload_intake.AudioLike,
     filename: str,
     language: Optional[str] = None,
     duration: Optional[int] = None,  # 🆕 v111: 添加 duration 参数
@@ -838,11 +882,6 @@ async def _transcribe_openai(
     # OpenAI API endpoint
     api_url = "https://api.openai.com/v1/audio/transcriptions"
     
-    # 准备请求
-    files = {
-        'file': (filename, audio_content, get_audio_content_type(filename))
-    }
-    
     # 使用 whisper-1：中文准确率比 gpt-4o-transcribe 更稳定，社区反馈 gpt-4o-transcribe 在中文上有误识别问题
     # temperature=0：固定贪心解码，大幅减少幻觉（Whisper 官方推荐对非实时场景使用）
     data = {
@@ -858,21 +897,23 @@ async def _transcribe_openai(
     else:
         print(f"[OPENAI-TRANSCRIBE] 🌍 使用自动语言识别")
     
+    # 准备请求（v136: multipart 一次拼好，音频部分切 memoryview 发送）
+    body = request_bodies.MultipartBody(data, 'file', filename, get_audio_content_type(filename), audio_content)
+    
     # 发送请求
-    response = requests.post(
+    response = await http_client.post(
         api_url,
         headers={
-            "Authorization": f"Bearer {openai_api_key}"
+            "Authorization": f"Bearer {openai_api_key}",
+            **body.headers,
         },
-        files=files,
-        data=data,
-        timeout=300  # v109: 增加超时到 5 分钟
+        content=body  # v109 的 5 分钟超时现为 http_client 的默认 read 超时
     )
     
     # 检查响应
+    PACING.observe("openai", response.headers)  # v144: 记下剩余限额，供主动节流
     if response.status_code != 200:
-        error_msg = f"OpenAI API 错误 [{response.status_code}]: {response.text}"
-        raise Exception(error_msg)
+        raise provider_errors.ProviderError.from_response("OpenAI", response)
     
     # 解析响应
     result = response.json()
@@ -1094,17 +1135,19 @@ def parse_diarization_result(result: Dict[str, Any], remove_speaker_labels: bool
 
 
 async def _transcribe_google(
-    audio_content: bytes,
+    audio_content: upload_intake.AudioLike,
     filename: str,
     language: Optional[str] = None,
     logger: Optional[TranscriptionLogger] = None,
     enable_diarization: bool = False,  # 🎙️ v110: 是否启用说话人分离
-    remove_speaker_labels: bool = False  # 🔥 v112: 是否移除说话人标签
+    remove_speaker_labels: bool = False,  # 🔥 v112: 是否移除说话人标签
+    duration: Optional[int] = None  # 🆕 v137: 音频时长（秒），决定走同步还是 long-running
 ) -> Tuple[str, Dict[str, Any]]:
     """
     调用 Google Cloud Speech-to-Text API 进行转录
     🎙️ v110: 支持多说话人分离（Speaker Diarization）
     🔥 v112: 支持移除说话人标签（转录所有人但不显示标签）
+    🕐 v137: 超过同步上限的长音频自动改走 longrunningrecognize
     
     Args:
         audio_content: 音频内容
@@ -1113,11 +1156,12 @@ async def _transcribe_google(
         logger: 日志记录器
         enable_diarization: 是否启用多说话人分离
         remove_speaker_labels: 是否移除说话人标签（True = 只返回完整文本）
+        duration: 音频时长（秒，可选；缺省时从 WAV 头估算）
     
     Returns:
         Tuple[str, dict]: (转录文本, 元数据)
     """
-    from server2 import get_access_token, get_project_id
+    from server2 import get_access_token_async, get_project_id
     
     print(f"[FALLBACK] 尝试使用 Google Cloud Speech-to-Text API")
     if enable_diarization:
@@ -1128,15 +1172,12 @@ async def _transcribe_google(
             print(f"[v112-GOOGLE-DIARIZATION] 📋 模式: 转录所有说话人并显示标签")
     
     # 获取访问令牌和项目 ID
-    access_token = get_access_token()
+    access_token = await get_access_token_async()
     project_id = get_project_id()
     
     # Google API endpoint
     api_url = f"https://speech.googleapis.com/v1/speech:recognize"
     
-    # 编码音频
-    audio_base64 = base64.b64encode(audio_content).decode('utf-8')
-    
     # 自动检测编码格式（支持 WAV/LINEAR16 和 WebM/WEBM_OPUS）
     google_encoding, sample_rate = detect_google_encoding(audio_content, filename)
     print(f"[GOOGLE-STT] 检测到编码格式: {google_encoding}" + (f", 采样率: {sample_rate}Hz" if sample_rate else "（采样率自动检测）"))
@@ -1172,38 +1213,54 @@ async def _transcribe_google(
         }
         print(f"[v112-GOOGLE-DIARIZATION] 配置: minSpeakers=1, maxSpeakers=6（优化准确率）")
     
-    # 构建请求体
-    request_body = {
-        "config": config,
-        "audio": {
-            "content": audio_base64
-        }
-    }
+    # 构建请求体（v136: 发送时边读边 base64，不在内存里生成整段 base64 字符串）
+    request_body = request_bodies.GoogleRecognizeBody(config, audio_content)
+    
+    # 🕐 v137: 同步接口只收约 1 分钟音频，更长的直接走 long-running
+    # 📡 v138: 开启 StreamingRecognize（且有可用的 gRPC 传输）时，5 分钟以内的音频按帧流式识别
+    audio_seconds = duration or _estimate_audio_seconds(audio_content)
+    if google_streaming.enabled() and (not audio_seconds or audio_seconds <= google_streaming.GOOGLE_STREAMING_MAX_SECONDS):
+        mode = "streaming"
+    elif audio_seconds and audio_seconds > GOOGLE_SYNC_MAX_SECONDS:
+        mode = "longrunning"
+    else:
+        mode = "sync"
+    lro_info = stream_info = None
+    status_code = 200
     
-    print(f"[v112-GOOGLE] 📤 发送转录请求...")
     start_time = time.time()
     
-    # 发送请求
-    response = requests.post(
-        api_url,
-        headers={
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        },
-        json=request_body,
-        timeout=300  # v109: 增加超时到 5 分钟
-    )
+    if mode == "streaming":
+        print(f"[v138-GOOGLE-STREAM] 📡 StreamingRecognize（{audio_seconds or '?'}s）")
+        result, stream_info = await google_streaming.streaming_recognize(audio_content, config)
     
-    api_time = time.time() - start_time
-    print(f"[v112-GOOGLE] ⏱️ API 响应耗时: {api_time:.2f}秒")
+    if mode == "sync":
+        print(f"[v112-GOOGLE] 📤 发送转录请求...")
+        response = await http_client.post(
+            api_url,
+            headers={
+                "Authorization": f"Bearer {access_token}",
+                **request_body.headers,
+            },
+            content=request_body
+        )
+        status_code = response.status_code
+        
+        if response.status_code == 400 and _google_sync_too_long(response.text):
+            # 时长未知/估错：Google 收完整段才报"太长"，请求体可重复发送，改走 long-running
+            print(f"[v137-GOOGLE-LRO] ⚠️ 同步接口拒绝（音频超过 1 分钟），改用 longrunningrecognize")
+            mode = "longrunning"
+        elif response.status_code != 200:
+            raise provider_errors.ProviderError.from_response("Google", response)
+        else:
+            result = response.json()
     
-    # 检查响应
-    if response.status_code != 200:
-        error_msg = f"Google API 错误 [{response.status_code}]: {response.text}"
-        raise Exception(error_msg)
+    if mode == "longrunning":
+        print(f"[v137-GOOGLE-LRO] 📤 长音频（{audio_seconds or '?'}s），使用 longrunningrecognize")
+        result, lro_info = await _google_long_running(request_body, access_token)
     
-    # 解析响应
-    result = response.json()
+    api_time = time.time() - start_time
+    print(f"[v112-GOOGLE] ⏱️ API 响应耗时: {api_time:.2f}秒")
     
     # 🌍 检测实际使用的语言（如果 Google API 返回了 languageCode）
     detected_language = None
@@ -1241,7 +1298,7 @@ async def _transcribe_google(
     metadata = {
         "api": "google",
         "model": "default",
-        "status_code": response.status_code,
+        "status_code": status_code,
         "diarization_enabled": enable_diarization,
         "speaker_labels_removed": remove_speaker_labels,  # 🔥 v112: 新增标识
         "detected_language": detected_language,  # 🌍 添加检测到的语言
@@ -1251,9 +1308,98 @@ async def _transcribe_google(
     if enable_diarization:
         metadata["speaker_count"] = count_unique_speakers(result)
     
+    if mode != "sync":
+        metadata["google_mode"] = mode
+    if lro_info is not None:
+        metadata["google_operation"] = lro_info
+    if stream_info is not None:
+        metadata["google_stream"] = stream_info
+    
     return text, metadata
 
 
+# --------------------------------------------------------------------------------
+# v137: Google long-running 识别
+#
+# `speech:recognize` 只收约 1 分钟音频，5–10 分钟的系统音频要先整段上传、被拒，再落到
+# Deepgram。长音频改走 `speech:longrunningrecognize`：提交后拿到 operation 名，再用
+# asyncio.sleep 退避轮询 `operations/{name}`——等待期间不占线程，事件循环照常服务其他请求。
+# 每次轮询把 progressPercent 报给当前任务（/transcribe-jobs 的 GET / SSE 可见）。
+#
+# 注：内联音频（audio.content）整个请求体上限 10MB；更长的 WAV 需要先传 GCS 用 uri，
+# 本项目没有配置 bucket，暂不支持——这类请求 Google 会直接报错，链路照旧落到下一个 provider。
+# --------------------------------------------------------------------------------
+
+GOOGLE_SYNC_MAX_SECONDS = float(os.environ.get("GOOGLE_SYNC_MAX_SECONDS", "55"))   # 官方上限 60s，留余量
+GOOGLE_LRO_POLL_INITIAL = float(os.environ.get("GOOGLE_LRO_POLL_INITIAL", "1.0"))
+GOOGLE_LRO_POLL_MAX = float(os.environ.get("GOOGLE_LRO_POLL_MAX", "10.0"))
+GOOGLE_LRO_POLL_FACTOR = 1.5
+GOOGLE_LRO_TIMEOUT_SECONDS = float(os.environ.get("GOOGLE_LRO_TIMEOUT_SECONDS", "900"))
+
+
+def _estimate_audio_seconds(audio_content: upload_intake.AudioLike) -> Optional[float]:
+    """从 WAV 头估算时长；其他格式（WebM 等）不解码，返回 None。"""
+    if len(audio_content) < 12 or audio_content[:4] != b"RIFF" or audio_content[8:12] != b"WAVE":
+        return None
+    try:
+        with wave.open(upload_intake.open_reader(audio_content), "rb") as w:
+            return w.getnframes() / float(w.getframerate())
+    except (wave.Error, EOFError, ZeroDivisionError):
+        return None
+
+
+def _google_sync_too_long(error_text: str) -> bool:
+    # 官方报错："Sync input too long. For audio longer than 1 min use LongRunningRecognize ..."
+    text = (error_text or "").lower()
+    return "too long" in text or "longrunningrecognize" in text
+
+
+async def _google_long_running(request_body, access_token: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """提交 longrunningrecognize 并退避轮询到完成，返回 (识别结果 JSON, 操作信息)。"""
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = await http_client.post(
+        "https://speech.googleapis.com/v1/speech:longrunningrecognize",
+        headers={**headers, **request_body.headers},
+        content=request_body
+    )
+    if response.status_code != 200:
+        raise provider_errors.ProviderError.from_response("Google", response)
+    name = response.json().get("name")
+    if not name:
+        raise Exception(f"Google longrunningrecognize 未返回 operation: {response.text}")
+    print(f"[v137-GOOGLE-LRO] 🆔 operation {name}")
+    transcription_jobs.report_progress(stage="google_longrunning", percent=0)
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + GOOGLE_LRO_TIMEOUT_SECONDS
+    delay = GOOGLE_LRO_POLL_INITIAL
+    polls = 0
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise Exception(f"Google longrunningrecognize 超时（{GOOGLE_LRO_TIMEOUT_SECONDS:.0f}s 未完成）")
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * GOOGLE_LRO_POLL_FACTOR, GOOGLE_LRO_POLL_MAX)
+
+        poll = await http_client.get(f"https://speech.googleapis.com/v1/operations/{name}", headers=headers)
+        polls += 1
+        if poll.status_code != 200:
+            raise provider_errors.ProviderError.from_response("Google", poll)
+        op = poll.json()
+        percent = (op.get("metadata") or {}).get("progressPercent", 0)
+        if op.get("done"):
+            break
+        print(f"[v137-GOOGLE-LRO] ⏳ 第 {polls} 次轮询: {percent}%")
+        transcription_jobs.report_progress(stage="google_longrunning", percent=percent)
+
+    if "error" in op:
+        error = op["error"]
+        raise Exception(f"Google longrunningrecognize 失败 [{error.get('code')}]: {error.get('message')}")
+    transcription_jobs.report_progress(stage="google_longrunning", percent=100)
+    print(f"[v137-GOOGLE-LRO] ✅ 完成，共轮询 {polls} 次")
+    return op.get("response") or {}, {"name": name, "polls": polls}
+
+
 # ================================================================================
 # 转录文本后处理：去除 JSON 残留符号
 # ================================================================================
@@ -1405,118 +1551,483 @@ def _postprocess_transcript(text: str) -> str:
 # 核心 Fallback 函数
 # ================================================================================
 
+# --------------------------------------------------------------------------------
+# v127: 对冲请求（hedged requests）
+#
+# 顺序 fallback 的尾延迟由最慢的那个 provider 决定：Whisper 卡住时要等它彻底失败
+# （最长 300s）才轮到 AI Builder。对冲模式下，主 API 超过阈值仍未返回就**并行**启动
+# 下一个，谁先给出有效结果用谁，另一个立即取消——p99 被压到约"阈值 + 第二个 API 耗时"。
+#
+# 默认关闭：开启后部分请求会被两个付费 API 同时转录，是拿钱换尾延迟，需要 owner 显式打开。
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "").strip().lower() in ("1", "true", "yes", "on")
+# 阈值：主 API 在该时长档位有足够样本时取其历史分位耗时，否则用固定秒数兜底
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DELAY_SECONDS = float(os.environ.get("HEDGE_DELAY_SECONDS", "8"))
+# 同时在飞的请求上限（主 + 对冲），防止一次请求把整条链全打出去
+HEDGE_MAX_PARALLEL = int(os.environ.get("HEDGE_MAX_PARALLEL", "2"))
+# --------------------------------------------------------------------------------
+
+
+def _hedge_threshold(provider: str, duration: Optional[int]) -> float:
+    """该 provider 的对冲阈值（秒）：历史 p95（按时长档位）或固定兜底值。"""
+    observed = PROVIDER_STATS.percentile(provider, duration, HEDGE_PERCENTILE,
+                                         min_samples=HEDGE_MIN_SAMPLES)
+    return observed if observed is not None else HEDGE_DELAY_SECONDS
+
+
+def _microphone_chain(audio_content, filename, language, duration, logger):
+    """麦克风 fallback 链，顺序即优先级。
+
+    每项：(provider 名, 对外 api_used 标签, 日志名, 调用工厂)。
+    调用工厂在调用时才解析 `_transcribe_*`，测试 monkeypatch 模块属性依然生效。
+    """
+    return [
+        ("openai", "openai_whisper", "OpenAI",
+         lambda: _transcribe_openai(audio_content, filename, language, duration, logger)),
+        ("ai_builder", "ai_builder", "AI Builder",
+         lambda: _transcribe_ai_builder(audio_content, filename, language, duration, logger)),
+        ("google", "google", "Google",
+         lambda: _transcribe_google(audio_content, filename, language, logger,
+                                    enable_diarization=False, remove_speaker_labels=False,
+                                    duration=duration)),
+    ]
+
+
+# --------------------------------------------------------------------------------
+# v130: 麦克风链路自适应排序
+#
+# 链路顺序原本写死（OpenAI → AI Builder → Google）。provider 延迟会按时段漂移，
+# 静态顺序白白丢掉几秒。MIC_ROUTING_MODE=adaptive 时，按 provider_health 里
+# (provider, 时长档位) 的 EWMA 估计"拿到有效结果的期望耗时"（EWMA 延迟 / EWMA 成功率）
+# 从快到慢排，但要满足 owner 设定的约束：
+#   · 质量：只有 ROUTING_PRIMARY_CANDIDATES 里的 provider 能被提前（Google 中文准确率
+#     不如 Whisper，默认不允许当主力）；成功率低于 ROUTING_MIN_SUCCESS_RATE 的不提前；
+#   · 成本：每分钟单价高于 ROUTING_MAX_COST_PER_MIN 的不提前；
+#   · 数据：样本少于 ROUTING_MIN_SAMPLES、或熔断中的不提前。
+# 不满足约束的 provider 不会被删掉，只是按原顺序排在后面继续当兜底。
+# ROUTING_EXPLORE_RATE 的请求保持静态顺序，让排在后面的 provider 也能持续积累样本。
+# --------------------------------------------------------------------------------
+MIC_ROUTING_MODE = os.environ.get("MIC_ROUTING_MODE", "static").strip().lower()
+ROUTING_PRIMARY_CANDIDATES = [
+    p.strip() for p in os.environ.get("ROUTING_PRIMARY_CANDIDATES", "openai,ai_builder").split(",")
+    if p.strip()
+]
+ROUTING_MIN_SAMPLES = int(os.environ.get("ROUTING_MIN_SAMPLES", "10"))
+ROUTING_MIN_SUCCESS_RATE = float(os.environ.get("ROUTING_MIN_SUCCESS_RATE", "0.8"))
+# 不设即不限（注意不能用 inf 兜底：get_api_status() 会进 JSON 响应，inf 无法序列化）
+ROUTING_MAX_COST_PER_MIN = (float(os.environ["ROUTING_MAX_COST_PER_MIN"])
+                            if os.environ.get("ROUTING_MAX_COST_PER_MIN") else None)
+ROUTING_EXPLORE_RATE = float(os.environ.get("ROUTING_EXPLORE_RATE", "0.05"))
+
+# 每分钟单价（美元），与文件头注释一致；可用 PROVIDER_COST_PER_MIN="openai=0.006,google=0.016" 覆盖
+PROVIDER_COST_PER_MIN = {
+    "openai": 0.006,
+    "openai_diarize": 0.006,
+    "ai_builder": 0.0,      # 免费额度
+    "google": 0.016,
+    "deepgram": 0.0077,
+}
+for _item in os.environ.get("PROVIDER_COST_PER_MIN", "").split(","):
+    if "=" in _item:
+        _name, _price = _item.split("=", 1)
+        try:
+            PROVIDER_COST_PER_MIN[_name.strip()] = float(_price)
+        except ValueError:
+            print(f"[v130-ROUTING] ⚠️ 忽略无效单价配置: {_item!r}")
+
+_LAST_ROUTING_DECISION: Dict[str, Any] = {}
+
+
+def _routing_ineligible(provider: str, duration: Optional[int]) -> Optional[str]:
+    """该 provider 不能被提前的原因；可以提前返回 None。"""
+    if provider not in ROUTING_PRIMARY_CANDIDATES:
+        return "不在主力候选名单"
+    if ROUTING_MAX_COST_PER_MIN is not None and PROVIDER_COST_PER_MIN.get(provider, 0.0) > ROUTING_MAX_COST_PER_MIN:
+        return "单价超出上限"
+    if not get_breaker(provider).allow_request():
+        return "熔断中"
+    est = PROVIDER_STATS.ewma(provider, duration)
+    if est is None or est["samples"] < ROUTING_MIN_SAMPLES or est["latency"] is None:
+        return "样本不足"
+    if est["success"] < ROUTING_MIN_SUCCESS_RATE:
+        return f"成功率 {est['success']:.0%} 过低"
+    return None
+
+
+def _order_microphone_chain(chain, duration):
+    """按 MIC_ROUTING_MODE 给麦克风链排序，返回 (排序后的链, 决策摘要)。"""
+    static_order = [step[0] for step in chain]
+    decision = {"mode": MIC_ROUTING_MODE, "bucket": duration_bucket(duration), "static_order": static_order}
+
+    if MIC_ROUTING_MODE != "adaptive":
+        ordered = list(chain)
+    elif random.random() < ROUTING_EXPLORE_RATE:
+        decision["mode"] = "adaptive-explore"
+        ordered = list(chain)
+    else:
+        scored, skipped = [], {}
+        for step in chain:
+            reason = _routing_ineligible(step[0], duration)
+            if reason:
+                skipped[step[0]] = reason
+                continue
+            est = PROVIDER_STATS.ewma(step[0], duration)
+            expected = est["latency"] / max(est["success"], 0.05)
+            scored.append((expected, step))
+        scored.sort(key=lambda item: item[0])
+        promoted = [step for _, step in scored]
+        ordered = promoted + [step for step in chain if step not in promoted]
+        decision["expected_seconds"] = {step[0]: round(exp, 2) for exp, step in scored}
+        decision["not_promoted"] = skipped
+
+    decision["order"] = [step[0] for step in ordered]
+    decision["decided_at"] = time.time()
+    _LAST_ROUTING_DECISION.clear()
+    _LAST_ROUTING_DECISION.update(decision)
+    if decision["order"] != static_order:
+        print(f"[v130-ROUTING] 🔀 {decision['bucket']} 档位顺序调整为 {decision['order']}")
+    return ordered, decision
+
+
+def _deadline_skip_reason(provider: str, duration: Optional[int], deadline) -> Tuple[Optional[str], Optional[float]]:
+    """v140：剩余预算来不及时不调用该 provider，返回 (原因, 历史耗时估计)；来得及返回 (None, 估计)。"""
+    if deadline.cancelled:
+        return f"请求已取消（{deadline.cancelled}）", None
+    if deadline.expired():
+        return "截止时间已到", None
+    estimate = PROVIDER_STATS.percentile(provider, duration, deadlines.DEADLINE_SKIP_PERCENTILE,
+                                         min_samples=deadlines.DEADLINE_SKIP_MIN_SAMPLES)
+    if estimate is not None and estimate > deadline.remaining():
+        return f"剩余预算 {deadline.remaining():.1f}s 不足（历史耗时约 {estimate:.1f}s）", estimate
+    return None, estimate
+
+
+def _note_abandoned(provider: str, duration: Optional[int], elapsed: float = 0.0) -> None:
+    """v141：客户端断线后没发起 / 被取消的 provider 调用，估算省下的等待时间与费用。"""
+    estimate = PROVIDER_STATS.percentile(provider, duration, deadlines.DEADLINE_SKIP_PERCENTILE)
+    if estimate is not None:
+        deadlines.note_cancellation("worker_seconds_saved", max(0.0, estimate - elapsed))
+    minutes = (duration or 0) / 60.0
+    deadlines.note_cancellation("spend_avoided_usd", PROVIDER_COST_PER_MIN.get(provider, 0.0) * minutes)
+
+
+async def _call_with_retries(provider, label, call, deadline):
+    """
+    v142：临时错误（is_temporary_error）按该 provider 的 RetryPolicy 快速重试，受全局 RetryBudget 与截止时间约束。
+    v143：Retry-After 不超过间隔上限的限流（429）也重试，间隔取两者较大值。
+
+    Returns:
+        (text, metadata, retries)；retries 为每次失败后重试的记录。不再重试时抛出最后一次的异常。
+    """
+    policy = retry_policy.policy_for(provider)
+    budget = retry_policy.RETRY_BUDGET
+    budget.record_call()
+    retries = []
+    delay = None
+    while True:
+        start = time.monotonic()
+        try:
+            text, metadata = await call()
+            return text, metadata, retries
+        except deadlines.DeadlineExceeded:
+            raise
+        except Exception as e:
+            error_msg = str(e)
+            error_class, retry_after = provider_errors.describe(e)
+            # v143：限流且对方给的等待时间不超过重试间隔上限，也原地等一下再试
+            short_rate_limit = (error_class == provider_errors.RATE_LIMITED and retry_after is not None
+                                and retry_after <= policy.cap)
+            if len(retries) >= policy.max_retries or not (error_class == provider_errors.TRANSIENT or short_rate_limit):
+                raise
+            delay = policy.next_delay(delay)
+            if short_rate_limit:
+                delay = max(delay, retry_after)
+            if deadline is not None and deadline.remaining() <= delay:
+                raise
+            if not budget.try_acquire():
+                print(f"[v142-RETRY] 🚫 {label} 临时错误，但全局重试预算已用完，不再重试")
+                raise
+            elapsed = time.monotonic() - start
+            retries.append({"attempt": len(retries) + 1, "error": error_msg[:120],
+                            "elapsed": round(elapsed, 2), "delay": round(delay, 3)})
+            if deadline is not None:
+                deadline.record(provider, "retried", elapsed=elapsed, error=error_msg[:120], delay=round(delay, 3))
+            print(f"[v142-RETRY] 🔁 {label} 临时错误（{error_msg[:80]}），{delay:.2f}s 后重试 "
+                  f"{len(retries)}/{policy.max_retries}")
+            await asyncio.sleep(delay)
+
+
+async def _attempt_provider(provider, label, call, duration, errors):
+    """
+    执行一次 provider 调用，并记录耗时统计、失败原因、配额状态。
+
+    成功返回 (text, metadata)；失败时把原因追加到 errors 后原样抛出。
+    被取消（对冲落败）不算失败，不计入统计。
+
+    v140：有截止时间（deadlines.current()）时只给这次调用剩余预算；按历史耗时来不及的直接跳过。
+    因预算耗尽被掐断不算 provider 的错——不计入熔断与耗时统计。每次尝试都记进 deadline 的账上。
+    v141：截止时间被作废（客户端断线）后不再发起调用，在途调用被取消时计入 CANCELLATION_STATS。
+    v142：临时错误先在同一 provider 上快速重试（_call_with_retries），重试记录写进 metadata["retries"]。
+    v144：发起前过一道 PACING（限流响应头驱动的节流）：短等待原地匀速，等不起就抛 PacingSpill 交给下一个。
+    v145：再拿该 provider 的并发名额（provider_concurrency）；排队等不起抛 ProviderBusy 交给下一个。
+    v149：排队按 client_scope 里的客户端公平轮转；排队耗时累计到截止时间上。
+    """
+    deadline = deadlines.current()
+    estimate = None
+    if deadline is not None:
+        reason, estimate = _deadline_skip_reason(provider, duration, deadline)
+        if reason:
+            if deadline.cancelled:
+                deadline.record(provider, "aborted")
+                deadlines.note_cancellation("skipped_calls")
+                _note_abandoned(provider, duration)
+            else:
+                deadline.record(provider, "skipped", estimate=estimate)
+            errors.append(f"{label}: {reason}，跳过")
+            print(f"[v140-DEADLINE] ⏭️ 跳过 {label}（{reason}）")
+            raise deadlines.DeadlineExceeded(f"{label} {reason}，跳过")
+
+    # v144：按上次响应头里的剩余限额主动节流；等不起就溢出到下一个 provider，不等 429
+    go, wait, window = PACING.acquire(provider, deadline.remaining() if deadline is not None else None)
+    if not go:
+        if deadline is not None:
+            deadline.record(provider, "skipped", estimate=wait, paced=window)
+        errors.append(f"{label}: 接近 {window} 限额（需等 {wait:.1f}s），跳过")
+        print(f"[v144-PACING] ↪️ {label} 接近 {window} 限额，需等 {wait:.1f}s，交给下一个 provider")
+        raise provider_pacing.PacingSpill(f"{label} 接近限额，跳过")
+    if wait > 0:
+        print(f"[v144-PACING] ⏳ {label} 接近 {window} 限额，匀速放行：等 {wait:.2f}s")
+        await asyncio.sleep(wait)
+
+    # v145：并发名额；满了排队（v149 起各客户端之间公平轮转），等不起就交给下一个 provider
+    slots = provider_concurrency.get_slots(provider)
+    try:
+        queued = await slots.acquire(deadline.remaining() if deadline is not None else None)
+    except provider_concurrency.ProviderBusy as e:
+        if deadline is not None:
+            deadline.record(provider, "skipped", busy=str(e))
+        errors.append(f"{label}: {e}，跳过")
+        print(f"[v145-CONCURRENCY] ↪️ {e}，交给下一个 provider")
+        raise
+    if queued > 0:
+        print(f"[v145-CONCURRENCY] ⏳ {label} 排队 {queued:.2f}s 后拿到名额")
+        if deadline is not None:
+            deadline.note_queued(queued)       # v149: 累计进 metadata["queue_wait"]
+
+    breaker = get_breaker(provider)
+    if not breaker.acquire():
+        slots.release()
+        # half-open 的唯一探测名额已被别的请求占用
+        errors.append(f"{label}: {skip_reason(provider)}，跳过")
+        raise Exception(f"{label} 熔断探测中，跳过")
+
+    allotted = deadline.remaining() if deadline is not None else None
+    start = time.monotonic()
+    try:
+        attempt = _call_with_retries(provider, label, call, deadline)
+        if allotted is None:
+            text, metadata, retries = await attempt
+        else:
+            text, metadata, retries = await asyncio.wait_for(attempt, allotted)
+    except asyncio.CancelledError:
+        breaker.release()
+        elapsed = time.monotonic() - start
+        if deadline is not None:
+            deadline.record(provider, "cancelled", allotted=allotted, elapsed=elapsed)
+        if deadline is not None and deadline.cancelled:
+            deadlines.note_cancellation("cancelled_calls")
+            _note_abandoned(provider, duration, elapsed)
+            print(f"[v141-DISCONNECT] 🛑 {label} 已取消（{deadline.cancelled}）")
+        else:
+            print(f"[v127-HEDGE] 🛑 {label} 已取消（对冲落败）")
+        raise
+    except Exception as e:
+        error_msg = str(e)
+        elapsed = time.monotonic() - start
+        if deadline is not None and (isinstance(e, (asyncio.TimeoutError, deadlines.DeadlineExceeded))
+                                     or deadline.expired()):
+            breaker.release()
+            if deadline.cancelled:
+                deadline.record(provider, "aborted", allotted=allotted, elapsed=elapsed)
+                errors.append(f"{label}: 请求已取消（{deadline.cancelled}）")
+                raise deadlines.DeadlineExceeded(f"{label} 请求已取消") from e
+            deadline.record(provider, "timeout", allotted=allotted, elapsed=elapsed, estimate=estimate)
+            errors.append(f"{label}: 截止时间已到（分配 {allotted:.1f}s，已用 {elapsed:.1f}s）")
+            print(f"[v140-DEADLINE] ⌛ {label} 用完剩余预算 {allotted:.1f}s，放弃")
+            raise deadlines.DeadlineExceeded(f"{label} 截止时间已到") from e
+        error_class, retry_after = provider_errors.describe(e)
+        if deadline is not None:
+            deadline.record(provider, "failed", allotted=allotted, elapsed=elapsed, estimate=estimate,
+                            **({"error_class": error_class} if error_class else {}))
+        PROVIDER_STATS.record_failure(provider, duration, elapsed)
+        if error_class == provider_errors.TRANSIENT:
+            breaker.record_failure(elapsed, reason=error_msg[:80])
+        else:
+            breaker.release()
+        errors.append(f"{label}: {error_msg}")
+        print(f"[v111-FALLBACK] ❌ {label} 失败: {error_msg}")
+        _apply_error_class(provider, error_class, retry_after)
+        raise
+    finally:
+        slots.release(time.monotonic() - start)
+    elapsed = time.monotonic() - start
+    PROVIDER_STATS.record_success(provider, duration, elapsed)
+    breaker.record_success(elapsed)
+    if deadline is not None:
+        deadline.record(provider, "ok", allotted=allotted, elapsed=elapsed, estimate=estimate,
+                        **({"queued": round(queued, 3)} if queued > 0 else {}))
+    if retries:
+        metadata["retries"] = retries
+    return text, metadata
+
+
+async def _run_hedged(steps, duration, errors):
+    """
+    对冲执行 steps：主 API 超过阈值未返回就并行启动下一个；某个失败且没有其他在飞请求时
+    立即顶上下一个（不等阈值）。第一个成功结果胜出，其余取消。
+
+    Returns:
+        (step, text, metadata, hedge_info)；全部失败返回 None。
+    """
+    queue = list(steps)
+    pending = {}
+    launched = []
+    started = time.monotonic()
+    next_hedge_at = None
+
+    def launch(reason):
+        nonlocal next_hedge_at
+        step = queue.pop(0)
+        provider, _, label, call = step
+        task = asyncio.ensure_future(_attempt_provider(provider, label, call, duration, errors))
+        pending[task] = step
+        threshold = _hedge_threshold(provider, duration)
+        next_hedge_at = time.monotonic() + threshold
+        launched.append({
+            "provider": provider,
+            "reason": reason,
+            "started_at": round(time.monotonic() - started, 2),
+            "hedge_threshold": round(threshold, 2),
+        })
+        print(f"[v127-HEDGE] 🚀 启动 {label}（{reason}），对冲阈值 {threshold:.1f}s")
+
+    launch("primary")
+    try:
+        while pending:
+            can_hedge = bool(queue) and len(pending) < HEDGE_MAX_PARALLEL
+            timeout = max(0.0, next_hedge_at - time.monotonic()) if can_hedge else None
+            done, _ = await asyncio.wait(list(pending), timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch("hedge")
+                continue
+            winner = next((t for t in done if t.exception() is None), None)
+            for task in done:
+                step = pending.pop(task)
+                if task is winner:
+                    text, metadata = task.result()
+                    info = {
+                        "enabled": True,
+                        "winner": step[0],
+                        "launched": launched,
+                        "cancelled": [s[0] for s in pending.values()],
+                        "elapsed": round(time.monotonic() - started, 2),
+                    }
+                    return step, text, metadata, info
+            if not pending and queue:
+                launch("fallback")
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
 async def transcribe_with_fallback(
-    audio_content: bytes,
+    audio_content: upload_intake.AudioLike,
     filename: str,
     language: Optional[str] = None,
     duration: Optional[int] = None,
-    logger: Optional[TranscriptionLogger] = None
+    logger: Optional[TranscriptionLogger] = None,
+    hedge: Optional[bool] = None
 ) -> Tuple[str, str, Dict[str, Any]]:
     """
     🎤 麦克风场景智能 fallback 转录
 
-    优先级（与下方函数体一致；v121 校正——原 docstring 写反了顺序、且第3位误写 Deepgram）：
+    优先级（与 _microphone_chain 一致；v121 校正——原 docstring 写反了顺序、且第3位误写 Deepgram）：
     1️⃣ OpenAI Whisper API（主力，whisper-1）
     2️⃣ AI Builder Space
     3️⃣ Google Cloud STT（最后备用）
     ⚠️ Deepgram 不在麦克风路径，只在系统音路径 transcribe_system_audio 里当兜底。
 
+    🆕 v127: hedge=True（或 HEDGE_ENABLED）时走对冲模式，见 _run_hedged。
+
     Args:
-        audio_content: 音频文件内容（字节）
+        audio_content: 音频内容（bytes / memoryview / upload_intake.AudioSource）
         filename: 文件名
         language: 语言代码（可选）
         duration: 音频时长（秒，可选）
         logger: 日志记录器（可选）
-    
+        hedge: 是否对冲；None 表示按 HEDGE_ENABLED
+
     Returns:
         Tuple[str, str, dict]: (转录文本, 使用的API, 元数据)
     """
     errors = []
-    
+    hedge = HEDGE_ENABLED if hedge is None else hedge
+
     print(f"[v111-DEBUG] ========== 开始麦克风场景 Fallback ==========")
     print(f"[v111-DEBUG] 音频大小: {len(audio_content) if audio_content else 'None'} bytes")
     print(f"[v111-DEBUG] 文件名: {filename}")
     print(f"[v111-DEBUG] 语言: {language}")
     print(f"[v111-DEBUG] 时长: {duration}")
-    
-    # ============================================================================
-    # 1️⃣ OpenAI Whisper（主力）
-    # ============================================================================
-    print(f"[v111-DEBUG] 检查 OpenAI 是否可用...")
-    if should_retry_api("openai"):
-        print(f"[v111-DEBUG] ✅ 开始尝试 OpenAI Whisper API...")
-        try:
-            text, metadata = await _transcribe_openai(
-                audio_content, filename, language, duration, logger
-            )
-            print(f"[v111-FALLBACK] ✅ OpenAI Whisper 转录成功 (#1)")
+    print(f"[v127-DEBUG] 对冲模式: {'开启' if hedge else '关闭'}")
+
+    chain, routing = _order_microphone_chain(
+        _microphone_chain(audio_content, filename, language, duration, logger), duration)
+
+    steps = []
+    for step in chain:
+        provider, _, label, _ = step
+        if should_retry_api(provider):
+            steps.append(step)
+        else:
+            print(f"[v111-FALLBACK] ⏭️ 跳过 {label}（{skip_reason(provider)}）")
+            errors.append(f"{label}: {skip_reason(provider)}，跳过")
+
+    if hedge and len(steps) > 1:
+        outcome = await _run_hedged(steps, duration, errors)
+        if outcome is not None:
+            (provider, api_used, label, _), text, metadata, hedge_info = outcome
+            print(f"[v127-HEDGE] ✅ {label} 胜出，耗时 {hedge_info['elapsed']}s，"
+                  f"取消: {hedge_info['cancelled'] or '无'}")
+            metadata["hedge"] = hedge_info
+            metadata["routing"] = routing
             text = _postprocess_transcript(text)
             print(f"[v111-DEBUG] 返回文本长度: {len(text)}")
-            return text, "openai_whisper", metadata
-        except Exception as e:
-            error_msg = str(e)
-            errors.append(f"OpenAI: {error_msg}")
-            print(f"[v111-FALLBACK] ❌ OpenAI 失败: {error_msg}")
-            if is_quota_exceeded(None, error_msg):
-                API_FALLBACK_STATUS["openai_quota_exceeded"] = True
-                API_FALLBACK_STATUS["openai_last_check"] = time.time()
+            return text, api_used, metadata
     else:
-        print(f"[v111-FALLBACK] ⏭️ 跳过 OpenAI（配额已耗尽）")
-        errors.append("OpenAI: 配额已耗尽，跳过")
-
-    # ============================================================================
-    # 2️⃣ AI Builder Space（备用）
-    # ============================================================================
-    print(f"[v111-DEBUG] 检查 AI Builder 是否可用...")
-    if should_retry_api("ai_builder"):
-        print(f"[v111-DEBUG] ✅ 开始尝试 AI Builder API...")
-        try:
-            text, metadata = await _transcribe_ai_builder(
-                audio_content, filename, language, duration, logger
-            )
-            print(f"[v111-FALLBACK] ✅ AI Builder Space 转录成功 (#2 备用)")
+        for rank, (provider, api_used, label, call) in enumerate(steps, 1):
+            print(f"[v111-DEBUG] ✅ 开始尝试 {label}...")
+            try:
+                text, metadata = await _attempt_provider(provider, label, call, duration, errors)
+            except Exception:
+                continue
+            print(f"[v111-FALLBACK] ✅ {label} 转录成功 (#{rank})")
+            metadata["routing"] = routing
             text = _postprocess_transcript(text)
             print(f"[v111-DEBUG] 返回文本长度: {len(text)}")
-            return text, "ai_builder", metadata
-        except Exception as e:
-            error_msg = str(e)
-            errors.append(f"AI Builder: {error_msg}")
-            print(f"[v111-FALLBACK] ❌ AI Builder 失败: {error_msg}")
-            if is_quota_exceeded(None, error_msg):
-                API_FALLBACK_STATUS["ai_builder_quota_exceeded"] = True
-                # v121 修复：此处原为 API_BUILDER_STATUS（未定义的笔误）——AI Builder 遇配额错误时
-                # 会抛 NameError、导致整个 fallback 崩溃而非降级到 Google。改回正确的 API_FALLBACK_STATUS。
-                API_FALLBACK_STATUS["ai_builder_last_check"] = time.time()
-    else:
-        print(f"[v111-FALLBACK] ⏭️ 跳过 AI Builder（配额已耗尽）")
-        errors.append("AI Builder: 配额已耗尽，跳过")
+            return text, api_used, metadata
 
-    # ============================================================================
-    # 3️⃣ Google Cloud Speech-to-Text（最后备用）
-    # ============================================================================
-    print(f"[v111-DEBUG] 检查 Google 是否可用...")
-    try:
-        text, metadata = await _transcribe_google(
-            audio_content, filename, language, logger,
-            enable_diarization=False,
-            remove_speaker_labels=False
-        )
-        print(f"[v111-FALLBACK] ✅ Google STT 转录成功 (#3 最后备用)")
-        text = _postprocess_transcript(text)
-        print(f"[v111-DEBUG] 返回文本长度: {len(text)}")
-        return text, "google", metadata
-    except Exception as e:
-        error_msg = str(e)
-        errors.append(f"Google: {error_msg}")
-        print(f"[v111-FALLBACK] ❌ Google 失败: {error_msg}")
-    
     # ============================================================================
     # ❌ 所有 API 都失败
     # ============================================================================
     error_summary = " | ".join(errors)
     print(f"[v111-FALLBACK] 💥 所有 API 都失败了")
     print(f"[v111-FALLBACK] 错误汇总: {error_summary}")
-    
+
     raise Exception(f"所有转录 API 都失败了: {error_summary}")
 
 
@@ -1524,12 +2035,126 @@ async def transcribe_with_fallback(
 # 🆕 v111: 系统/混合音频专用函数（Deepgram + Google 双保险）
 # ================================================================================
 
+# --------------------------------------------------------------------------------
+# v128: 系统音频竞速（race）模式
+#
+# 多说话人的 YouTube 采集是最慢的一类请求：顺序链路 OpenAI Diarize → Google → Deepgram
+# 每一步都要重新上传同一份音频，前一个慢/挂了后一个才开始。竞速模式把几个支持
+# diarization 的 provider **同时**打出去，第一个通过质量检查的结果胜出，其余取消。
+# 这类请求"快"比"省"重要——多花的那份钱是有意接受的代价。
+#
+# 默认仍是 sequential；SYSTEM_AUDIO_STRATEGY=race 开启。参赛者按 SYSTEM_RACE_PROVIDERS
+# 的顺序取（至少 2 个才有意义），没参赛的 provider 在全部参赛者失败后按原顺序兜底。
+# --------------------------------------------------------------------------------
+SYSTEM_AUDIO_STRATEGY = os.environ.get("SYSTEM_AUDIO_STRATEGY", "sequential").strip().lower()
+SYSTEM_RACE_PROVIDERS = [
+    p.strip() for p in os.environ.get("SYSTEM_RACE_PROVIDERS", "openai_diarize,google").split(",")
+    if p.strip()
+]
+
+
+def _system_chain(audio_content, filename, language, duration, logger):
+    """系统/混合音频链（均开启多说话人识别、不显示标签），顺序即优先级。格式同 _microphone_chain。"""
+    return [
+        ("openai_diarize", "openai_diarize", "OpenAI Diarize",
+         lambda: _transcribe_openai_diarize(
+             audio_content=audio_content, filename=filename, language=language,
+             duration=duration, logger=logger)),
+        ("google", "google", "Google",
+         lambda: _transcribe_google(
+             audio_content=audio_content, filename=filename, language=language, logger=logger,
+             enable_diarization=True,  # 🎤 启用多说话人识别
+             remove_speaker_labels=True,  # 🔥 v112: 不显示说话人标签
+             duration=duration)),
+        ("deepgram", "deepgram_nova2_chinese", "Deepgram",
+         lambda: _transcribe_deepgram(
+             audio_content=audio_content, filename=filename, language=language,
+             duration=duration, enable_diarization=True, logger=logger)),
+    ]
+
+
+def _reported_speaker_count(metadata: Dict[str, Any]) -> Optional[int]:
+    """各 provider 元数据里报告的说话人数（Google 来自 count_unique_speakers）；没报告返回 None。"""
+    for key in ("speaker_count", "num_speakers"):
+        value = metadata.get(key)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def _race_quality_check(text: str, metadata: Dict[str, Any]) -> Tuple[bool, str]:
+    """
+    竞速胜者的质量门槛：
+    - 后处理（JSON 残留 + 幻觉套话清洗）后仍有文本——整段是幻觉的结果不算赢；
+    - 开了 diarization 却报告 0 个说话人，说明没有识别出任何带说话人信息的词，视为无效。
+    （适配器内部的幻觉检测命中时会直接抛异常，已在 _attempt_provider 里算作失败。）
+    """
+    if not text or not text.strip():
+        return False, "后处理后文本为空（幻觉/静音）"
+    if _reported_speaker_count(metadata) == 0:
+        return False, "未识别出任何说话人"
+    return True, ""
+
+
+async def _run_race(steps, duration, errors):
+    """
+    同时启动 steps，第一个通过 _race_quality_check 的结果胜出，其余取消。
+    同一轮有多个结果同时完成时，优先说话人更多的（信息更完整）。
+
+    Returns:
+        (step, 已后处理文本, metadata, race_info)；全部失败/不合格返回 None。
+    """
+    started = time.monotonic()
+    pending = {
+        asyncio.ensure_future(_attempt_provider(step[0], step[2], step[3], duration, errors)): step
+        for step in steps
+    }
+    print(f"[v128-RACE] 🏁 同时启动: {[s[0] for s in steps]}")
+    try:
+        while pending:
+            done, _ = await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED)
+            finished = []
+            for task in done:
+                step = pending.pop(task)
+                if task.exception() is None:
+                    text, metadata = task.result()
+                    finished.append((step, _postprocess_transcript(text), metadata))
+            finished.sort(key=lambda r: _reported_speaker_count(r[2]) or 0, reverse=True)
+            for step, text, metadata in finished:
+                ok, reason = _race_quality_check(text, metadata)
+                if not ok:
+                    print(f"[v128-RACE] ⚠️ {step[2]} 结果不合格: {reason}")
+                    errors.append(f"{step[2]}: 竞速质量检查未通过（{reason}）")
+                    continue
+                info = {
+                    "strategy": "race",
+                    "winner": step[0],
+                    "entrants": [s[0] for s in steps],
+                    "cancelled": [s[0] for s in pending.values()],
+                    "speaker_count": _reported_speaker_count(metadata),
+                    "elapsed": round(time.monotonic() - started, 2),
+                }
+                return step, text, metadata, info
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def _record_system_success(provider: str):
+    API_FALLBACK_STATUS["last_successful_api"] = provider
+    _count_usage(provider)
+
+
 async def transcribe_system_audio(
-    audio_content: bytes,
+    audio_content: upload_intake.AudioLike,
     filename: str,
     language: Optional[str] = None,
     duration: Optional[int] = None,
-    logger: Optional[TranscriptionLogger] = None
+    logger: Optional[TranscriptionLogger] = None,
+    strategy: Optional[str] = None
 ) -> Tuple[str, str, Dict[str, Any]]:
     """
     🔊 v112: 系统/混合音频转录（支持多说话人识别，不显示标签）
@@ -1540,107 +2165,60 @@ async def transcribe_system_audio(
     3️⃣ Deepgram Nova-2 (备用)
     
     ✅ 特性：转录所有说话人的话，但不显示"Speaker A:", "Speaker B:"等标签
+    🆕 v128: strategy="race"（或 SYSTEM_AUDIO_STRATEGY=race）时参赛者并行竞速，见 _run_race。
     
     Args:
-        audio_content: 音频文件内容（字节）
+        audio_content: 音频内容（bytes / memoryview / upload_intake.AudioSource）
         filename: 文件名
         language: 语言代码（可选）
         duration: 音频时长（秒，可选）
         logger: 日志记录器（可选）
+        strategy: "sequential" / "race"；None 表示按 SYSTEM_AUDIO_STRATEGY
     
     Returns:
         Tuple[str, str, dict]: (转录文本, 使用的API, 元数据)
     """
-    print(f"[v112-SYSTEM] 🔊 系统/混合音频场景 → 启用多说话人识别（无标签模式）")
+    strategy = (strategy or SYSTEM_AUDIO_STRATEGY).lower()
+    print(f"[v112-SYSTEM] 🔊 系统/混合音频场景 → 启用多说话人识别（无标签模式），策略: {strategy}")
     errors = []
-    
-    # ============================================================================
-    # 1️⃣ 尝试 OpenAI gpt-4o-transcribe-diarize（主力）
-    # ============================================================================
-    try:
-        text, metadata = await _transcribe_openai_diarize(
-            audio_content=audio_content,
-            filename=filename,
-            language=language,
-            duration=duration,
-            logger=logger
-        )
-        
-        # 成功！更新状态
-        API_FALLBACK_STATUS["last_successful_api"] = "openai_diarize"
-        API_FALLBACK_STATUS["api_usage_count"]["openai_diarize"] += 1
-        
-        print(f"[v112-SYSTEM] ✅ OpenAI Diarize 转录成功（多说话人，无标签）")
-        text = _postprocess_transcript(text)
-        return text, "openai_diarize", metadata
-        
-    except Exception as e:
-        error_msg = str(e)
-        errors.append(f"OpenAI Diarize: {error_msg}")
-        print(f"[v112-SYSTEM] ❌ OpenAI Diarize 失败: {error_msg}")
-    
-    # ============================================================================
-    # 2️⃣ 尝试 Google Cloud Speech-to-Text + Diarization（无标签）
-    # ============================================================================
-    try:
-        text, metadata = await _transcribe_google(
-            audio_content=audio_content,
-            filename=filename,
-            language=language,
-            logger=logger,
-            enable_diarization=True,  # 🎤 启用多说话人识别
-            remove_speaker_labels=True  # 🔥 v112: 不显示说话人标签
-        )
-        
-        # 成功！更新状态
-        API_FALLBACK_STATUS["last_successful_api"] = "google"
-        API_FALLBACK_STATUS["api_usage_count"]["google"] += 1
-        
-        print(f"[v112-SYSTEM] ✅ Google API 转录成功（多说话人，无标签）(Fallback #2)")
-        text = _postprocess_transcript(text)
-        return text, "google", metadata
-        
-    except Exception as e:
-        error_msg = str(e)
-        errors.append(f"Google: {error_msg}")
-        print(f"[v112-SYSTEM] ❌ Google API 失败: {error_msg}")
-    
-    # ============================================================================
-    # 3️⃣ 尝试 Deepgram Nova-2 + Diarization（备用）
-    # ============================================================================
-    if should_retry_api("deepgram"):
+
+    steps = []
+    for step in _system_chain(audio_content, filename, language, duration, logger):
+        provider, _, label, _ = step
+        if should_retry_api(provider):
+            steps.append(step)
+        else:
+            print(f"[v112-SYSTEM] ⏭️ 跳过 {label}（{skip_reason(provider)}）")
+            errors.append(f"{label}: {skip_reason(provider)}，跳过")
+
+    if strategy == "race":
+        entrants = [s for name in SYSTEM_RACE_PROVIDERS for s in steps if s[0] == name]
+        if len(entrants) >= 2:
+            outcome = await _run_race(entrants, duration, errors)
+            if outcome is not None:
+                (provider, api_used, label, _), text, metadata, race_info = outcome
+                _record_system_success(provider)
+                wins = API_FALLBACK_STATUS.setdefault("race_wins", {})
+                wins[provider] = wins.get(provider, 0) + 1
+                metadata["race"] = race_info
+                print(f"[v128-RACE] 🏆 {label} 胜出，耗时 {race_info['elapsed']}s，"
+                      f"说话人数: {race_info['speaker_count']}，取消: {race_info['cancelled'] or '无'}")
+                return text, api_used, metadata
+            print(f"[v128-RACE] 💥 参赛者全部失败，按原顺序尝试其余 provider")
+            steps = [s for s in steps if s not in entrants]
+        else:
+            print(f"[v128-RACE] ⚠️ 可用参赛者不足 2 个，退回顺序模式")
+
+    for rank, (provider, api_used, label, call) in enumerate(steps, 1):
         try:
-            text, metadata = await _transcribe_deepgram(
-                audio_content=audio_content,
-                filename=filename,
-                language=language,
-                duration=duration,
-                enable_diarization=True,  # 🎤 启用多说话人识别
-                logger=logger
-            )
-            
-            # 成功！更新状态
-            API_FALLBACK_STATUS["last_successful_api"] = "deepgram"
-            API_FALLBACK_STATUS["api_usage_count"]["deepgram"] += 1
-            
-            print(f"[v112-SYSTEM] ✅ Deepgram Nova-2 转录成功（多说话人）(Fallback #3 - 备用)")
-            text = _postprocess_transcript(text)
-            return text, "deepgram_nova2_chinese", metadata
-            
-        except Exception as e:
-            error_msg = str(e)
-            errors.append(f"Deepgram: {error_msg}")
-            print(f"[v112-SYSTEM] ❌ Deepgram 失败: {error_msg}")
-            
-            # 检查是否是配额问题
-            if is_quota_exceeded(None, error_msg):
-                API_FALLBACK_STATUS["deepgram_quota_exceeded"] = True
-                API_FALLBACK_STATUS["deepgram_last_check"] = time.time()
-                print(f"[v112-SYSTEM] 🚨 Deepgram 配额耗尽")
-    else:
-        print(f"[v112-SYSTEM] ⏭️ 跳过 Deepgram（配额已耗尽）")
-        errors.append("Deepgram: 配额已耗尽，跳过")
-    
+            text, metadata = await _attempt_provider(provider, label, call, duration, errors)
+        except Exception:
+            continue
+        _record_system_success(provider)
+        print(f"[v112-SYSTEM] ✅ {label} 转录成功（多说话人，无标签）(#{rank})")
+        text = _postprocess_transcript(text)
+        return text, api_used, metadata
+
     # ============================================================================
     # ❌ 所有 API 都失败
     # ============================================================================
@@ -1652,11 +2230,40 @@ async def transcribe_system_audio(
 
 
 # ================================================================================
-# 指定 API 直连函数（不走 fallback）
+# 指定 API 优先（历史记录重试场景）
+#
+# v153：指定的 provider 原本直接调适配器，熔断、冷却、重试预算、节流、并发名额、截止时间
+# 全部绕开——带 preferred_api 的客户端不受任何保护约束。现在它和链路里的 provider 一样走
+# _attempt_provider；被跳过（配额 / 熔断 / 冷却）或失败时，按该音频源的正常链路兜底。
 # ================================================================================
 
+PREFERRED_API_ALIASES = {
+    "openai": "openai", "openai_whisper": "openai",
+    "ai_builder": "ai_builder", "aibuilder": "ai_builder", "abs": "ai_builder",
+    "google": "google", "google_stt": "google", "gcp": "google",
+}
+
+
+def _preferred_step(provider, audio_content, filename, language, duration, logger, audio_source):
+    """指定 API 那一步，格式同 _microphone_chain；api_used 沿用原来的 openai / ai_builder / google。"""
+    if provider == "openai":
+        return ("openai", "openai", "OpenAI",
+                lambda: _transcribe_openai(audio_content=audio_content, filename=filename, language=language,
+                                           duration=duration, logger=logger))
+    if provider == "ai_builder":
+        return ("ai_builder", "ai_builder", "AI Builder",
+                lambda: _transcribe_ai_builder(audio_content=audio_content, filename=filename, language=language,
+                                               duration=duration, logger=logger))
+    # 系统/混合音频优先开启多说话人并移除标签，麦克风音频走普通模式
+    use_diarization = audio_source in ["system", "both"]
+    return ("google", "google", "Google",
+            lambda: _transcribe_google(audio_content=audio_content, filename=filename, language=language,
+                                       logger=logger, enable_diarization=use_diarization,
+                                       remove_speaker_labels=use_diarization, duration=duration))
+
+
 async def transcribe_with_preferred_api(
-    audio_content: bytes,
+    audio_content: upload_intake.AudioLike,
     filename: str,
     preferred_api: str,
     language: Optional[str] = None,
@@ -1665,50 +2272,41 @@ async def transcribe_with_preferred_api(
     audio_source: str = "microphone"
 ) -> Tuple[str, str, Dict[str, Any]]:
     """
-    按用户指定 API 进行转录（不走 fallback 链）。
-    支持: openai / ai_builder / google
+    按用户指定 API 优先转录，支持: openai / ai_builder / google。
+    指定的那个不可用或失败时按音频源的正常链路兜底，metadata["preferred_api"] 记录实际情况。
     """
     api = (preferred_api or "").strip().lower()
     if not api:
         raise Exception("preferred_api 不能为空")
+    provider = PREFERRED_API_ALIASES.get(api)
+    if provider is None:
+        raise Exception(f"不支持的 preferred_api: {preferred_api}")
 
-    if api in ("openai", "openai_whisper"):
-        text, metadata = await _transcribe_openai(
-            audio_content=audio_content,
-            filename=filename,
-            language=language,
-            duration=duration,
-            logger=logger
-        )
-        text = _postprocess_transcript(text)
-        return text, "openai", metadata
-
-    if api in ("ai_builder", "aibuilder", "abs"):
-        text, metadata = await _transcribe_ai_builder(
-            audio_content=audio_content,
-            filename=filename,
-            language=language,
-            duration=duration,
-            logger=logger
-        )
-        text = _postprocess_transcript(text)
-        return text, "ai_builder", metadata
-
-    if api in ("google", "google_stt", "gcp"):
-        # 系统/混合音频优先开启多说话人并移除标签，麦克风音频走普通模式
-        use_diarization = audio_source in ["system", "both"]
-        text, metadata = await _transcribe_google(
-            audio_content=audio_content,
-            filename=filename,
-            language=language,
-            logger=logger,
-            enable_diarization=use_diarization,
-            remove_speaker_labels=use_diarization
-        )
-        text = _postprocess_transcript(text)
-        return text, "google", metadata
+    system = audio_source in ["system", "both"]
+    chain = (_system_chain if system else _microphone_chain)(audio_content, filename, language, duration, logger)
+    steps = [_preferred_step(provider, audio_content, filename, language, duration, logger, audio_source)]
+    steps += [step for step in chain if step[0] != provider]
+
+    errors = []
+    for name, api_used, label, call in steps:
+        if not should_retry_api(name):
+            print(f"[v114-ROUTING] ⏭️ 跳过 {label}（{skip_reason(name)}）")
+            errors.append(f"{label}: {skip_reason(name)}，跳过")
+            continue
+        try:
+            text, metadata = await _attempt_provider(name, label, call, duration, errors)
+        except Exception:
+            continue
+        metadata["preferred_api"] = {"requested": provider, "used": name}
+        if name != provider:
+            print(f"[v114-ROUTING] ↪️ 指定的 {provider} 不可用，由 {label} 兜底")
+        if system:
+            _record_system_success(name)
+        return _postprocess_transcript(text), api_used, metadata
 
-    raise Exception(f"不支持的 preferred_api: {preferred_api}")
+    error_summary = " | ".join(errors)
+    print(f"[v114-ROUTING] 💥 指定 API {provider} 及兜底全部失败: {error_summary}")
+    raise Exception(f"所有转录 API 都失败了: {error_summary}")
 
 
 # ================================================================================
@@ -1719,31 +2317,58 @@ def get_api_status() -> Dict[str, Any]:
     """
     获取当前 API fallback 状态
     
+    🆕 v129: available 同时反映配额与熔断器；circuit 为熔断器快照（状态、窗口错误率、p95 等）
+    
     Returns:
         dict: API 状态信息
     """
+    def _provider_status(api_name: str, with_quota: bool = True) -> Dict[str, Any]:
+        entry = {
+            "available": (not _quota_locked(api_name) and COOLDOWNS.remaining(api_name) <= 0
+                          and get_breaker(api_name).allow_request()),
+            "cooldown": COOLDOWNS.describe(api_name),  # 🆕 v143: 限流 / 鉴权冷却
+        }
+        if with_quota:
+            entry["quota_exceeded"] = API_FALLBACK_STATUS[f"{api_name}_quota_exceeded"] or _quota_shared(api_name)
+            entry["last_check"] = API_FALLBACK_STATUS[f"{api_name}_last_check"]
+        entry["usage_count"] = API_FALLBACK_STATUS["api_usage_count"][api_name]
+        if state_backend.STATE.shared:
+            entry["usage_count_all_workers"] = int(shared_get(f"usage:{api_name}") or 0)  # 🆕 v147
+        entry["circuit"] = get_breaker(api_name).snapshot()
+        return entry
+
     return {
-        "deepgram": {  # 🆕 v111
-            "available": not API_FALLBACK_STATUS["deepgram_quota_exceeded"],
-            "quota_exceeded": API_FALLBACK_STATUS["deepgram_quota_exceeded"],
-            "last_check": API_FALLBACK_STATUS["deepgram_last_check"],
-            "usage_count": API_FALLBACK_STATUS["api_usage_count"]["deepgram"]
+        "deepgram": _provider_status("deepgram"),  # 🆕 v111
+        "ai_builder": _provider_status("ai_builder"),
+        "openai": _provider_status("openai"),
+        "openai_diarize": _provider_status("openai_diarize", with_quota=False),
+        "google": _provider_status("google", with_quota=False),
+        "last_successful_api": API_FALLBACK_STATUS["last_successful_api"],
+        "hedge_enabled": HEDGE_ENABLED,  # 🆕 v127
+        "system_audio_strategy": SYSTEM_AUDIO_STRATEGY,  # 🆕 v128
+        "race_wins": dict(API_FALLBACK_STATUS.get("race_wins", {})),
+        "cancellations": deadlines.cancellation_stats(),  # 🆕 v141
+        "retry": {  # 🆕 v142
+            "max_retries": dict(retry_policy.PROVIDER_MAX_RETRIES),
+            "budget": retry_policy.RETRY_BUDGET.snapshot(),
         },
-        "ai_builder": {
-            "available": not API_FALLBACK_STATUS["ai_builder_quota_exceeded"],
-            "quota_exceeded": API_FALLBACK_STATUS["ai_builder_quota_exceeded"],
-            "last_check": API_FALLBACK_STATUS["ai_builder_last_check"],
-            "usage_count": API_FALLBACK_STATUS["api_usage_count"]["ai_builder"]
+        "pacing": PACING.snapshot(),  # 🆕 v144: 各 provider 限流窗口与节流计数
+        "state_backend": state_backend.STATE.name,  # 🆕 v147
+        "concurrency": provider_concurrency.snapshot(),  # 🆕 v145: 各 provider 在飞数、队列深度、排队耗时
+        "client_in_flight": provider_concurrency.CLIENT_IN_FLIGHT.snapshot(),  # 🆕 v149: 每客户端在途上限与拒绝次数
+        "google_streaming": {  # 🆕 v138
+            "enabled": google_streaming.GOOGLE_STREAMING_ENABLED,
+            "available": google_streaming.available(),
         },
-        "openai": {
-            "available": not API_FALLBACK_STATUS["openai_quota_exceeded"],
-            "quota_exceeded": API_FALLBACK_STATUS["openai_quota_exceeded"],
-            "last_check": API_FALLBACK_STATUS["openai_last_check"],
-            "usage_count": API_FALLBACK_STATUS["api_usage_count"]["openai"]
-        },
-        "google": {
-            "available": True,
-            "usage_count": API_FALLBACK_STATUS["api_usage_count"]["google"]
+        "routing": {  # 🆕 v130
+            "mode": MIC_ROUTING_MODE,
+            "constraints": {
+                "primary_candidates": ROUTING_PRIMARY_CANDIDATES,
+                "max_cost_per_min": ROUTING_MAX_COST_PER_MIN,
+                "min_success_rate": ROUTING_MIN_SUCCESS_RATE,
+                "min_samples": ROUTING_MIN_SAMPLES,
+            },
+            "last_decision": dict(_LAST_ROUTING_DECISION),
         },
-        "last_successful_api": API_FALLBACK_STATUS["last_successful_api"]
+        "latency": PROVIDER_STATS.snapshot()  # 🆕 v130
     }
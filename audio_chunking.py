@@ -0,0 +1,278 @@
+"""
+服务端长音频分段（v134）
+
+问题：长录音要么整段丢给一个 provider（10 分钟音频就是一次 10 分钟级别的调用，中途一次
+"脱轨"毁掉后面全部内容），要么由浏览器 `splitAudioAtSilence` 解码、找静音、重编码 WAV，
+再一段一段上传——手机 CPU 吃不消，而且每段一个往返。
+
+做法：与前端 v115 同一套切法，挪到服务端：
+  · 在目标切点（每 CHUNK_TARGET_SECONDS 秒）± CHUNK_SEARCH_WINDOW_SECONDS 内找 RMS 最低的
+    30ms 窗口下刀，尾段不足 CHUNK_MIN_TAIL_SECONDS 并入前一段；
+  · 每段向前多带 CHUNK_OVERLAP_SECONDS，切点附近的字不会被刀切断——代价是重叠处的字可能
+    出现两次，由 stitch_texts 拼接时去重。
+
+只处理 PCM WAV（浏览器 VAD 输出即 16kHz 单声道 WAV）：标准库 `wave` 即可解析。WebM/MP4 需要
+解码器（ffmpeg），镜像里没有，也不为此引入——这类输入 split_wav_at_silence 返回 None，走整段转录。
+"""
+
+import io
+import os
+import re
+import math
+import wave
+import asyncio
+from array import array
+from typing import List, Optional
+
+import upload_intake
+
+CHUNK_MIN_SECONDS = float(os.environ.get("CHUNK_MIN_SECONDS", "90"))         # 短于此不分段
+CHUNK_TARGET_SECONDS = float(os.environ.get("CHUNK_TARGET_SECONDS", "60"))
+CHUNK_SEARCH_WINDOW_SECONDS = float(os.environ.get("CHUNK_SEARCH_WINDOW_SECONDS", "8"))
+CHUNK_MIN_TAIL_SECONDS = float(os.environ.get("CHUNK_MIN_TAIL_SECONDS", "15"))
+CHUNK_OVERLAP_SECONDS = float(os.environ.get("CHUNK_OVERLAP_SECONDS", "1.0"))
+CHUNK_RETRIES = int(os.environ.get("CHUNK_RETRIES", "1"))                     # 失败段整段重转几轮
+RMS_WINDOW_MS = 30
+_ARRAY_TYPECODES = {2: "h", 4: "i"}   # 8-bit 单独处理；24-bit WAV 少见，不支持（走整段）
+
+# 拼接去重：最多比对重叠处多少个词/字；少于 2 个不算重叠（单字重复在中文里太常见）
+STITCH_MAX_OVERLAP_TOKENS = 12
+STITCH_MIN_OVERLAP_TOKENS = 2
+
+
+class AudioChunk:
+    """一段切好的音频。v135 起按需生成：只存起止帧，转录这一段时才从源音频读出并封成 WAV，
+    同一时刻内存里只有正在上传的那几段（≤ 并发数），不是整段录音的一份完整拷贝。"""
+
+    def __init__(self, audio: Optional[bytes], start_sec: float, end_sec: float, index: int, loader=None):
+        self._audio = audio
+        self._loader = loader
+        self.start_sec = start_sec
+        self.end_sec = end_sec
+        self.index = index
+
+    @property
+    def audio(self) -> bytes:
+        return self._audio if self._audio is not None else self._loader()
+
+    @property
+    def duration(self) -> float:
+        return self.end_sec - self.start_sec
+
+
+def _window_rms(frames: bytes, sampwidth: int, start: int, count: int) -> float:
+    """frames 中从第 start 个采样起 count 个采样的 RMS（多声道按交错采样整体算，够用于找静音）。"""
+    chunk = frames[start * sampwidth:(start + count) * sampwidth]
+    if sampwidth == 1:
+        samples = [b - 128 for b in chunk]   # 8-bit WAV 是无符号
+    else:
+        samples = array(_ARRAY_TYPECODES[sampwidth])
+        samples.frombytes(chunk)
+    if not samples:
+        return 0.0
+    return math.sqrt(sum(s * s for s in samples) / len(samples))
+
+
+def find_cut_frames(read_frames, total_frames: int, sample_rate: int, channels: int, sampwidth: int) -> List[int]:
+    """返回切点（帧号，升序）。只读取各目标切点附近的搜索窗口算 RMS，不扫全段。
+
+    read_frames(start, count) -> 从第 start 帧起 count 帧的原始 PCM 字节。
+    """
+    total_sec = total_frames / sample_rate
+    window_frames = max(1, int(sample_rate * RMS_WINDOW_MS / 1000))
+    search = int(CHUNK_SEARCH_WINDOW_SECONDS * sample_rate)
+
+    cuts = []
+    t = CHUNK_TARGET_SECONDS
+    while t < total_sec - CHUNK_MIN_TAIL_SECONDS:
+        center = int(t * sample_rate)
+        lo = max(window_frames, center - search)
+        hi = min(total_frames - window_frames, center + search)
+        region = read_frames(lo, hi - lo + window_frames) if hi > lo else b""
+        best, best_rms = None, None
+        for f in range(lo, hi, window_frames):
+            rms = _window_rms(region, sampwidth, (f - lo) * channels, window_frames * channels)
+            if best_rms is None or rms < best_rms:
+                best, best_rms = f, rms
+        if best is not None and (not cuts or best > cuts[-1]):
+            cuts.append(best)
+        t += CHUNK_TARGET_SECONDS
+    return cuts
+
+
+def wav_duration(audio) -> Optional[float]:
+    """PCM WAV 的实际时长（秒），只读文件头；不是 WAV 或解析失败返回 None。v148 限流按它计费。"""
+    if len(audio) < 12 or audio[:4] != b"RIFF" or audio[8:12] != b"WAVE":
+        return None
+    try:
+        with wave.open(upload_intake.open_reader(audio), "rb") as w:
+            return w.getnframes() / w.getframerate()
+    except (wave.Error, EOFError, ZeroDivisionError):
+        return None
+
+
+def split_wav_at_silence(audio) -> Optional[List[AudioChunk]]:
+    """把 PCM WAV 在静音点切块；不是 WAV、不够长或切不出两段时返回 None（调用方走整段转录）。
+
+    audio 可以是 bytes / memoryview / upload_intake.AudioSource，全程按需读取，不整段载入。
+    """
+    if len(audio) < 12 or audio[:4] != b"RIFF" or audio[8:12] != b"WAVE":
+        return None
+    try:
+        w = wave.open(upload_intake.open_reader(audio), "rb")
+        channels, sampwidth, rate, total_frames = w.getnchannels(), w.getsampwidth(), w.getframerate(), w.getnframes()
+    except (wave.Error, EOFError) as e:
+        print(f"[v134-CHUNK] ⚠️ WAV 解析失败，走整段转录: {e}")
+        return None
+    if sampwidth not in (1, 2, 4) or total_frames / rate <= CHUNK_MIN_SECONDS:
+        return None
+
+    def read_frames(start: int, count: int) -> bytes:
+        # 每次新开一个 reader：各段可能在不同任务里并发读取
+        with wave.open(upload_intake.open_reader(audio), "rb") as r:
+            r.setpos(start)
+            return r.readframes(count)
+
+    cuts = find_cut_frames(read_frames, total_frames, rate, channels, sampwidth)
+    if not cuts:
+        return None
+
+    def loader(start: int, end: int):
+        def _load() -> bytes:
+            buf = io.BytesIO()
+            with wave.open(buf, "wb") as out:
+                out.setnchannels(channels)
+                out.setsampwidth(sampwidth)
+                out.setframerate(rate)
+                out.writeframes(read_frames(start, end - start))
+            return buf.getvalue()
+        return _load
+
+    overlap = int(CHUNK_OVERLAP_SECONDS * rate)
+    bounds = [0] + cuts + [total_frames]
+    chunks = []
+    for i in range(len(bounds) - 1):
+        start = max(0, bounds[i] - overlap) if i > 0 else 0
+        end = bounds[i + 1]
+        chunks.append(AudioChunk(None, start / rate, end / rate, i, loader=loader(start, end)))
+    print(f"[v134-CHUNK] ✂️ 长音频 {total_frames / rate:.0f}s 切为 {len(chunks)} 段: "
+          + ", ".join(f"{c.start_sec:.1f}–{c.end_sec:.1f}s" for c in chunks))
+    return chunks
+
+
+# ---------- 拼接 ----------
+
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"   # 假名 + 汉字：逐字成词、前后不加空格
+_TOKEN_RE = re.compile(rf"[{_CJK}]|[^\s{_CJK}]+")
+_PUNCT_RE = re.compile(r"[^\w]+", re.UNICODE)
+
+
+def _norm(token: str) -> str:
+    return _PUNCT_RE.sub("", token).lower()
+
+
+def _overlap_end(prev: str, nxt: str) -> int:
+    """nxt 开头与 prev 结尾重复的部分在 nxt 中的结束位置（字符下标）；无重叠返回 0。"""
+    prev_tokens = [_norm(m.group()) for m in _TOKEN_RE.finditer(prev)]
+    next_matches = list(_TOKEN_RE.finditer(nxt))
+    next_tokens = [_norm(m.group()) for m in next_matches]
+    # 比较时忽略纯标点 token（两段在重叠处的标点经常不一致）
+    prev_idx = [t for t in prev_tokens if t][-STITCH_MAX_OVERLAP_TOKENS:]
+    next_idx = [(i, t) for i, t in enumerate(next_tokens) if t][:STITCH_MAX_OVERLAP_TOKENS]
+    for k in range(min(len(prev_idx), len(next_idx)), STITCH_MIN_OVERLAP_TOKENS - 1, -1):
+        if prev_idx[-k:] == [t for _, t in next_idx[:k]]:
+            return next_matches[next_idx[k - 1][0]].end()
+    return 0
+
+
+def _joiner(left: str, right: str) -> str:
+    if not left or not right:
+        return ""
+    if re.match(rf"[{_CJK}]", left[-1]) or re.match(rf"[{_CJK}]", right[0]):
+        return ""
+    return " "
+
+
+def stitch_texts(texts: List[str]) -> str:
+    """按顺序拼接各段文本，去掉相邻两段重叠处重复的词/字。"""
+    result = ""
+    for text in texts:
+        text = (text or "").strip()
+        if not text:
+            continue
+        if result:
+            cut = _overlap_end(result, text)
+            if cut:
+                text = text[cut:].lstrip(" ,，、。.;；")
+                if not text:
+                    continue
+        result += _joiner(result, text) + text
+    return result
+
+
+# ---------- 并行转录 ----------
+
+async def transcribe_chunks(chunks: List[AudioChunk], transcribe_one, max_parallel: int):
+    """各段并发转录（至多 max_parallel 段同时在途），按原顺序拼接。
+
+    transcribe_one(chunk) -> (text, api_used, metadata)。失败的段再整段重转 CHUNK_RETRIES 轮；
+    仍失败的记为空文本，metadata 标 partial=True 并列出缺失的时间段（missing）——调用方据此不写缓存、
+    告诉客户端结果不完整，而不是把缺一段的文本当成功。全部失败才抛出第一段的异常。
+    返回 (text, api_used, metadata)。
+    """
+    semaphore = asyncio.Semaphore(max(1, max_parallel))
+    loop = asyncio.get_running_loop()
+
+    async def _run(chunk: AudioChunk):
+        async with semaphore:
+            started = loop.time()
+            try:
+                text, api_used, _ = await transcribe_one(chunk)
+                return chunk, text, api_used, None, loop.time() - started
+            except Exception as e:
+                print(f"[v134-CHUNK] ❌ 段 {chunk.index + 1}/{len(chunks)} 失败: {e}")
+                return chunk, "", None, e, loop.time() - started
+
+    results = await asyncio.gather(*(_run(c) for c in chunks))
+    retried = 0
+    for _ in range(CHUNK_RETRIES):
+        failed = [i for i, r in enumerate(results) if r[3] is not None]
+        if not failed or len(failed) == len(results):
+            break
+        retried += len(failed)
+        print(f"[v134-CHUNK] 🔁 {len(failed)} 段失败，重转一轮")
+        for i, r in zip(failed, await asyncio.gather(*(_run(chunks[i]) for i in failed))):
+            results[i] = r
+    errors = [r[3] for r in results if r[3] is not None]
+    if len(errors) == len(results):
+        raise errors[0]
+
+    apis = []
+    for _, _, api_used, _, _ in results:
+        if api_used and api_used not in apis:
+            apis.append(api_used)
+    text = stitch_texts([r[1] for r in results])
+    metadata = {
+        "chunked": len(chunks),
+        "chunk_failures": len(errors),
+        "chunk_retries": retried,
+        "max_parallel": max_parallel,
+        "chunks": [
+            {
+                "index": c.index,
+                "start": round(c.start_sec, 2),
+                "end": round(c.end_sec, 2),
+                "api_used": api_used,
+                "elapsed": round(elapsed, 3),
+                **({"error": str(err)} if err is not None else {}),
+            }
+            for c, _, api_used, err, elapsed in results
+        ],
+    }
+    if errors:
+        metadata["partial"] = True
+        metadata["missing"] = [[round(c.start_sec, 2), round(c.end_sec, 2)] for c, _, _, err, _ in results
+                               if err is not None]
+    print(f"[v134-CHUNK] ✅ 分段转录完成: {len(chunks)} 段，失败 {len(errors)} 段，"
+          f"最慢一段 {max(r[4] for r in results):.2f}s")
+    return text, "+".join(apis), metadata
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+中间件开销微基准：v150 纯 ASGI RequestGate vs 之前的 @app.middleware("http")（BaseHTTPMiddleware）。
+
+两边调用的是同一对判定函数（_canonical_redirect / _rate_limit_response），只换外壳：
+  · before：两个 BaseHTTPMiddleware，每个请求都构造 Request、起 call_next 的任务组和内存流
+  · after ：当前 server2.app —— 静态资源 / 非限流路径在 scope 上判断完直接透传
+
+用法：
+    ./venv/bin/python bench_middleware.py            # 默认每种各 2000 个请求
+    ./venv/bin/python bench_middleware.py 5000
+不起服务、不打网络（httpx.ASGITransport 直连 app）。
+"""
+import asyncio
+import inspect
+import sys
+import time
+
+import httpx
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+
+import server2
+
+PATHS = ["/static/style.css", "/transcribe-jobs/missing"]
+
+
+def _legacy_stack():
+    """把两个 RequestGate 换回 BaseHTTPMiddleware 版本（同样的判定函数、同样的顺序）。"""
+    def wrap(check, applies):
+        async def dispatch(request, call_next):
+            if applies(request.scope):
+                response = check(request)
+                if inspect.isawaitable(response):
+                    response = await response
+                if response is not None:
+                    return response
+            return await call_next(request)
+        return Middleware(BaseHTTPMiddleware, dispatch=dispatch)
+
+    return [wrap(m.options["check"], m.options["applies"]) if m.cls is server2.RequestGate else m
+            for m in server2.app.user_middleware]
+
+
+async def _rps(path, n):
+    transport = httpx.ASGITransport(app=server2.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+        for _ in range(50):
+            await client.get(path)
+        started = time.perf_counter()
+        for _ in range(n):
+            await client.get(path)
+        return n / (time.perf_counter() - started)
+
+
+async def main(n):
+    original = list(server2.app.user_middleware)
+    results = {}
+    for label, stack in (("before", _legacy_stack()), ("after", original)):
+        server2.app.user_middleware[:] = stack
+        server2.app.middleware_stack = None
+        results[label] = {path: await _rps(path, n) for path in PATHS}
+    server2.app.user_middleware[:] = original
+    server2.app.middleware_stack = None
+
+    print(f"{'path':<28}{'before req/s':>14}{'after req/s':>14}{'提升':>8}")
+    for path in PATHS:
+        before, after = results["before"][path], results["after"][path]
+        print(f"{path:<28}{before:>14.0f}{after:>14.0f}{after / before - 1:>8.0%}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
@@ -0,0 +1,171 @@
+"""
+请求截止时间（v140）
+
+问题：每个适配器各自 `timeout=300`，`transcribe_with_fallback` 最坏要跑完整条链——约 15 分钟，
+而浏览器 120s 就放弃了。之后的 provider 调用全是白花钱：结果没人收。
+
+做法：每个转录请求带一个总的截止时间（服务端默认值，或客户端用 `X-Request-Timeout` 请求头给出，
+按 [DEADLINE_MIN_SECONDS, DEADLINE_MAX_SECONDS] 夹住），放在 contextvar 里沿调用链往下传：
+  · api_fallback._attempt_provider：每次 provider 调用只拿剩余预算；按该时长档位的历史耗时估计
+    来不及的 provider 直接跳过；预算耗尽时后面的 provider 一律不再调用；
+  · http_client.request：每个出站请求的超时不超过剩余预算，预算已耗尽则不再发出；
+  · 预算怎么花的（每次尝试的分配、耗时、结果）随响应 metadata["deadline"] 返回。
+
+contextvar 会随 asyncio 任务复制（v132 在途合并、v134 分段并发、v127 对冲都一样），
+不用改动各层函数签名。
+
+v141：截止时间同时承载取消——客户端断线且没人再等这次结果时 `cancel()`，剩余预算立即归零：
+后面的 provider 不再调用、不再发出新的出站请求；CANCELLATION_STATS 记录断线取消省下的调用、时间与费用。
+"""
+
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "110"))   # 前端 120s 中止，留点余量
+JOB_DEADLINE_SECONDS = float(os.environ.get("JOB_DEADLINE_SECONDS", "900"))           # 异步任务没人在浏览器前干等
+DEADLINE_MIN_SECONDS = 5.0
+DEADLINE_MAX_SECONDS = float(os.environ.get("DEADLINE_MAX_SECONDS", "900"))
+DEADLINE_HEADER = "X-Request-Timeout"
+
+# 跳过判断：该 provider 在此时长档位的历史耗时分位数超过剩余预算就不调用；样本不足时照常尝试
+DEADLINE_SKIP_PERCENTILE = float(os.environ.get("DEADLINE_SKIP_PERCENTILE", "0.5"))
+DEADLINE_SKIP_MIN_SAMPLES = int(os.environ.get("DEADLINE_SKIP_MIN_SAMPLES", "5"))
+
+
+class DeadlineExceeded(Exception):
+    """截止时间已到（或剩余预算不够）——不算 provider 的错，不计入熔断与统计。"""
+
+
+class Deadline:
+    def __init__(self, budget: float, source: str = "server",
+                 clock: Callable[[], float] = time.monotonic):
+        self.budget = float(budget)
+        self.source = source
+        self._clock = clock
+        self.started = clock()
+        self.expires_at = self.started + self.budget
+        self.attempts: List[Dict[str, Any]] = []
+        self.cancelled: Optional[str] = None
+        self.queued = 0.0          # v149: 排 provider 名额花掉的秒数（各次尝试累计）
+
+    def elapsed(self) -> float:
+        return self._clock() - self.started
+
+    def remaining(self) -> float:
+        if self.cancelled:
+            return 0.0
+        return max(0.0, self.expires_at - self._clock())
+
+    def cancel(self, reason: str) -> None:
+        """提前作废（如客户端断线）：之后 remaining() 恒为 0。"""
+        if not self.cancelled:
+            self.cancelled = reason
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def note_queued(self, seconds: float) -> None:
+        self.queued += seconds
+
+    def record(self, provider: str, outcome: str, *, allotted: Optional[float] = None,
+               elapsed: Optional[float] = None, estimate: Optional[float] = None, **detail: Any) -> None:
+        """记一笔预算开销。outcome: ok / failed / timeout / skipped / cancelled / aborted / retried（v142）。
+        v144：因节流溢出的 skipped 带 paced=<窗口>。"""
+        entry: Dict[str, Any] = {"provider": provider, "outcome": outcome,
+                                 "at": round(self.elapsed(), 2)}
+        if allotted is not None:
+            entry["allotted"] = round(allotted, 2)
+        if elapsed is not None:
+            entry["elapsed"] = round(elapsed, 2)
+        if estimate is not None:
+            entry["estimate"] = round(estimate, 2)
+        entry.update(detail)
+        self.attempts.append(entry)
+
+    def report(self) -> Dict[str, Any]:
+        report = {
+            "budget": round(self.budget, 2),
+            "source": self.source,
+            "elapsed": round(self.elapsed(), 2),
+            "remaining": round(self.remaining(), 2),
+            "attempts": list(self.attempts),
+        }
+        if self.queued:
+            report["queued"] = round(self.queued, 3)
+        if self.cancelled:
+            report["cancelled"] = self.cancelled
+        return report
+
+
+def parse_timeout(value: Optional[str]) -> Optional[float]:
+    """解析客户端给的超时（秒）；无效返回 None，越界的夹到允许范围内。"""
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    if seconds != seconds or seconds <= 0:      # NaN / 非正数
+        return None
+    return min(DEADLINE_MAX_SECONDS, max(DEADLINE_MIN_SECONDS, seconds))
+
+
+def for_request(client_timeout: Optional[str], default: Optional[float] = None) -> Deadline:
+    """客户端给了有效超时就用它，否则用服务端默认值。"""
+    seconds = parse_timeout(client_timeout)
+    if seconds is not None:
+        return Deadline(seconds, source="client")
+    return Deadline(REQUEST_DEADLINE_SECONDS if default is None else default, source="server")
+
+
+_CURRENT: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("deadline", default=None)
+
+
+def current() -> Optional[Deadline]:
+    return _CURRENT.get()
+
+
+def remaining() -> Optional[float]:
+    """当前截止时间的剩余秒数；没有截止时间时返回 None。"""
+    deadline = _CURRENT.get()
+    return None if deadline is None else deadline.remaining()
+
+
+@contextmanager
+def scope(deadline: Optional[Deadline]):
+    """在 with 块内（及其间创建的任务里）生效的截止时间。"""
+    token = _CURRENT.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _CURRENT.reset(token)
+
+
+# ---------- v141：断线取消统计 ----------
+
+CANCELLATION_STATS: Dict[str, float] = {
+    "disconnects": 0,                   # 检测到客户端断线的请求
+    "orphaned": 0,                      # 断线后已没有任何请求在等的转录（预算被作废）
+    "completed_after_disconnect": 0,    # 作废时结果已在路上、照常写进缓存的
+    "cancelled_calls": 0,               # 被取消的在途 provider 调用
+    "skipped_calls": 0,                 # 因此没有发起的后续 provider 调用
+    "worker_seconds_saved": 0.0,        # 按历史耗时估计省下的 provider 等待时间
+    "spend_avoided_usd": 0.0,           # 按单价 × 音频时长估计省下的费用（被取消的在途调用也算，各家对中断请求的计费不一）
+}
+
+
+def note_cancellation(field: str, amount: float = 1) -> None:
+    CANCELLATION_STATS[field] += amount
+
+
+def cancellation_stats() -> Dict[str, float]:
+    return {k: round(v, 4) if isinstance(v, float) else v for k, v in CANCELLATION_STATS.items()}
+
+
+def reset_cancellation_stats() -> None:
+    for key, value in CANCELLATION_STATS.items():
+        CANCELLATION_STATS[key] = 0.0 if isinstance(value, float) else 0
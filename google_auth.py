@@ -0,0 +1,182 @@
+"""
+Google 访问令牌（v139）
+
+问题：`get_access_token` 每次缓存过期（写死的 3600s）都重新从磁盘加载服务账号文件，并在事件循环里
+同步执行 `credentials.refresh()`——过期后的第一个请求要白等一次 OAuth 往返，期间整个 worker 卡住；
+同一时刻涌进来的多个请求各自刷新一遍。`get_project_id` 则每次 Google 调用都重新读、解析一遍凭证 JSON。
+
+做法：
+  · 凭证文件只加载一次（project_id 同时取出缓存）；
+  · 后台任务按 Google 实际返回的 expiry 提前 GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS 刷新，刷新本身放到线程里跑；
+    失败按指数退避重试，旧令牌在过期前照常使用；
+  · 调用方 `await get_token()`：令牌新鲜时直接返回，不让出事件循环；真的过期了（如刷新一直失败）才等一次刷新，
+    同一时刻的多个等待者合并到同一次刷新上。
+"""
+
+import os
+import json
+import time
+import asyncio
+import datetime
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS = float(os.environ.get("GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+GOOGLE_TOKEN_EXPIRY_SKEW_SECONDS = 30.0         # 离过期不足这么久就当作已过期，免得令牌在途中失效
+GOOGLE_TOKEN_RETRY_BASE_SECONDS = 5.0
+GOOGLE_TOKEN_RETRY_MAX_SECONDS = 300.0
+GOOGLE_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+
+def load_service_account(credentials_file: str):
+    """从服务账号文件加载凭证，返回 (credentials, project_id)。"""
+    from google.oauth2 import service_account
+
+    with open(credentials_file, "r") as f:
+        info = json.load(f)
+    credentials = service_account.Credentials.from_service_account_info(info, scopes=GOOGLE_SCOPES)
+    return credentials, info.get("project_id", "")
+
+
+def _default_request():
+    from google.auth.transport.requests import Request as GoogleRequest
+    return GoogleRequest()
+
+
+def _expiry_timestamp(expiry: Optional[datetime.datetime], fallback: float) -> float:
+    # google-auth 的 expiry 是不带时区的 UTC 时间
+    if expiry is None:
+        return fallback
+    if expiry.tzinfo is None:
+        expiry = expiry.replace(tzinfo=datetime.timezone.utc)
+    return expiry.timestamp()
+
+
+class GoogleTokenProvider:
+    def __init__(self, credentials_file: Optional[str] = None,
+                 loader: Optional[Callable[[], Tuple[Any, str]]] = None,
+                 request_factory: Callable[[], Any] = _default_request,
+                 refresh_margin: float = GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS,
+                 clock: Callable[[], float] = time.time):
+        self.credentials_file = credentials_file
+        self._loader = loader or (lambda: load_service_account(credentials_file))
+        self._request_factory = request_factory
+        self.refresh_margin = refresh_margin
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._credentials = None
+        self._project_id: Optional[str] = None
+        self._token: Optional[str] = None
+        self._expiry = 0.0
+        self._inflight: Optional[Tuple[asyncio.AbstractEventLoop, "asyncio.Task"]] = None
+        self._refresher: Optional["asyncio.Task"] = None
+        self.loads = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.coalesced = 0
+        self.last_error: Optional[str] = None
+
+    # ---------- 凭证 ----------
+
+    def configured(self) -> bool:
+        return self.credentials_file is None or os.path.exists(self.credentials_file)
+
+    def _ensure_loaded(self):
+        if self._credentials is None:
+            with self._lock:
+                if self._credentials is None:
+                    self._credentials, self._project_id = self._loader()
+                    self.loads += 1
+        return self._credentials
+
+    @property
+    def project_id(self) -> str:
+        self._ensure_loaded()
+        return self._project_id
+
+    # ---------- 令牌 ----------
+
+    def current_token(self) -> Optional[str]:
+        """当前令牌；快过期或还没有时返回 None。不做任何 I/O。"""
+        if self._token and self._clock() < self._expiry - GOOGLE_TOKEN_EXPIRY_SKEW_SECONDS:
+            return self._token
+        return None
+
+    def refresh_blocking(self, force: bool = False) -> str:
+        """同步刷新（在线程里调用）。拿到锁后再看一眼：别的线程刚刷新过就直接用。"""
+        credentials = self._ensure_loaded()
+        with self._lock:
+            if not force and self.current_token():
+                return self._token
+            try:
+                credentials.refresh(self._request_factory())
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                raise Exception(f"无法获取访问令牌: {e}") from e
+            self._token = credentials.token
+            self._expiry = _expiry_timestamp(credentials.expiry, self._clock() + 3600)
+            self.refreshes += 1
+            self.last_error = None
+            print(f"[v139-GOOGLE-AUTH] 🔑 令牌已刷新，{self._expiry - self._clock():.0f}s 后过期")
+            return self._token
+
+    async def refresh(self, force: bool = False) -> str:
+        """异步刷新：同一事件循环里并发的调用合并成一次（在线程里执行）。"""
+        loop = asyncio.get_running_loop()
+        if self._inflight is not None and self._inflight[0] is loop and not self._inflight[1].done():
+            self.coalesced += 1
+            return await asyncio.shield(self._inflight[1])
+        task = asyncio.ensure_future(asyncio.to_thread(self.refresh_blocking, force))
+        self._inflight = (loop, task)
+        return await asyncio.shield(task)
+
+    async def get_token(self) -> str:
+        token = self.current_token()
+        if token:
+            return token
+        return await self.refresh()
+
+    # ---------- 后台刷新 ----------
+
+    async def _refresh_loop(self) -> None:
+        failures = 0
+        while True:
+            try:
+                await self.refresh(force=self._token is not None)
+                failures = 0
+                delay = max(1.0, self._expiry - self._clock() - self.refresh_margin)
+            except Exception as e:
+                failures += 1
+                delay = min(GOOGLE_TOKEN_RETRY_MAX_SECONDS, GOOGLE_TOKEN_RETRY_BASE_SECONDS * 2 ** (failures - 1))
+                print(f"[v139-GOOGLE-AUTH] ⚠️ 令牌刷新失败（第 {failures} 次），{delay:.0f}s 后重试: {e}")
+            await asyncio.sleep(delay)
+
+    def start(self) -> bool:
+        """启动后台刷新（应用启动时调用）；没有凭证文件时不启动。"""
+        if not self.configured():
+            print(f"[v139-GOOGLE-AUTH] 未找到 Google 凭证文件，跳过令牌后台刷新")
+            return False
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.ensure_future(self._refresh_loop())
+        return True
+
+    async def stop(self) -> None:
+        task, self._refresher = self._refresher, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "configured": self.configured(),
+            "has_token": self.current_token() is not None,
+            "expires_in": round(self._expiry - self._clock(), 1) if self._token else None,
+            "loads": self.loads,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "coalesced": self.coalesced,
+            "refresher_running": self._refresher is not None and not self._refresher.done(),
+            "last_error": self.last_error,
+        }
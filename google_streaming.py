@@ -0,0 +1,295 @@
+"""
+Google StreamingRecognize 路径（v138）
+
+问题：`_transcribe_google` 走 REST，音频必须整段 base64 进一个 JSON 请求体（v136 已改成边发边编码，
+但仍是"整段上传完才开始识别"）；超过 1 分钟还得走 v137 的 long-running 轮询。
+
+做法：StreamingRecognize 是 gRPC 双向流——第一条消息发识别配置，之后把音频按固定大小的帧
+（GOOGLE_STREAMING_FRAME_BYTES，低于官方每条 25KB 的上限）依次发出；帧直接从上传内存或落盘的
+临时文件里按块读（upload_intake.open_reader，走 mmap），也接受任意异步字节流（不必等整段到齐）。
+服务端边收边回 interim / final 结果，这里逐条收集：final 按序累积，interim 只保留最新一条，
+每收到一条就通过 transcription_jobs.report_progress 报给当前任务。
+
+传输层可替换（同 http_client._TRANSPORT 的做法）：
+  · GrpcSpeechTransport：真实 gRPC，依赖可选包 grpcio + google-cloud-speech；
+  · StandInSpeech：进程内替身，按 Google 的消息约定回 interim / final，离线测试用；
+  · serve_stand_in()：把替身挂到本机 gRPC 端口上，可用 GrpcSpeechTransport 端到端地打（需要 grpcio）。
+两个可选包都没装时 available() 为 False，调用方照旧走 REST。
+
+传输层之间统一用 dict 交换消息，字段名与 REST JSON 一致（camelCase：isFinal、speakerTag……），
+最后拼出的 {"results": [...]} 可以直接交给 api_fallback 里现有的解析逻辑。
+"""
+
+import os
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+
+import upload_intake
+import transcription_jobs
+
+
+GOOGLE_STREAMING_ENABLED = os.environ.get("GOOGLE_STREAMING_ENABLED", "false").strip().lower() in ("1", "true", "yes", "on")
+GOOGLE_STREAMING_TARGET = os.environ.get("GOOGLE_STREAMING_TARGET", "speech.googleapis.com:443")
+GOOGLE_STREAMING_FRAME_BYTES = int(os.environ.get("GOOGLE_STREAMING_FRAME_BYTES", str(16 * 1024)))
+# 官方限制：单条流约 5 分钟音频；更长的仍走 long-running
+GOOGLE_STREAMING_MAX_SECONDS = float(os.environ.get("GOOGLE_STREAMING_MAX_SECONDS", "290"))
+STREAMING_MAX_FRAME_BYTES = 25 * 1024
+
+# 测试注入点：设为 StandInSpeech() 或指向本机替身的 GrpcSpeechTransport
+_TRANSPORT = None
+
+
+class StreamingError(Exception):
+    """流式识别失败（替身校验失败、gRPC 错误等）。"""
+
+
+def _grpc_modules():
+    """可选依赖：grpcio + google-cloud-speech。缺任何一个返回 None。"""
+    try:
+        import grpc
+        from google.cloud import speech_v1
+    except ImportError:
+        return None
+    return grpc, speech_v1
+
+
+def available() -> bool:
+    return _TRANSPORT is not None or _grpc_modules() is not None
+
+
+def enabled() -> bool:
+    return GOOGLE_STREAMING_ENABLED and available()
+
+
+# ---------- 分帧 ----------
+
+async def iter_frames(audio: Union[upload_intake.AudioLike, AsyncIterable[bytes]],
+                      frame_bytes: int = GOOGLE_STREAMING_FRAME_BYTES) -> AsyncIterator[bytes]:
+    """把音频切成固定大小的帧（最后一帧可以更短）。
+
+    audio 为 bytes / memoryview / AudioSource 时按块从内存或临时文件读；为异步字节流时边收边切。
+    """
+    if hasattr(audio, "__aiter__"):
+        pending = bytearray()
+        async for chunk in audio:
+            pending += chunk
+            while len(pending) >= frame_bytes:
+                yield bytes(pending[:frame_bytes])
+                del pending[:frame_bytes]
+        if pending:
+            yield bytes(pending)
+        return
+    reader = upload_intake.open_reader(audio)
+    while True:
+        frame = reader.read(frame_bytes)
+        if not frame:
+            return
+        yield frame
+
+
+# ---------- 结果收集 ----------
+
+class StreamingTranscript:
+    """逐条收集 StreamingRecognizeResponse：final 按序累积，interim 只留最新。"""
+
+    def __init__(self):
+        self.finals: List[Dict[str, Any]] = []
+        self.interim: str = ""
+        self.responses = 0
+
+    def add(self, response: Dict[str, Any]) -> None:
+        self.responses += 1
+        interim = []
+        for result in response.get("results", []):
+            if result.get("isFinal"):
+                self.finals.append(result)
+            else:
+                alternatives = result.get("alternatives") or [{}]
+                interim.append(alternatives[0].get("transcript", ""))
+        self.interim = "".join(interim)
+
+    @property
+    def text(self) -> str:
+        return "".join((r.get("alternatives") or [{}])[0].get("transcript", "") for r in self.finals)
+
+    def result(self) -> Dict[str, Any]:
+        """与 REST `speech:recognize` 同构的结果。"""
+        return {"results": list(self.finals)}
+
+
+async def streaming_recognize(audio, config: Dict[str, Any], *, transport=None,
+                              frame_bytes: int = GOOGLE_STREAMING_FRAME_BYTES,
+                              on_update: Optional[Callable[[StreamingTranscript], None]] = None
+                              ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """发起一条识别流，返回 (与 REST 同构的结果, 流信息)。"""
+    transport = transport or _TRANSPORT or GrpcSpeechTransport()
+    total = len(audio) if not hasattr(audio, "__aiter__") else None
+    sent = {"frames": 0, "bytes": 0}
+
+    async def _requests():
+        yield {"streaming_config": {"config": config, "interim_results": True}}
+        async for frame in iter_frames(audio, frame_bytes):
+            sent["frames"] += 1
+            sent["bytes"] += len(frame)
+            yield {"audio_content": frame}
+
+    transcript = StreamingTranscript()
+    async for response in transport.streaming_recognize(_requests()):
+        transcript.add(response)
+        progress = {"stage": "google_streaming", "finals": len(transcript.finals),
+                    "interim": transcript.interim[-200:], "sent_bytes": sent["bytes"]}
+        if total:
+            progress["percent"] = int(100 * sent["bytes"] / total)
+        transcription_jobs.report_progress(**progress)
+        if on_update is not None:
+            on_update(transcript)
+    info = {**sent, "responses": transcript.responses, "finals": len(transcript.finals)}
+    return transcript.result(), info
+
+
+# ---------- 传输：进程内替身 ----------
+
+class StandInSpeech:
+    """本地替身：按 StreamingRecognize 的消息约定收帧、回结果，不联网。
+
+    每收满 bytes_per_final 字节音频回一条 final（"第 N 句。"，说话人 1/2 交替），其间每帧回一条 interim。
+    同时检查调用方是否守约：第一条必须是 streaming_config 且只出现一次，每帧不超过 25KB。
+    """
+
+    def __init__(self, bytes_per_final: int = 64 * 1024):
+        self.bytes_per_final = bytes_per_final
+        self.configs: List[Dict[str, Any]] = []
+        self.frame_sizes: List[int] = []
+
+    @staticmethod
+    def _result(index: int, is_final: bool) -> Dict[str, Any]:
+        transcript = f"第{index}句。"
+        alternative = {"transcript": transcript}
+        if is_final:
+            alternative["confidence"] = 0.9
+            alternative["words"] = [{"word": transcript, "speakerTag": (index - 1) % 2 + 1}]
+        return {"results": [{"alternatives": [alternative], "isFinal": is_final, "languageCode": "zh-cn"}]}
+
+    async def streaming_recognize(self, requests: AsyncIterable[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        first = True
+        pending = 0
+        finals = 0
+        async for request in requests:
+            if first:
+                if "streaming_config" not in request:
+                    raise StreamingError("第一条消息必须是 streaming_config")
+                self.configs.append(request["streaming_config"])
+                first = False
+                continue
+            if "streaming_config" in request:
+                raise StreamingError("streaming_config 只能出现在第一条消息")
+            frame = request.get("audio_content") or b""
+            if len(frame) > STREAMING_MAX_FRAME_BYTES:
+                raise StreamingError(f"audio_content 超过 {STREAMING_MAX_FRAME_BYTES} 字节")
+            self.frame_sizes.append(len(frame))
+            pending += len(frame)
+            if pending >= self.bytes_per_final:
+                finals += 1
+                pending = 0
+                yield self._result(finals, True)
+            else:
+                yield self._result(finals + 1, False)
+        if pending:
+            yield self._result(finals + 1, True)
+
+
+# ---------- 传输：gRPC ----------
+
+def _request_to_proto(speech_v1, request: Dict[str, Any]):
+    if "streaming_config" in request:
+        streaming = request["streaming_config"]
+        return speech_v1.StreamingRecognizeRequest(streaming_config=speech_v1.StreamingRecognitionConfig(
+            # config 用的是 REST 字段名（camelCase），from_json 按 JSON 名解析
+            config=speech_v1.RecognitionConfig.from_json(json.dumps(streaming["config"])),
+            interim_results=streaming.get("interim_results", False),
+        ))
+    return speech_v1.StreamingRecognizeRequest(audio_content=bytes(request["audio_content"]))
+
+
+def _request_from_proto(speech_v1, message) -> Dict[str, Any]:
+    if "streaming_config" in message:
+        streaming = message.streaming_config
+        return {"streaming_config": {
+            "config": json.loads(speech_v1.RecognitionConfig.to_json(streaming.config)),
+            "interim_results": streaming.interim_results,
+        }}
+    return {"audio_content": message.audio_content}
+
+
+class GrpcSpeechTransport:
+    """真实 gRPC 传输。target 为 host:port；insecure=True 时用明文通道（连本机替身）。"""
+
+    def __init__(self, target: str = GOOGLE_STREAMING_TARGET, insecure: bool = False,
+                 token_provider: Optional[Callable[[], str]] = None):
+        self.target = target
+        self.insecure = insecure
+        self.token_provider = token_provider
+
+    def _channel(self, grpc):
+        if self.insecure:
+            return grpc.aio.insecure_channel(self.target)
+        token_provider = self.token_provider
+        if token_provider is None:
+            from server2 import get_access_token
+            token_provider = get_access_token   # v139 起令牌由后台刷新，这里通常直接命中
+        credentials = grpc.composite_channel_credentials(
+            grpc.ssl_channel_credentials(), grpc.access_token_call_credentials(token_provider()))
+        return grpc.aio.secure_channel(self.target, credentials)
+
+    async def streaming_recognize(self, requests: AsyncIterable[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        modules = _grpc_modules()
+        if modules is None:
+            raise StreamingError("未安装 grpcio / google-cloud-speech，无法使用 StreamingRecognize")
+        grpc, speech_v1 = modules
+        from google.cloud.speech_v1.services.speech.transports import SpeechGrpcAsyncIOTransport
+
+        async def _proto_requests():
+            async for request in requests:
+                yield _request_to_proto(speech_v1, request)
+
+        channel = self._channel(grpc)
+        try:
+            client = speech_v1.SpeechAsyncClient(transport=SpeechGrpcAsyncIOTransport(channel=channel))
+            stream = await client.streaming_recognize(requests=_proto_requests())
+            async for response in stream:
+                yield json.loads(speech_v1.StreamingRecognizeResponse.to_json(response))
+        except grpc.aio.AioRpcError as e:
+            raise StreamingError(f"Google StreamingRecognize 错误 [{e.code().name}]: {e.details()}") from e
+        finally:
+            await channel.close()
+
+
+async def serve_stand_in(stand_in: StandInSpeech, host: str = "127.0.0.1", port: int = 0):
+    """把替身挂到本机 gRPC 端口（服务名/方法名与 google.cloud.speech.v1.Speech 一致），返回 (server, target)。"""
+    modules = _grpc_modules()
+    if modules is None:
+        raise StreamingError("未安装 grpcio / google-cloud-speech，无法启动 gRPC 替身")
+    grpc, speech_v1 = modules
+
+    async def _streaming_recognize(request_iterator, context):
+        async def _requests():
+            async for message in request_iterator:
+                yield _request_from_proto(speech_v1, message)
+        try:
+            async for response in stand_in.streaming_recognize(_requests()):
+                yield speech_v1.StreamingRecognizeResponse.from_json(json.dumps(response))
+        except StreamingError as e:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+    handler = grpc.method_handlers_generic_handler("google.cloud.speech.v1.Speech", {
+        "StreamingRecognize": grpc.stream_stream_rpc_method_handler(
+            _streaming_recognize,
+            request_deserializer=speech_v1.StreamingRecognizeRequest.deserialize,
+            response_serializer=speech_v1.StreamingRecognizeResponse.serialize,
+        ),
+    })
+    server = grpc.aio.server()
+    server.add_generic_rpc_handlers((handler,))
+    bound = server.add_insecure_port(f"{host}:{port}")
+    await server.start()
+    return server, f"{host}:{bound}"
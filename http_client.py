@@ -0,0 +1,173 @@
+"""
+共享异步 HTTP 客户端层（v126）
+
+问题：api_fallback.py 里的各个 `_transcribe_*` 虽然是 `async def`，内部却调用同步的
+`requests.post(..., timeout=300)`。一次慢吞吞的 Whisper 调用会把整个 uvicorn 事件循环
+卡住最长 5 分钟——期间其他用户的上传、页面加载、限流检查全部排队干等。
+
+做法：所有出站调用（各 provider 适配器 + 旧版 `/speech-to-text`、`/speech-to-text-aibuilder`
+路由）统一走这里的 `httpx.AsyncClient`：
+  · 按 provider 主机（scheme://host:port）各持一个客户端，连接池 keep-alive 复用，
+    省掉每次请求的 TCP + TLS 握手；
+  · 连接池上限、各阶段超时（connect / read / write / pool）均可用环境变量调；
+  · 客户端与创建它的事件循环绑定——换了循环（测试、热重载）会自动重建，
+    不会拿着一个属于已关闭循环的连接池去发请求。
+
+单个 worker 因此可以同时挂着几十个转录请求，互不阻塞。
+"""
+
+import os
+import asyncio
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+import deadlines
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        print(f"[v126-HTTP] ⚠️ 环境变量 {name} 不是数字，使用默认值 {default}")
+        return float(default)
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(_env_float(name, default))
+
+
+# 连接池：每个 provider 主机各一份（不是全局共享一份），一个 provider 堵死不会占光别人的连接
+HTTP_POOL_MAX_CONNECTIONS = _env_int("HTTP_POOL_MAX_CONNECTIONS", 100)
+HTTP_POOL_MAX_KEEPALIVE = _env_int("HTTP_POOL_MAX_KEEPALIVE", 20)
+HTTP_KEEPALIVE_EXPIRY = _env_float("HTTP_KEEPALIVE_EXPIRY", 30.0)
+
+# 分阶段超时：连接要快速失败；read 保留 v109 的 5 分钟（长音频转录确实要这么久）
+HTTP_CONNECT_TIMEOUT = _env_float("HTTP_CONNECT_TIMEOUT", 10.0)
+HTTP_READ_TIMEOUT = _env_float("HTTP_READ_TIMEOUT", 300.0)
+HTTP_WRITE_TIMEOUT = _env_float("HTTP_WRITE_TIMEOUT", 60.0)
+HTTP_POOL_TIMEOUT = _env_float("HTTP_POOL_TIMEOUT", 30.0)
+
+
+def pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def make_timeout(read: Optional[float] = None, connect: Optional[float] = None) -> httpx.Timeout:
+    """构造分阶段超时；未指定的阶段取全局默认值。"""
+    return httpx.Timeout(
+        connect=HTTP_CONNECT_TIMEOUT if connect is None else connect,
+        read=HTTP_READ_TIMEOUT if read is None else read,
+        write=HTTP_WRITE_TIMEOUT,
+        pool=HTTP_POOL_TIMEOUT,
+    )
+
+
+# origin -> (event loop, client)
+_clients: Dict[str, Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+
+# 测试注入点：设为 httpx.MockTransport 即可不打网络
+_TRANSPORT: Optional[httpx.AsyncBaseTransport] = None
+
+
+def _origin(url: str) -> str:
+    u = httpx.URL(url)
+    port = f":{u.port}" if u.port else ""
+    return f"{u.scheme}://{u.host}{port}"
+
+
+def get_client(url: str) -> httpx.AsyncClient:
+    """返回该 URL 所属主机的共享客户端（不存在或属于别的事件循环时新建）。"""
+    origin = _origin(url)
+    loop = asyncio.get_running_loop()
+    entry = _clients.get(origin)
+    if entry and entry[0] is loop and not entry[1].is_closed:
+        return entry[1]
+
+    client = httpx.AsyncClient(
+        limits=pool_limits(),
+        timeout=make_timeout(),
+        transport=_TRANSPORT,
+    )
+    _clients[origin] = (loop, client)
+    print(f"[v126-HTTP] 新建连接池: {origin} (max={HTTP_POOL_MAX_CONNECTIONS}, "
+          f"keepalive={HTTP_POOL_MAX_KEEPALIVE})")
+    return client
+
+
+def _clamp_timeout(timeout: Optional[Any], budget: float) -> httpx.Timeout:
+    """把各阶段超时压到 budget 以内（timeout 可为 None / 秒数 / httpx.Timeout）。"""
+    if timeout is None:
+        base = make_timeout()
+    elif isinstance(timeout, httpx.Timeout):
+        base = timeout
+    else:
+        base = httpx.Timeout(float(timeout))
+
+    def clamp(value):
+        return budget if value is None else min(value, budget)
+
+    return httpx.Timeout(connect=clamp(base.connect), read=clamp(base.read),
+                         write=clamp(base.write), pool=clamp(base.pool))
+
+
+async def request(method: str, url: str, *, timeout: Optional[Any] = None, **kwargs) -> httpx.Response:
+    """发送请求。网络层异常统一转成带类型名与主机的 Exception，便于上层按文本分类错误。
+
+    httpx 的超时异常 str() 常常是空串（requests 则带详细描述）；不补上类型名的话，
+    上层 `errors.append(f"OpenAI: {e}")` 只会记下一个冒号。
+    """
+    client = get_client(url)
+    budget = deadlines.remaining()
+    if budget is not None:
+        # v140：超时不超过请求剩余预算；预算已耗尽就不再发出
+        if budget <= 0:
+            raise deadlines.DeadlineExceeded(f"截止时间已到，未发出请求 ({_origin(url)})")
+        timeout = _clamp_timeout(timeout, budget)
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    try:
+        return await client.request(method, url, **kwargs)
+    except httpx.TransportError as e:
+        raise Exception(f"{type(e).__name__} ({_origin(url)}): {e or 'timeout/connection error'}") from e
+
+
+async def post(url: str, *, timeout: Optional[Any] = None, **kwargs) -> httpx.Response:
+    return await request("POST", url, timeout=timeout, **kwargs)
+
+
+async def get(url: str, *, timeout: Optional[Any] = None, **kwargs) -> httpx.Response:
+    return await request("GET", url, timeout=timeout, **kwargs)
+
+
+async def aclose_all() -> None:
+    """关闭所有连接池（应用 shutdown 时调用）。"""
+    entries = list(_clients.values())
+    _clients.clear()
+    for _, client in entries:
+        try:
+            await client.aclose()
+        except Exception as e:
+            print(f"[v126-HTTP] 关闭连接池失败（忽略）: {e}")
+
+
+def pool_stats() -> Dict[str, Any]:
+    """当前连接池概况（调试/状态接口用）。"""
+    return {
+        "hosts": sorted(_clients.keys()),
+        "limits": {
+            "max_connections": HTTP_POOL_MAX_CONNECTIONS,
+            "max_keepalive_connections": HTTP_POOL_MAX_KEEPALIVE,
+            "keepalive_expiry": HTTP_KEEPALIVE_EXPIRY,
+        },
+        "timeouts": {
+            "connect": HTTP_CONNECT_TIMEOUT,
+            "read": HTTP_READ_TIMEOUT,
+            "write": HTTP_WRITE_TIMEOUT,
+            "pool": HTTP_POOL_TIMEOUT,
+        },
+    }
@@ -0,0 +1,287 @@
+"""
+按 provider 限制并发 + 有界排队（v145）
+
+问题：发往每个 provider 的并发调用数没有任何上限。一波流量能同时打出几百个 Whisper 上传，
+它们一起撞上对方的限流（或把我们自己的连接池 / 上行带宽挤满），再一起失败、一起降级。
+
+做法：每个 provider 一个 ProviderSlots：
+  · 最多 PROVIDER_MAX_CONCURRENCY 个调用同时在飞（可用 "openai=16,google=8" 覆盖，0 表示不限）；
+  · 名额满了就按先来后到排队（FIFO：名额空出来直接交给队首，后来的插不了队），
+    队列最多 PROVIDER_QUEUE_SIZE 个；
+  · 最长排 PROVIDER_MAX_QUEUE_SECONDS，且不超过请求剩余截止时间；按"前面排着的人数 / 并发上限 ×
+    平均占用时长"估计要排多久，估计就超了的不进队——三种情况都抛 ProviderBusy，交给下一个 provider；
+  · 队列深度、排队耗时、各原因的溢出次数随 get_api_status()["concurrency"] 导出。
+
+v149：一个客户端能在 60 秒窗口内同时挂着 20 个长转录，把 provider 名额全占住，别人只能排在它后面。
+  · 每个客户端同时在转录的请求数有上限（CLIENT_MAX_IN_FLIGHT，ClientInFlight）；超了直接 ClientBusy（429）；
+  · 排队改为按客户端分队列、队列之间 deficit round robin：名额空出来轮流交给各客户端的队首，
+    重度用户的第十个请求不会挡在轻度用户的第一个前面；同一客户端内部仍是先来后到；
+  · 客户端身份与截止时间一样走 contextvar（client_scope），调用链各层不用改签名；
+  · 排队耗时累加到截止时间上（Deadline.queued），随响应 metadata["queue_wait"] 返回。
+"""
+
+import os
+import math
+import time
+import asyncio
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from provider_health import Ewma, LatencyWindow
+
+
+PROVIDER_QUEUE_SIZE = int(os.environ.get("PROVIDER_QUEUE_SIZE", "32"))
+PROVIDER_MAX_QUEUE_SECONDS = float(os.environ.get("PROVIDER_MAX_QUEUE_SECONDS", "10"))
+# v149：每个客户端同时在转录的请求数上限（0 = 不限）；前端最多并发 2 段，正常用绝不会碰到
+CLIENT_MAX_IN_FLIGHT = int(os.environ.get("CLIENT_MAX_IN_FLIGHT", "4"))
+# DRR 每轮给每个客户端的额度；一次调用花费 1，即每轮每个客户端拿一个名额
+FAIR_QUEUE_QUANTUM = 1.0
+
+# OpenAI 是主力，名额最多；Diarize 单次调用又长又贵，收紧些
+PROVIDER_MAX_CONCURRENCY = {
+    "openai": 16,
+    "openai_diarize": 4,
+    "ai_builder": 8,
+    "google": 8,
+    "deepgram": 8,
+}
+for _item in os.environ.get("PROVIDER_MAX_CONCURRENCY", "").split(","):
+    if "=" in _item:
+        _name, _count = _item.split("=", 1)
+        try:
+            PROVIDER_MAX_CONCURRENCY[_name.strip()] = int(_count)
+        except ValueError:
+            print(f"[v145-CONCURRENCY] ⚠️ 忽略无效并发上限配置: {_item!r}")
+
+
+class ProviderBusy(Exception):
+    """该 provider 名额已满且等不起——交给下一个 provider。不算 provider 的错。"""
+
+
+class ClientBusy(Exception):
+    """该客户端同时在转录的请求已达上限——调用方返回 429。"""
+
+
+_CLIENT: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("client", default=None)
+
+
+def current_client() -> Optional[str]:
+    return _CLIENT.get()
+
+
+@contextmanager
+def client_scope(client: Optional[str]):
+    """在 with 块内（及其间创建的任务里）排队时按这个客户端计入公平队列。"""
+    token = _CLIENT.set(client)
+    try:
+        yield client
+    finally:
+        _CLIENT.reset(token)
+
+
+class ProviderSlots:
+    """单个 provider 的并发名额与等待队列：客户端之间 DRR 轮转，同一客户端内 FIFO。时间源可注入（测试用）。"""
+
+    def __init__(self, name: str, limit: int, queue_size: Optional[int] = None, max_wait: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.limit = limit
+        self.queue_size = PROVIDER_QUEUE_SIZE if queue_size is None else queue_size
+        self.max_wait = PROVIDER_MAX_QUEUE_SECONDS if max_wait is None else max_wait
+        self._clock = clock
+        self._queues: Dict[Optional[str], Deque[Tuple[asyncio.Future, float]]] = {}
+        self._ring: Deque[Optional[str]] = deque()        # 有人在排队的客户端，轮转顺序
+        self._deficit: Dict[Optional[str], float] = {}
+        self._hold = Ewma()
+        self.active = 0
+        self.max_depth = 0
+        self.waits = LatencyWindow()
+        self.total_wait = 0.0
+        self.queued = 0
+        self.spilled = {"queue_full": 0, "predicted": 0, "timeout": 0}
+
+    def depth(self) -> int:
+        return sum(1 for queue in self._queues.values() for f, _ in queue if not f.done())
+
+    def clients_waiting(self) -> int:
+        return sum(1 for queue in self._queues.values() if any(not f.done() for f, _ in queue))
+
+    def _live(self, client: Optional[str]) -> int:
+        return sum(1 for f, _ in self._queues.get(client, ()) if not f.done())
+
+    def predicted_wait(self, client: Optional[str] = None) -> Optional[float]:
+        """排到这里大约要等多久：排在前面的人（含自己）分几轮 × 平均占用时长。没有样本返回 None。
+
+        公平轮转下，排在前面的是自己队列里的全部，加上别的客户端各自最多"自己排第几就几个"。
+        """
+        if self._hold.value is None:
+            return None
+        own = self._live(client)
+        ahead = own + sum(min(self._live(other), own + 1) for other in self._queues if other != client)
+        rounds = math.ceil((ahead + 1) / self.limit)
+        return rounds * self._hold.value
+
+    def _spill(self, reason: str, message: str):
+        self.spilled[reason] += 1
+        raise ProviderBusy(message)
+
+    async def acquire(self, budget: Optional[float] = None, client: Optional[str] = None,
+                      cost: float = 1.0) -> float:
+        """拿一个名额，返回排队秒数；等不起抛 ProviderBusy。client 缺省取 client_scope 里的。"""
+        if self.limit <= 0 or (self.active < self.limit and not self.depth()):
+            self.active += 1
+            return 0.0
+        if self.depth() >= self.queue_size:
+            self._spill("queue_full", f"{self.name} 并发已满（{self.active}）且排队已满（{self.queue_size}）")
+        client = current_client() if client is None else client
+        max_wait = self.max_wait if budget is None else min(self.max_wait, budget)
+        predicted = self.predicted_wait(client)
+        if predicted is not None and predicted > max_wait:
+            self._spill("predicted", f"{self.name} 预计排队 {predicted:.1f}s，超过可等的 {max_wait:.1f}s")
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(client)
+        if queue is None:
+            queue = self._queues[client] = deque()
+            self._ring.append(client)
+            self._deficit[client] = 0.0
+        queue.append((future, cost))
+        self.queued += 1
+        self.max_depth = max(self.max_depth, self.depth())
+        start = self._clock()
+        try:
+            await asyncio.wait_for(future, max_wait)
+        except asyncio.TimeoutError:
+            self._forget(future)
+            self._spill("timeout", f"{self.name} 排队 {max_wait:.1f}s 仍未轮到")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()          # 名额已交到手上又被取消：还回去
+            else:
+                self._forget(future)
+            raise
+        waited = self._clock() - start
+        self.waits.add(waited)
+        self.total_wait += waited
+        return waited
+
+    def _forget(self, future) -> None:
+        for queue in self._queues.values():
+            for entry in queue:
+                if entry[0] is future:
+                    queue.remove(entry)
+                    return
+
+    def _drop_client(self, client: Optional[str]) -> None:
+        self._ring.remove(client)
+        del self._queues[client]
+        del self._deficit[client]
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        """deficit round robin：轮到的客户端加一份额度，够付队首的花费就交给它，不够就让给下一位。"""
+        while self._ring:
+            client = self._ring[0]
+            queue = self._queues[client]
+            while queue and queue[0][0].done():         # 已超时 / 取消的
+                queue.popleft()
+            if not queue:
+                self._drop_client(client)
+                continue
+            future, cost = queue[0]
+            if self._deficit[client] < cost:
+                self._deficit[client] += FAIR_QUEUE_QUANTUM
+                if self._deficit[client] < cost:
+                    self._ring.rotate(-1)
+                continue
+            queue.popleft()
+            self._deficit[client] -= cost
+            if not any(not f.done() for f, _ in queue):
+                self._drop_client(client)
+            elif self._deficit[client] < queue[0][1]:
+                self._ring.rotate(-1)                   # 本轮额度用完，下一位
+            return future
+        return None
+
+    def release(self, held: Optional[float] = None) -> None:
+        """调用结束（无论成败）；名额直接交给下一个轮到的（active 不变），没人排队才减。"""
+        if held is not None:
+            self._hold.update(held)
+        future = self._next_waiter()
+        if future is not None:
+            future.set_result(None)
+            return
+        self.active = max(0, self.active - 1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        p95 = self.waits.percentile(0.95)
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queue_depth": self.depth(),
+            "clients_waiting": self.clients_waiting(),
+            "max_queue_depth": self.max_depth,
+            "queued": self.queued,
+            "wait_p95": round(p95, 3) if p95 is not None else None,
+            "wait_total_seconds": round(self.total_wait, 3),
+            "avg_hold_seconds": round(self._hold.value, 2) if self._hold.value is not None else None,
+            "spilled": dict(self.spilled),
+        }
+
+
+class ClientInFlight:
+    """每个客户端同时在转录的请求数（同步请求从开始转录到返回；异步任务从提交到结束）。"""
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = CLIENT_MAX_IN_FLIGHT if limit is None else limit
+        self._counts: Dict[str, int] = {}
+        self.rejected = 0
+
+    def enter(self, client: str) -> None:
+        count = self._counts.get(client, 0)
+        if self.limit > 0 and count >= self.limit:
+            self.rejected += 1
+            raise ClientBusy(f"{client} 已有 {count} 个转录在进行（上限 {self.limit}）")
+        self._counts[client] = count + 1
+
+    def leave(self, client: str) -> None:
+        count = self._counts.get(client, 0) - 1
+        if count > 0:
+            self._counts[client] = count
+        else:
+            self._counts.pop(client, None)
+
+    def in_flight(self, client: str) -> int:
+        return self._counts.get(client, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "clients": len(self._counts),
+            "in_flight": sum(self._counts.values()),
+            "rejected": self.rejected,
+        }
+
+
+CLIENT_IN_FLIGHT = ClientInFlight()
+
+_SLOTS: Dict[str, ProviderSlots] = {}
+
+
+def get_slots(provider: str) -> ProviderSlots:
+    slots = _SLOTS.get(provider)
+    if slots is None:
+        slots = _SLOTS[provider] = ProviderSlots(provider, PROVIDER_MAX_CONCURRENCY.get(provider, 0))
+    return slots
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    return {name: slots.snapshot() for name, slots in _SLOTS.items()}
+
+
+def reset() -> None:
+    """测试用：清空各 provider 的名额与队列，以及各客户端的在途计数。"""
+    global CLIENT_IN_FLIGHT
+    _SLOTS.clear()
+    CLIENT_IN_FLIGHT = ClientInFlight()
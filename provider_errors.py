@@ -0,0 +1,162 @@
+"""
+provider 错误分类（v143）
+
+问题：`is_quota_exceeded` 把任何 429、任何带 "exceeded" / "limit reached" 的报错都当成配额耗尽。
+OpenAI 一次突发限流（RPM 满了，几秒后就恢复）就让主力 provider 被 QUOTA_RECHECK_INTERVAL 锁一整小时，
+这一小时里所有请求都落到更慢的兜底上。
+
+做法：错误分成五类，各自处理（api_fallback._apply_error_class）：
+  · rate_limited     —— 限流：按 Retry-After / 限流响应头冷却几秒到几分钟（不是一小时），短的可以原地等一下重试；
+  · quota_exhausted  —— 真正的余额/额度耗尽（insufficient_quota、402、billing…）：才锁 QUOTA_RECHECK_INTERVAL；
+  · auth             —— 密钥无效/未配置（401/403）：冷却一段时间，不计入熔断；
+  · bad_input        —— 这段音频/参数的问题（其余 4xx）：不冷却、不重试、不计入熔断；
+  · transient        —— 5xx、超时、连接错误：可快速重试（v142），计入熔断器。
+分类不了的（空文本、幻觉）返回 None。
+
+适配器收到非 200 时抛 ProviderError（文本格式与原来的 "XXX API 错误 [status]: body" 一致），
+带上状态码与从响应头解析出的 retry_after，供上层按类处理。
+"""
+
+import re
+import time
+import email.utils
+from typing import Any, Mapping, Optional, Tuple
+
+
+RATE_LIMITED = "rate_limited"
+QUOTA_EXHAUSTED = "quota_exhausted"
+AUTH = "auth"
+BAD_INPUT = "bad_input"
+TRANSIENT = "transient"
+
+# 先判限流：Google 的 "Quota exceeded for quota metric ... per minute" 是每分钟配额，本质是限流
+RATE_LIMIT_KEYWORDS = ("rate limit", "rate_limit", "ratelimit", "too many requests",
+                       "per minute", "per second", "requests per min", "throttl")
+QUOTA_KEYWORDS = ("insufficient_quota", "exceeded your current quota", "exceeded your quota",
+                  "quota exceeded", "out of credits", "not have enough credits", "insufficient credits",
+                  "insufficient funds", "insufficient balance", "billing", "payment required")
+AUTH_KEYWORDS = ("invalid api key", "incorrect api key", "invalid_api_key", "unauthorized",
+                 "unauthenticated", "permission denied", "permission_denied", "未配置")
+TEMPORARY_KEYWORDS = ("timeout", "connection", "network", "temporary", "unavailable", "try again",
+                      "connecterror", "readerror", "writeerror", "protocolerror", "reset by peer")
+
+
+def extract_status_code(error_message: str) -> Optional[int]:
+    """从错误文本里取出 HTTP 状态码（格式统一为 "XXX API 错误 [503]: ..."）"""
+    m = re.search(r'\[(\d{3})\]', str(error_message or ''))
+    return int(m.group(1)) if m else None
+
+
+def classify(status_code: Optional[int], error_message: str) -> Optional[str]:
+    """按状态码与错误文本归类；归不了类返回 None。"""
+    text = str(error_message or "").lower()
+    if any(k in text for k in RATE_LIMIT_KEYWORDS):
+        return RATE_LIMITED
+    if status_code == 402 or any(k in text for k in QUOTA_KEYWORDS):
+        return QUOTA_EXHAUSTED
+    if status_code in (401, 403) or any(k in text for k in AUTH_KEYWORDS):
+        return AUTH
+    if status_code == 429:
+        return RATE_LIMITED
+    if status_code is not None and (status_code == 408 or status_code >= 500):
+        return TRANSIENT
+    if status_code is None and any(k in text for k in TEMPORARY_KEYWORDS):
+        return TRANSIENT        # 网络层异常（http_client 转出来的 ReadTimeout / ConnectError …）
+    if status_code is not None and 400 <= status_code < 500:
+        return BAD_INPUT
+    return None
+
+
+# ---------- 响应头 → 冷却秒数 ----------
+
+def parse_duration(value: str) -> Optional[float]:
+    """OpenAI 风格的时长："1s" / "6m0s" / "120ms" / "1h2m3.5s"；纯数字按秒。"""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if not parts or "".join(n + u for n, u in parts) != value:
+        return None
+    scale = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    return sum(float(n) * scale[u] for n, u in parts)
+
+
+def _retry_after_header(value: str, now: float) -> Optional[float]:
+    """Retry-After：秒数或 HTTP 日期。"""
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - now)
+
+
+def parse_retry_after(headers: Mapping[str, Any], now: Optional[float] = None) -> Optional[float]:
+    """从响应头算出多久后可以再试（秒）；没有相关头返回 None。
+
+    依次看：Retry-After-Ms、Retry-After、OpenAI 的 x-ratelimit-reset-{requests,tokens}（优先取已耗尽的那项）、
+    IETF 草案的 RateLimit-Reset / 常见的 X-RateLimit-Reset（大于 1e9 视为 Unix 时间戳）。
+    """
+    now = time.time() if now is None else now
+    h = {str(k).lower(): str(v) for k, v in (headers or {}).items()}
+
+    if "retry-after-ms" in h:
+        try:
+            return max(0.0, float(h["retry-after-ms"]) / 1000.0)
+        except ValueError:
+            pass
+    if "retry-after" in h:
+        seconds = _retry_after_header(h["retry-after"], now)
+        if seconds is not None:
+            return seconds
+
+    resets = {}
+    for kind in ("requests", "tokens"):
+        raw = h.get(f"x-ratelimit-reset-{kind}")
+        seconds = parse_duration(raw) if raw else None
+        if seconds is not None:
+            resets[kind] = seconds
+    if resets:
+        exhausted = [s for kind, s in resets.items() if h.get(f"x-ratelimit-remaining-{kind}") == "0"]
+        return max(exhausted) if exhausted else min(resets.values())
+
+    for name in ("ratelimit-reset", "x-ratelimit-reset"):
+        if name in h:
+            try:
+                value = float(h[name])
+            except ValueError:
+                continue
+            return max(0.0, value - now) if value > 1e9 else max(0.0, value)
+    return None
+
+
+class ProviderError(Exception):
+    """provider 返回了非 200：文本同原来的格式，另带状态码、错误类别与 retry_after。"""
+
+    def __init__(self, message: str, *, status_code: Optional[int] = None,
+                 headers: Optional[Mapping[str, Any]] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error_class = classify(status_code, message)
+        self.retry_after = parse_retry_after(headers) if headers else None
+
+    @classmethod
+    def from_response(cls, label: str, response) -> "ProviderError":
+        return cls(f"{label} API 错误 [{response.status_code}]: {response.text}",
+                   status_code=response.status_code, headers=response.headers)
+
+
+def describe(exc: BaseException) -> Tuple[Optional[str], Optional[float]]:
+    """异常的 (类别, retry_after)。适配器包了一层（raise ... from e）也能找到里面的 ProviderError。"""
+    seen = exc
+    while seen is not None:
+        if isinstance(seen, ProviderError):
+            return seen.error_class, seen.retry_after
+        seen = seen.__cause__ or seen.__context__
+    message = str(exc)
+    return classify(extract_status_code(message), message), None
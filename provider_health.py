@@ -0,0 +1,458 @@
+"""
+Provider 健康/延迟统计（v127）
+
+给 api_fallback 的路由决策提供"实测数据"：每个 provider、每个音频时长档位
+各保留最近 N 次调用的耗时，按需算分位数（p50/p95…）。
+
+为什么要按时长分档：转录耗时和音频长度强相关——10 秒片段和 10 分钟录音混在一起算 p95
+毫无意义，对短音频会把对冲阈值抬得过高、对长音频又会过早对冲。
+
+v129 起同一模块还放各 provider 的熔断器（CircuitBreaker），见下方。
+
+纯内存、进程内，服务器重启即清空（与 API_FALLBACK_STATUS 相同）。
+v147：熔断器打开、冷却另外写一份到共享状态后端（state_backend，多 worker / 多副本时），
+别的进程据此直接跳过，不用各自再撞一次；耗时统计仍是进程内的。
+"""
+
+import os
+import math
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+import state_backend
+from state_backend import StateBackendError
+
+# 时长档位上界（秒）；超过最后一档归入 ">600s"
+DURATION_BUCKETS = (15, 60, 180, 600)
+
+# 每个 (provider, 档位) 保留的最近样本数
+LATENCY_WINDOW_SIZE = 200
+
+# v130: EWMA 平滑系数——越大越跟得上"按时段漂移"的延迟，越小越稳
+EWMA_ALPHA = float(os.environ.get("ROUTING_EWMA_ALPHA", "0.2"))
+
+
+def duration_bucket(duration: Optional[float]) -> str:
+    """把音频时长映射到档位标签（未知时长单独一档）。"""
+    if duration is None:
+        return "unknown"
+    try:
+        d = float(duration)
+    except (TypeError, ValueError):
+        return "unknown"
+    for upper in DURATION_BUCKETS:
+        if d <= upper:
+            return f"<={upper}s"
+    return f">{DURATION_BUCKETS[-1]}s"
+
+
+def _percentile(sorted_values, q: float) -> float:
+    """最近邻秩分位数（样本量小，不做插值）。"""
+    if not sorted_values:
+        raise ValueError("empty")
+    idx = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[idx]
+
+
+class LatencyWindow:
+    """固定容量的滑动样本窗口：只记录成功调用的耗时（失败的耗时不代表"出结果要多久"）。"""
+
+    def __init__(self, size: int = LATENCY_WINDOW_SIZE):
+        self.samples = deque(maxlen=size)
+
+    def add(self, latency: float):
+        self.samples.append(latency)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        return _percentile(sorted(self.samples), q)
+
+
+class Ewma:
+    """指数加权移动平均；第一个样本直接作为初值。"""
+
+    def __init__(self, alpha: float = EWMA_ALPHA):
+        self.alpha = alpha
+        self.value: Optional[float] = None
+
+    def update(self, x: float) -> float:
+        self.value = x if self.value is None else self.alpha * x + (1 - self.alpha) * self.value
+        return self.value
+
+
+class ProviderStats:
+    """按 (provider, 时长档位) 汇总的延迟与成败计数。
+
+    v130：另外维护 EWMA 延迟（只看成功调用）与 EWMA 成功率，供自适应路由排序。
+    """
+
+    def __init__(self, window_size: int = LATENCY_WINDOW_SIZE):
+        self.window_size = window_size
+        self._latency: Dict[Tuple[str, str], LatencyWindow] = {}
+        self._ewma: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._last_update: Dict[str, float] = {}
+
+    def _window(self, provider: str, bucket: str) -> LatencyWindow:
+        key = (provider, bucket)
+        w = self._latency.get(key)
+        if w is None:
+            w = self._latency[key] = LatencyWindow(self.window_size)
+        return w
+
+    def _count(self, provider: str, field: str):
+        c = self._counts.setdefault(provider, {"success": 0, "failure": 0})
+        c[field] += 1
+        self._last_update[provider] = time.time()
+
+    def _ewma_entry(self, provider: str, bucket: str) -> Dict[str, Any]:
+        key = (provider, bucket)
+        e = self._ewma.get(key)
+        if e is None:
+            e = self._ewma[key] = {"latency": Ewma(), "success": Ewma(), "samples": 0}
+        return e
+
+    def record_success(self, provider: str, duration: Optional[float], latency: float):
+        bucket = duration_bucket(duration)
+        self._window(provider, bucket).add(latency)
+        e = self._ewma_entry(provider, bucket)
+        e["latency"].update(latency)
+        e["success"].update(1.0)
+        e["samples"] += 1
+        self._count(provider, "success")
+
+    def record_failure(self, provider: str, duration: Optional[float], latency: float):
+        e = self._ewma_entry(provider, duration_bucket(duration))
+        e["success"].update(0.0)
+        e["samples"] += 1
+        self._count(provider, "failure")
+
+    def ewma(self, provider: str, duration: Optional[float]) -> Optional[Dict[str, Any]]:
+        """该档位的 EWMA 估计：{"latency", "success", "samples"}；从未调用过返回 None。
+        latency 为 None 表示只有失败、没有成功样本。"""
+        e = self._ewma.get((provider, duration_bucket(duration)))
+        if e is None:
+            return None
+        return {"latency": e["latency"].value, "success": e["success"].value, "samples": e["samples"]}
+
+    def percentile(self, provider: str, duration: Optional[float], q: float,
+                   min_samples: int = 1) -> Optional[float]:
+        """该 provider 在此时长档位的分位耗时；样本不足 min_samples 时返回 None。"""
+        w = self._latency.get((provider, duration_bucket(duration)))
+        if w is None or len(w) < min_samples:
+            return None
+        return w.percentile(q)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """供 get_api_status() 展示的摘要。"""
+        out: Dict[str, Dict] = {}
+        for (provider, bucket), w in self._latency.items():
+            entry = out.setdefault(provider, {"buckets": {}})
+            entry["buckets"][bucket] = {
+                "samples": len(w),
+                "p50": round(w.percentile(0.5), 2),
+                "p95": round(w.percentile(0.95), 2),
+            }
+        for (provider, bucket), e in self._ewma.items():
+            entry = out.setdefault(provider, {"buckets": {}})
+            b = entry["buckets"].setdefault(bucket, {"samples": 0})
+            lat = e["latency"].value
+            b["ewma_latency"] = round(lat, 2) if lat is not None else None
+            b["ewma_success"] = round(e["success"].value, 3)
+        for provider, counts in self._counts.items():
+            entry = out.setdefault(provider, {"buckets": {}})
+            entry.update(counts)
+            entry["last_update"] = self._last_update.get(provider)
+        return out
+
+    def reset(self):
+        self._latency.clear()
+        self._ewma.clear()
+        self._counts.clear()
+        self._last_update.clear()
+
+
+# 全局实例（api_fallback 读写）
+PROVIDER_STATS = ProviderStats()
+
+
+# ================================================================================
+# v147: 共享状态读写（只在多进程共享的后端上做；出错就当没有共享状态，按进程内状态走）
+# v154: 经 state_backend.MIRROR——事件循环上只读本进程镜像、写入排队，由后台同步批量刷出 / 读回，
+#       熔断判断、冷却查询不再每次都是一次 SQLite / Redis 往返
+# ================================================================================
+def shared_get_many(*keys: str):
+    if not state_backend.STATE.shared:
+        return [None] * len(keys)
+    try:
+        return state_backend.MIRROR.get_many(keys)
+    except StateBackendError as e:
+        print(f"[v147-STATE] ⚠️ 读共享状态失败（{e}），按本进程状态判断")
+        return [None] * len(keys)
+
+
+def shared_get(key: str) -> Optional[float]:
+    return shared_get_many(key)[0]
+
+
+def shared_call(method: str, key: str, *args, **kwargs) -> None:
+    """写共享状态（set / incr / delete）；不共享或失败时什么都不做。"""
+    if not state_backend.STATE.shared:
+        return
+    try:
+        state_backend.MIRROR.call(method, key, *args, **kwargs)
+    except StateBackendError as e:
+        print(f"[v147-STATE] ⚠️ 写共享状态失败（{e}），只在本进程生效")
+
+
+# ================================================================================
+# v129: 按 provider 的熔断器（closed / open / half-open）
+# ================================================================================
+# 取代原先只有一个 sticky `*_quota_exceeded` 布尔值的健康判断：那个标记只管"配额耗尽"，
+# provider 只是慢、或一直回 5xx 时，每个请求都照样先去白等一次（最长 300s）。
+#
+#   closed    —— 正常放行；滚动窗口内错误率或慢调用 p95 超阈值 → open
+#   open      —— 一律跳过；冷却期过后 → half-open
+#   half-open —— 只放**一个**探测请求；成功 → closed（清空窗口），失败 → open 且冷却期翻倍
+#
+# 只统计"说明 provider 不健康"的结果（超时、连接错误、5xx）；音频本身的问题
+# （空文本、幻觉、4xx 参数错误）不算 provider 的锅，不计入错误率。
+# v143 起 429 限流与 401/403 鉴权错误也不计入，改由下方的 ProviderCooldowns 按响应头冷却。
+# ================================================================================
+BREAKER_WINDOW_SECONDS = float(os.environ.get("BREAKER_WINDOW_SECONDS", "120"))
+BREAKER_MIN_REQUESTS = int(os.environ.get("BREAKER_MIN_REQUESTS", "5"))
+BREAKER_ERROR_RATE = float(os.environ.get("BREAKER_ERROR_RATE", "0.5"))
+# 慢调用阈值：窗口内 p95 超过它也熔断（默认远高于正常长音频耗时，只拦"卡死"）
+BREAKER_SLOW_P95_SECONDS = float(os.environ.get("BREAKER_SLOW_P95_SECONDS", "150"))
+BREAKER_OPEN_SECONDS = float(os.environ.get("BREAKER_OPEN_SECONDS", "30"))
+BREAKER_MAX_OPEN_SECONDS = float(os.environ.get("BREAKER_MAX_OPEN_SECONDS", "600"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    """单个 provider 的熔断器。时间源可注入（测试用）。"""
+
+    def __init__(self, name: str, clock=time.monotonic):
+        self.name = name
+        self._clock = clock
+        self.state = CLOSED
+        self._events = deque()          # (timestamp, ok, latency)
+        self._opened_at = None
+        self._open_seconds = BREAKER_OPEN_SECONDS
+        self._probe_in_flight = False
+        self.last_trip_reason = None
+        self.trip_count = 0
+
+    # ---- 窗口统计 -------------------------------------------------------------
+    def _prune(self, now):
+        while self._events and now - self._events[0][0] > BREAKER_WINDOW_SECONDS:
+            self._events.popleft()
+
+    def error_rate(self) -> Optional[float]:
+        self._prune(self._clock())
+        if not self._events:
+            return None
+        return sum(1 for _, ok, _ in self._events if not ok) / len(self._events)
+
+    def latency_p95(self) -> Optional[float]:
+        self._prune(self._clock())
+        latencies = sorted(lat for _, _, lat in self._events if lat is not None)
+        return _percentile(latencies, 0.95) if latencies else None
+
+    # ---- 放行判断 -------------------------------------------------------------
+    def _cooldown_over(self, now) -> bool:
+        return self._opened_at is not None and now - self._opened_at >= self._open_seconds
+
+    def _shared_open(self) -> bool:
+        """v147：别的进程把它熔断了（共享状态里还没过期）。"""
+        return shared_get(f"breaker:{self.name}") is not None
+
+    def allow_request(self) -> bool:
+        """只读判断：现在去调用是否会被放行（不占用探测名额）。"""
+        if self.state == CLOSED:
+            return not self._shared_open()
+        if self.state == OPEN:
+            return self._cooldown_over(self._clock())
+        return not self._probe_in_flight
+
+    def acquire(self) -> bool:
+        """真正发起调用前调用：open 冷却结束 → half-open 并占用唯一的探测名额。"""
+        now = self._clock()
+        if self.state == OPEN and self._cooldown_over(now):
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+            print(f"[v129-BREAKER] {self.name}: open → half_open，放行一个探测请求")
+        if self.state == CLOSED:
+            return not self._shared_open()
+        if self.state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def release(self):
+        """调用被取消（对冲/竞速落败）：归还探测名额，不计成败。"""
+        self._probe_in_flight = False
+
+    # ---- 结果回报 -------------------------------------------------------------
+    def record_success(self, latency: Optional[float] = None):
+        now = self._clock()
+        if self.state == HALF_OPEN:
+            print(f"[v129-BREAKER] {self.name}: 探测成功 → closed")
+            self._close()
+            return
+        self._events.append((now, True, latency))
+        self._evaluate(now)
+
+    def record_failure(self, latency: Optional[float] = None, reason: str = "error"):
+        now = self._clock()
+        if self.state == HALF_OPEN:
+            self._open(now, f"探测失败: {reason}", backoff=True)
+            return
+        self._events.append((now, False, latency))
+        self._evaluate(now)
+
+    def trip(self, seconds: float, reason: str):
+        """外部强制熔断一段时间（例如配额耗尽）。"""
+        now = self._clock()
+        self._open(now, reason)
+        self._open_seconds = seconds
+        shared_call("set", f"breaker:{self.name}", 1, ttl=seconds)
+
+    def _evaluate(self, now):
+        if self.state != CLOSED:
+            return
+        self._prune(now)
+        if len(self._events) < BREAKER_MIN_REQUESTS:
+            return
+        rate = self.error_rate()
+        if rate is not None and rate >= BREAKER_ERROR_RATE:
+            self._open(now, f"错误率 {rate:.0%} ≥ {BREAKER_ERROR_RATE:.0%}")
+            return
+        p95 = self.latency_p95()
+        if p95 is not None and p95 >= BREAKER_SLOW_P95_SECONDS:
+            self._open(now, f"p95 耗时 {p95:.1f}s ≥ {BREAKER_SLOW_P95_SECONDS:.0f}s")
+
+    def _open(self, now, reason, backoff=False):
+        if backoff:
+            self._open_seconds = min(self._open_seconds * 2, BREAKER_MAX_OPEN_SECONDS)
+        else:
+            self._open_seconds = BREAKER_OPEN_SECONDS
+        self.state = OPEN
+        self._opened_at = now
+        self._probe_in_flight = False
+        self.last_trip_reason = reason
+        self.trip_count += 1
+        shared_call("set", f"breaker:{self.name}", 1, ttl=self._open_seconds)
+        print(f"[v129-BREAKER] {self.name}: → open（{reason}），冷却 {self._open_seconds:.0f}s")
+
+    def _close(self):
+        if self._opened_at is not None:
+            shared_call("delete", f"breaker:{self.name}")    # 探测成功：别的进程也不用再等
+        self.state = CLOSED
+        self._events.clear()
+        self._opened_at = None
+        self._open_seconds = BREAKER_OPEN_SECONDS
+        self._probe_in_flight = False
+
+    def snapshot(self) -> Dict:
+        now = self._clock()
+        rate = self.error_rate()
+        p95 = self.latency_p95()
+        retry_in = None
+        if self.state == OPEN and self._opened_at is not None:
+            retry_in = round(max(0.0, self._open_seconds - (now - self._opened_at)), 1)
+        return {
+            "state": self.state,
+            "window_requests": len(self._events),
+            "error_rate": round(rate, 3) if rate is not None else None,
+            "latency_p95": round(p95, 2) if p95 is not None else None,
+            "retry_in_seconds": retry_in,
+            "last_trip_reason": self.last_trip_reason,
+            "trip_count": self.trip_count,
+            "shared_open": self.state == CLOSED and self._shared_open(),  # 🆕 v147: 别的进程熔断的
+        }
+
+
+CIRCUIT_BREAKERS: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    breaker = CIRCUIT_BREAKERS.get(provider)
+    if breaker is None:
+        breaker = CIRCUIT_BREAKERS[provider] = CircuitBreaker(provider)
+    return breaker
+
+
+# ================================================================================
+# v143: 按 provider 的冷却（限流 / 鉴权 / 无配额标记的 provider 的额度耗尽）
+# ================================================================================
+# 与熔断器互补：熔断器靠统计"猜" provider 不健康；冷却则是 provider 明确告诉我们
+# 多久以后再来（Retry-After、x-ratelimit-reset-*）。冷却期内直接跳过，到点自动恢复。
+# ================================================================================
+# 共享状态里按原因分键存冷却（值只能是数字），与 provider_errors 的类别名一致
+COOLDOWN_REASONS = ("rate_limited", "quota_exhausted", "auth")
+
+
+class ProviderCooldowns:
+    """各 provider 的冷却截止时刻与原因。时间源可注入（测试用）。"""
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._until: Dict[str, Tuple[float, str]] = {}
+
+    def set(self, provider: str, seconds: float, reason: str) -> None:
+        """冷却 seconds 秒；已有更晚结束的冷却时保留那个。"""
+        until = self._clock() + max(0.0, seconds)
+        self._adopt(provider, until, reason)
+        shared_call("set", f"cooldown:{provider}:{reason}", until, ttl=max(0.001, seconds))
+
+    def _adopt(self, provider: str, until: float, reason: str) -> None:
+        current = self._until.get(provider)
+        if current is None or until > current[0]:
+            self._until[provider] = (until, reason)
+
+    def _sync(self, provider: str) -> None:
+        """v147：把别的进程设下的冷却并进来（值是冷却截止时刻）。"""
+        values = shared_get_many(*(f"cooldown:{provider}:{r}" for r in COOLDOWN_REASONS))
+        for reason, until in zip(COOLDOWN_REASONS, values):
+            if until is not None:
+                self._adopt(provider, until, reason)
+
+    def remaining(self, provider: str) -> float:
+        self._sync(provider)
+        entry = self._until.get(provider)
+        if entry is None:
+            return 0.0
+        left = entry[0] - self._clock()
+        if left <= 0:
+            del self._until[provider]
+            return 0.0
+        return left
+
+    def reason(self, provider: str) -> Optional[str]:
+        return self._until[provider][1] if self.remaining(provider) > 0 else None
+
+    def describe(self, provider: str) -> Optional[Dict[str, Any]]:
+        left = self.remaining(provider)
+        if left <= 0:
+            return None
+        return {"reason": self._until[provider][1], "remaining": round(left, 1)}
+
+    def reset(self) -> None:
+        self._until.clear()
+
+
+COOLDOWNS = ProviderCooldowns()
+
+
+def reset_all():
+    """清空全部统计、熔断与冷却状态（测试用）。"""
+    PROVIDER_STATS.reset()
+    CIRCUIT_BREAKERS.clear()
+    COOLDOWNS.reset()
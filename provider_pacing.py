@@ -0,0 +1,165 @@
+"""
+按 provider 限流响应头主动节流（v144）
+
+问题：OpenAI（以及走通用 X-RateLimit-* 头的 provider）每个响应都带着剩余请求数 / 剩余 token 数，
+适配器看完状态码就扔了。高峰期我们一路把请求打满，直到吃到 429，才由 v143 冷却、降级到更慢的 provider——
+一波流量就是一串 429 → fallback → 慢 provider。
+
+做法：适配器每收到一个响应就 `PACING.observe(provider, response.headers)`，记下各限流窗口
+（requests / tokens）的上限、剩余与重置时刻；`_attempt_provider` 发起调用前先 `PACING.acquire()`：
+  · 剩余充足：直接放行；
+  · 剩余不足上限的 PACING_SLOW_FRACTION：把剩余名额均匀摊到重置前（匀速放行，相邻两次至少隔
+    "距重置秒数 / 剩余名额"），短等待原地排队；
+  · 剩余只剩 PACING_RESERVE 个：等到窗口重置；
+  · 需要等的时间超过 PACING_MAX_WAIT_SECONDS（或剩余截止时间）：不等，溢出到下一个 provider。
+响应头会滞后于并发中的请求，所以每放行一次先在本地把剩余请求数减一，下一个响应到了再以头为准。
+没见过响应头、或窗口已过重置时刻的 provider 不受影响。
+"""
+
+import os
+import time
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+import provider_errors
+
+
+PACING_ENABLED = os.environ.get("PACING_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+PACING_SLOW_FRACTION = float(os.environ.get("PACING_SLOW_FRACTION", "0.2"))
+PACING_RESERVE = int(os.environ.get("PACING_RESERVE", "1"))
+PACING_MAX_WAIT_SECONDS = float(os.environ.get("PACING_MAX_WAIT_SECONDS", "2.0"))
+
+WINDOWS = ("requests", "tokens")
+
+
+class PacingSpill(Exception):
+    """接近限额、等不起——这次不调用该 provider，交给下一个。不算 provider 的错。"""
+
+
+def _number(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def parse_limits(headers: Mapping[str, Any], now: float) -> Dict[str, Dict[str, float]]:
+    """响应头 → {窗口: {"limit", "remaining", "reset_at"}}；缺项的窗口不返回。
+
+    认 OpenAI 的 x-ratelimit-{limit,remaining,reset}-{requests,tokens}，
+    以及通用的 X-RateLimit-* / IETF 草案 RateLimit-*（视为 requests 窗口，reset 大于 1e9 按 Unix 时间戳）。
+    """
+    h = {str(k).lower(): str(v) for k, v in (headers or {}).items()}
+    limits = {}
+    for kind in WINDOWS:
+        limit = _number(h.get(f"x-ratelimit-limit-{kind}"))
+        remaining = _number(h.get(f"x-ratelimit-remaining-{kind}"))
+        raw_reset = h.get(f"x-ratelimit-reset-{kind}")
+        reset = provider_errors.parse_duration(raw_reset) if raw_reset else None
+        if limit and remaining is not None and reset is not None:
+            limits[kind] = {"limit": limit, "remaining": remaining, "reset_at": now + reset}
+    if "requests" not in limits:
+        for prefix in ("x-ratelimit-", "ratelimit-"):
+            limit = _number(h.get(f"{prefix}limit"))
+            remaining = _number(h.get(f"{prefix}remaining"))
+            reset = _number(h.get(f"{prefix}reset"))
+            if limit and remaining is not None and reset is not None:
+                reset_at = reset if reset > 1e9 else now + reset
+                limits["requests"] = {"limit": limit, "remaining": remaining, "reset_at": reset_at}
+                break
+    return limits
+
+
+class ProviderPacer:
+    """单个 provider 的节流状态。"""
+
+    def __init__(self):
+        self.windows: Dict[str, Dict[str, float]] = {}
+        self.next_slot = 0.0
+        self.paced = 0          # 匀速 / 等重置而排队的调用
+        self.spilled = 0        # 等不起而溢出到下一个 provider 的调用
+        self.waited_seconds = 0.0
+
+    def observe(self, headers: Mapping[str, Any], now: float) -> None:
+        self.windows.update(parse_limits(headers, now))
+
+    def _wait_for(self, now: float) -> Tuple[float, Optional[str]]:
+        """放行前需要等多久，以及是哪个窗口卡着。"""
+        wait, blocking = 0.0, None
+        for kind, w in list(self.windows.items()):
+            until_reset = w["reset_at"] - now
+            if until_reset <= 0:
+                del self.windows[kind]      # 窗口已重置，等下一个响应头
+                continue
+            if w["remaining"] <= PACING_RESERVE:
+                need = until_reset
+            elif w["remaining"] < w["limit"] * PACING_SLOW_FRACTION:
+                need = max(0.0, self.next_slot - now)
+                self.next_slot = max(self.next_slot, now) + until_reset / w["remaining"]
+            else:
+                continue
+            if need > wait:
+                wait, blocking = need, kind
+        return wait, blocking
+
+    def acquire(self, now: float, max_wait: float) -> Tuple[bool, float, Optional[str]]:
+        """(是否放行, 需等待秒数, 卡住的窗口)。放行即预占一个名额。"""
+        slot = self.next_slot
+        wait, blocking = self._wait_for(now)
+        if wait > max_wait:
+            self.next_slot = slot           # 不放行就不占匀速名额
+            self.spilled += 1
+            return False, wait, blocking
+        if "requests" in self.windows:
+            self.windows["requests"]["remaining"] -= 1
+        if wait > 0:
+            self.paced += 1
+            self.waited_seconds += wait
+        return True, wait, blocking
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {
+            "windows": {
+                kind: {"limit": int(w["limit"]), "remaining": int(w["remaining"]),
+                       "reset_in": round(max(0.0, w["reset_at"] - now), 2)}
+                for kind, w in self.windows.items() if w["reset_at"] > now
+            },
+            "paced": self.paced,
+            "spilled": self.spilled,
+            "waited_seconds": round(self.waited_seconds, 3),
+        }
+
+
+class PacingScheduler:
+    """各 provider 的 ProviderPacer。时间源可注入（测试用）。"""
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self._pacers: Dict[str, ProviderPacer] = {}
+
+    def _pacer(self, provider: str) -> ProviderPacer:
+        pacer = self._pacers.get(provider)
+        if pacer is None:
+            pacer = self._pacers[provider] = ProviderPacer()
+        return pacer
+
+    def observe(self, provider: str, headers: Mapping[str, Any]) -> None:
+        """适配器收到响应（无论成败）后调用。"""
+        if headers:
+            self._pacer(provider).observe(headers, self._clock())
+
+    def acquire(self, provider: str, max_wait: Optional[float] = None) -> Tuple[bool, float, Optional[str]]:
+        """发起调用前调用，返回 (是否放行, 需等待秒数, 卡住的窗口)。放行时调用方先等这么久再发。"""
+        if not PACING_ENABLED or provider not in self._pacers:
+            return True, 0.0, None
+        limit = PACING_MAX_WAIT_SECONDS if max_wait is None else min(max_wait, PACING_MAX_WAIT_SECONDS)
+        return self._pacers[provider].acquire(self._clock(), limit)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = self._clock()
+        return {name: pacer.snapshot(now) for name, pacer in self._pacers.items()}
+
+    def reset(self) -> None:
+        self._pacers.clear()
+
+
+PACING = PacingScheduler()
@@ -0,0 +1,396 @@
+"""
+转录端点限流：滑动窗口近似计数 + 时间轮过期（v146）
+
+问题：v120 的 `rate_limit_middleware` 在 async 代码里拿 `threading.Lock`，每个请求对每个窗口都
+`sum(1 for t in hits ...)` 把该客户端的时间戳 deque 从头数一遍（小时窗口最多 150 个）；dict 超过
+1000 个客户端后还要在锁里整张扫一遍找过期的。扫描器从几千个 IP 同时打过来时，这些开销全压在
+事件循环上，正常用户的上传也跟着变慢。
+
+做法：
+  · 每个客户端每个窗口只存三个数：当前窗口编号、本窗口计数、上一窗口计数。估计值
+    = 上一窗口计数 × 上一窗口仍落在滑动区间里的比例 + 本窗口计数（Cloudflare 的 sliding window 近似），
+    检查与计数都是 O(1)；被拒时按同一公式反解出估计值何时降到上限以下，作为 Retry-After；
+  · 过期交给时间轮：客户端最后一次计数后 2 个最长窗口就不再影响判断，按那一刻挂到对应的轮槽上；
+    每次检查只推进走过的轮槽（摊还 O(1)），不再整表扫描；
+  · 状态按客户端哈希分片，每片各自一张表、一个时间轮——单片表小，扩容与过期都只动一小片；
+  · 全部在事件循环线程里同步完成，中间不 await，不需要任何锁。
+
+v147：多 worker / 多副本时改用 SharedRateLimiter，计数放在共享状态后端里（见 state_backend.py）。
+v148：CostLimiter——按音频时长 / 字节数加权的令牌桶（突发 + 持续），与按次数的限流叠加。
+"""
+
+import math
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import state_backend
+from state_backend import StateBackendError
+
+
+RATE_LIMIT_SHARDS = 16
+RATE_LIMIT_WHEEL_TICK_SECONDS = 1.0
+
+
+class _Counter:
+    __slots__ = ("index", "current", "previous")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.current = 0
+        self.previous = 0
+
+    def roll(self, index: int) -> None:
+        """滚动到窗口编号 index：跨一个窗口时本窗口变上一窗口，跨得更多就都清零。"""
+        if index == self.index:
+            return
+        self.previous = self.current if index == self.index + 1 else 0
+        self.current = 0
+        self.index = index
+
+
+def _estimate(counter: _Counter, window: float, now: float) -> float:
+    elapsed = now - counter.index * window
+    return counter.previous * (1.0 - elapsed / window) + counter.current
+
+
+def _retry_after(counter: _Counter, window: float, limit: int, now: float) -> float:
+    """估计值降到 limit 以下（可以再放行一次）还要多久。"""
+    elapsed = now - counter.index * window
+    if counter.current < limit and counter.previous:
+        # 本窗口内，上一窗口的份额线性减少：previous × (1 - t/window) + current < limit
+        return max(0.0, window * (1.0 - (limit - counter.current) / counter.previous) - elapsed)
+    # 本窗口已满：等到下一窗口，本窗口计数成为"上一窗口"后再按比例减少
+    return (window - elapsed) + window * (1.0 - limit / counter.current if counter.current else 0.0)
+
+
+class TimingWheel:
+    """按轮槽（tick）挂定时过期的 key；advance 只处理走过的轮槽。"""
+
+    def __init__(self, tick: float = RATE_LIMIT_WHEEL_TICK_SECONDS):
+        self.tick = tick
+        self._slots: Dict[int, Set[str]] = {}
+        self._cursor: Optional[int] = None
+
+    def slot_for(self, at: float) -> int:
+        return int(math.ceil(at / self.tick))
+
+    def schedule(self, key: str, at: float, previous: Optional[int] = None) -> int:
+        slot = self.slot_for(at)
+        if previous is not None and previous != slot:
+            self.cancel(key, previous)
+        self._slots.setdefault(slot, set()).add(key)
+        return slot
+
+    def cancel(self, key: str, slot: int) -> None:
+        keys = self._slots.get(slot)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._slots[slot]
+
+    def advance(self, now: float) -> List[str]:
+        """返回到期的 key（并从轮上摘掉）。"""
+        current = int(now // self.tick)
+        if self._cursor is None:
+            self._cursor = current
+        if current < self._cursor:
+            return []
+        expired: List[str] = []
+        if current - self._cursor > len(self._slots):
+            # 空转了很久：轮槽比走过的格子少，直接挑出到期的轮槽
+            due = [slot for slot in self._slots if slot <= current]
+        else:
+            due = [slot for slot in range(self._cursor, current + 1) if slot in self._slots]
+        for slot in due:
+            expired.extend(self._slots.pop(slot))
+        self._cursor = current + 1
+        return expired
+
+    def __len__(self) -> int:
+        return sum(len(keys) for keys in self._slots.values())
+
+
+class _Shard:
+    __slots__ = ("clients", "expiry_slot", "wheel")
+
+    def __init__(self, tick: float):
+        self.clients: Dict[str, Dict[float, _Counter]] = {}
+        self.expiry_slot: Dict[str, int] = {}
+        self.wheel = TimingWheel(tick)
+
+
+class RateLimiter:
+    """多窗口限流。hit() 放行时计一次，被拒不计（与 v120 一致）。时间源可注入（测试用）。"""
+
+    def __init__(self, shards: int = RATE_LIMIT_SHARDS, tick: float = RATE_LIMIT_WHEEL_TICK_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._tick = tick
+        self._shards = [_Shard(tick) for _ in range(max(1, shards))]
+        self.allowed = 0
+        self.blocked = 0
+        self.expired = 0
+
+    def _shard(self, client: str) -> _Shard:
+        return self._shards[zlib.crc32(client.encode("utf-8")) % len(self._shards)]
+
+    def _expire(self, shard: _Shard, now: float) -> None:
+        for client in shard.wheel.advance(now):
+            shard.clients.pop(client, None)
+            shard.expiry_slot.pop(client, None)
+            self.expired += 1
+
+    def hit(self, client: str, limits: Sequence[Tuple[float, int]],
+            now: Optional[float] = None) -> Tuple[bool, float, Optional[Tuple[float, int, float]]]:
+        """检查并计数。返回 (是否放行, Retry-After 秒数, 被哪个 (窗口, 上限, 估计值) 拦下)。"""
+        now = self._clock() if now is None else now
+        shard = self._shard(client)
+        self._expire(shard, now)
+
+        counters = shard.clients.get(client)
+        if counters is None:
+            counters = {}
+        rolled = []
+        for window, limit in limits:
+            counter = counters.get(window)
+            index = int(now // window)
+            if counter is None:
+                counter = _Counter(index)
+            else:
+                counter.roll(index)
+            rolled.append(counter)
+            estimate = _estimate(counter, window, now)
+            if estimate >= limit:
+                self.blocked += 1
+                return False, _retry_after(counter, window, limit, now), (window, limit, estimate)
+
+        expires_at = now
+        for (window, _), counter in zip(limits, rolled):
+            counter.current += 1
+            counters[window] = counter
+            expires_at = max(expires_at, (counter.index + 2) * window)
+        shard.clients[client] = counters
+        shard.expiry_slot[client] = shard.wheel.schedule(client, expires_at, shard.expiry_slot.get(client))
+        self.allowed += 1
+        return True, 0.0, None
+
+    async def ahit(self, client: str, limits: Sequence[Tuple[float, int]],
+                   now: Optional[float] = None) -> Tuple[bool, float, Optional[Tuple[float, int, float]]]:
+        """与 SharedRateLimiter.ahit 同一个接口；进程内计数 O(1)，直接算。"""
+        return self.hit(client, limits, now)
+
+    def clients(self) -> int:
+        return sum(len(shard.clients) for shard in self._shards)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "clients": self.clients(),
+            "shards": len(self._shards),
+            "allowed": self.allowed,
+            "blocked": self.blocked,
+            "expired": self.expired,
+        }
+
+    def reset(self) -> None:
+        self._shards = [_Shard(self._tick) for _ in self._shards]
+        self.allowed = self.blocked = self.expired = 0
+
+
+class SharedRateLimiter:
+    """
+    🆕 v147: 计数放在共享状态后端（state_backend）里的同一套滑动窗口近似——多个 worker / 副本合计一个限额。
+
+    每个 (客户端, 窗口, 窗口编号) 一个计数键，TTL 两个窗口；一次检查 = 一次批量读 + 放行时每窗口一次 incr。
+    先读后加不是原子的：几个进程同一瞬间打进来时可能多放行几个，近似限流可以接受。
+    后端不可用时退回进程内的 RateLimiter（每个进程各自限流），不因共享状态挂了而放开或拒绝一切。
+    """
+
+    def __init__(self, backend, fallback: Optional[RateLimiter] = None, prefix: str = "rl"):
+        self.backend = backend
+        self.fallback = fallback or RateLimiter()
+        self.prefix = prefix
+        self.allowed = 0
+        self.blocked = 0
+        self.backend_errors = 0
+
+    def _key(self, client: str, window: float, index: int) -> str:
+        return f"{self.prefix}:{client}:{window:g}:{index}"
+
+    def hit(self, client: str, limits: Sequence[Tuple[float, int]],
+            now: Optional[float] = None) -> Tuple[bool, float, Optional[Tuple[float, int, float]]]:
+        now = time.time() if now is None else now
+        keys = []
+        for window, _ in limits:
+            index = int(now // window)
+            keys += [self._key(client, window, index), self._key(client, window, index - 1)]
+        try:
+            values = self.backend.get_many(keys)
+            for i, (window, limit) in enumerate(limits):
+                counter = _Counter(int(now // window))
+                counter.current = int(values[2 * i] or 0)
+                counter.previous = int(values[2 * i + 1] or 0)
+                estimate = _estimate(counter, window, now)
+                if estimate >= limit:
+                    self.blocked += 1
+                    return False, _retry_after(counter, window, limit, now), (window, limit, estimate)
+            for i, (window, _) in enumerate(limits):
+                self.backend.incr(keys[2 * i], 1, ttl=2 * window)
+        except StateBackendError as e:
+            self.backend_errors += 1
+            print(f"[v147-STATE] ⚠️ 限流共享计数不可用（{e}），本进程内限流")
+            return self.fallback.hit(client, limits)
+        self.allowed += 1
+        return True, 0.0, None
+
+    async def ahit(self, client: str, limits: Sequence[Tuple[float, int]],
+                   now: Optional[float] = None) -> Tuple[bool, float, Optional[Tuple[float, int, float]]]:
+        """🆕 v154: 事件循环上用这个——SQLite / Redis 的读写整次放到 state_backend 的专用线程里，不卡住别的连接。"""
+        return await state_backend.offload(self.backend, self.hit, client, limits, now)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "backend": self.backend.name,
+            "allowed": self.allowed,
+            "blocked": self.blocked,
+            "backend_errors": self.backend_errors,
+            "fallback": self.fallback.stats(),
+        }
+
+    def reset(self) -> None:
+        self.allowed = self.blocked = self.backend_errors = 0
+        self.fallback.reset()
+        try:
+            self.backend.clear(self.prefix)          # 只清限流计数；熔断、冷却等别的状态不动
+        except StateBackendError:
+            pass
+
+
+def make_limiter(backend=None):
+    """按共享状态后端选限流器：不共享（memory）时用进程内的 RateLimiter，否则 SharedRateLimiter。"""
+    if backend is None or not getattr(backend, "shared", False):
+        return RateLimiter()
+    return SharedRateLimiter(backend)
+
+
+# ---------- v148：按音频时长 / 字节数加权的令牌桶 ----------
+
+# 字节数折算成"音频秒"（v155 分两种）：
+#   · 前端录的是 16 kHz / 16-bit 单声道 PCM WAV = 32000 B/s。中间件看不到正文，只能按 Content-Length 预估，
+#     按这个速率算：WAV 恰好准，压缩格式偏少，端点读完后补扣
+#   · 压缩格式（mp3 / m4a / webm）按 128 kbps ≈ 16000 B/s 兜底：声明的时长再短，25MB 的上传也按 ~1600 秒算
+# WAV 读得出文件头时只按实测时长算，不再按字节折算（v148 按 16000 B/s 折算，WAV 被算成了实际时长的两倍）
+COST_WAV_BYTES_PER_AUDIO_SECOND = 32000
+COST_BYTES_PER_AUDIO_SECOND = 16000
+RATE_LIMIT_COST_TICK_SECONDS = 10.0
+
+
+def audio_cost(size: int, seconds: Optional[float] = None, measured: bool = False) -> float:
+    """一次上传的花费（单位：音频秒）。
+
+    measured=True 表示 seconds 是从 WAV 文件头实测的，直接按它算；否则（非 WAV，seconds 是声明的时长或未知）
+    = max(声明时长, 字节数按压缩码率折算的时长)。
+    """
+    if measured and seconds is not None:
+        return float(seconds)
+    return max(float(seconds or 0.0), (size or 0) / COST_BYTES_PER_AUDIO_SECOND)
+
+
+def prepaid_audio_cost(content_length: int) -> float:
+    """中间件按 Content-Length 预扣的花费：按前端 WAV 的码率估，多退少补由端点做。"""
+    return (content_length or 0) / COST_WAV_BYTES_PER_AUDIO_SECOND
+
+
+class CostLimits:
+    """一组令牌桶 [(容量, 每秒回补), ...]，每个都够扣才放行。name 相同的路径共用同一组桶。"""
+
+    __slots__ = ("name", "buckets")
+
+    def __init__(self, name: str, buckets: Sequence[Tuple[float, float]]):
+        self.name = name
+        self.buckets = tuple((float(capacity), float(rate)) for capacity, rate in buckets)
+
+
+class CostLimiter:
+    """
+    加权令牌桶限流：每个请求按花费（audio_cost）扣桶，而不是一律算 1 次。
+
+    突发与持续各用一个桶（容量大回补慢的管长期用量，容量小回补快的管一次性打进来多少）。
+    两段式扣费：中间件只知道 Content-Length，先按字节数 check + charge；端点读完上传、拿到实测 / 声明的
+    时长后再 charge 差额——可以扣成负数（欠账），下一次请求要等桶回补到够扣才放行。
+    桶回满的客户端等同于没有记录，挂到时间轮上到点摘掉。时间源可注入（测试用）。
+    """
+
+    def __init__(self, tick: float = RATE_LIMIT_COST_TICK_SECONDS, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._tick = tick
+        self._state: Dict[str, List[float]] = {}        # key -> [上次结算时刻, 各桶余量...]
+        self._expiry_slot: Dict[str, int] = {}
+        self._wheel = TimingWheel(tick)
+        self.blocked = 0
+        self.expired = 0
+        self.charged = 0.0
+
+    @staticmethod
+    def _key(client: str, limits: CostLimits) -> str:
+        return f"{limits.name}:{client}"
+
+    def _expire(self, now: float) -> None:
+        for key in self._wheel.advance(now):
+            self._state.pop(key, None)
+            self._expiry_slot.pop(key, None)
+            self.expired += 1
+
+    def levels(self, client: str, limits: CostLimits, now: Optional[float] = None) -> List[float]:
+        """各桶此刻的余量（按经过的时间回补，不超过容量）。"""
+        now = self._clock() if now is None else now
+        state = self._state.get(self._key(client, limits))
+        if state is None:
+            return [capacity for capacity, _ in limits.buckets]
+        elapsed = max(0.0, now - state[0])
+        return [min(capacity, level + rate * elapsed)
+                for level, (capacity, rate) in zip(state[1:], limits.buckets)]
+
+    def check(self, client: str, limits: CostLimits, cost: float, now: Optional[float] = None) -> float:
+        """还要等多少秒才够扣 cost（0 = 现在就够，不扣费）。
+
+        各桶独立线性回补，取最慢的那个就是准确的 Retry-After。cost 超过某个桶的容量时按容量算——
+        桶满时总能放行一个超大请求（扣成欠账），而不是永远拒绝。
+        """
+        now = self._clock() if now is None else now
+        self._expire(now)
+        wait = 0.0
+        for level, (capacity, rate) in zip(self.levels(client, limits, now), limits.buckets):
+            need = min(cost, capacity) - level
+            if need > 0:
+                wait = max(wait, need / rate)
+        if wait > 0:
+            self.blocked += 1
+        return wait
+
+    def charge(self, client: str, limits: CostLimits, cost: float, now: Optional[float] = None) -> List[float]:
+        """无条件扣 cost（负数即退还多扣的部分），返回扣后各桶余量。"""
+        now = self._clock() if now is None else now
+        key = self._key(client, limits)
+        levels = [min(capacity, level - cost)
+                  for level, (capacity, _) in zip(self.levels(client, limits, now), limits.buckets)]
+        full_at = now + max((capacity - level) / rate for level, (capacity, rate) in zip(levels, limits.buckets))
+        self._state[key] = [now] + levels
+        self._expiry_slot[key] = self._wheel.schedule(key, full_at, self._expiry_slot.get(key))
+        self.charged += cost
+        return levels
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "clients": len(self._state),
+            "blocked": self.blocked,
+            "expired": self.expired,
+            "charged_audio_seconds": round(self.charged, 1),
+        }
+
+    def reset(self) -> None:
+        self._state.clear()
+        self._expiry_slot.clear()
+        self._wheel = TimingWheel(self._tick)
+        self.blocked = self.expired = 0
+        self.charged = 0.0
@@ -0,0 +1,135 @@
+"""
+出站请求体的零拷贝构造（v136）
+
+问题：`_transcribe_google` 先把整段音频 base64 成一个大字符串，塞进 dict，再交给 `json=`
+由 httpx 再 `json.dumps` 一遍、encode 成 bytes——一段 20MB 的音频在内存里同时存在原始字节、
+base64 str（约 27MB）、JSON str、JSON bytes 四份，峰值接近输入的 4 倍。旧版 `/speech-to-text`
+路由同样如此。multipart 这边（OpenAI / AI Builder）则是每次 `post(files=..., data=...)`
+都让 httpx 重新拼一遍，AI Builder 冷启动重试时又拼一遍。
+
+做法：请求体是一个可重复迭代的异步字节流，长度事先算好（带 Content-Length，不走 chunked）：
+  · GoogleRecognizeBody：JSON 前缀 + 音频按 3 字节整数倍分块、逐块 base64 + JSON 后缀。
+    每块独立编码后直接拼接即是整段的 base64，内存里同时只有一块编码结果；
+  · MultipartBody：边界、各表单字段、文件头在构造时拼好一次，音频部分是 memoryview
+    切片（落盘的上传走 mmap），发送时按块交出去不复制。同一个 body 可以在重试中反复发送。
+
+每次迭代都从头生成一遍，所以同一个 body 对象可以交给 httpx 发送多次。
+"""
+
+import os
+import re
+import json
+import base64
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Dict, Optional
+
+import upload_intake
+
+
+BODY_CHUNK_BYTES = 64 * 1024
+# base64 每 3 字节输入对应 4 字节输出：分块大小取 3 的整数倍，逐块编码再拼接与整段编码逐字节相同
+BASE64_CHUNK_BYTES = 48 * 1024
+
+
+def base64_length(n: int) -> int:
+    return 4 * ((n + 2) // 3)
+
+
+class StreamingBody(ABC):
+    """可重复迭代的异步请求体。传给 httpx 的 `content=`，并带上 `headers`（含 Content-Length）。
+    子类实现 _generate：每次调用从头交出整个请求体。"""
+
+    content_type = "application/octet-stream"
+
+    def __init__(self):
+        self.content_length = 0
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Content-Type": self.content_type, "Content-Length": str(self.content_length)}
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return self._generate()
+
+    @abstractmethod
+    def _generate(self) -> AsyncIterator[bytes]:
+        """异步生成器：按块交出请求体，总长等于 content_length。"""
+
+    async def to_bytes(self) -> bytes:
+        """拼成完整 bytes（测试/调试用；正常发送路径不要调用）。
+        注意不能叫 aread：httpx 见到 aread 会把 body 当文件对象按 aread(n) 读。"""
+        return b"".join([bytes(chunk) async for chunk in self])
+
+
+def _byte_view(audio: upload_intake.AudioLike) -> memoryview:
+    view = memoryview(upload_intake.as_buffer(audio))
+    return view.cast("B") if view.format != "B" or view.ndim != 1 else view
+
+
+class GoogleRecognizeBody(StreamingBody):
+    """Google `speech:recognize` 的 JSON 请求体：{"config": ..., "audio": {"content": "<base64>"}}。"""
+
+    content_type = "application/json"
+
+    def __init__(self, config: Dict[str, Any], audio: upload_intake.AudioLike):
+        super().__init__()
+        self.config = config
+        self._audio = audio
+        self._prefix = ('{"config":' + json.dumps(config, separators=(",", ":"), ensure_ascii=False)
+                        + ',"audio":{"content":"').encode("utf-8")
+        self._suffix = b'"}}'
+        self.content_length = len(self._prefix) + base64_length(len(audio)) + len(self._suffix)
+
+    async def _generate(self) -> AsyncIterator[bytes]:
+        # config 在构造时就已序列化：调用方之后再改 config 不影响已建好的 body
+        yield self._prefix
+        view = _byte_view(self._audio)
+        for start in range(0, len(view), BASE64_CHUNK_BYTES):
+            yield base64.b64encode(view[start:start + BASE64_CHUNK_BYTES])
+        yield self._suffix
+
+
+_FORM_ESCAPES = {'"': "%22", "\\": "\\\\"}
+_FORM_ESCAPES.update({chr(c): f"%{c:02X}" for c in range(0x20) if c != 0x1B})
+_FORM_ESCAPE_RE = re.compile("|".join(re.escape(c) for c in _FORM_ESCAPES))
+
+
+def _quote(value: str) -> str:
+    # 与 httpx 一致（HTML5 表单编码）：引号 → %22，反斜杠加倍，控制字符 → %XX
+    return _FORM_ESCAPE_RE.sub(lambda m: _FORM_ESCAPES[m.group(0)], value)
+
+
+def _field_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+class MultipartBody(StreamingBody):
+    """multipart/form-data 请求体：若干文本字段 + 一个音频文件字段。"""
+
+    def __init__(self, fields: Optional[Dict[str, Any]], file_field: str, filename: str,
+                 file_content_type: str, audio: upload_intake.AudioLike, boundary: Optional[str] = None):
+        super().__init__()
+        self.boundary = boundary or os.urandom(16).hex()
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self._audio = audio
+
+        head = bytearray()
+        for name, value in (fields or {}).items():
+            if value is None:
+                continue
+            head += (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(name)}"\r\n\r\n'
+                     f'{_field_value(value)}\r\n').encode("utf-8")
+        head += (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(file_field)}"; '
+                 f'filename="{_quote(filename or "audio")}"\r\nContent-Type: {file_content_type}\r\n\r\n').encode("utf-8")
+        self._head = bytes(head)
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self.content_length = len(self._head) + len(audio) + len(self._tail)
+
+    async def _generate(self) -> AsyncIterator[bytes]:
+        yield self._head
+        view = _byte_view(self._audio)
+        for start in range(0, len(view), BODY_CHUNK_BYTES):
+            yield view[start:start + BODY_CHUNK_BYTES]
+        yield self._tail
@@ -0,0 +1,124 @@
+"""
+provider 调用的快速重试（v142）
+
+问题：`is_temporary_error` 定义了却没人调用。OpenAI 偶发一个 502 或连接被重置，请求就立即降级到
+更慢、更贵的下一个 provider——其实马上再试一次多半就好了。
+
+做法：
+  · 每个 provider 一个 RetryPolicy：临时错误（is_temporary_error）最多快速重试 max_retries 次，
+    间隔用 decorrelated jitter（sleep = min(cap, uniform(base, 上次 sleep × 3))），
+    并发请求不会在同一时刻一起重试；
+  · 全局 RetryBudget：滑动窗口内重试次数不超过调用次数的 RETRY_BUDGET_RATIO（默认 10%），
+    外加 RETRY_BUDGET_MIN_RETRIES 的保底（低流量时也能重试）。provider 真挂了的时候重试被预算掐住，
+    不会把故障放大成几倍的流量；
+  · 重试仍在 v140 截止时间内：剩余预算不够等下一次间隔就不重试。
+
+可用 PROVIDER_MAX_RETRIES="openai=2,google=1" 覆盖各 provider 的重试次数（0 表示不重试）。
+"""
+
+import os
+import time
+import random
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+
+RETRY_BASE_DELAY_SECONDS = float(os.environ.get("RETRY_BASE_DELAY_SECONDS", "0.2"))
+RETRY_MAX_DELAY_SECONDS = float(os.environ.get("RETRY_MAX_DELAY_SECONDS", "2.0"))
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MIN_RETRIES = int(os.environ.get("RETRY_BUDGET_MIN_RETRIES", "3"))
+RETRY_BUDGET_WINDOW_SECONDS = float(os.environ.get("RETRY_BUDGET_WINDOW_SECONDS", "60"))
+
+# 主力 OpenAI 多给一次机会；其余 provider 本身就是兜底，重试一次即可
+PROVIDER_MAX_RETRIES = {
+    "openai": 2,
+    "openai_diarize": 1,
+    "ai_builder": 1,
+    "google": 1,
+    "deepgram": 1,
+}
+for _item in os.environ.get("PROVIDER_MAX_RETRIES", "").split(","):
+    if "=" in _item:
+        _name, _count = _item.split("=", 1)
+        try:
+            PROVIDER_MAX_RETRIES[_name.strip()] = int(_count)
+        except ValueError:
+            print(f"[v142-RETRY] ⚠️ 忽略无效重试次数配置: {_item!r}")
+
+
+class RetryPolicy:
+    def __init__(self, max_retries: int, base: Optional[float] = None, cap: Optional[float] = None,
+                 rng: Callable[[float, float], float] = random.uniform):
+        self.max_retries = max_retries
+        self.base = RETRY_BASE_DELAY_SECONDS if base is None else base
+        self.cap = RETRY_MAX_DELAY_SECONDS if cap is None else cap
+        self._rng = rng
+
+    def next_delay(self, previous: Optional[float]) -> float:
+        """decorrelated jitter：在 [base, 上次间隔 × 3] 里随机取，封顶 cap。"""
+        upper = max(self.base, (previous or self.base) * 3)
+        return min(self.cap, self._rng(self.base, upper))
+
+
+def policy_for(provider: str) -> RetryPolicy:
+    return RetryPolicy(PROVIDER_MAX_RETRIES.get(provider, 0))
+
+
+class RetryBudget:
+    """滑动窗口内：重试次数 ≤ 调用次数 × ratio + min_retries。"""
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, min_retries: int = RETRY_BUDGET_MIN_RETRIES,
+                 window: float = RETRY_BUDGET_WINDOW_SECONDS, clock: Callable[[], float] = time.monotonic):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._clock = clock
+        self._calls = deque()
+        self._retries = deque()
+        self.total_calls = 0
+        self.total_retries = 0
+        self.denied = 0
+
+    def _prune(self, now: float) -> None:
+        cutoff = now - self.window
+        for q in (self._calls, self._retries):
+            while q and q[0] < cutoff:
+                q.popleft()
+
+    def record_call(self) -> None:
+        now = self._clock()
+        self._prune(now)
+        self._calls.append(now)
+        self.total_calls += 1
+
+    def try_acquire(self) -> bool:
+        """要重试前调用：预算内返回 True 并记一次重试，否则 False。"""
+        now = self._clock()
+        self._prune(now)
+        if len(self._retries) >= len(self._calls) * self.ratio + self.min_retries:
+            self.denied += 1
+            return False
+        self._retries.append(now)
+        self.total_retries += 1
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._prune(self._clock())
+        return {
+            "ratio": self.ratio,
+            "window_seconds": self.window,
+            "window_calls": len(self._calls),
+            "window_retries": len(self._retries),
+            "total_calls": self.total_calls,
+            "total_retries": self.total_retries,
+            "denied": self.denied,
+        }
+
+
+RETRY_BUDGET = RetryBudget()
+
+
+def reset() -> None:
+    """测试用：清空全局重试预算。"""
+    global RETRY_BUDGET
+    RETRY_BUDGET = RetryBudget()
@@ -1,18 +1,30 @@
 import os
 import re
 import json
+import math
 import time
-import base64
+import asyncio
 import hashlib
-import threading
-import requests
+import inspect
 import datetime
-from collections import defaultdict, deque
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Header, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse, RedirectResponse
-from google.oauth2 import service_account
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, StreamingResponse
 from logging_helper import TranscriptionLogger, detect_audio_format, format_file_header_hex
+import http_client
+import deadlines
+import google_auth
+import audio_chunking
+import upload_intake
+import request_bodies
+from upload_intake import AudioSource, UploadTooLarge, UploadLimitMiddleware
+import transcription_cache
+import rate_limiter
+import state_backend
+import provider_concurrency
+from transcription_cache import TRANSCRIPTION_CACHE, IN_FLIGHT
+from transcription_jobs import JOB_MANAGER, JobQueueFull
 
 # 🔥 支持环境变量部署（Railway/Heroku等）
 # 优先从环境变量读取 Google Cloud 凭证
@@ -33,47 +45,24 @@ else:
     print("[INFO] 使用本地凭证文件")
     CREDENTIALS_FILE = "oceanic-hook-453405-u5-9e4b90fc923f.json"
 
-# 缓存访问令牌，避免重复获取
-_access_token_cache = None
-_token_expiry = None
+# v139: 凭证只加载一次，令牌由后台任务按 Google 返回的实际 expiry 提前刷新（见 google_auth.py）
+GOOGLE_TOKENS = google_auth.GoogleTokenProvider(CREDENTIALS_FILE)
+
+
+async def get_access_token_async():
+    """获取 Google Cloud 访问令牌：令牌新鲜时立即返回；过期时并发调用合并成一次刷新（在线程里执行）"""
+    return await GOOGLE_TOKENS.get_token()
+
 
-# 加载凭证并获取访问令牌
 def get_access_token():
-    """获取 Google Cloud 访问令牌"""
-    global _access_token_cache, _token_expiry
-    import time
-    
-    # 如果令牌还有效，直接返回缓存的令牌
-    if _access_token_cache and _token_expiry and time.time() < _token_expiry:
-        return _access_token_cache
-    
-    try:
-        # 使用 service_account 加载凭证
-        credentials = service_account.Credentials.from_service_account_file(
-            CREDENTIALS_FILE,
-            scopes=['https://www.googleapis.com/auth/cloud-platform']
-        )
-        
-        # 刷新令牌
-        if not credentials.valid:
-            # 创建一个简单的请求对象来刷新令牌
-            from google.auth.transport.requests import Request as GoogleRequest
-            credentials.refresh(GoogleRequest())
-        
-        # 缓存令牌（设置过期时间为1小时，实际令牌有效期可能更长）
-        _access_token_cache = credentials.token
-        _token_expiry = time.time() + 3600  # 1小时后过期
-        
-        return _access_token_cache
-    except Exception as e:
-        raise Exception(f"无法获取访问令牌: {str(e)}")
+    """同步版本（非事件循环上下文用）：令牌新鲜时直接返回，否则阻塞刷新一次"""
+    return GOOGLE_TOKENS.current_token() or GOOGLE_TOKENS.refresh_blocking()
+
 
-# 读取项目ID（从凭证文件中）
+# 读取项目ID（从凭证文件中，只读一次）
 def get_project_id():
     """从凭证文件中获取项目ID"""
-    with open(CREDENTIALS_FILE, 'r') as f:
-        creds = json.load(f)
-        return creds.get('project_id', '')
+    return GOOGLE_TOKENS.project_id
 
 # v120: 默认关闭自动生成的 API 文档（fail-closed）
 # /docs、/redoc、/openapi.json 会把所有端点和请求 schema 公开列出来，
@@ -84,7 +73,23 @@ def get_project_id():
 # （v120 首版用的是 == 'production'，结果生产上该变量没设，文档意外敞开。）
 SHOW_DOCS = os.getenv('DEPLOY_ENVIRONMENT', 'production').lower() == 'development'
 
+
+@asynccontextmanager
+async def _lifespan(_app):
+    """应用生命周期：启动时清理过期的磁盘缓存（v131）、启动 Google 令牌后台刷新（v139）；
+    退出时停掉令牌刷新与任务 worker（v133）、关闭 http_client 的各 provider 连接池（v126）"""
+    purged = TRANSCRIPTION_CACHE.purge_expired()
+    if purged:
+        print(f"[v131-CACHE] 启动清理过期磁盘缓存 {purged} 条")
+    GOOGLE_TOKENS.start()
+    yield
+    await GOOGLE_TOKENS.stop()
+    await JOB_MANAGER.stop()
+    await http_client.aclose_all()
+
+
 app = FastAPI(
+    lifespan=_lifespan,
     title="VoiceSpark",
     description="语音转文字服务（OpenAI Whisper / AI Builder Space / Google STT / Deepgram）",
     docs_url="/docs" if SHOW_DOCS else None,
@@ -93,6 +98,16 @@ app = FastAPI(
 )
 print(f"[v120-SECURITY] API docs: {'enabled (development)' if SHOW_DOCS else 'disabled'}")
 
+# v135: 上传路径的请求体上限——Content-Length 超限直接 413，边收边数超限立刻中断（见 upload_intake.py）。
+# 先于限流中间件注册 → 位于其内侧，被拒的超大上传同样计入限流次数（但不扣音频花费，见 _prepaid_cost）。
+app.add_middleware(UploadLimitMiddleware)
+
+
+@app.exception_handler(UploadTooLarge)
+async def _upload_too_large_handler(request: Request, exc: UploadTooLarge):
+    _refund_audio_cost(request, request.url.path)   # v158: 收到一半才超限的，预扣的音频花费退回
+    return upload_intake.too_large_response(exc)
+
 
 # ============================================================
 # v120: 转录端点限流
@@ -107,15 +122,26 @@ RATE_LIMITS = [
     (60, 20),      # 每 60 秒最多 20 次
     (3600, 150),   # 每 3600 秒最多 150 次
 ]
+# v148：按次数不够——20 个 25MB 的上传和 20 个两秒的片段算一样，但账单和上行带宽是按音频分钟涨的。
+# 再叠一层按"音频秒"计费的令牌桶：WAV 按实测时长；其他格式 = max(声明的时长, 字节数 ÷ 16KB/s)（见 rate_limiter.audio_cost）。
+#   突发桶：一次最多 30 分钟音频，每秒回补 6 秒（5 分钟回满）
+#   持续桶：容量 3 小时，每秒回补 1 秒——长期下来不超过实时速率，正常用（边说边转）绝不会碰到
+COST_RATE_LIMIT_ENABLED = os.environ.get("COST_RATE_LIMIT_ENABLED", "1") != "0"
+AUDIO_COST_LIMITS = rate_limiter.CostLimits("audio", [
+    (1800, 6.0),     # 突发
+    (10800, 1.0),    # 持续
+])
+# 路径 → 加权令牌桶配置（None = 只按次数限流）；共用同一个 CostLimits 的路径共用一组桶，换端点绕不过去
 RATE_LIMITED_PATHS = {
-    "/transcribe-segment",
-    "/speech-to-text",
-    "/speech-to-text-aibuilder",
+    "/transcribe-segment": AUDIO_COST_LIMITS,
+    "/transcribe-jobs": AUDIO_COST_LIMITS,          # v133: 只有 POST 提交走这个路径；轮询 /transcribe-jobs/{id} 不计
+    "/speech-to-text": AUDIO_COST_LIMITS,
+    "/speech-to-text-aibuilder": AUDIO_COST_LIMITS,
 }
-_RATE_WINDOW = max(w for w, _ in RATE_LIMITS)
-
-_rate_hits = defaultdict(deque)   # client_id -> deque[timestamp]
-_rate_lock = threading.Lock()
+# v146：O(1) 滑动窗口近似计数 + 时间轮过期，不再拿 threading.Lock、不再逐个时间戳数（见 rate_limiter.py）
+# v147：STATE_BACKEND 是共享后端（shm / sqlite / redis）时，各 worker / 副本合计一个限额
+RATE_LIMITER = rate_limiter.make_limiter(state_backend.STATE)
+COST_LIMITER = rate_limiter.CostLimiter()
 
 
 def _client_id(request: Request) -> str:
@@ -134,44 +160,147 @@ def _client_id(request: Request) -> str:
     return request.client.host if request.client else "unknown"
 
 
-@app.middleware("http")
-async def rate_limit_middleware(request: Request, call_next):
-    if request.url.path not in RATE_LIMITED_PATHS:
-        return await call_next(request)
+def _cost_limits(path: str):
+    return RATE_LIMITED_PATHS.get(path) if COST_RATE_LIMIT_ENABLED else None
+
+
+def _content_length(request: Request) -> int:
+    try:
+        return max(0, int(request.headers.get("content-length") or 0))
+    except ValueError:
+        return 0
+
 
+def _too_many_requests(retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(max(math.ceil(retry_after), 1))},
+        content={
+            "success": False,
+            "message": "请求过于频繁，请稍后再试。",
+            "text": "",
+        },
+    )
+
+
+# v149: 同一客户端同时在转录的请求超过 CLIENT_MAX_IN_FLIGHT；前面的请求一般几秒到几十秒就结束
+CLIENT_BUSY_RETRY_AFTER_SECONDS = 5
+
+
+def _client_busy_response() -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(CLIENT_BUSY_RETRY_AFTER_SECONDS)},
+        content={
+            "success": False,
+            "message": "同时进行的转录太多，请等前面的完成后再试。",
+            "text": "",
+        },
+    )
+
+
+def _prepaid_cost(request: Request) -> float:
+    """中间件按 Content-Length 预扣的音频花费。v158：声明的长度已超过上传上限的不扣——
+    内侧的 UploadLimitMiddleware 一个字节都不读就 413，不能让一次误传的大文件留下几分钟的欠账。"""
+    content_length = _content_length(request)
+    if content_length > upload_intake.UPLOAD_MAX_BYTES + upload_intake.MULTIPART_OVERHEAD_BYTES:
+        return 0.0
+    return rate_limiter.prepaid_audio_cost(content_length)
+
+
+def _refund_audio_cost(request: Request, path: str, amount: float = None) -> None:
+    """v158: 请求没转录就被拒时退回已扣的音频花费：上传超限（413）退中间件的预扣；
+    同时在转的太多（429）时已按实际花费补扣过，amount 传 _charge_audio_cost 的返回值全部退回。"""
+    if request is None:
+        return
+    limits = _cost_limits(path)
+    if limits is not None:
+        COST_LIMITER.charge(_client_id(request), limits, -(_prepaid_cost(request) if amount is None else amount))
+
+
+def _charge_audio_cost(request: Request, path: str, audio, declared_seconds: float = None) -> float:
+    """v148: 读完上传后按实际花费补扣令牌桶。
+
+    时长优先用实测（WAV 读文件头），否则用表单声明的 duration；中间件已按 Content-Length 预扣的部分
+    扣掉不重复算，多扣的退回。可以扣成欠账：这次照常转录，下一次请求等桶回补。
+    v155：WAV 只按实测时长算，字节数折算只用于非 WAV。返回这次请求一共扣了多少（没扣返回 0）。
+    """
+    if request is None:
+        return 0.0
+    limits = _cost_limits(path)
+    if limits is None:
+        return 0.0
+    measured = audio_chunking.wav_duration(audio)
+    if measured is not None:
+        cost = rate_limiter.audio_cost(len(audio), measured, measured=True)
+    else:
+        cost = rate_limiter.audio_cost(len(audio), declared_seconds)
+    COST_LIMITER.charge(_client_id(request), limits, cost - _prepaid_cost(request))
+    return cost
+
+
+async def _rate_limit_response(request: Request):
+    """限流判定：该拒就返回 429 响应，放行返回 None（放行时已计数 / 扣费）。只对 RATE_LIMITED_PATHS 调用。
+    v154：共享计数（SQLite / Redis）的读写在 state_backend 的专用线程里做，不阻塞事件循环。"""
     client = _client_id(request)
-    now = time.monotonic()
-
-    with _rate_lock:
-        # 定期清理过期条目，防止 dict 被大量一次性 IP 撑大
-        if len(_rate_hits) > 1000:
-            for stale in [c for c, h in _rate_hits.items()
-                          if not h or now - h[-1] > _RATE_WINDOW]:
-                del _rate_hits[stale]
-
-        hits = _rate_hits[client]
-        while hits and now - hits[0] > _RATE_WINDOW:
-            hits.popleft()
-
-        for window, limit in RATE_LIMITS:
-            recent = sum(1 for t in hits if now - t <= window)
-            if recent >= limit:
-                retry_after = int(window - (now - hits[0])) + 1
-                print(f"[v120-RATELIMIT] BLOCKED {client} -> {request.url.path} "
-                      f"({recent}/{limit} in {window}s)")
-                return JSONResponse(
-                    status_code=429,
-                    headers={"Retry-After": str(max(retry_after, 1))},
-                    content={
-                        "success": False,
-                        "message": "请求过于频繁，请稍后再试。",
-                        "text": "",
-                    },
-                )
+    # v148: 先看令牌桶够不够扣（按 Content-Length 预估，不扣费；v155 按前端 WAV 码率估）；够了再按次数计，两层都过才扣
+    limits = _cost_limits(request.url.path)
+    if limits is not None:
+        prepaid = _prepaid_cost(request)
+        wait = COST_LIMITER.check(client, limits, prepaid)
+        if wait > 0:
+            print(f"[v148-RATELIMIT] BLOCKED {client} -> {request.url.path} "
+                  f"(音频花费 {prepaid:.0f}s，令牌桶需再等 {wait:.1f}s)")
+            return _too_many_requests(wait)
 
-        hits.append(now)
+    allowed, retry_after, blocked_by = await RATE_LIMITER.ahit(client, RATE_LIMITS)
+    if not allowed:
+        window, limit, recent = blocked_by
+        print(f"[v120-RATELIMIT] BLOCKED {client} -> {request.url.path} "
+              f"({recent:.1f}/{limit} in {window}s)")
+        return _too_many_requests(retry_after)
+
+    if limits is not None:
+        COST_LIMITER.charge(client, limits, prepaid)
+    return None
+
+
+# ============================================================
+# v150: 纯 ASGI 中间件
+# ============================================================
+# 原来的 @app.middleware("http") 是 Starlette 的 BaseHTTPMiddleware：每个请求（包括静态资源）都要
+# 多开一个任务、把请求 / 响应各包一层内存流，大响应（StaticFiles、SSE）也得从这层包装里过一遍。
+# 两个中间件实际只对极少数请求做事，改成纯 ASGI：先只看 scope（path / method，零分配）判断要不要管，
+# 不管的原样交给下一层；要管的才构造 Request 交给判定函数，拒绝就直接回响应，否则原样往下传。
+# /static 与 SEO 辅助路由（robots / sitemap / favicon）两个中间件都不看——它们既不限流也不需要跳转。
+_FAST_PATH_PREFIXES = ("/static/", "/robots.txt", "/sitemap.xml", "/favicon.ico")
+
+
+class RequestGate:
+    """纯 ASGI：applies(scope) 为真才构造 Request 调 check；check 返回响应就直接回，返回 None 放行。
+    check 可以是普通函数，也可以是协程函数（v154 限流判定要等共享计数）。"""
+
+    def __init__(self, app, check, applies):
+        self.app = app
+        self.check = check
+        self.applies = applies
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.applies(scope):
+            return await self.app(scope, receive, send)
+        response = self.check(Request(scope, receive))
+        if inspect.isawaitable(response):
+            response = await response
+        if response is not None:
+            return await response(scope, receive, send)
+        await self.app(scope, receive, send)
+
+
+def _is_rate_limited(scope) -> bool:
+    return scope["path"] in RATE_LIMITED_PATHS
 
-    return await call_next(request)
+
+app.add_middleware(RequestGate, check=_rate_limit_response, applies=_is_rate_limited)
 
 # ================================================================================
 # SEO（v125）：非规范域名 301 到 voicespark.app
@@ -219,8 +348,8 @@ def _should_redirect_to_canonical(host: str) -> bool:
     return host.endswith(_RAILWAY_SUFFIX)
 
 
-@app.middleware("http")
-async def canonical_host_middleware(request: Request, call_next):
+def _canonical_redirect(request: Request):
+    """非规范域名的 GET/HEAD → 301 响应；其余返回 None。"""
     if request.method in ("GET", "HEAD"):
         host = (request.headers.get("host") or "").split(":")[0].lower()
         if _should_redirect_to_canonical(host):
@@ -228,7 +357,15 @@ async def canonical_host_middleware(request: Request, call_next):
             if request.url.query:
                 target += f"?{request.url.query}"
             return RedirectResponse(url=target, status_code=301)
-    return await call_next(request)
+    return None
+
+
+def _may_redirect(scope) -> bool:
+    return scope["method"] in ("GET", "HEAD") and not scope["path"].startswith(_FAST_PATH_PREFIXES)
+
+
+# v150：纯 ASGI（见上方 RequestGate）
+app.add_middleware(RequestGate, check=_canonical_redirect, applies=_may_redirect)
 
 
 # ================================================================================
@@ -322,7 +459,7 @@ async def sitemap():
 # 于是只剩 APP_VERSION 一个版本号，混淆的根源消失。
 # ⚠️ 历史注释里的 vNNN 一律保持原样，不要重编——那 200 多处是考古坐标，重编等于烧掉它们。
 # ================================================================================
-APP_VERSION = "v125"   # 唯一权威来源：要改版本号只改这里
+APP_VERSION = "v159"   # 唯一权威来源：要改版本号只改这里
 
 # --------------------------------------------------------------------------------
 # 静态资源自动 cache-bust：用文件内容哈希替换 HTML 里的 ?v=…
@@ -476,7 +613,7 @@ else:
 
 
 @app.post("/speech-to-text")
-async def speech_to_text(audio_file: UploadFile = File(...)):
+async def speech_to_text(audio_file: UploadFile = File(...), request: Request = None):
     """
     将语音文件转换为文字
     
@@ -484,12 +621,11 @@ async def speech_to_text(audio_file: UploadFile = File(...)):
     
     返回识别出的文字内容
     """
+    audio_content = None
     try:
-        # 读取上传的音频文件
-        audio_content = await audio_file.read()
-        
-        # 将音频内容编码为 base64
-        audio_base64 = base64.b64encode(audio_content).decode('utf-8')
+        # 读取上传的音频文件（v136: 分块读取，大文件落临时文件；base64 留到发送时逐块做）
+        audio_content = await AudioSource.from_upload(audio_file)
+        _charge_audio_cost(request, "/speech-to-text", audio_content)   # v148: 按实际音频花费补扣令牌桶
         
         # 根据文件扩展名确定音频编码格式
         file_extension = audio_file.filename.split('.')[-1].lower() if audio_file.filename else 'wav'
@@ -512,20 +648,15 @@ async def speech_to_text(audio_file: UploadFile = File(...)):
         # 判断是否需要使用 v1p1beta1 API（MP3 需要）
         use_beta_api = (file_extension == 'mp3')
         
-        # 构建请求体
-        request_body = {
-            "config": {
-                "language_code": "zh-CN",  # 中文，可以改为 "en-US" 等
-                "enable_automatic_punctuation": True,
-            },
-            "audio": {
-                "content": audio_base64
-            }
+        # 识别配置（音频部分在发送前由 GoogleRecognizeBody 拼进请求体）
+        config = {
+            "language_code": "zh-CN",  # 中文，可以改为 "en-US" 等
+            "enable_automatic_punctuation": True,
         }
         
         # 如果编码格式已知，添加到配置中
         if audio_encoding:
-            request_body["config"]["encoding"] = audio_encoding
+            config["encoding"] = audio_encoding
             
             # 对于 MP3，需要指定 sampleRateHertz
             # 尝试从音频文件检测采样率
@@ -539,7 +670,7 @@ async def speech_to_text(audio_file: UploadFile = File(...)):
                     
                     # 创建临时文件来检测采样率
                     with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
-                        tmp_file.write(audio_content)
+                        tmp_file.write(upload_intake.as_buffer(audio_content))
                         tmp_path = tmp_file.name
                     
                     try:
@@ -562,23 +693,23 @@ async def speech_to_text(audio_file: UploadFile = File(...)):
                 if sample_rate is None:
                     sample_rate = 44100
                 
-                request_body["config"]["sampleRateHertz"] = sample_rate
+                config["sampleRateHertz"] = sample_rate
         
         # 对于 OGG_OPUS，也需要指定 sampleRateHertz
         elif file_extension == 'ogg':
             # OGG_OPUS 支持的采样率：8000, 12000, 16000, 24000, 48000
-            request_body["config"]["sampleRateHertz"] = 48000  # 默认值
+            config["sampleRateHertz"] = 48000  # 默认值
         
         # 对于 AMR，sampleRateHertz 必须是 8000
         elif file_extension == 'amr':
-            request_body["config"]["sampleRateHertz"] = 8000
+            config["sampleRateHertz"] = 8000
         
         # 对于 AMR_WB，sampleRateHertz 必须是 16000
         elif file_extension == 'amr-wb':
-            request_body["config"]["sampleRateHertz"] = 16000
+            config["sampleRateHertz"] = 16000
         
         # 获取访问令牌
-        access_token = get_access_token()
+        access_token = await get_access_token_async()
         
         # 构建 API URL
         # MP3 需要使用 v1p1beta1 API（Beta 功能）
@@ -588,12 +719,13 @@ async def speech_to_text(audio_file: UploadFile = File(...)):
             api_url = "https://speech.googleapis.com/v1/speech:recognize"
         
         # 发送请求到 Google Speech-to-Text REST API
+        request_body = request_bodies.GoogleRecognizeBody(config, audio_content)
         headers = {
             "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
+            **request_body.headers,
         }
         
-        response = requests.post(api_url, json=request_body, headers=headers)
+        response = await http_client.post(api_url, content=request_body, headers=headers)
         
         # 检查响应状态
         if response.status_code != 200:
@@ -676,12 +808,16 @@ async def speech_to_text(audio_file: UploadFile = File(...)):
             status_code=500,
             detail=f"语音识别失败: {str(e)}"
         )
+    finally:
+        if audio_content is not None:
+            audio_content.close()   # v135: 用完即关临时文件 / mmap，不等 GC
 
 
 @app.post("/speech-to-text-aibuilder")
 async def speech_to_text_aibuilder(
     audio_file: UploadFile = File(...),
-    language: str = None
+    language: str = None,
+    request: Request = None
 ):
     """
     使用 AI Builder Space Audio API 将语音文件转换为文字
@@ -700,6 +836,7 @@ async def speech_to_text_aibuilder(
     
     # 初始化日志记录器
     logger = TranscriptionLogger("speech-to-text-aibuilder")
+    audio_content = None
     
     try:
         # 检查是否配置了 AI Builder Token
@@ -718,8 +855,15 @@ async def speech_to_text_aibuilder(
                 )
             )
         
-        # 读取上传的音频文件
-        audio_content = await audio_file.read()
+        # 读取上传的音频文件（v157: 同其他端点分块读取，大文件借用落盘的临时文件，不整段进内存）
+        try:
+            audio_content = await AudioSource.from_upload(audio_file)
+        except UploadTooLarge as too_large:
+            logger.log_error("FILE_TOO_LARGE", f"文件太大: 已读 {too_large.received / 1024 / 1024:.2f} MB > {too_large.limit / 1024 / 1024} MB")
+            logger.print_log("ERROR")
+            _refund_audio_cost(request, "/speech-to-text-aibuilder")   # v158
+            return upload_intake.too_large_response(too_large)
+        _charge_audio_cost(request, "/speech-to-text-aibuilder", audio_content)   # v148
         file_size = len(audio_content)
         filename = audio_file.filename or 'audio.mp3'
         content_type = audio_file.content_type or 'audio/mpeg'
@@ -763,10 +907,8 @@ async def speech_to_text_aibuilder(
             model_value=model_value
         )
         
-        # 准备 multipart/form-data
-        files = {
-            field_name: (filename, audio_content, final_content_type)
-        }
+        # 准备 multipart/form-data（v157: 流式请求体，音频部分直接从上传里切片，不再让 httpx 拼一份）
+        request_body = request_bodies.MultipartBody(form_data, field_name, filename, final_content_type, audio_content)
         
         logger.log_api_request({
             field_name: {
@@ -781,12 +923,12 @@ async def speech_to_text_aibuilder(
         
         # 发送请求到 AI Builder Space Audio API
         request_start_time = datetime.datetime.now()
-        response = requests.post(
+        response = await http_client.post(
             api_url,
-            headers={"Authorization": f"Bearer {AI_BUILDER_TOKEN}", "Accept": "application/json"},
-            files=files,
-            data=form_data,
-            timeout=120
+            headers={"Authorization": f"Bearer {AI_BUILDER_TOKEN}", "Accept": "application/json",
+                     **request_body.headers},
+            content=request_body,
+            timeout=http_client.make_timeout(read=120)
         )
         request_end_time = datetime.datetime.now()
         request_duration = (request_end_time - request_start_time).total_seconds()
@@ -914,6 +1056,186 @@ async def speech_to_text_aibuilder(
             status_code=500,
             detail=f"语音识别失败: {str(e)}"
         )
+    finally:
+        if audio_content is not None:
+            audio_content.close()
+
+
+def _cached_result(cache_key):
+    """v131: 查转录缓存；命中返回 (text, api_used, metadata)，metadata 带 cache=hit。"""
+    if cache_key is None:
+        return None
+    cached = TRANSCRIPTION_CACHE.get(cache_key)
+    if cached is None:
+        return None
+    text, api_used, metadata, cached_at = cached
+    metadata["cache"] = "hit"
+    metadata["cached_at"] = cached_at
+    print(f"[v131-CACHE] ✅ 命中缓存 {cache_key[:12]}…（{api_used}，{len(text)} 字符）")
+    return text, api_used, metadata
+
+
+# ============================================================
+# v134: 服务端长音频分段
+# ============================================================
+# 麦克风长录音（WAV）在服务端按静音点切段、并发转录、按序拼接——10 分钟录音耗时约等于最慢的
+# 那一段，而不是各段之和。细节见 audio_chunking.py。系统音频（说话人分离）不切。
+SERVER_CHUNKING_ENABLED = os.getenv('SERVER_CHUNKING_ENABLED', 'true').lower() not in ('0', 'false', 'no', 'off')
+CHUNK_MAX_PARALLEL = int(os.getenv('CHUNK_MAX_PARALLEL', '4'))
+
+
+async def _run_transcription(audio_content, filename, *, language, duration, audio_source, preferred_api, logger):
+    """转录一次上传：长 WAV 先切段并发转录（v134），否则整段交给 _dispatch_transcription。
+
+    v159：要不要切看 WAV 文件头里的实际时长，不看表单声明的 duration（默认 60，不传或报短了就永远不切）；
+    每段按需读帧、封 WAV 也放到线程里做，不在事件循环上拷贝几 MB。
+    """
+    if (SERVER_CHUNKING_ENABLED and audio_source not in ['system', 'both']
+            and (audio_chunking.wav_duration(audio_content) or 0) > audio_chunking.CHUNK_MIN_SECONDS):
+        chunks = await asyncio.to_thread(audio_chunking.split_wav_at_silence, audio_content)
+        if chunks:
+            async def _one(chunk):
+                audio = await asyncio.to_thread(lambda: chunk.audio)
+                return await _dispatch_transcription(
+                    audio, f"chunk{chunk.index + 1}.wav",
+                    language=language, duration=max(1, round(chunk.duration)), audio_source=audio_source,
+                    preferred_api=preferred_api, logger=logger
+                )
+            return await audio_chunking.transcribe_chunks(chunks, _one, CHUNK_MAX_PARALLEL)
+    return await _dispatch_transcription(
+        audio_content, filename,
+        language=language, duration=duration, audio_source=audio_source,
+        preferred_api=preferred_api, logger=logger
+    )
+
+
+async def _dispatch_transcription(audio_content, filename, *, language, duration, audio_source, preferred_api, logger):
+    """按 preferred_api / 音频源分派到 api_fallback 的转录流程，返回 (text, api_used, metadata)。"""
+    from api_fallback import (
+        transcribe_with_fallback,
+        transcribe_system_audio,
+        transcribe_with_preferred_api,
+    )
+    
+    # 🆕 v114: 手动指定 API（历史记录重试场景）
+    if preferred_api:
+        return await transcribe_with_preferred_api(
+            audio_content=audio_content,
+            filename=filename,
+            preferred_api=preferred_api,
+            language=language,
+            duration=duration,
+            logger=logger,
+            audio_source=audio_source
+        )
+    # 🎙️ v110: 根据音频源选择 API 策略
+    if audio_source in ['system', 'both']:
+        # 系统音频/混合：Deepgram Nova-3 + Google API（支持多说话人）
+        return await transcribe_system_audio(
+            audio_content=audio_content,
+            filename=filename,
+            language=language,
+            duration=duration,
+            logger=logger
+        )
+    # 纯麦克风：标准 Fallback（AI Builder → OpenAI → Google）
+    return await transcribe_with_fallback(
+        audio_content=audio_content,
+        filename=filename,
+        language=language,
+        duration=duration,
+        logger=logger
+    )
+
+
+# ============================================================
+# v141: 客户端断线即取消
+# ============================================================
+# 用户关掉标签页或浏览器 120s 超时后，服务端原本还在等 provider，甚至继续往下一个付费 provider 落。
+# /transcribe-segment 在等结果时每 DISCONNECT_POLL_SECONDS 查一次连接；断了就离开在途组（v132）：
+#   · 组里已经没有别的请求在等 → 作废它的截止时间（v140），后面的 provider 不再调用；
+#   · 宽限 DISCONNECT_GRACE_SECONDS 内结果到了照常写缓存，有重传请求合并进来就继续；否则取消在途调用。
+# 统计见 get_api_status()["cancellations"]。
+DISCONNECT_POLL_SECONDS = float(os.getenv('DISCONNECT_POLL_SECONDS', '0.5'))
+DISCONNECT_GRACE_SECONDS = float(os.getenv('DISCONNECT_GRACE_SECONDS', '2'))
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def _wait_disconnect(is_disconnected):
+    while not await is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+
+async def _transcribe_shared(audio_content, filename, *, language, duration, audio_source, preferred_api,
+                             logger, content_key, cache_key, idem_scope=None, deadline=None,
+                             is_disconnected=None, client=None):
+    """一次真实转录，外面包上 v132 在途合并与 v131 写缓存。/transcribe-segment 与任务 worker 共用。
+
+    v140：deadline 在发起在途组之前设好，组内任务随之继承；合并进来的请求沿用发起者的截止时间。
+    预算花费写进 metadata["deadline"]（不进缓存）。
+    v141：传了 is_disconnected（如 request.is_disconnected）时，客户端断线即离开在途组并抛 ClientDisconnected。
+    v149：client 决定排 provider 名额时进哪个公平队列；排队耗时写进 metadata["queue_wait"]。
+    """
+    async def _transcribe():
+        # v135: 底层转录可能比发起请求活得久（断线宽限、合并进来的请求还在等），自己持有一份音频
+        source = audio_content.retain() if isinstance(audio_content, AudioSource) else None
+        try:
+            result = await _run_transcription(
+                audio_content, filename,
+                language=language, duration=duration, audio_source=audio_source,
+                preferred_api=preferred_api, logger=logger
+            )
+        finally:
+            if source is not None:
+                source.close()
+        # 写缓存放在组内：发起者断线了，结果照样留给重传请求
+        # 分段转录缺了段（重转后仍失败）的不写：重试 / 重传要真的再转一次，而不是 24h 里一直拿到缺段的文本
+        if cache_key is not None and not result[2].get("partial"):
+            TRANSCRIPTION_CACHE.put(cache_key, *result)
+        if deadline is not None and deadline.cancelled:
+            deadlines.note_cancellation("completed_after_disconnect")
+            print(f"[v141-DISCONNECT] 📦 客户端已断开，结果在宽限期内到达，已写缓存")
+        return result
+
+    def _orphaned():
+        deadlines.note_cancellation("orphaned")
+        if deadline is not None:
+            deadline.cancel("client_disconnected")
+
+    flight_keys = [f"content:{content_key}"]
+    if idem_scope:
+        flight_keys.insert(0, f"idem:{idem_scope}")
+    with deadlines.scope(deadline), provider_concurrency.client_scope(client):
+        flight = asyncio.ensure_future(IN_FLIGHT.do(flight_keys, _transcribe, on_orphan=_orphaned))
+    try:
+        if is_disconnected is not None:
+            watcher = asyncio.ensure_future(_wait_disconnect(is_disconnected))
+            try:
+                await asyncio.wait({flight, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                watcher.cancel()
+            if not flight.done():
+                flight.cancel()
+                await asyncio.gather(flight, return_exceptions=True)
+                deadlines.note_cancellation("disconnects")
+                orphaned = IN_FLIGHT.abandon(flight_keys, grace=DISCONNECT_GRACE_SECONDS)
+                print(f"[v141-DISCONNECT] 🔌 客户端已断开"
+                      f"{'，停止后续 provider' if orphaned else '，仍有其他请求在等这次结果'}")
+                raise ClientDisconnected("客户端已断开连接")
+        (text, api_used, metadata), joined = await flight
+    finally:
+        if not flight.done():       # 本请求被取消：只离开在途组，底层调用照旧（v132）
+            flight.cancel()
+    metadata = dict(metadata)
+    if joined:
+        metadata["dedup"] = "joined"
+    if deadline is not None:
+        metadata["deadline"] = deadline.report()
+        metadata["queue_wait"] = {"provider_seconds": round(deadline.queued, 3)}
+    return text, api_used, metadata
 
 
 @app.post("/transcribe-segment")
@@ -923,7 +1245,10 @@ async def transcribe_segment(
     needs_segmentation: str = Form(default=None),
     language: str = Form(default=None),  # 🌍 v107: 语言参数（保留但默认自动识别）
     audio_source: str = Form(default='microphone'),  # 🎙️ v110: 音频源（microphone/system/both）
-    preferred_api: str = Form(default=None)  # 🆕 用户手动指定 API（openai/ai_builder/google）
+    preferred_api: str = Form(default=None),  # 🆕 用户手动指定 API（openai/ai_builder/google）
+    idempotency_key: str = Header(default=None, alias="Idempotency-Key"),  # 🔗 v132: 可选，重传时带同一个
+    request_timeout: str = Header(default=None, alias=deadlines.DEADLINE_HEADER),  # ⌛ v140: 可选，客户端愿意等的秒数
+    request: Request = None
 ):
     """
     转录音频片段（用于录音界面的转录功能）
@@ -937,28 +1262,42 @@ async def transcribe_segment(
     - **language**: 转录语言代码（如 'en', 'zh'），默认为 None（自动识别）
     - **audio_source**: 音频源类型（'microphone', 'system', 'both'），默认 'microphone'
     - **preferred_api**: 指定 API（'openai'/'ai_builder'/'google'），默认 None（自动 fallback）
+    - **Idempotency-Key**（请求头，可选）: 同一客户端带同一个 key 的并发请求只转录一次
+    - **X-Request-Timeout**（请求头，可选）: 整个请求的截止时间（秒），默认 REQUEST_DEADLINE_SECONDS
     
-    返回转录结果
+    返回转录结果（metadata.deadline / 失败时的 deadline：预算及每次 provider 尝试的花费）
     """
     import datetime
     import traceback
-    from api_fallback import (
-        transcribe_with_fallback,
-        transcribe_system_audio,
-        transcribe_with_preferred_api,
-        get_api_status
-    )
+    from api_fallback import get_api_status
     
     # 初始化日志记录器
     logger = TranscriptionLogger("transcribe-segment-fallback")
+    # ⌛ v140: 整个请求的截止时间，从这里开始计
+    deadline = deadlines.for_request(request_timeout)
+    audio_content = None
     
     try:
-        # 读取上传的音频文件
-        audio_content = await audio_file.read()
-        file_size = len(audio_content)
         filename = audio_file.filename or 'recording.webm'
         content_type = audio_file.content_type or 'audio/webm'
         
+        # 📥 v135: 分块读取上传（超过 25MB 立即停止），大文件落临时文件，不整段进内存
+        try:
+            audio_content = await AudioSource.from_upload(audio_file)
+        except UploadTooLarge as too_large:
+            logger.log_error("FILE_TOO_LARGE", f"文件太大: 已读 {too_large.received / 1024 / 1024:.2f} MB > {too_large.limit / 1024 / 1024} MB")
+            logger.print_log("ERROR")
+            _refund_audio_cost(request, "/transcribe-segment")   # v158
+            return {
+                "success": False,
+                "message": too_large.message,
+                "text": "",
+                "api_used": None,
+                "debug_info": logger.get_log_dict()
+            }
+        file_size = len(audio_content)
+        charged = _charge_audio_cost(request, "/transcribe-segment", audio_content, duration)   # v148: 按实测 / 声明的时长补扣令牌桶
+        
         # 记录请求基本信息
         logger.log_request_info(filename, content_type, file_size, duration)
         print(f"[API_FALLBACK] 开始智能 API fallback 转录")
@@ -970,24 +1309,24 @@ async def transcribe_segment(
         # 🎙️ v110: 根据音频源智能路由
         if audio_source in ['system', 'both']:
             print(f"[v110-ROUTING] 🔄 系统音频/混合音频 → 强制使用 Google API（支持多说话人）")
-            use_google_only = True
         else:
             print(f"[v110-ROUTING] 🎤 纯麦克风录音 → 使用标准 Fallback（AI Builder → OpenAI → Google）")
-            use_google_only = False
         
-        # 检查文件大小（25MB 限制）
-        max_size = 25 * 1024 * 1024  # 25MB
-        if file_size > max_size:
-            logger.log_error("FILE_TOO_LARGE", f"文件太大: {file_size / 1024 / 1024:.2f} MB > {max_size / 1024 / 1024} MB")
-            logger.print_log("ERROR")
+        # 🗂️ v131: 内容寻址缓存——同一段音频（重试按钮、超时重传、连点两次）直接返回上次结果
+        content_key = transcription_cache.cache_key(audio_content, language, audio_source, preferred_api)
+        cache_key = content_key if transcription_cache.CACHE_ENABLED else None
+        cached = _cached_result(cache_key)
+        if cached is not None:
+            cached_text, cached_api, cached_metadata = cached
             return {
-                "success": False,
-                "message": f"音频文件太大 ({file_size / 1024 / 1024:.2f} MB)，超过限制 (25 MB)。请尝试转录更短的片段。",
-                "text": "",
-                "api_used": None,
-                "debug_info": logger.get_log_dict()
+                "success": True,
+                "text": cached_text,
+                "api_used": cached_api,
+                "metadata": cached_metadata,
+                "duration_seconds": 0.0,
+                "api_status": get_api_status()
             }
-        
+
         # 检测音频格式
         file_header_hex = format_file_header_hex(audio_content)
         detected_format, final_content_type = detect_audio_format(audio_content, filename, content_type)
@@ -998,40 +1337,30 @@ async def transcribe_segment(
         # 打印请求前的日志
         logger.print_log("INFO")
         
+        # 🚦 v149: 同一客户端同时在转录的请求数有上限，超了直接 429，不去占 provider 名额
+        client = _client_id(request) if request is not None else "unknown"
+        try:
+            provider_concurrency.CLIENT_IN_FLIGHT.enter(client)
+        except provider_concurrency.ClientBusy as busy:
+            print(f"[v149-FAIRNESS] 🚦 {busy}")
+            _refund_audio_cost(request, "/transcribe-segment", charged)   # v158: 没转录，花费全退
+            return _client_busy_response()
+
         # 🔥 使用智能 fallback 进行转录
         request_start_time = datetime.datetime.now()
         try:
-            # 🆕 v114: 手动指定 API（历史记录重试场景）
-            if preferred_api:
-                transcription_text, api_used, metadata = await transcribe_with_preferred_api(
-                    audio_content=audio_content,
-                    filename=filename,
-                    preferred_api=preferred_api,
-                    language=language,
-                    duration=duration,
-                    logger=logger,
-                    audio_source=audio_source
-                )
-            else:
-                # 🎙️ v110: 根据音频源选择 API 策略
-                if use_google_only:
-                    # 系统音频/混合：Deepgram Nova-3 + Google API（支持多说话人）
-                    transcription_text, api_used, metadata = await transcribe_system_audio(
-                        audio_content=audio_content,
-                        filename=filename,
-                        language=language,
-                        duration=duration,
-                        logger=logger
-                    )
-                else:
-                    # 纯麦克风：标准 Fallback（AI Builder → OpenAI → Google）
-                    transcription_text, api_used, metadata = await transcribe_with_fallback(
-                        audio_content=audio_content,
-                        filename=filename,
-                        language=language,
-                        duration=duration,
-                        logger=logger
-                    )
+            # 🔗 v132: 同内容（或同客户端同 Idempotency-Key）的请求还在转录中 → 直接等它的结果
+            idem_scope = None
+            if idempotency_key and len(idempotency_key) <= transcription_cache.IDEMPOTENCY_KEY_MAX_LENGTH:
+                idem_scope = f"{client}:{idempotency_key}"
+            transcription_text, api_used, metadata = await _transcribe_shared(
+                audio_content, filename,
+                language=language, duration=duration, audio_source=audio_source,
+                preferred_api=preferred_api, logger=logger,
+                content_key=content_key, cache_key=cache_key, idem_scope=idem_scope,
+                deadline=deadline, is_disconnected=getattr(request, "is_disconnected", None),
+                client=client
+            )
             
             request_end_time = datetime.datetime.now()
             request_duration = (request_end_time - request_start_time).total_seconds()
@@ -1045,15 +1374,27 @@ async def transcribe_segment(
             # 打印成功日志
             logger.print_log("SUCCESS")
             
+            if cache_key is not None:
+                metadata["cache"] = "miss"
+            
             return {
                 "success": True,
                 "text": transcription_text,
                 "api_used": api_used,
+                "partial": bool(metadata.get("partial")),   # v134: 分段转录有段缺失，见 metadata["missing"]
                 "metadata": metadata,
                 "duration_seconds": request_duration,
                 "api_status": get_api_status()
             }
             
+        except ClientDisconnected:
+            # 🔌 v141: 没人收响应了，不再记失败日志
+            return JSONResponse(status_code=499, content={
+                "success": False,
+                "message": "客户端已断开连接",
+                "deadline": deadline.report(),
+            })
+            
         except Exception as fallback_error:
             request_end_time = datetime.datetime.now()
             request_duration = (request_end_time - request_start_time).total_seconds()
@@ -1074,9 +1415,13 @@ async def transcribe_segment(
                 "text": "",
                 "api_used": None,
                 "duration_seconds": request_duration,
+                "deadline": deadline.report(),
                 "api_status": get_api_status(),
                 "debug_info": logger.get_log_dict()
             }
+
+        finally:
+            provider_concurrency.CLIENT_IN_FLIGHT.leave(client)
     
     except Exception as e:
         # 未预期的错误
@@ -1095,6 +1440,136 @@ async def transcribe_segment(
             "api_used": None,
             "debug_info": logger.get_log_dict()
         }
+    finally:
+        if audio_content is not None:
+            audio_content.close()   # v135: 在途合并的底层转录另有 retain，不会被这里关掉
+
+
+# ============================================================
+# v133: 异步任务模式
+# ============================================================
+# POST /transcribe-jobs 收下音频立即返回 job_id（202），转录交给 transcription_jobs 的 worker 池；
+# 客户端 GET /transcribe-jobs/{id} 轮询，或 GET /transcribe-jobs/{id}/events 订阅 SSE。
+# 连接断了不影响任务本身，换个连接拿 job_id 继续取结果即可。
+JOB_SSE_HEARTBEAT_SECONDS = 15
+
+
+@app.post("/transcribe-jobs", status_code=202)
+async def create_transcription_job(
+    audio_file: UploadFile = File(...),
+    duration: int = Form(default=60),
+    language: str = Form(default=None),
+    audio_source: str = Form(default='microphone'),
+    preferred_api: str = Form(default=None),
+    request_timeout: str = Header(default=None, alias=deadlines.DEADLINE_HEADER),
+    request: Request = None
+):
+    """
+    提交异步转录任务（参数同 /transcribe-segment），立即返回 job_id
+    
+    截止时间（v140）从任务开始执行时算，默认 JOB_DEADLINE_SECONDS；X-Request-Timeout 可覆盖。
+    
+    返回 202：{"job_id", "status", "poll_url", "events_url"}；队列满返回 503。
+    """
+    filename = audio_file.filename or 'recording.webm'
+    try:
+        audio_content = await AudioSource.from_upload(audio_file)   # v135: 分块读取，超限即停
+    except UploadTooLarge as too_large:
+        _refund_audio_cost(request, "/transcribe-jobs")   # v158
+        return upload_intake.too_large_response(too_large)
+    charged = _charge_audio_cost(request, "/transcribe-jobs", audio_content, duration)   # v148
+
+    # 🚦 v149: 任务从提交到结束都算在途（排在任务队列里的也算），同一客户端超过上限直接 429
+    client = _client_id(request) if request is not None else "unknown"
+    try:
+        provider_concurrency.CLIENT_IN_FLIGHT.enter(client)
+    except provider_concurrency.ClientBusy as busy:
+        print(f"[v149-FAIRNESS] 🚦 {busy}")
+        audio_content.close()
+        _refund_audio_cost(request, "/transcribe-jobs", charged)   # v158: 没转录，花费全退
+        return _client_busy_response()
+
+    content_key = transcription_cache.cache_key(audio_content, language, audio_source, preferred_api)
+    cache_key = content_key if transcription_cache.CACHE_ENABLED else None
+    submitted = time.monotonic()
+
+    def _release(job=None):
+        # v156: 任务进入终态时由 JobManager 调用一次——包括没跑就作废（换事件循环、关闭时还在排队）的
+        provider_concurrency.CLIENT_IN_FLIGHT.leave(client)
+        audio_content.close()
+
+    async def _job():
+        job_wait = time.monotonic() - submitted
+        cached = _cached_result(cache_key)
+        if cached is None:
+            cached = await _transcribe_shared(
+                audio_content, filename,
+                language=language, duration=duration, audio_source=audio_source,
+                preferred_api=preferred_api, logger=TranscriptionLogger("transcribe-job"),
+                content_key=content_key, cache_key=cache_key,
+                deadline=deadlines.for_request(request_timeout, default=deadlines.JOB_DEADLINE_SECONDS),
+                client=client
+            )
+        text, api_used, metadata = cached
+        metadata = dict(metadata)
+        metadata["queue_wait"] = {**metadata.get("queue_wait", {}), "job_seconds": round(job_wait, 3)}
+        return {"text": text, "api_used": api_used, "partial": bool(metadata.get("partial")), "metadata": metadata}
+
+    try:
+        job = JOB_MANAGER.submit(_job, info={"duration": duration, "audio_source": audio_source},
+                                 on_done=_release)
+    except JobQueueFull as e:
+        _release()
+        _refund_audio_cost(request, "/transcribe-jobs", charged)   # v158
+        print(f"[v133-JOBS] ❌ {e}")
+        return JSONResponse(status_code=503, headers={"Retry-After": "30"}, content={
+            "success": False,
+            "message": "服务器繁忙，请稍后再试。",
+        })
+
+    print(f"[v133-JOBS] 📥 新任务 {job.id[:8]}（{len(audio_content)} bytes，{audio_source}）")
+    return {
+        "success": True,
+        "job_id": job.id,
+        "status": job.status,
+        "poll_url": f"/transcribe-jobs/{job.id}",
+        "events_url": f"/transcribe-jobs/{job.id}/events",
+    }
+
+
+def _get_job_or_404(job_id: str):
+    job = JOB_MANAGER.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return job
+
+
+@app.get("/transcribe-jobs/{job_id}")
+async def get_transcription_job(job_id: str):
+    """查询任务状态；succeeded 时带 result（text / api_used / metadata），failed 时带 error。"""
+    job = _get_job_or_404(job_id)
+    return {"success": True, **job.to_dict()}
+
+
+@app.get("/transcribe-jobs/{job_id}/events")
+async def stream_transcription_job(job_id: str):
+    """SSE：每次状态变化推一条 `event: <status>`，到 succeeded/failed 为止；空闲时发心跳注释。"""
+    job = _get_job_or_404(job_id)
+
+    async def _events():
+        version = -1
+        while True:
+            if job.version != version:
+                version = job.version
+                payload = json.dumps(job.to_dict(), ensure_ascii=False)
+                yield f"event: {job.status}\ndata: {payload}\n\n"
+                if job.done:
+                    return
+            if not await job.wait_change(version, JOB_SSE_HEARTBEAT_SECONDS):
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(_events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 # Railway/Production startup
@@ -0,0 +1,705 @@
+"""
+跨 worker / 跨实例共享的状态后端（v147）
+
+问题：限流计数（v146 RATE_LIMITER）、熔断器、配额标记、冷却、用量计数都是进程内全局变量。
+uvicorn 开几个 worker、或 Railway 开几个副本时，有效限额就乘以进程数；某个 provider 没额度了，
+每个进程还得各自撞一次（各花一次钱、各等一次超时）才知道。
+
+做法：一个很小的键值接口，值一律是数字，可带 TTL：
+  · get_many(keys) / incr(key, amount, ttl) / set(key, value, ttl) / delete(key) / clear()
+实现：
+  · MemoryBackend       —— 进程内 dict（默认；单 worker 时与原来等价，不共享）；
+  · SharedMemoryBackend —— /dev/shm 下的定长开放寻址哈希表（mmap + fcntl 文件锁），同一台机器的多个 worker 共享；
+  · SQLiteBackend       —— SQLite WAL 文件，同机多进程共享（也适合挂同一块卷的副本）；
+  · RedisBackend        —— 自带的极简 RESP 客户端（不依赖 redis 包），跨实例共享；
+    serve_stand_in() 在本机起一个说 RESP 的替身（背后是 MemoryBackend），测试和本地联调用。
+由 STATE_BACKEND=memory|shm|sqlite|redis 选择（STATE_BACKEND_PATH / STATE_BACKEND_URL 指定位置）。
+
+接口是同步的。memory / shm 是本机内存操作（微秒级），在事件循环上直接调；SQLite（busy-timeout）和
+Redis（网络往返）标 blocking=True，事件循环上不直接调：
+  · 限流（SharedRateLimiter.ahit）整次检查经 offload() 放到专用的单线程里做；
+  · 熔断 / 冷却 / 配额 / 用量走 StateMirror：事件循环上只读本进程镜像、写入排队，
+    由一次后台同步把写入刷出去、把关注的键一次 get_many 批量读回来（最多 STATE_SYNC_INTERVAL_SECONDS 一次）。
+一个慢 Redis 因此只拖慢这条后台线程，不会卡住所有连接。
+后端出错一律抛 StateBackendError，调用方回退到进程内状态（照常放行 / 照常调用），不因共享状态不可用而拒绝服务。
+TTL 按墙上时间（time.time）计——跨进程只有墙上时间是同一把尺子。
+
+键的第一段（第一个 ":" 之前，如 rl / breaker / cooldown）是命名空间：clear(namespace) 只清这一类。
+Redis 的键另加 STATE_BACKEND_KEY_PREFIX 前缀，clear() 用 SCAN + DEL 只删本服务的键，不 FLUSHDB——
+同一个库里别的服务的数据不受影响。Redis 版本要求 ≥ 2.8（SET … PX … NX、SCAN）。
+"""
+
+import os
+import mmap
+import time
+import asyncio
+import fnmatch
+import functools
+import socket
+import struct
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+try:
+    import fcntl
+except ImportError:     # Windows：没有 fcntl，共享内存后端不可用
+    fcntl = None
+
+
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory").strip().lower()
+STATE_BACKEND_PATH = os.environ.get("STATE_BACKEND_PATH", "")
+STATE_BACKEND_URL = os.environ.get("STATE_BACKEND_URL", "redis://127.0.0.1:6379/0")
+STATE_BACKEND_TIMEOUT_SECONDS = float(os.environ.get("STATE_BACKEND_TIMEOUT_SECONDS", "0.05"))
+STATE_SHM_SLOTS = int(os.environ.get("STATE_SHM_SLOTS", str(1 << 16)))
+STATE_BACKEND_KEY_PREFIX = os.environ.get("STATE_BACKEND_KEY_PREFIX", "voicespark:")
+STATE_SYNC_INTERVAL_SECONDS = float(os.environ.get("STATE_SYNC_INTERVAL_SECONDS", "0.5"))
+
+
+def _namespace_prefix(namespace: Optional[str]) -> str:
+    return f"{namespace}:" if namespace else ""
+
+
+class StateBackendError(Exception):
+    """共享状态读写失败（文件锁、数据库、网络）。调用方应回退到进程内状态。"""
+
+
+class MemoryBackend:
+    """进程内 dict。时间源可注入（测试用）。"""
+
+    name = "memory"
+    shared = False
+    blocking = False
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self._data: Dict[str, Tuple[float, float]] = {}     # key -> (value, expires_at；0 表示不过期)
+
+    def _live(self, key: str, now: float) -> Optional[float]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] and entry[1] <= now:
+            del self._data[key]
+            return None
+        return entry[0]
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[float]]:
+        now = self._clock()
+        return [self._live(k, now) for k in keys]
+
+    def get(self, key: str) -> Optional[float]:
+        return self.get_many([key])[0]
+
+    def incr(self, key: str, amount: float = 1.0, ttl: Optional[float] = None) -> float:
+        """加 amount 并返回新值；键不存在（或已过期）时从 0 开始，并按 ttl 设过期。已存在的键不续期。"""
+        now = self._clock()
+        current = self._live(key, now)
+        if current is None:
+            value, expires = float(amount), (now + ttl if ttl else 0.0)
+        else:
+            value, expires = current + amount, self._data[key][1]
+        self._data[key] = (value, expires)
+        return value
+
+    def set(self, key: str, value: float, ttl: Optional[float] = None) -> None:
+        self._data[key] = (float(value), self._clock() + ttl if ttl else 0.0)
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        if not namespace:
+            self._data.clear()
+            return
+        prefix = _namespace_prefix(namespace)
+        for key in [k for k in self._data if k.startswith(prefix)]:
+            del self._data[key]
+
+
+# ---------- 共享内存：定长开放寻址表 ----------
+
+_SLOT = struct.Struct("<16sdd")          # 键摘要、值、过期时刻（0 = 不过期）
+_EMPTY = b"\x00" * 16
+_TOMBSTONE = b"\xff" * 16
+_MAX_PROBES = 128
+
+
+def _tag(namespace: str) -> bytes:
+    return hashlib.blake2b(namespace.encode("utf-8"), digest_size=4).digest()
+
+
+def _digest(key: str) -> bytes:
+    """前 4 字节是命名空间的摘要（clear(namespace) 按它挑槽），后 12 字节是整个键的摘要。"""
+    d = _tag(key.split(":", 1)[0]) + hashlib.blake2b(key.encode("utf-8"), digest_size=12).digest()
+    return d if d not in (_EMPTY, _TOMBSTONE) else d[:15] + b"\x01"
+
+
+class SharedMemoryBackend:
+    """/dev/shm 下的 mmap 文件：STATE_SHM_SLOTS 个 32 字节槽，线性探测；读写都在 fcntl 文件锁内。"""
+
+    name = "shm"
+    shared = True
+    blocking = False
+
+    def __init__(self, path: Optional[str] = None, slots: Optional[int] = None):
+        if fcntl is None:
+            raise StateBackendError("当前平台没有 fcntl，无法使用共享内存后端")
+        base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        self.path = path or os.path.join(base, "voicespark-state")
+        self.slots = slots or STATE_SHM_SLOTS
+        size = self.slots * _SLOT.size
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+        self._thread_lock = threading.Lock()     # flock 按文件描述符算，同进程多线程还得再锁一层
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _find(self, digest: bytes, now: float, for_write: bool) -> Optional[int]:
+        """键所在的槽；for_write 时找不到就返回可复用的空槽 / 墓碑 / 已过期槽。"""
+        start = int.from_bytes(digest[:8], "little") % self.slots
+        reusable = None
+        for i in range(min(_MAX_PROBES, self.slots)):
+            slot = (start + i) % self.slots
+            d, _, expires = _SLOT.unpack_from(self._map, slot * _SLOT.size)
+            if d == digest:
+                if expires and expires <= now:
+                    self._write(slot, _TOMBSTONE, 0.0, 0.0)
+                    return slot if for_write else None
+                return slot
+            if d == _EMPTY:
+                return (reusable if reusable is not None else slot) if for_write else None
+            if reusable is None and (d == _TOMBSTONE or (expires and expires <= now)):
+                reusable = slot
+        if for_write and reusable is not None:
+            return reusable
+        if for_write:
+            raise StateBackendError(f"共享内存表已满（{self.slots} 槽）")
+        return None
+
+    def _read(self, slot: int) -> Tuple[bytes, float, float]:
+        return _SLOT.unpack_from(self._map, slot * _SLOT.size)
+
+    def _write(self, slot: int, digest: bytes, value: float, expires: float) -> None:
+        _SLOT.pack_into(self._map, slot * _SLOT.size, digest, value, expires)
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[float]]:
+        now = time.time()
+        out = []
+        with self._locked():
+            for key in keys:
+                slot = self._find(_digest(key), now, for_write=False)
+                out.append(None if slot is None else self._read(slot)[1])
+        return out
+
+    def get(self, key: str) -> Optional[float]:
+        return self.get_many([key])[0]
+
+    def incr(self, key: str, amount: float = 1.0, ttl: Optional[float] = None) -> float:
+        now = time.time()
+        digest = _digest(key)
+        with self._locked():
+            slot = self._find(digest, now, for_write=True)
+            d, value, expires = self._read(slot)
+            if d != digest:
+                value, expires = 0.0, (now + ttl if ttl else 0.0)
+            value += amount
+            self._write(slot, digest, value, expires)
+        return value
+
+    def set(self, key: str, value: float, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        digest = _digest(key)
+        with self._locked():
+            self._write(self._find(digest, now, for_write=True), digest, float(value), now + ttl if ttl else 0.0)
+
+    def delete(self, key: str) -> None:
+        with self._locked():
+            slot = self._find(_digest(key), time.time(), for_write=False)
+            if slot is not None:
+                self._write(slot, _TOMBSTONE, 0.0, 0.0)
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        with self._locked():
+            if not namespace:
+                self._map[:] = b"\x00" * len(self._map)
+                return
+            tag = _tag(namespace)
+            for slot in range(self.slots):
+                d = self._read(slot)[0]
+                if d[:4] == tag and d != _TOMBSTONE:
+                    self._write(slot, _TOMBSTONE, 0.0, 0.0)
+
+
+# ---------- SQLite WAL ----------
+
+class SQLiteBackend:
+    """SQLite WAL：读写互不阻塞，多进程各自一个连接；过期行在写入时顺带清理。"""
+
+    name = "sqlite"
+    shared = True
+    blocking = True
+    _SWEEP_EVERY = 500
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(tempfile.gettempdir(), "voicespark-state.sqlite3")
+        try:
+            self._conn = sqlite3.connect(self.path, timeout=STATE_BACKEND_TIMEOUT_SECONDS,
+                                         isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value REAL NOT NULL, "
+                               "expires REAL NOT NULL DEFAULT 0)")
+        except sqlite3.Error as e:
+            raise StateBackendError(f"SQLite 状态库打不开（{self.path}）: {e}") from e
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _run(self, sql: str, params: Sequence = ()):
+        try:
+            with self._lock:
+                return self._conn.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            raise StateBackendError(f"SQLite 状态读写失败: {e}") from e
+
+    def _sweep(self, now: float) -> None:
+        self._writes += 1
+        if self._writes % self._SWEEP_EVERY == 0:
+            self._run("DELETE FROM kv WHERE expires > 0 AND expires <= ?", (now,))
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[float]]:
+        if not keys:
+            return []
+        rows = self._run(f"SELECT key, value FROM kv WHERE key IN ({','.join('?' * len(keys))}) "
+                         f"AND (expires = 0 OR expires > ?)", (*keys, time.time()))
+        found = dict(rows)
+        return [found.get(k) for k in keys]
+
+    def get(self, key: str) -> Optional[float]:
+        return self.get_many([key])[0]
+
+    def incr(self, key: str, amount: float = 1.0, ttl: Optional[float] = None) -> float:
+        now = time.time()
+        expires = now + ttl if ttl else 0.0
+        rows = self._run(
+            "INSERT INTO kv (key, value, expires) VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+            "value = CASE WHEN kv.expires > 0 AND kv.expires <= ? THEN excluded.value ELSE kv.value + excluded.value END, "
+            "expires = CASE WHEN kv.expires > 0 AND kv.expires <= ? THEN excluded.expires ELSE kv.expires END "
+            "RETURNING value", (key, float(amount), expires, now, now))
+        self._sweep(now)
+        return rows[0][0]
+
+    def set(self, key: str, value: float, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        self._run("INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)",
+                  (key, float(value), now + ttl if ttl else 0.0))
+        self._sweep(now)
+
+    def delete(self, key: str) -> None:
+        self._run("DELETE FROM kv WHERE key = ?", (key,))
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        if not namespace:
+            self._run("DELETE FROM kv")
+            return
+        self._run("DELETE FROM kv WHERE key >= ? AND key < ?", (f"{namespace}:", f"{namespace};"))
+
+
+# ---------- Redis（RESP） ----------
+
+def _encode(*args) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+
+def _read_reply(stream):
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("连接已关闭")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body.decode()
+    if kind == b"-":
+        raise StateBackendError(f"Redis 错误: {body.decode()}")
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        n = int(body)
+        if n < 0:
+            return None
+        data = stream.read(n + 2)
+        return data[:-2].decode()
+    if kind == b"*":
+        n = int(body)
+        return None if n < 0 else [_read_reply(stream) for _ in range(n)]
+    raise StateBackendError(f"无法解析的 RESP 回复: {line!r}")
+
+
+def _glob_escape(text: str) -> str:
+    return "".join("\\" + ch if ch in "*?[]\\" else ch for ch in text)
+
+
+class RedisBackend:
+    """极简同步 RESP 客户端：一次发完一批命令（pipeline）再依次读回复；连接断了下次调用时重连。
+    所有键加 key_prefix（默认 STATE_BACKEND_KEY_PREFIX），与同库的其他服务互不干扰。"""
+
+    name = "redis"
+    shared = True
+    blocking = True
+
+    def __init__(self, url: Optional[str] = None, timeout: Optional[float] = None, key_prefix: Optional[str] = None):
+        parsed = urlparse(url or STATE_BACKEND_URL)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.password = parsed.password
+        self.timeout = STATE_BACKEND_TIMEOUT_SECONDS if timeout is None else timeout
+        self.key_prefix = STATE_BACKEND_KEY_PREFIX if key_prefix is None else key_prefix
+        self._sock = None
+        self._stream = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock, self._stream = sock, sock.makefile("rb")
+        setup = ([("AUTH", self.password)] if self.password else []) + ([("SELECT", self.db)] if self.db else [])
+        if setup:
+            self._send(setup)
+
+    def _send(self, commands):
+        self._sock.sendall(b"".join(_encode(*c) for c in commands))
+        return [_read_reply(self._stream) for _ in commands]
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._stream = None
+
+    def pipeline(self, commands: Sequence[Tuple]) -> list:
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self._connect()
+                return self._send(commands)
+            except (OSError, ConnectionError, ValueError) as e:
+                self._close()
+                raise StateBackendError(f"Redis {self.host}:{self.port} 不可用: {e}") from e
+            except StateBackendError:
+                # 一批里某条回 -ERR 时后面的回复还没读，留在连接上会让之后每条命令读到上一条的回复
+                # （AUTH 失败时 SELECT 的 +OK 被 MGET 读走）；解析不了的回复同理。关掉，下次重连
+                self._close()
+                raise
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[float]]:
+        if not keys:
+            return []
+        values = self.pipeline([("MGET", *(self.key_prefix + k for k in keys))])[0]
+        return [None if v is None else float(v) for v in values]
+
+    def get(self, key: str) -> Optional[float]:
+        return self.get_many([key])[0]
+
+    def incr(self, key: str, amount: float = 1.0, ttl: Optional[float] = None) -> float:
+        key = self.key_prefix + key
+        if not ttl:
+            return float(self.pipeline([("INCRBYFLOAT", key, amount)])[0])
+        # 键不存在时先带 TTL 建成 0（SET … NX），再加：已存在的键不续期。INCRBYFLOAT 不动 TTL
+        replies = self.pipeline([("SET", key, 0, "PX", max(1, int(ttl * 1000)), "NX"),
+                                 ("INCRBYFLOAT", key, amount)])
+        return float(replies[1])
+
+    def set(self, key: str, value: float, ttl: Optional[float] = None) -> None:
+        args = ("SET", self.key_prefix + key, value) + (("PX", max(1, int(ttl * 1000))) if ttl else ())
+        self.pipeline([args])
+
+    def delete(self, key: str) -> None:
+        self.pipeline([("DEL", self.key_prefix + key)])
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        """SCAN + DEL 只删本服务（key_prefix）下、该命名空间的键。"""
+        pattern = _glob_escape(self.key_prefix + _namespace_prefix(namespace)) + "*"
+        cursor = "0"
+        while True:
+            cursor, keys = self.pipeline([("SCAN", cursor, "MATCH", pattern, "COUNT", 500)])[0]
+            if keys:
+                self.pipeline([("DEL", *keys)])
+            if cursor == "0":
+                return
+
+
+class _StandInHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True      # pipeline 的几条回复分开写，不关 Nagle 会等对端的延迟 ACK
+
+    def handle(self):
+        store: MemoryBackend = self.server.store
+        while True:
+            try:
+                command = _read_reply(self.rfile)
+            except (ConnectionError, StateBackendError, ValueError):
+                return
+            name, args = command[0].upper(), command[1:]
+            with self.server.lock:
+                reply = self._execute(store, name, args)
+            self.wfile.write(reply)
+
+    @staticmethod
+    def _bulk(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, float):
+            value = int(value) if value.is_integer() else repr(value)
+        data = str(value).encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    def _execute(self, store: MemoryBackend, name: str, args: list) -> bytes:
+        if name in ("PING", "SELECT", "AUTH"):
+            return b"+OK\r\n" if name != "PING" else b"+PONG\r\n"
+        if name == "MGET":
+            values = store.get_many(args)
+            return b"*%d\r\n" % len(values) + b"".join(self._bulk(v) for v in values)
+        if name == "GET":
+            return self._bulk(store.get(args[0]))
+        if name == "INCRBYFLOAT":
+            return self._bulk(store.incr(args[0], float(args[1])))
+        if name == "SET":
+            options = [a.upper() for a in args[2:]]
+            ttl = int(args[3]) / 1000.0 if "PX" in options else None
+            if "NX" in options and store.get(args[0]) is not None:
+                return b"$-1\r\n"
+            store.set(args[0], float(args[1]), ttl)
+            return b"+OK\r\n"
+        if name == "SCAN":
+            pattern = args[args.index("MATCH") + 1] if "MATCH" in args else "*"
+            keys = [k for k in list(store._data) if fnmatch.fnmatchcase(k, pattern) and store.get(k) is not None]
+            return b"*2\r\n" + self._bulk("0") + b"*%d\r\n" % len(keys) + b"".join(self._bulk(k) for k in keys)
+        if name == "DEL":
+            existed = sum(1 for k in args if store.get(k) is not None)
+            for k in args:
+                store.delete(k)
+            return b":%d\r\n" % existed
+        return b"-ERR unknown command '%s'\r\n" % name.encode()
+
+
+class _StandInServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve_stand_in(host: str = "127.0.0.1", port: int = 0):
+    """在本机起一个说 RESP 的替身（只实现本模块用到的命令），返回 (server, url)。用完 server.shutdown()。"""
+    server = _StandInServer((host, port), _StandInHandler)
+    server.store = MemoryBackend()
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, name="resp-stand-in", daemon=True).start()
+    return server, f"redis://{host}:{server.server_address[1]}/0"
+
+
+# ---------- 选择后端 ----------
+
+def make_backend(kind: Optional[str] = None, path: Optional[str] = None, url: Optional[str] = None):
+    kind = (kind or STATE_BACKEND).strip().lower()
+    if kind == "memory":
+        return MemoryBackend()
+    if kind == "shm":
+        return SharedMemoryBackend(path or STATE_BACKEND_PATH or None)
+    if kind == "sqlite":
+        return SQLiteBackend(path or STATE_BACKEND_PATH or None)
+    if kind == "redis":
+        return RedisBackend(url or STATE_BACKEND_URL)
+    raise StateBackendError(f"未知的 STATE_BACKEND: {kind!r}（可选 memory / shm / sqlite / redis）")
+
+
+def _initial_backend():
+    try:
+        backend = make_backend()
+    except StateBackendError as e:
+        print(f"[v147-STATE] ⚠️ {e}，退回进程内状态")
+        return MemoryBackend()
+    print(f"[v147-STATE] 共享状态后端: {backend.name}")
+    return backend
+
+
+STATE = _initial_backend()
+
+
+def use(backend) -> None:
+    """替换全局后端（启动配置 / 测试用）。"""
+    global STATE
+    STATE = backend
+
+
+# ---------- 不在事件循环上阻塞 ----------
+
+# 单线程：SQLite / Redis 后端本来就各自一把锁、一条连接，多开线程只会排在锁上
+_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-backend")
+
+
+async def offload(backend, fn, *args, **kwargs):
+    """backend 会阻塞（SQLite / Redis）时把 fn 放到专用线程里跑；内存类后端直接调。"""
+    if not getattr(backend, "blocking", False):
+        return fn(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_EXECUTOR, functools.partial(fn, *args, **kwargs))
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class StateMirror:
+    """
+    熔断 / 冷却 / 配额 / 用量这类共享键在本进程的镜像（provider_health.shared_get_many / shared_call 走这里）。
+
+    在事件循环上：读只看镜像（读过的键记为"关注"），写先改镜像、再排进待写队列；随后最多每
+    interval 秒一次后台同步——一次线程切换里把待写的刷出去、把关注的键一次 get_many 读回来。
+    别的进程写下的状态最多晚 interval 秒可见（熔断 / 冷却本来就是秒级以上）。
+    不在事件循环上（同步代码、启动阶段）时直接读写后端，与原来一致。
+    """
+
+    def __init__(self, interval: Optional[float] = None):
+        self.interval = STATE_SYNC_INTERVAL_SECONDS if interval is None else interval
+        self._backend = None
+        self._values: Dict[str, Optional[float]] = {}
+        self._expires: Dict[str, float] = {}           # 本进程带 TTL 写入的键，到点镜像里也当不存在
+        self._watched = set()
+        self._pending: List[Tuple[str, tuple, dict]] = []
+        self._written = set()                          # 同步途中本进程又写过的键，读回的旧值不覆盖它们
+        self._sync_task = None
+        self._synced_at = float("-inf")
+        self.syncs = 0
+        self.errors = 0
+
+    def _bind(self):
+        backend = STATE
+        if backend is not self._backend:                # 换了后端（启动配置 / 测试）：镜像作废
+            self._backend = backend
+            self._values.clear()
+            self._expires.clear()
+            self._watched.clear()
+            self._pending.clear()
+        return backend
+
+    def _cached(self, key: str, now: float) -> Optional[float]:
+        expires = self._expires.get(key)
+        if expires is not None and expires <= now:
+            return None
+        return self._values.get(key)
+
+    def _apply_local(self, method: str, key: str, args: tuple, kwargs: dict) -> None:
+        now = time.time()
+        ttl = kwargs.get("ttl", args[1] if len(args) > 1 else None)
+        if method == "delete":
+            self._values[key] = None
+            self._expires.pop(key, None)
+        elif method == "set":
+            self._values[key] = float(args[0])
+            if ttl:
+                self._expires[key] = now + ttl
+            else:
+                self._expires.pop(key, None)
+        elif method == "incr":
+            current = self._cached(key, now)
+            self._values[key] = (current or 0.0) + float(args[0] if args else kwargs.get("amount", 1.0))
+            if current is None:
+                if ttl:
+                    self._expires[key] = now + ttl
+                else:
+                    self._expires.pop(key, None)
+        self._written.add(key)
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[float]]:
+        """读；后端出错抛 StateBackendError（只有不在事件循环上直接读时才会）。"""
+        backend = self._bind()
+        loop = _running_loop()
+        if loop is None:
+            values = backend.get_many(keys)
+            self._values.update(zip(keys, values))
+            return values
+        self._watched.update(keys)
+        self._kick(loop)
+        now = time.time()
+        return [self._cached(k, now) for k in keys]
+
+    def call(self, method: str, key: str, *args, **kwargs) -> None:
+        """写（set / incr / delete）；后端出错抛 StateBackendError（只有不在事件循环上直接写时才会）。"""
+        backend = self._bind()
+        self._apply_local(method, key, args, kwargs)
+        loop = _running_loop()
+        if loop is None:
+            getattr(backend, method)(key, *args, **kwargs)
+            return
+        self._pending.append((method, (key,) + args, kwargs))
+        self._kick(loop, force=True)
+
+    def _kick(self, loop, force: bool = False) -> None:
+        if self._sync_task is not None and not self._sync_task.done():
+            return
+        if not force and time.monotonic() - self._synced_at < self.interval:
+            return
+        self._sync_task = loop.create_task(self.sync())
+
+    async def sync(self) -> None:
+        """刷出待写队列、批量读回关注的键；期间又有新的写入就接着再来一轮。"""
+        while True:
+            backend = self._bind()
+            pending, self._pending = self._pending, []
+            keys = sorted(self._watched)
+            self._written.clear()
+
+            def work():
+                for method, args, kwargs in pending:
+                    getattr(backend, method)(*args, **kwargs)
+                return backend.get_many(keys) if keys else []
+
+            self._synced_at = time.monotonic()
+            try:
+                values = await offload(backend, work)
+            except StateBackendError as e:
+                self.errors += 1
+                print(f"[v147-STATE] ⚠️ 同步共享状态失败（{e}），按本进程状态判断")
+                return
+            if backend is not self._backend:
+                return
+            self.syncs += 1
+            for key, value in zip(keys, values):
+                if key not in self._written:
+                    self._values[key] = value
+                    self._expires.pop(key, None)
+            if not self._pending:
+                return
+
+    def stats(self) -> Dict[str, int]:
+        return {"watched": len(self._watched), "pending": len(self._pending),
+                "syncs": self.syncs, "errors": self.errors}
+
+
+MIRROR = StateMirror()
@@ -1419,6 +1419,9 @@ async function splitAudioAtSilence(audioBlob, opts = {}) {
     }
 }
 
+// 服务端 /transcribe-segment 的上传上限是 25MB，留 1MB 余量
+const SERVER_CHUNK_MAX_BYTES = 24 * 1024 * 1024;
+
 /**
  * 上传单个音频 blob 到 /transcribe-segment，返回服务端 JSON（不吞错误，失败抛异常）。
  *
@@ -1448,6 +1451,12 @@ async function uploadForTranscription(blob, { durationSec, audioSource, language
         return formData;
     };
 
+    // v132：同一次上传的所有重试共用一个 Idempotency-Key——超时重传时服务端上一次调用往往还在跑，
+    // 带上同一个 key 就会合并到那次调用，不会再付一次费
+    const idempotencyKey = (window.crypto && crypto.randomUUID)
+        ? crypto.randomUUID()
+        : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+
     let lastErr;
     for (let attempt = 0; attempt <= retries; attempt++) {
         const controller = new AbortController();
@@ -1456,6 +1465,11 @@ async function uploadForTranscription(blob, { durationSec, audioSource, language
             const response = await fetch('/transcribe-segment', {
                 method: 'POST',
                 body: buildForm(),
+                // v140：告诉服务端本次最多等多久（比前端中止早 5s），过了截止时间服务端不再调用后面的 provider
+                headers: {
+                    'Idempotency-Key': idempotencyKey,
+                    'X-Request-Timeout': String(Math.max(5, Math.round(timeoutMs / 1000) - 5)),
+                },
                 signal: controller.signal,
             });
             if (response.ok) {
@@ -1491,7 +1505,10 @@ async function uploadForTranscription(blob, { durationSec, audioSource, language
  * success=false（如纯静音段被后端过滤）不重试、按空文本跳过；所有段都失败才整体报错。
  */
 async function transcribeAudioSmart(blob, { durationSec, audioSource, language, onProgress = null }) {
-    const chunks = await splitAudioAtSilence(blob);
+    // v134：WAV（VAD 输出）整段上传，由服务端按静音切段、并发转录——浏览器不再解码/重编码，
+    // 也省掉每段一个往返。服务端解不了的格式（WebM 等）或超过上传上限的，仍在本地切。
+    const serverChunks = (blob.type || '').includes('wav') && blob.size <= SERVER_CHUNK_MAX_BYTES;
+    const chunks = serverChunks ? null : await splitAudioAtSilence(blob);
     if (!chunks || chunks.length < 2) {
         return await uploadForTranscription(blob, { durationSec, audioSource, language });
     }
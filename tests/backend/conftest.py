@@ -3,3 +3,29 @@ import sys
 
 # 让 tests/backend 下的用例能 import 仓库根的 api_fallback / server2
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+
+import pytest
+
+import provider_concurrency
+import provider_health
+import provider_pacing
+import retry_policy
+
+
+@pytest.fixture(autouse=True)
+def _reset_provider_health(monkeypatch):
+    """v129: 延迟统计与熔断器是进程级全局状态，每个用例前后清空，避免串扰。
+    v142: 全局重试预算同理；重试间隔压到毫秒级，别的用例里的临时错误不拖慢测试。
+    v144: 限流响应头驱动的节流状态同理；v145: 各 provider 的并发名额与队列同理。"""
+    monkeypatch.setattr(retry_policy, "RETRY_BASE_DELAY_SECONDS", 0.001)
+    monkeypatch.setattr(retry_policy, "RETRY_MAX_DELAY_SECONDS", 0.005)
+    provider_health.reset_all()
+    retry_policy.reset()
+    provider_pacing.PACING.reset()
+    provider_concurrency.reset()
+    yield
+    provider_health.reset_all()
+    retry_policy.reset()
+    provider_pacing.PACING.reset()
+    provider_concurrency.reset()
@@ -0,0 +1,131 @@
+"""
+🎯 麦克风链路自适应排序（后端 pytest）— v130 _order_microphone_chain
+
+覆盖：
+  · 默认 static：顺序与 G3 一致，不受统计数据影响
+  · adaptive：样本充足时期望耗时（EWMA 延迟 / 成功率）最小的候选者排第一
+  · 约束：不在主力候选名单（Google）、单价超上限、成功率过低、样本不足、熔断中 → 不提前，按原顺序兜底
+  · 决策在 get_api_status()["routing"] 与 metadata["routing"] 中可见，且可 JSON 序列化
+
+做法：直接往 PROVIDER_STATS 喂样本，ROUTING_EXPLORE_RATE 置 0 保证确定性。
+"""
+import json
+
+import pytest
+
+import api_fallback as af
+import provider_health as ph
+from provider_health import PROVIDER_STATS
+
+
+@pytest.fixture(autouse=True)
+def adaptive(monkeypatch):
+    monkeypatch.setattr(af, "MIC_ROUTING_MODE", "adaptive")
+    monkeypatch.setattr(af, "ROUTING_EXPLORE_RATE", 0.0)
+    monkeypatch.setattr(af, "ROUTING_MIN_SAMPLES", 5)
+    snap = dict(af.API_FALLBACK_STATUS)
+    for k in ("openai_quota_exceeded", "ai_builder_quota_exceeded"):
+        af.API_FALLBACK_STATUS[k] = False
+    yield
+    af.API_FALLBACK_STATUS.clear()
+    af.API_FALLBACK_STATUS.update(snap)
+
+
+def _feed(provider, latency, n=10, duration=30, fail_every=0):
+    for i in range(n):
+        if fail_every and i % fail_every == 0:
+            PROVIDER_STATS.record_failure(provider, duration, latency)
+        else:
+            PROVIDER_STATS.record_success(provider, duration, latency)
+
+
+def _order(duration=30):
+    chain = af._microphone_chain(b"x", "f.wav", None, duration, None)
+    ordered, decision = af._order_microphone_chain(chain, duration)
+    return [s[0] for s in ordered], decision
+
+
+def test_static模式不受统计影响(monkeypatch):
+    monkeypatch.setattr(af, "MIC_ROUTING_MODE", "static")
+    _feed("openai", 9.0)
+    _feed("ai_builder", 1.0)
+    assert _order()[0] == ["openai", "ai_builder", "google"]
+
+
+def test_更快的候选者被提到第一():
+    _feed("openai", 9.0)
+    _feed("ai_builder", 2.0)
+    order, decision = _order()
+    assert order == ["ai_builder", "openai", "google"]
+    assert decision["expected_seconds"]["ai_builder"] < decision["expected_seconds"]["openai"]
+
+
+def test_按时长档位分别判断():
+    _feed("openai", 9.0, duration=30)
+    _feed("ai_builder", 2.0, duration=30)
+    _feed("openai", 20.0, duration=400)
+    _feed("ai_builder", 60.0, duration=400)
+    assert _order(30)[0][0] == "ai_builder"
+    assert _order(400)[0][0] == "openai"
+
+
+def test_Google再快也不当主力():
+    _feed("openai", 9.0)
+    _feed("ai_builder", 8.0)
+    _feed("google", 0.5)
+    order, decision = _order()
+    assert order[-1] == "google"
+    assert decision["not_promoted"]["google"] == "不在主力候选名单"
+
+
+def test_单价超上限不提前(monkeypatch):
+    monkeypatch.setattr(af, "ROUTING_MAX_COST_PER_MIN", 0.001)
+    _feed("openai", 1.0)
+    _feed("ai_builder", 5.0)
+    order, decision = _order()
+    assert order[0] == "ai_builder"
+    assert decision["not_promoted"]["openai"] == "单价超出上限"
+
+
+def test_成功率过低不提前():
+    _feed("openai", 9.0)
+    _feed("ai_builder", 1.0, n=20, fail_every=2)   # 一半失败
+    order, decision = _order()
+    assert order[0] == "openai"
+    assert "成功率" in decision["not_promoted"]["ai_builder"]
+
+
+def test_样本不足保持原顺序():
+    _feed("openai", 9.0)
+    _feed("ai_builder", 1.0, n=2)
+    assert _order()[0] == ["openai", "ai_builder", "google"]
+
+
+def test_熔断中不提前():
+    _feed("openai", 9.0)
+    _feed("ai_builder", 1.0)
+    ph.get_breaker("ai_builder").trip(60, "test")
+    order, decision = _order()
+    assert order[0] == "openai"
+    assert decision["not_promoted"]["ai_builder"] == "熔断中"
+
+
+async def test_决策在状态与元数据中可见(monkeypatch):
+    _feed("openai", 9.0)
+    _feed("ai_builder", 2.0)
+    calls = []
+
+    async def ok(name):
+        async def f(*a, **k):
+            calls.append(name)
+            return "OK", {}
+        return f
+
+    monkeypatch.setattr(af, "_transcribe_openai", await ok("openai"))
+    monkeypatch.setattr(af, "_transcribe_ai_builder", await ok("ai_builder"))
+    text, api_used, meta = await af.transcribe_with_fallback(b"x", "f.wav", duration=30)
+    assert api_used == "ai_builder" and calls == ["ai_builder"]
+    assert meta["routing"]["order"][0] == "ai_builder"
+    status = af.get_api_status()
+    assert status["routing"]["last_decision"]["order"][0] == "ai_builder"
+    json.dumps(status, allow_nan=False)  # 会进 HTTP 响应，必须能严格序列化
@@ -0,0 +1,52 @@
+"""
+🎯 纯 ASGI 中间件栈（后端 pytest）— v150 server2.RequestGate
+
+覆盖：
+  · 中间件栈里不再有 BaseHTTPMiddleware；顺序不变：规范域名跳转最外、限流居中、上传上限最内
+  · 整个 app 走一遍：Railway 域名的页面照常 301；/static 与 robots.txt 走快速通道，不跳转
+  · 限流路径被拒时在到达端点之前直接 429 + Retry-After
+
+做法：httpx.ASGITransport 打 server2.app，不起服务、不打网络。
+"""
+import httpx
+import pytest
+from starlette.middleware.base import BaseHTTPMiddleware
+
+import server2
+from upload_intake import UploadLimitMiddleware
+
+RAILWAY = "web-production-37d30.up.railway.app"
+
+
+@pytest.fixture
+async def client():
+    server2.RATE_LIMITER.reset()
+    server2.COST_LIMITER.reset()
+    transport = httpx.ASGITransport(app=server2.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as c:
+        yield c
+    server2.RATE_LIMITER.reset()
+    server2.COST_LIMITER.reset()
+
+
+def test_中间件栈无BaseHTTPMiddleware_顺序不变():
+    stack = server2.app.user_middleware
+    assert not any(issubclass(m.cls, BaseHTTPMiddleware) for m in stack)
+    gates = [m.options.get("check") for m in stack]
+    assert gates.index(server2._canonical_redirect) < gates.index(server2._rate_limit_response)
+    assert [m.cls for m in stack][-1] is UploadLimitMiddleware
+
+
+async def test_Railway域名页面照常301_静态资源走快速通道(client):
+    r = await client.get("/faq.html?a=1", headers={"host": RAILWAY})
+    assert r.status_code == 301 and r.headers["location"] == "https://voicespark.app/faq.html?a=1"
+    for path in ("/static/style.css", "/robots.txt"):
+        r = await client.get(path, headers={"host": RAILWAY})
+        assert r.status_code == 200, path
+
+
+async def test_限流路径在到达端点前429(client, monkeypatch):
+    monkeypatch.setattr(server2, "RATE_LIMITS", [(60, 0)])
+    r = await client.post("/transcribe-segment", files={"audio_file": ("a.webm", b"x" * 100, "audio/webm")})
+    assert r.status_code == 429 and int(r.headers["retry-after"]) >= 1
+    assert r.json()["success"] is False
@@ -0,0 +1,208 @@
+"""
+🎯 服务端长音频分段（后端 pytest）— v134 audio_chunking
+
+覆盖：
+  · 切点落在静音处；每段带重叠；非 WAV / 不够长 → None（走整段）
+  · 拼接去重：中文逐字、英文按词，重叠处重复的内容只留一份；无重叠时原样拼接
+  · 并发转录：至多 max_parallel 段同时在途，总耗时≈最慢一段而非各段之和；结果按原顺序
+  · 失败段整段重转一轮；仍失败的跳过并计数、标 partial 与缺失时间段；全部失败抛第一段的异常
+  · 缺段的结果不写缓存，/transcribe-segment 返回 partial=True
+  · server2._run_transcription：长 WAV 走分段，系统音频不切；切不切看 WAV 实测时长而非声明的 duration，
+    每段的读帧 / 封 WAV 在线程里做（v159）
+
+做法：合成 16kHz 单声道正弦波 + 静音，provider 调用 monkeypatch 掉。
+"""
+import asyncio
+import io
+import math
+import threading
+import time
+import wave
+from array import array
+
+import pytest
+
+import api_fallback as af
+import audio_chunking as ac
+import server2
+
+RATE = 16000
+
+
+def _wav(seconds, silent_at=()):
+    """合成音频：silent_at 里的整数秒是静音，其余是响亮的正弦波。"""
+    samples = array("h")
+    tone = array("h", (int(8000 * math.sin(i * 0.1)) for i in range(RATE)))
+    silence = array("h", bytes(2 * RATE))
+    for sec in range(seconds):
+        samples.extend(silence if sec in silent_at else tone)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(RATE)
+        w.writeframes(samples.tobytes())
+    return buf.getvalue()
+
+
+def test_在静音处下刀且带重叠():
+    chunks = ac.split_wav_at_silence(_wav(200, silent_at={57, 122, 178}))
+    assert len(chunks) == 4
+    # 切点在静音秒内（±8s 搜索窗口里最安静的位置）
+    for c, silent in zip(chunks[1:], (57, 122, 178)):
+        cut = c.start_sec + ac.CHUNK_OVERLAP_SECONDS
+        assert silent <= cut <= silent + 1
+    # 相邻两段重叠 CHUNK_OVERLAP_SECONDS
+    assert chunks[1].start_sec == pytest.approx(chunks[0].end_sec - ac.CHUNK_OVERLAP_SECONDS)
+    # 每段都是能再解析的 WAV
+    with wave.open(io.BytesIO(chunks[1].audio)) as w:
+        assert w.getframerate() == RATE
+        assert w.getnframes() / RATE == pytest.approx(chunks[1].duration)
+
+
+def test_不切的情况():
+    assert ac.split_wav_at_silence(_wav(60)) is None                  # 不够长
+    assert ac.split_wav_at_silence(b"\x1aE\xdf\xa3" + b"\x00" * 99) is None   # WebM 解不了
+    assert ac.split_wav_at_silence(b"RIFF\x00\x00\x00\x00WAVEjunk") is None   # 坏 WAV
+
+
+@pytest.mark.parametrize("texts, expected", [
+    (["今天我们讨论一下项目的进度", "项目的进度还不错，下周发布"], "今天我们讨论一下项目的进度还不错，下周发布"),
+    (["we talked about the roadmap for", "The roadmap, for next quarter"], "we talked about the roadmap for next quarter"),
+    (["第一段。", "第二段。"], "第一段。第二段。"),
+    (["Hello world.", "Another sentence"], "Hello world. Another sentence"),
+    (["前面", "", "后面"], "前面后面"),
+])
+def test_拼接去重(texts, expected):
+    assert ac.stitch_texts(texts) == expected
+
+
+def _chunks(n):
+    return [ac.AudioChunk(b"", i * 60.0, (i + 1) * 60.0, i) for i in range(n)]
+
+
+async def test_并发受限且按序拼接():
+    in_flight, peak = 0, 0
+
+    async def one(chunk):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05 if chunk.index else 0.1)   # 第一段最慢，结果仍排第一
+        in_flight -= 1
+        return f"第{chunk.index + 1}段", "openai_whisper", {}
+
+    start = time.monotonic()
+    text, api_used, meta = await ac.transcribe_chunks(_chunks(4), one, max_parallel=4)
+    assert time.monotonic() - start < 0.2        # ≈最慢一段，不是 0.25 之和
+    assert text == "第1段第2段第3段第4段"
+    assert api_used == "openai_whisper"
+    assert meta["chunked"] == 4 and meta["chunk_failures"] == 0
+
+    peak = 0
+    await ac.transcribe_chunks(_chunks(5), one, max_parallel=2)
+    assert peak == 2
+
+
+async def test_单段失败跳过_全部失败才抛():
+    async def flaky(chunk):
+        if chunk.index == 1:
+            raise Exception("所有转录 API 都失败了: 静音")
+        return f"段{chunk.index}", "google" if chunk.index == 2 else "openai_whisper", {}
+
+    text, api_used, meta = await ac.transcribe_chunks(_chunks(3), flaky, max_parallel=3)
+    assert text == "段0段2"
+    assert api_used == "openai_whisper+google"
+    assert meta["chunk_failures"] == 1 and "静音" in meta["chunks"][1]["error"]
+    assert meta["chunk_retries"] == 1 and meta["partial"] is True and meta["missing"] == [[60.0, 120.0]]
+
+    async def dead(chunk):
+        raise Exception(f"所有转录 API 都失败了: {chunk.index}")
+
+    with pytest.raises(Exception, match="都失败了: 0"):
+        await ac.transcribe_chunks(_chunks(3), dead, max_parallel=3)
+
+
+async def test_失败段重转一轮成功则结果完整():
+    attempts = {}
+
+    async def once_503(chunk):
+        attempts[chunk.index] = attempts.get(chunk.index, 0) + 1
+        if chunk.index == 1 and attempts[1] == 1:
+            raise Exception("OpenAI API 错误 [503]: overloaded")
+        return f"段{chunk.index}", "openai_whisper", {}
+
+    text, _, meta = await ac.transcribe_chunks(_chunks(4), once_503, max_parallel=4)
+    assert text == "段0段1段2段3" and attempts == {0: 1, 1: 2, 2: 1, 3: 1}
+    assert meta["chunk_failures"] == 0 and meta["chunk_retries"] == 1 and "partial" not in meta
+
+
+async def test_缺段的结果不写缓存_响应标partial(monkeypatch):
+    from transcription_cache import SingleFlight, TranscriptionCache
+
+    cache = TranscriptionCache(disk_dir=None)
+    monkeypatch.setattr(server2, "TRANSCRIPTION_CACHE", cache)
+    monkeypatch.setattr(server2, "IN_FLIGHT", SingleFlight())
+
+    async def chunk2_down(**kw):
+        if kw["filename"] == "chunk2.wav":
+            raise Exception("所有转录 API 都失败了: OpenAI API 错误 [503]")
+        return kw["filename"], "openai_whisper", {}
+
+    monkeypatch.setattr(af, "transcribe_with_fallback", chunk2_down)
+    text, _, meta = await server2._transcribe_shared(
+        _wav(200, silent_at={57, 122, 178}), "a.wav", language=None, duration=200, audio_source="microphone",
+        preferred_api=None, logger=None, content_key="k", cache_key="k")
+    assert "chunk2" not in text and meta["partial"] is True and len(meta["missing"]) == 1
+    assert cache.get("k") is None
+
+
+async def test_服务端长WAV走分段_系统音频不切(monkeypatch):
+    calls = []
+
+    async def fake_mic(**kw):
+        calls.append(("mic", kw["filename"], kw["duration"]))
+        return "片段", "openai_whisper", {}
+
+    async def fake_system(**kw):
+        calls.append(("system", kw["filename"], kw["duration"]))
+        return "整段", "google", {}
+
+    monkeypatch.setattr(af, "transcribe_with_fallback", fake_mic)
+    monkeypatch.setattr(af, "transcribe_system_audio", fake_system)
+    audio = _wav(200, silent_at={57, 122, 178})
+    common = dict(language=None, duration=200, preferred_api=None, logger=None)
+
+    text, api_used, meta = await server2._run_transcription(audio, "a.wav", audio_source="microphone", **common)
+    assert meta["chunked"] == 4
+    assert [c[1] for c in calls] == ["chunk1.wav", "chunk2.wav", "chunk3.wav", "chunk4.wav"]
+
+    calls.clear()
+    await server2._run_transcription(audio, "a.wav", audio_source="system", **common)
+    assert calls == [("system", "a.wav", 200)]
+
+
+async def test_切不切看实测时长_每段在线程里读出(monkeypatch):
+    calls, loaders = [], []
+    real_audio = ac.AudioChunk.audio
+
+    def audio_on_thread(chunk):
+        loaders.append(threading.current_thread() is threading.main_thread())
+        return real_audio.fget(chunk)
+
+    async def fake_mic(**kw):
+        calls.append(kw["filename"])
+        return "片段", "openai_whisper", {}
+
+    monkeypatch.setattr(ac.AudioChunk, "audio", property(audio_on_thread))
+    monkeypatch.setattr(af, "transcribe_with_fallback", fake_mic)
+    audio = _wav(200, silent_at={57, 122, 178})
+    _, _, meta = await server2._run_transcription(   # 没传 duration 时表单默认 60
+        audio, "a.wav", language=None, duration=60, audio_source="microphone", preferred_api=None, logger=None)
+    assert meta["chunked"] == 4 and len(calls) == 4
+    assert loaders == [False] * 4
+
+    calls.clear()
+    await server2._run_transcription(   # 声明得再长，实际短的也不切
+        _wav(30), "a.wav", language=None, duration=600, audio_source="microphone", preferred_api=None, logger=None)
+    assert calls == ["a.wav"]
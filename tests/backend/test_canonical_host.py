@@ -40,14 +40,9 @@ class _FakeRequest:
 
 
 async def _call(request):
-    """跑一次 canonical 中间件；未拦截时 call_next 返回哨兵对象。"""
-    sentinel = object()
-
-    async def call_next(_):
-        return sentinel
-
-    result = await srv.canonical_host_middleware(request, call_next)
-    return None if result is sentinel else result
+    """跑一次 canonical 判定（v150 起中间件是纯 ASGI 的 RequestGate，判定逻辑在 _canonical_redirect）；
+    未拦截时返回 None。"""
+    return srv._canonical_redirect(request)
 
 
 PROD_RAILWAY = "web-production-37d30.up.railway.app"
@@ -133,7 +128,7 @@ class TestNoEnvDependency:
         src = open(os.path.join(os.path.dirname(__file__), "..", "..", "server2.py"),
                    encoding="utf-8").read()
         start = src.index("def _should_redirect_to_canonical")
-        end = src.index("return await call_next(request)", start)
+        end = src.index("def _may_redirect", start)
         block = src[start:end]
         assert "DEPLOY_ENVIRONMENT" not in block, \
             "规范域名判定不得依赖 DEPLOY_ENVIRONMENT —— 生产上该变量没设，会导致静默失效"
@@ -0,0 +1,179 @@
+"""
+🎯 熔断器（后端 pytest）— v129 provider_health.CircuitBreaker + should_retry_api / get_api_status
+
+覆盖：
+  · closed → open：滚动窗口错误率超阈值；慢调用 p95 超阈值
+  · open 冷却期内一律拒绝；冷却后 half-open 只放行**一个**探测请求
+  · 探测成功 → closed；探测失败 → 重新 open 且冷却期翻倍
+  · 窗口外的旧失败不计入
+  · 集成：OpenAI 连续 503 → 熔断 → 下一个请求直接跳过 OpenAI，get_api_status 可见
+  · 音频本身的问题（空文本/幻觉）不计入错误率；Google 也有健康跟踪
+
+做法：熔断器时钟可注入，用假时钟推进，不 sleep。
+"""
+import pytest
+
+import api_fallback as af
+import provider_health as ph
+import retry_policy
+
+
+class FakeClock:
+    def __init__(self):
+        self.t = 1000.0
+
+    def __call__(self):
+        return self.t
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return ph.CircuitBreaker("test", clock=clock)
+
+
+def _fail_n(breaker, n, latency=1.0):
+    for _ in range(n):
+        breaker.record_failure(latency)
+
+
+def test_错误率超阈值后熔断(breaker):
+    for _ in range(ph.BREAKER_MIN_REQUESTS - 1):
+        breaker.record_failure(1.0)
+    assert breaker.state == ph.CLOSED  # 样本不足不判
+    breaker.record_failure(1.0)
+    assert breaker.state == ph.OPEN
+    assert breaker.allow_request() is False
+
+
+def test_低错误率不熔断(breaker):
+    for i in range(20):
+        (breaker.record_failure if i % 4 == 0 else breaker.record_success)(1.0)
+    assert breaker.state == ph.CLOSED
+
+
+def test_慢调用p95超阈值也熔断(breaker):
+    for _ in range(ph.BREAKER_MIN_REQUESTS):
+        breaker.record_success(ph.BREAKER_SLOW_P95_SECONDS + 10)
+    assert breaker.state == ph.OPEN
+    assert "p95" in breaker.last_trip_reason
+
+
+def test_窗口外的旧失败不计入(breaker, clock):
+    _fail_n(breaker, ph.BREAKER_MIN_REQUESTS - 1)
+    clock.t += ph.BREAKER_WINDOW_SECONDS + 1
+    breaker.record_failure(1.0)
+    assert breaker.state == ph.CLOSED
+
+
+def test_冷却后半开只放行一个探测_成功则闭合(breaker, clock):
+    _fail_n(breaker, ph.BREAKER_MIN_REQUESTS)
+    clock.t += ph.BREAKER_OPEN_SECONDS
+    assert breaker.allow_request() is True
+    assert breaker.acquire() is True
+    assert breaker.state == ph.HALF_OPEN
+    assert breaker.allow_request() is False   # 探测在飞，其余请求继续跳过
+    assert breaker.acquire() is False
+    breaker.record_success(1.0)
+    assert breaker.state == ph.CLOSED
+    assert breaker.acquire() is True
+
+
+def test_探测失败重新熔断且冷却翻倍(breaker, clock):
+    _fail_n(breaker, ph.BREAKER_MIN_REQUESTS)
+    clock.t += ph.BREAKER_OPEN_SECONDS
+    assert breaker.acquire() is True
+    breaker.record_failure(1.0)
+    assert breaker.state == ph.OPEN
+    clock.t += ph.BREAKER_OPEN_SECONDS
+    assert breaker.allow_request() is False    # 冷却期已翻倍
+    clock.t += ph.BREAKER_OPEN_SECONDS
+    assert breaker.allow_request() is True
+
+
+def test_探测被取消时归还名额(breaker, clock):
+    _fail_n(breaker, ph.BREAKER_MIN_REQUESTS)
+    clock.t += ph.BREAKER_OPEN_SECONDS
+    assert breaker.acquire() is True
+    breaker.release()
+    assert breaker.acquire() is True
+
+
+# ---------------------------------------------------------------- 集成
+@pytest.fixture
+def reset_status():
+    snap = dict(af.API_FALLBACK_STATUS)
+    for k in ("openai_quota_exceeded", "ai_builder_quota_exceeded", "deepgram_quota_exceeded"):
+        af.API_FALLBACK_STATUS[k] = False
+    yield
+    af.API_FALLBACK_STATUS.clear()
+    af.API_FALLBACK_STATUS.update(snap)
+
+
+async def test_连续503后跳过OpenAI_状态可见(monkeypatch, reset_status):
+    calls = []
+
+    async def openai_503(*a, **k):
+        calls.append("openai")
+        raise Exception("OpenAI API 错误 [503]: upstream unavailable")
+
+    async def ai_ok(*a, **k):
+        return "AIB_OK", {}
+
+    monkeypatch.setattr(af, "_transcribe_openai", openai_503)
+    monkeypatch.setattr(af, "_transcribe_ai_builder", ai_ok)
+    monkeypatch.setitem(retry_policy.PROVIDER_MAX_RETRIES, "openai", 0)   # 只数熔断前的请求次数
+
+    for _ in range(ph.BREAKER_MIN_REQUESTS):
+        await af.transcribe_with_fallback(b"x", "f.wav")
+    assert len(calls) == ph.BREAKER_MIN_REQUESTS
+
+    text, api_used, _ = await af.transcribe_with_fallback(b"x", "f.wav")
+    assert api_used == "ai_builder"
+    assert len(calls) == ph.BREAKER_MIN_REQUESTS  # 熔断期间不再白等 OpenAI
+    assert af.should_retry_api("openai") is False
+    status = af.get_api_status()
+    assert status["openai"]["available"] is False
+    assert status["openai"]["circuit"]["state"] == ph.OPEN
+    assert status["openai"]["quota_exceeded"] is False  # 熔断 ≠ 配额耗尽
+
+
+async def test_音频问题不计入错误率(monkeypatch, reset_status):
+    async def empty(*a, **k):
+        raise Exception("OpenAI API 返回空文本")
+
+    async def ai_ok(*a, **k):
+        return "AIB_OK", {}
+
+    monkeypatch.setattr(af, "_transcribe_openai", empty)
+    monkeypatch.setattr(af, "_transcribe_ai_builder", ai_ok)
+    for _ in range(ph.BREAKER_MIN_REQUESTS * 2):
+        await af.transcribe_with_fallback(b"x", "f.wav")
+    assert ph.get_breaker("openai").state == ph.CLOSED
+
+
+async def test_Google也有健康跟踪(monkeypatch, reset_status):
+    async def down(*a, **k):
+        raise Exception("Google API 错误 [500]: internal")
+
+    for name in ("_transcribe_openai", "_transcribe_ai_builder", "_transcribe_google"):
+        monkeypatch.setattr(af, name, down)
+    for _ in range(ph.BREAKER_MIN_REQUESTS):
+        with pytest.raises(Exception):
+            await af.transcribe_with_fallback(b"x", "f.wav")
+    assert af.get_api_status()["google"]["circuit"]["state"] == ph.OPEN
+    with pytest.raises(Exception) as ei:
+        await af.transcribe_with_fallback(b"x", "f.wav")
+    assert "熔断中" in str(ei.value)
+
+
+def test_状态码与健康失败分类():
+    assert af.extract_status_code("OpenAI API 错误 [503]: x") == 503
+    assert af.is_provider_health_failure("OpenAI API 错误 [502]: bad gateway") is True
+    assert af.is_provider_health_failure("ReadTimeout (https://api.openai.com): timeout") is True
+    assert af.is_provider_health_failure("OpenAI API 错误 [400]: invalid file") is False
+    assert af.is_provider_health_failure("所有段落均为非语音/幻觉内容") is False
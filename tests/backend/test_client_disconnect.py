@@ -0,0 +1,139 @@
+"""
+🎯 客户端断线即取消（后端 pytest）— v141
+
+覆盖：
+  · 断线后在途 provider 调用被取消，整条 fallback 链不再往下走；响应 499
+  · 宽限期内结果已经到了 → 照常写缓存，之后同一段音频直接命中
+  · 断线后在途调用失败 → 后面的付费 provider 不再调用（记为 aborted），省下的费用计入统计
+  · 还有别的请求（重传 / 相同音频）在等同一次转录 → 不取消，继续给它结果
+  · 统计：get_api_status()["cancellations"]
+
+做法：monkeypatch 掉 _transcribe_*；请求对象用假的，is_disconnected 由用例控制；轮询与宽限调到几十毫秒。
+"""
+import asyncio
+import io
+
+import pytest
+from starlette.datastructures import UploadFile
+
+import api_fallback as af
+import deadlines
+import server2
+import transcription_cache as tc
+from transcription_cache import SingleFlight, TranscriptionCache
+
+AUDIO = b"\x1aE\xdf\xa3" + b"\x05" * 64
+
+
+@pytest.fixture(autouse=True)
+def endpoint(monkeypatch):
+    snap = dict(af.API_FALLBACK_STATUS)
+    for k in ("openai_quota_exceeded", "ai_builder_quota_exceeded", "deepgram_quota_exceeded"):
+        af.API_FALLBACK_STATUS[k] = False
+    monkeypatch.setattr(server2, "TRANSCRIPTION_CACHE", TranscriptionCache(disk_dir=None))
+    monkeypatch.setattr(server2, "IN_FLIGHT", SingleFlight())
+    monkeypatch.setattr(tc, "CACHE_ENABLED", True)
+    monkeypatch.setattr(server2, "DISCONNECT_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(server2, "DISCONNECT_GRACE_SECONDS", 0.05)
+    deadlines.reset_cancellation_stats()
+    yield
+    deadlines.reset_cancellation_stats()
+    af.API_FALLBACK_STATUS.clear()
+    af.API_FALLBACK_STATUS.update(snap)
+
+
+def _mock(name, events, delay=0.0, fail=None):
+    async def f(*a, **k):
+        events.append(("start", name))
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            events.append(("cancelled", name))
+            raise
+        if fail:
+            raise Exception(fail)
+        events.append(("done", name))
+        return f"{name.upper()}_TEXT", {"mock": name}
+    return f
+
+
+def _patch(monkeypatch, openai, ai, google):
+    monkeypatch.setattr(af, "_transcribe_openai", openai)
+    monkeypatch.setattr(af, "_transcribe_ai_builder", ai)
+    monkeypatch.setattr(af, "_transcribe_google", google)
+
+
+class _FakeRequest:
+    headers = {}
+    client = type("C", (), {"host": "1.1.1.1"})()
+
+    def __init__(self, disconnect_after=None):
+        self.disconnect_after = disconnect_after
+        self._loop_started = None
+
+    async def is_disconnected(self):
+        if self.disconnect_after is None:
+            return False
+        loop = asyncio.get_running_loop()
+        if self._loop_started is None:
+            self._loop_started = loop.time()
+        return loop.time() - self._loop_started >= self.disconnect_after
+
+
+async def _post(request, audio=AUDIO):
+    upload = UploadFile(file=io.BytesIO(audio), filename="a.webm")
+    return await server2.transcribe_segment(
+        audio_file=upload, duration=30, needs_segmentation=None, language=None,
+        audio_source="microphone", preferred_api=None,
+        idempotency_key=None, request_timeout=None, request=request,
+    )
+
+
+async def test_断线后取消在途调用_不再往下走(monkeypatch):
+    ev = []
+    _patch(monkeypatch, _mock("openai", ev, delay=5), _mock("ai", ev), _mock("google", ev))
+    response = await _post(_FakeRequest(disconnect_after=0.02))
+    assert response.status_code == 499
+    await asyncio.sleep(0.15)           # 宽限期过后取消
+    assert ev == [("start", "openai"), ("cancelled", "openai")]
+    stats = af.get_api_status()["cancellations"]
+    assert stats["disconnects"] == 1 and stats["orphaned"] == 1 and stats["cancelled_calls"] == 1
+    assert stats["spend_avoided_usd"] == pytest.approx(0.006 * 0.5)
+    assert server2.IN_FLIGHT.stats()["cancelled"] == 1
+
+
+async def test_宽限期内结果到达照常写缓存(monkeypatch):
+    monkeypatch.setattr(server2, "DISCONNECT_GRACE_SECONDS", 1.0)
+    ev = []
+    _patch(monkeypatch, _mock("openai", ev, delay=0.1), _mock("ai", ev), _mock("google", ev))
+    response = await _post(_FakeRequest(disconnect_after=0.02))
+    assert response.status_code == 499
+    await asyncio.sleep(0.2)
+    assert ("done", "openai") in ev
+    assert deadlines.CANCELLATION_STATS["completed_after_disconnect"] == 1
+    again = await _post(_FakeRequest())
+    assert again["metadata"]["cache"] == "hit" and again["text"] == "OPENAI_TEXT"
+    assert ev.count(("start", "openai")) == 1
+
+
+async def test_断线后在途调用失败_后面的provider不再调用(monkeypatch):
+    monkeypatch.setattr(server2, "DISCONNECT_GRACE_SECONDS", 1.0)
+    ev = []
+    _patch(monkeypatch, _mock("openai", ev, delay=0.1, fail="500 Internal Server Error"),
+           _mock("ai", ev), _mock("google", ev))
+    await _post(_FakeRequest(disconnect_after=0.02))
+    await asyncio.sleep(0.2)
+    assert [e for e in ev if e[0] == "start"] == [("start", "openai")]
+    stats = deadlines.cancellation_stats()
+    assert stats["skipped_calls"] == 2
+    assert stats["spend_avoided_usd"] == pytest.approx(0.016 * 0.5)    # AI Builder 免费，Google 半分钟
+
+
+async def test_还有请求在等时不取消(monkeypatch):
+    ev = []
+    _patch(monkeypatch, _mock("openai", ev, delay=0.2), _mock("ai", ev), _mock("google", ev))
+    gone, stays = await asyncio.gather(_post(_FakeRequest(disconnect_after=0.02)), _post(_FakeRequest()))
+    assert gone.status_code == 499
+    assert stays["success"] and stays["text"] == "OPENAI_TEXT"
+    assert ("cancelled", "openai") not in ev
+    assert deadlines.CANCELLATION_STATS["orphaned"] == 0
@@ -0,0 +1,193 @@
+"""
+🎯 按音频时长 / 字节数加权的令牌桶（后端 pytest）— v148 rate_limiter.CostLimiter
+
+覆盖：
+  · 花费 = max(时长, 字节数折算)：声明再短，大文件也按字节算
+  · WAV 只按实测时长算：前端的 16 kHz / 16-bit 单声道 WAV 60 秒就扣 60，不按字节算成两倍（v155）
+  · 没转录就被拒的不留花费：Content-Length 超上传上限的不预扣；读到一半超限 413、
+    同时在转的太多 429、任务队列满 503 都把已扣的退回（v158）
+  · Retry-After 准确：按最慢回补的桶反解，到点恰好够扣（早一点仍不够）
+  · 突发桶管一次性打进来多少，持续桶管长期速率；超过桶容量的单个请求桶满时放行、扣成欠账
+  · 桶回满的客户端到点被摘掉
+  · 中间件：按 Content-Length 预扣，大上传被拒而小片段照常；端点补扣实测（WAV）/ 声明时长的差额
+
+做法：CostLimiter 直接传 now；限流判定（_rate_limit_response）用轻量假 request。
+"""
+import io
+import wave
+
+import httpx
+import pytest
+
+import provider_concurrency
+import server2
+import upload_intake
+from rate_limiter import (COST_BYTES_PER_AUDIO_SECOND, COST_WAV_BYTES_PER_AUDIO_SECOND, CostLimiter, CostLimits,
+                          audio_cost, prepaid_audio_cost)
+
+LIMITS = CostLimits("audio", [(1800, 6.0), (10800, 1.0)])
+
+
+class _URL:
+    def __init__(self, path):
+        self.path = path
+
+
+class _Req:
+    def __init__(self, path, content_length=0, host="7.7.7.7"):
+        self.url = _URL(path)
+        self.headers = {"content-length": str(content_length)}
+        self.client = type("C", (), {"host": host})()
+
+
+@pytest.fixture(autouse=True)
+def reset_limiters():
+    server2.RATE_LIMITER.reset()
+    server2.COST_LIMITER.reset()
+    yield
+    server2.RATE_LIMITER.reset()
+    server2.COST_LIMITER.reset()
+
+
+def _wav(seconds, rate=8000):
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\0\0" * int(seconds * rate))
+    return buf.getvalue()
+
+
+def test_花费按时长与字节数取大():
+    assert audio_cost(1000, 90) == 90
+    assert audio_cost(25 * 1024 * 1024, 1) == pytest.approx(25 * 1024 * 1024 / COST_BYTES_PER_AUDIO_SECOND)
+    assert audio_cost(32000) == 2.0
+    assert audio_cost(32000 * 60, 60, measured=True) == 60            # 实测的 WAV 时长不再和字节数比
+    assert prepaid_audio_cost(32000 * 60) == 60
+
+
+def test_Retry_After按最慢的桶反解_到点恰好够扣():
+    limiter = CostLimiter()
+    limiter.charge("a", LIMITS, 1700, now=0.0)          # 突发桶剩 100，持续桶剩 9100
+    wait = limiter.check("a", LIMITS, 400, now=0.0)
+    assert wait == pytest.approx(300 / 6.0)              # 突发桶每秒回 6，差 300
+    assert limiter.check("a", LIMITS, 400, now=wait - 0.5) > 0
+    assert limiter.check("a", LIMITS, 400, now=wait) == 0
+    assert limiter.stats()["blocked"] == 2
+
+
+def test_持续桶管长期速率():
+    limiter = CostLimiter()
+    now, spent = 0.0, 0.0
+    # 每 10 秒来 60 秒音频（6 倍实时）：突发桶刚好跟得上，持续桶每 10 秒只回 10、净少 50
+    while limiter.check("a", LIMITS, 60, now=now) == 0:
+        limiter.charge("a", LIMITS, 60, now=now)
+        spent += 60
+        now += 10
+    assert spent == pytest.approx(10800 * 6 / 5, abs=60)          # 持续桶 10800 ÷ 每秒净少 5 ≈ 36 分钟
+    # 此时卡在持续桶：每秒回 1，差多少等多少
+    burst, sustained = limiter.levels("a", LIMITS, now=now)
+    assert burst == 1800 and limiter.check("a", LIMITS, 60, now=now) == pytest.approx(60 - sustained)
+
+
+def test_超过桶容量的请求桶满时放行_扣成欠账():
+    limiter = CostLimiter()
+    assert limiter.check("a", LIMITS, 2500, now=0.0) == 0     # 按容量 1800 算，满桶够扣
+    burst, _ = limiter.charge("a", LIMITS, 2500, now=0.0)
+    assert burst == -700
+    # 欠账要先还清：再来 60 秒需要 (700 + 60) / 6
+    assert limiter.check("a", LIMITS, 60, now=0.0) == pytest.approx(760 / 6.0)
+
+
+def test_桶回满的客户端到点被摘掉():
+    limiter = CostLimiter(tick=1.0)
+    for i in range(100):
+        limiter.charge(f"10.0.0.{i}", LIMITS, 60, now=0.0)    # 持续桶 60 秒回满
+    limiter.check("x", LIMITS, 1, now=30.0)
+    assert limiter.stats()["clients"] == 100
+    limiter.check("x", LIMITS, 1, now=62.0)
+    assert limiter.stats()["clients"] == 0 and limiter.stats()["expired"] == 100
+
+
+async def test_中间件_大上传被拒_小片段照常():
+    path = "/transcribe-segment"
+    big = 25 * 1024 * 1024                                      # 按 WAV 码率预估 ≈819 秒
+    for _ in range(2):
+        assert await server2._rate_limit_response(_Req(path, big)) is None
+    r = await server2._rate_limit_response(_Req(path, big))
+    assert r.status_code == 429
+    expected = (prepaid_audio_cost(big) - (1800 - 2 * prepaid_audio_cost(big))) / 6.0
+    assert int(r.headers["Retry-After"]) == pytest.approx(expected, abs=1.01)
+    # 被令牌桶拒的不计次数；同一客户端的小片段照常放行
+    assert server2.RATE_LIMITER.stats()["allowed"] == 2
+    assert await server2._rate_limit_response(_Req(path, 20_000)) is None
+    # 非付费路径中间件根本不看
+    assert server2._is_rate_limited({"path": "/"}) is False
+
+
+def test_端点补扣实测或声明时长的差额():
+    path = "/transcribe-segment"
+    wav = _wav(120, rate=4000)                                  # 实测 120 秒，字节数只折合 60 秒
+    req = _Req(path, content_length=len(wav) + 300)
+    server2.COST_LIMITER.charge("7.7.7.7", server2.AUDIO_COST_LIMITS, prepaid_audio_cost(len(wav) + 300))
+    server2._charge_audio_cost(req, path, wav, declared_seconds=5)      # 声明 5 秒不算，按实测
+    assert server2.COST_LIMITER.stats()["charged_audio_seconds"] == pytest.approx(120, abs=0.1)
+
+    server2.COST_LIMITER.reset()
+    webm = b"\x1aE\xdf\xa3" + b"\0" * 1000                     # 非 WAV：按声明的时长
+    server2._charge_audio_cost(_Req(path, len(webm)), path, webm, declared_seconds=45)
+    assert server2.COST_LIMITER.stats()["charged_audio_seconds"] == pytest.approx(45 - 1004 / 32000, abs=0.1)
+
+    server2.COST_LIMITER.reset()
+    mp3 = b"ID3" + b"\0" * (COST_BYTES_PER_AUDIO_SECOND * 100)   # 非 WAV、声明很短：按压缩码率兜底 ≈100 秒
+    server2._charge_audio_cost(_Req(path, len(mp3)), path, mp3, declared_seconds=2)
+    assert server2.COST_LIMITER.stats()["charged_audio_seconds"] == pytest.approx(100 - len(mp3) / 32000, abs=0.1)
+
+
+async def test_前端16kHz的WAV60秒扣60():
+    path = "/transcribe-segment"
+    wav = _wav(60, rate=16000)
+    assert len(wav) == pytest.approx(60 * COST_WAV_BYTES_PER_AUDIO_SECOND, abs=100)
+    req = _Req(path, content_length=len(wav) + 300)                  # multipart 的边界 / 表单字段
+    assert await server2._rate_limit_response(req) is None          # 预扣 ≈60.0
+    server2._charge_audio_cost(req, path, wav, declared_seconds=60)
+    assert server2.COST_LIMITER.stats()["charged_audio_seconds"] == pytest.approx(60, abs=0.05)
+
+
+async def test_超上传上限的ContentLength不预扣():
+    path = "/transcribe-segment"
+    too_big = upload_intake.UPLOAD_MAX_BYTES + upload_intake.MULTIPART_OVERHEAD_BYTES + 1
+    assert await server2._rate_limit_response(_Req(path, 100 * 1024 * 1024)) is None     # 内侧直接 413
+    assert await server2._rate_limit_response(_Req(path, too_big)) is None
+    assert server2.COST_LIMITER.stats()["charged_audio_seconds"] == 0
+    assert server2.COST_LIMITER.levels("7.7.7.7", server2.AUDIO_COST_LIMITS)[0] == 1800
+
+
+async def _post(path, wav, client="9.9.9.9"):
+    transport = httpx.ASGITransport(app=server2.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as c:
+        return await c.post(path, files={"audio_file": ("a.wav", wav, "audio/wav")},
+                            data={"duration": "30"}, headers={"x-forwarded-for": client})
+
+
+@pytest.mark.parametrize("path", ["/transcribe-segment", "/transcribe-jobs", "/speech-to-text-aibuilder"])
+async def test_上传超限退回预扣(path, monkeypatch):
+    async def too_large(upload, *a, **k):
+        raise upload_intake.UploadTooLarge(upload_intake.UPLOAD_MAX_BYTES + 1)
+
+    monkeypatch.setattr(server2, "AI_BUILDER_TOKEN", "token")
+    monkeypatch.setattr(server2.AudioSource, "from_upload", too_large)
+    r = await _post(path, _wav(60, rate=16000))
+    assert r.json()["success"] is False and "超过限制" in r.json()["message"]     # segment 沿用 200 + success=False
+    assert server2.COST_LIMITER.stats()["charged_audio_seconds"] == pytest.approx(0, abs=0.05)
+
+
+@pytest.mark.parametrize("path", ["/transcribe-segment", "/transcribe-jobs"])
+async def test_同时在转太多429退回花费(path, monkeypatch):
+    monkeypatch.setattr(provider_concurrency, "CLIENT_IN_FLIGHT", provider_concurrency.ClientInFlight(limit=1))
+    provider_concurrency.CLIENT_IN_FLIGHT.enter("9.9.9.9")
+    r = await _post(path, _wav(60, rate=16000))
+    assert r.status_code == 429
+    assert server2.COST_LIMITER.stats()["charged_audio_seconds"] == pytest.approx(0, abs=0.05)
+    assert server2.COST_LIMITER.levels("9.9.9.9", server2.AUDIO_COST_LIMITS)[0] == pytest.approx(1800, abs=0.05)
@@ -0,0 +1,185 @@
+"""
+🎯 请求截止时间（后端 pytest）— v140 deadlines
+
+覆盖：
+  · 每次 provider 调用只拿剩余预算：慢 provider 到点被掐断，后面的 provider 不再调用，整条链按预算结束
+  · 被截止时间掐断不算 provider 的错：不计入熔断、不计入耗时统计
+  · 按该时长档位的历史耗时估计来不及的 provider 直接跳过，轮到来得及的
+  · http_client 出站请求的超时压到剩余预算以内；预算耗尽后不再发出请求
+  · 客户端 X-Request-Timeout 解析与夹取
+  · /transcribe-segment：成功与失败响应都带上预算花费明细
+
+做法：与 test_fallback_engine 相同，monkeypatch 掉 _transcribe_*；预算调到零点几秒。
+"""
+import asyncio
+import io
+import time
+
+import httpx
+import pytest
+from starlette.datastructures import UploadFile
+
+import api_fallback as af
+import deadlines
+import http_client
+import server2
+import transcription_cache as tc
+from deadlines import Deadline
+from provider_health import PROVIDER_STATS, get_breaker
+from transcription_cache import SingleFlight, TranscriptionCache
+
+
+@pytest.fixture(autouse=True)
+def reset_state():
+    snap = dict(af.API_FALLBACK_STATUS)
+    for k in ("openai_quota_exceeded", "ai_builder_quota_exceeded", "deepgram_quota_exceeded"):
+        af.API_FALLBACK_STATUS[k] = False
+    yield
+    af.API_FALLBACK_STATUS.clear()
+    af.API_FALLBACK_STATUS.update(snap)
+
+
+def _mock(name, calls, delay=0.0, fail=None):
+    async def f(*a, **k):
+        calls.append(name)
+        await asyncio.sleep(delay)
+        if fail:
+            raise Exception(fail)
+        return f"{name.upper()}_TEXT", {"mock": name}
+    return f
+
+
+def _patch(monkeypatch, openai, ai, google):
+    monkeypatch.setattr(af, "_transcribe_openai", openai)
+    monkeypatch.setattr(af, "_transcribe_ai_builder", ai)
+    monkeypatch.setattr(af, "_transcribe_google", google)
+
+
+async def test_慢provider到点被掐断_后面的不再调用(monkeypatch):
+    calls = []
+    _patch(monkeypatch, _mock("openai", calls, delay=5), _mock("ai", calls), _mock("google", calls))
+    deadline = Deadline(0.2)
+    started = time.monotonic()
+    with deadlines.scope(deadline), pytest.raises(Exception, match="截止时间已到"):
+        await af.transcribe_with_fallback(b"x", "f.wav", duration=30)
+    assert time.monotonic() - started < 1.0
+    assert calls == ["openai"]
+    assert [a["outcome"] for a in deadline.attempts] == ["timeout", "skipped", "skipped"]
+    # 不是 provider 的错：熔断器不记失败，统计里也没有这次
+    assert get_breaker("openai").error_rate() is None
+    assert PROVIDER_STATS.ewma("openai", 30) is None
+
+
+async def test_每次尝试只拿剩余预算(monkeypatch):
+    calls = []
+    _patch(monkeypatch, _mock("openai", calls, delay=0.1, fail="500 Internal Server Error"),
+           _mock("ai", calls), _mock("google", calls))
+    deadline = Deadline(1.0)
+    with deadlines.scope(deadline):
+        text, api_used, _ = await af.transcribe_with_fallback(b"x", "f.wav", duration=30)
+    assert api_used == "ai_builder"
+    first, second = deadline.attempts
+    assert (first["provider"], first["outcome"], first["allotted"]) == ("openai", "failed", 1.0)
+    assert second["provider"] == "ai_builder" and second["outcome"] == "ok"
+    assert 0.8 <= second["allotted"] <= 0.9
+
+
+async def test_历史耗时来不及的provider直接跳过(monkeypatch):
+    calls = []
+    _patch(monkeypatch, _mock("openai", calls), _mock("ai", calls), _mock("google", calls))
+    for _ in range(deadlines.DEADLINE_SKIP_MIN_SAMPLES):
+        PROVIDER_STATS.record_success("openai", 30, 50.0)      # 这个档位 OpenAI 一般要 50s
+    deadline = Deadline(10)
+    with deadlines.scope(deadline):
+        _, api_used, _ = await af.transcribe_with_fallback(b"x", "f.wav", duration=30)
+    assert api_used == "ai_builder" and calls == ["ai"]
+    skipped = deadline.attempts[0]
+    assert skipped == {"provider": "openai", "outcome": "skipped", "at": skipped["at"], "estimate": 50.0}
+    # 样本不足或别的档位：照常尝试
+    calls.clear()
+    with deadlines.scope(Deadline(10)):
+        _, api_used, _ = await af.transcribe_with_fallback(b"x", "f.wav", duration=600)
+    assert api_used == "openai_whisper"
+
+
+async def test_http_client超时不超过剩余预算(monkeypatch):
+    seen = []
+
+    def handler(request):
+        seen.append(request.extensions["timeout"])
+        return httpx.Response(200)
+
+    monkeypatch.setattr(http_client, "_TRANSPORT", httpx.MockTransport(handler))
+    await http_client.aclose_all()
+    try:
+        await http_client.post("https://api.example.com/x")
+        with deadlines.scope(Deadline(2.0)):
+            await http_client.post("https://api.example.com/x", timeout=http_client.make_timeout(connect=1.0))
+        assert seen[0]["read"] == http_client.HTTP_READ_TIMEOUT
+        assert seen[1]["connect"] == 1.0 and 1.9 < seen[1]["read"] <= 2.0 and seen[1]["write"] <= 2.0
+
+        expired = Deadline(0.0)
+        with deadlines.scope(expired), pytest.raises(deadlines.DeadlineExceeded):
+            await http_client.get("https://api.example.com/x")
+        assert len(seen) == 2
+    finally:
+        await http_client.aclose_all()
+
+
+def test_客户端超时解析与夹取():
+    assert deadlines.parse_timeout(None) is None
+    assert deadlines.parse_timeout("abc") is None
+    assert deadlines.parse_timeout("-1") is None
+    assert deadlines.parse_timeout("nan") is None
+    assert deadlines.parse_timeout("30") == 30.0
+    assert deadlines.parse_timeout("0.1") == deadlines.DEADLINE_MIN_SECONDS
+    assert deadlines.parse_timeout("99999") == deadlines.DEADLINE_MAX_SECONDS
+    assert deadlines.for_request("30").source == "client"
+    server_side = deadlines.for_request(None)
+    assert server_side.source == "server" and server_side.budget == deadlines.REQUEST_DEADLINE_SECONDS
+
+
+# ---------- 端点 ----------
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    monkeypatch.setattr(server2, "TRANSCRIPTION_CACHE", TranscriptionCache(disk_dir=None))
+    monkeypatch.setattr(server2, "IN_FLIGHT", SingleFlight())
+    monkeypatch.setattr(tc, "CACHE_ENABLED", True)
+
+
+class _FakeRequest:
+    headers = {}
+    client = type("C", (), {"host": "1.1.1.1"})()
+
+
+async def _post(audio, timeout):
+    upload = UploadFile(file=io.BytesIO(audio), filename="a.webm")
+    return await server2.transcribe_segment(
+        audio_file=upload, duration=30, needs_segmentation=None, language=None,
+        audio_source="microphone", preferred_api=None,
+        idempotency_key=None, request_timeout=timeout, request=_FakeRequest(),
+    )
+
+
+async def test_端点响应带上预算花费(monkeypatch, endpoint):
+    calls = []
+    _patch(monkeypatch, _mock("openai", calls), _mock("ai", calls), _mock("google", calls))
+    result = await _post(b"\x1aE\xdf\xa3" + b"\x03" * 64, timeout="7")
+    assert result["success"]
+    report = result["metadata"]["deadline"]
+    assert report["budget"] == 7.0 and report["source"] == "client"
+    assert [a["provider"] for a in report["attempts"]] == ["openai"]
+    # 预算明细不进缓存：同一段音频再来一次是缓存命中，不带上一次的账
+    again = await _post(b"\x1aE\xdf\xa3" + b"\x03" * 64, timeout="7")
+    assert again["metadata"]["cache"] == "hit" and "deadline" not in again["metadata"]
+
+
+async def test_端点失败时也报告预算花费(monkeypatch, endpoint):
+    calls = []
+    monkeypatch.setattr(deadlines, "DEADLINE_MIN_SECONDS", 0.1)
+    _patch(monkeypatch, _mock("openai", calls, delay=5), _mock("ai", calls), _mock("google", calls))
+    result = await _post(b"\x1aE\xdf\xa3" + b"\x04" * 64, timeout="0.2")
+    assert not result["success"]
+    assert [a["outcome"] for a in result["deadline"]["attempts"]] == ["timeout", "skipped", "skipped"]
+    assert result["duration_seconds"] < 1.0
@@ -0,0 +1,171 @@
+"""
+🎯 每客户端在途上限 + provider 名额公平轮转（后端 pytest）— v149 provider_concurrency
+
+覆盖：
+  · DRR：名额空出来轮流交给各客户端的队首——重度用户排了 5 个，轻度用户的第 1 个只等一轮
+  · 同一客户端内部仍是先来后到；客户端身份走 client_scope（contextvar），不用改调用签名
+  · 预计排队按公平轮转估算：别人排得再深，新客户端也不会被"预计排队太久"误溢出
+  · 每客户端同时在转录的请求数上限：/transcribe-segment 第 5 个同时在转的 429，别的客户端不受影响
+  · 排队耗时随 metadata["queue_wait"] 返回
+
+做法：ProviderSlots 直接用；端点部分 monkeypatch 掉 transcribe_with_fallback / _transcribe_*。
+"""
+import asyncio
+import io
+
+import pytest
+from starlette.datastructures import UploadFile
+
+import api_fallback as af
+import provider_concurrency
+import server2
+import transcription_cache as tc
+from deadlines import Deadline
+from provider_concurrency import ClientBusy, ClientInFlight, ProviderBusy, ProviderSlots, client_scope
+from transcription_cache import SingleFlight, TranscriptionCache
+
+
+async def _queue(slots, order, name, client):
+    await slots.acquire(client=client)
+    order.append(name)
+
+
+async def _drain(slots, tasks):
+    for _ in tasks:
+        slots.release()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+
+async def test_DRR_轻度用户的第一个不排在重度用户后面():
+    slots = ProviderSlots("openai", limit=1, queue_size=20, max_wait=10)
+    await slots.acquire()
+    order = []
+    tasks = [asyncio.ensure_future(_queue(slots, order, f"heavy{i}", "heavy")) for i in range(5)]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.ensure_future(_queue(slots, order, "light0", "light")))
+    await asyncio.sleep(0)
+    assert slots.depth() == 6 and slots.snapshot()["clients_waiting"] == 2
+    await _drain(slots, tasks)
+    await asyncio.gather(*tasks)
+    assert order == ["heavy0", "light0", "heavy1", "heavy2", "heavy3", "heavy4"]
+
+
+async def test_client_scope决定进哪个队列_同一客户端内先来后到():
+    slots = ProviderSlots("openai", limit=1, queue_size=20, max_wait=10)
+    await slots.acquire()
+    order = []
+
+    async def wait(name, client):
+        with client_scope(client):
+            await slots.acquire()
+        order.append(name)
+
+    tasks = [asyncio.ensure_future(wait(n, c)) for n, c in
+             [("a1", "a"), ("a2", "a"), ("a3", "a"), ("b1", "b"), ("b2", "b")]]
+    await asyncio.sleep(0)
+    await _drain(slots, tasks)
+    await asyncio.gather(*tasks)
+    assert order == ["a1", "b1", "a2", "b2", "a3"]
+
+
+async def test_预计排队按公平轮转估算_新客户端不被误溢出():
+    slots = ProviderSlots("openai", limit=1, queue_size=20, max_wait=60)
+    await slots.acquire()
+    slots.release(held=5.0)                     # 平均占用 5s
+    await slots.acquire()
+    tasks = [asyncio.ensure_future(slots.acquire(client="heavy")) for _ in range(4)]
+    await asyncio.sleep(0)
+    # 重度用户再排一个要等 5 轮（25s）；轻度用户只排在重度用户的队首之后（2 轮，10s）
+    assert slots.predicted_wait("heavy") == 25.0 and slots.predicted_wait("light") == 10.0
+    with pytest.raises(ProviderBusy, match="预计排队"):
+        await slots.acquire(budget=12, client="heavy")
+    light = asyncio.ensure_future(slots.acquire(budget=12, client="light"))
+    await asyncio.sleep(0)
+    assert slots.depth() == 5
+    for t in tasks + [light]:
+        t.cancel()
+    await asyncio.gather(*tasks, light, return_exceptions=True)
+
+
+def test_每客户端在途上限():
+    gate = ClientInFlight(limit=2)
+    gate.enter("a")
+    gate.enter("a")
+    with pytest.raises(ClientBusy):
+        gate.enter("a")
+    gate.enter("b")
+    gate.leave("a")
+    gate.enter("a")
+    assert gate.snapshot() == {"limit": 2, "clients": 2, "in_flight": 3, "rejected": 1}
+
+
+# ---------- 端点 ----------
+
+class _FakeRequest:
+    def __init__(self, host):
+        self.headers = {}
+        self.client = type("C", (), {"host": host})()
+
+
+async def _post(audio, host):
+    upload = UploadFile(file=io.BytesIO(audio), filename="a.webm")
+    return await server2.transcribe_segment(
+        audio_file=upload, duration=30, needs_segmentation=None, language=None,
+        audio_source="microphone", preferred_api=None,
+        idempotency_key=None, request=_FakeRequest(host),
+    )
+
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(server2, "TRANSCRIPTION_CACHE", TranscriptionCache(disk_dir=None))
+    monkeypatch.setattr(server2, "IN_FLIGHT", SingleFlight())
+    monkeypatch.setattr(tc, "CACHE_ENABLED", False)
+
+
+async def test_端点_同一客户端同时在转的超过上限即429(monkeypatch, fresh_cache):
+    monkeypatch.setattr(provider_concurrency, "CLIENT_MAX_IN_FLIGHT", 2)
+    provider_concurrency.reset()
+    gate = asyncio.Event()
+
+    async def blocked(**kw):
+        await gate.wait()
+        return "转录结果", "openai_whisper", {}
+
+    monkeypatch.setattr(af, "transcribe_with_fallback", blocked)
+    running = [asyncio.ensure_future(_post(b"\x1aE\xdf\xa3" + bytes([i]) * 64, "1.1.1.1")) for i in range(2)]
+    await asyncio.sleep(0.01)
+    busy = await _post(b"\x1aE\xdf\xa3" + b"\x09" * 64, "1.1.1.1")
+    assert busy.status_code == 429 and busy.headers["Retry-After"] == "5"
+    other = asyncio.ensure_future(_post(b"\x1aE\xdf\xa3" + b"\x0a" * 64, "2.2.2.2"))
+    await asyncio.sleep(0.01)
+    gate.set()
+    results = await asyncio.gather(*running, other)
+    assert all(r["success"] for r in results)
+    assert provider_concurrency.CLIENT_IN_FLIGHT.snapshot()["in_flight"] == 0
+    assert af.get_api_status()["client_in_flight"]["rejected"] == 1
+
+
+async def test_排队耗时写进metadata(monkeypatch, fresh_cache):
+    monkeypatch.setitem(provider_concurrency.PROVIDER_MAX_CONCURRENCY, "openai", 1)
+    snap = dict(af.API_FALLBACK_STATUS)
+    for k in ("openai_quota_exceeded", "ai_builder_quota_exceeded", "deepgram_quota_exceeded"):
+        af.API_FALLBACK_STATUS[k] = False
+
+    async def slow_openai(*a, **k):
+        await asyncio.sleep(0.05)
+        return "OPENAI_TEXT", {}
+
+    monkeypatch.setattr(af, "_transcribe_openai", slow_openai)
+    try:
+        results = await asyncio.gather(*[server2._transcribe_shared(
+            bytes([i]) * 64, "a.webm", language=None, duration=10, audio_source="microphone",
+            preferred_api=None, logger=server2.TranscriptionLogger("t"), content_key=f"k{i}", cache_key=None,
+            deadline=Deadline(30), client=f"c{i}") for i in range(2)])
+    finally:
+        af.API_FALLBACK_STATUS.clear()
+        af.API_FALLBACK_STATUS.update(snap)
+    waits = sorted(metadata["queue_wait"]["provider_seconds"] for _, _, metadata in results)
+    assert waits[0] == 0 and waits[1] >= 0.03
+    assert max(m["deadline"].get("queued", 0) for _, _, m in results) == waits[1]
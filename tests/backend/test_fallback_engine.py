@@ -155,11 +155,12 @@ def test_is_quota_exceeded_detection():
     # 关键词检测——实际 fallback 路径走的就是这条：is_quota_exceeded(None, error_msg)
     assert af.is_quota_exceeded(None, "insufficient_quota") is True
     assert af.is_quota_exceeded(None, "You exceeded your quota") is True
-    assert af.is_quota_exceeded(None, "rate_limit_exceeded") is True
-    # 状态码检测：仅当 error_message 非空时才会走到（402/429）
-    assert af.is_quota_exceeded(429, "too many requests") is True
+    # v143：限流不是配额耗尽（归 rate_limited，按 Retry-After 短暂冷却）
+    assert af.is_quota_exceeded(None, "rate_limit_exceeded") is False
+    assert af.is_quota_exceeded(429, "too many requests") is False
+    # 状态码检测：仅当 error_message 非空时才会走到（402）
     assert af.is_quota_exceeded(402, "payment declined") is True
-    # ⚠️ 已知短路：空 error_message 直接返回 False，即使状态码是 429（函数开头 `if not error_message`）。
+    # ⚠️ 已知短路：空 error_message 直接返回 False（函数开头 `if not error_message`）。
     #   实际路径 error_msg 总是非空异常字符串，故无影响；此处固化该契约避免误改。
     assert af.is_quota_exceeded(429, "") is False
     assert af.is_quota_exceeded(200, "ok") is False
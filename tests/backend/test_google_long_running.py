@@ -0,0 +1,147 @@
+"""
+🎯 Google long-running 识别（后端 pytest）— v137
+
+覆盖：
+  · 时长超过同步上限 → longrunningrecognize + 轮询 operations/{name} 到 done，结果照常解析（含说话人分离）
+  · 短音频仍走同步 recognize；没传时长时从 WAV 头估算
+  · 同步接口报 "Sync input too long" → 同一个请求体改交 longrunningrecognize
+  · operation 报错 / 轮询超时 → 抛异常（交给 fallback 链落到下一个 provider）
+  · 在任务里执行时，轮询进度写进任务的 progress
+
+做法：Google 端点用 httpx.MockTransport 模拟；轮询间隔调成 0。
+"""
+import asyncio
+import io
+import json
+import wave
+
+import httpx
+import pytest
+
+import api_fallback as af
+import http_client
+import server2
+from transcription_jobs import SUCCEEDED, JobManager
+
+AUDIO = b"\x1aE\xdf\xa3" + b"\x00" * 4096   # WebM 头：时长只能靠调用方传入
+
+RESULT = {"results": [{"alternatives": [{"transcript": "长音频", "words": [
+    {"word": "长音频", "speakerTag": 1}, {"word": "好的", "speakerTag": 2}]}], "languageCode": "zh-cn"}]}
+
+
+def _wav(seconds, rate=8000):
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\x00\x00" * int(seconds * rate))
+    return buf.getvalue()
+
+
+class _FakeGoogle:
+    """模拟 Google STT：同步接口、longrunningrecognize、operations 轮询。"""
+
+    def __init__(self, progress=(0, 40, 80), sync_status=200, op_error=None):
+        self.progress = list(progress)
+        self.sync_status = sync_status
+        self.op_error = op_error
+        self.calls = []
+        self.bodies = []
+        self.on_poll = None
+
+    async def __call__(self, request):
+        path = request.url.path
+        self.calls.append(path)
+        if request.method == "POST":
+            self.bodies.append(await request.aread())
+        if path.endswith("speech:recognize"):
+            if self.sync_status != 200:
+                return httpx.Response(self.sync_status, json={"error": {
+                    "code": 400, "message": "Sync input too long. For audio longer than 1 min use LongRunningRecognize with a 'uri' parameter."}})
+            return httpx.Response(200, json=RESULT)
+        if path.endswith("speech:longrunningrecognize"):
+            return httpx.Response(200, json={"name": "op-123"})
+        if path.endswith("/operations/op-123"):
+            if self.on_poll:
+                self.on_poll()
+            if self.progress:
+                return httpx.Response(200, json={"name": "op-123", "metadata": {"progressPercent": self.progress.pop(0)}})
+            if self.op_error:
+                return httpx.Response(200, json={"name": "op-123", "done": True, "error": self.op_error})
+            return httpx.Response(200, json={"name": "op-123", "done": True,
+                                             "metadata": {"progressPercent": 100}, "response": RESULT})
+        return httpx.Response(404)
+
+
+@pytest.fixture
+async def google(monkeypatch):
+    fake = _FakeGoogle()
+    monkeypatch.setattr(server2.GOOGLE_TOKENS, "current_token", lambda: "token")
+    monkeypatch.setattr(server2, "get_project_id", lambda: "proj")
+    monkeypatch.setattr(af, "GOOGLE_LRO_POLL_INITIAL", 0.0)
+    monkeypatch.setattr(http_client, "_TRANSPORT", httpx.MockTransport(lambda r: fake(r)))
+    await http_client.aclose_all()
+    yield fake
+    await http_client.aclose_all()
+
+
+async def test_长音频走longrunning并轮询到完成(google):
+    text, meta = await af._transcribe_google(AUDIO, "a.webm", duration=300,
+                                             enable_diarization=True, remove_speaker_labels=True)
+    assert text and meta["speaker_count"] == 2
+    assert google.calls[0].endswith("speech:longrunningrecognize")
+    assert google.calls.count("/v1/operations/op-123") == 4
+    assert meta["google_mode"] == "longrunning"
+    assert meta["google_operation"] == {"name": "op-123", "polls": 4}
+
+
+async def test_短音频仍走同步接口(google):
+    _, meta = await af._transcribe_google(AUDIO, "a.webm", duration=30)
+    assert google.calls == ["/v1/speech:recognize"]
+    assert "google_mode" not in meta
+
+
+async def test_没传时长时从WAV头估算(google):
+    await af._transcribe_google(_wav(56), "a.wav")
+    assert google.calls[0].endswith("speech:longrunningrecognize")
+    google.calls.clear()
+    await af._transcribe_google(_wav(50), "a.wav")
+    assert google.calls == ["/v1/speech:recognize"]
+
+
+async def test_同步接口嫌太长时改走longrunning(google):
+    google.sync_status = 400
+    text, meta = await af._transcribe_google(AUDIO, "a.webm")
+    assert text == "长音频"
+    assert google.calls[0].endswith("speech:recognize")
+    assert google.calls[1].endswith("speech:longrunningrecognize")
+    assert google.bodies[0] == google.bodies[1]        # v136 请求体可重复发送
+    assert meta["google_mode"] == "longrunning"
+
+
+async def test_operation报错时抛异常(google):
+    google.op_error = {"code": 3, "message": "Invalid audio"}
+    with pytest.raises(Exception, match="Invalid audio"):
+        await af._transcribe_google(AUDIO, "a.webm", duration=300)
+
+
+async def test_轮询超时抛异常(google, monkeypatch):
+    google.progress = [10] * 1000
+    monkeypatch.setattr(af, "GOOGLE_LRO_POLL_INITIAL", 0.01)
+    monkeypatch.setattr(af, "GOOGLE_LRO_TIMEOUT_SECONDS", 0.05)
+    with pytest.raises(Exception, match="超时"):
+        await af._transcribe_google(AUDIO, "a.webm", duration=300)
+
+
+async def test_任务里轮询进度写进progress(google):
+    jm = JobManager(workers=1)
+    snapshots = []
+    job = jm.submit(lambda: af._transcribe_google(AUDIO, "a.webm", duration=300))
+    google.on_poll = lambda: snapshots.append(json.loads(json.dumps(job.to_dict()))["progress"]["percent"])
+    while not job.done:
+        await asyncio.sleep(0.01)
+    await jm.stop()
+    assert job.status == SUCCEEDED
+    assert snapshots == [0, 0, 40, 80]
+    assert job.to_dict()["progress"] == {"stage": "google_longrunning", "percent": 100}
@@ -0,0 +1,155 @@
+"""
+🎯 Google StreamingRecognize（后端 pytest）— v138 google_streaming
+
+覆盖：
+  · 分帧：内存 / 落盘音频 / 异步字节流都切成固定大小的帧，拼回去与原音频一致
+  · 消息约定：第一条是 streaming_config，之后全是 ≤25KB 的音频帧（由本地替身校验）
+  · interim / final 逐条收集：final 按序累积，结果与 REST 同构，可直接走现有解析（含说话人分离）
+  · 在任务里执行时，每收到一条结果就更新任务 progress
+  · _transcribe_google：开启且有传输时走流式；未开启时照旧走 REST
+  · 替身挂到真实 gRPC 端口端到端（需要 grpcio + google-cloud-speech，未安装则跳过）
+
+做法：传输层注入进程内替身 StandInSpeech，不联网。
+"""
+import asyncio
+import io
+
+import httpx
+import pytest
+
+import api_fallback as af
+import google_streaming as gs
+import http_client
+import server2
+from transcription_jobs import SUCCEEDED, JobManager
+from upload_intake import AudioSource
+
+AUDIO = bytes(range(256)) * 1000 + b"tail"   # 256KB + 4：最后一帧不满
+CONFIG = {"encoding": "WEBM_OPUS", "languageCode": "zh-CN",
+          "diarizationConfig": {"enableSpeakerDiarization": True}}
+
+
+class _Upload:
+    def __init__(self, data):
+        self._file = io.BytesIO(data)
+
+    async def read(self, n=-1):
+        return self._file.read(n)
+
+
+async def _collect(frames):
+    return [f async for f in frames]
+
+
+async def test_分帧_内存落盘与异步流一致():
+    spooled = await AudioSource.from_upload(_Upload(AUDIO), spool_threshold=1)
+
+    async def stream():
+        for i in range(0, len(AUDIO), 10_000):
+            yield AUDIO[i:i + 10_000]
+
+    for source in (AUDIO, memoryview(AUDIO), spooled, stream()):
+        frames = await _collect(gs.iter_frames(source, 16 * 1024))
+        assert all(len(f) == 16 * 1024 for f in frames[:-1])
+        assert b"".join(frames) == AUDIO
+    spooled.close()
+
+
+async def test_替身校验消息约定并逐条回结果():
+    stand_in = gs.StandInSpeech(bytes_per_final=64 * 1024)
+    updates = []
+    result, info = await gs.streaming_recognize(
+        AudioSource.from_bytes(AUDIO), CONFIG, transport=stand_in, frame_bytes=16 * 1024,
+        on_update=lambda t: updates.append((len(t.finals), t.interim)))
+    assert stand_in.configs == [{"config": CONFIG, "interim_results": True}]
+    assert max(stand_in.frame_sizes) <= gs.STREAMING_MAX_FRAME_BYTES
+    assert info["frames"] == 16 and info["bytes"] == len(AUDIO)
+    assert [r["alternatives"][0]["transcript"] for r in result["results"]] == \
+        ["第1句。", "第2句。", "第3句。", "第4句。"]
+    # 每帧一条响应：interim 期间 finals 数不变，收满一句才加一
+    assert updates[0] == (0, "第1句。") and updates[3] == (1, "")
+    assert af.count_unique_speakers(result) == 2
+
+
+async def test_违反约定时报错():
+    stand_in = gs.StandInSpeech()
+
+    class _BadFrames:
+        async def streaming_recognize(self, requests):
+            async def only_audio():
+                yield {"audio_content": b"x"}
+            async for r in stand_in.streaming_recognize(only_audio()):
+                yield r
+
+    with pytest.raises(gs.StreamingError, match="streaming_config"):
+        await gs.streaming_recognize(AUDIO, CONFIG, transport=_BadFrames())
+    with pytest.raises(gs.StreamingError, match="超过"):
+        await gs.streaming_recognize(AUDIO, CONFIG, transport=stand_in, frame_bytes=64 * 1024)
+
+
+async def test_任务里每条结果都更新progress():
+    stand_in = gs.StandInSpeech(bytes_per_final=64 * 1024)
+    jm = JobManager(workers=1)
+    job = jm.submit(lambda: gs.streaming_recognize(AUDIO, CONFIG, transport=stand_in))
+    while not job.done:
+        await asyncio.sleep(0.01)
+    await jm.stop()
+    assert job.status == SUCCEEDED
+    progress = job.to_dict()["progress"]
+    assert progress["stage"] == "google_streaming"
+    assert progress["finals"] == 4 and progress["percent"] == 100
+
+
+@pytest.fixture
+def google_auth(monkeypatch):
+    monkeypatch.setattr(server2.GOOGLE_TOKENS, "current_token", lambda: "token")
+    monkeypatch.setattr(server2, "get_project_id", lambda: "proj")
+
+
+async def test_开启后_transcribe_google走流式(monkeypatch, google_auth):
+    stand_in = gs.StandInSpeech(bytes_per_final=64 * 1024)
+    monkeypatch.setattr(gs, "_TRANSPORT", stand_in)
+    monkeypatch.setattr(gs, "GOOGLE_STREAMING_ENABLED", True)
+    text, meta = await af._transcribe_google(AUDIO, "a.webm", duration=200,
+                                             enable_diarization=True, remove_speaker_labels=True)
+    assert text == "第1句。 第2句。 第3句。 第4句。"
+    assert meta["google_mode"] == "streaming" and meta["speaker_count"] == 2
+    assert meta["google_stream"]["bytes"] == len(AUDIO)
+    assert stand_in.configs[0]["config"]["encoding"] == "WEBM_OPUS"
+
+
+async def test_超过流式上限或未开启时走REST(monkeypatch, google_auth):
+    stand_in = gs.StandInSpeech()
+    monkeypatch.setattr(gs, "_TRANSPORT", stand_in)
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(200, json={"results": [{"alternatives": [{"transcript": "REST"}]}]})
+
+    monkeypatch.setattr(http_client, "_TRANSPORT", httpx.MockTransport(handler))
+    await http_client.aclose_all()
+    try:
+        text, _ = await af._transcribe_google(AUDIO, "a.webm", duration=30)   # 未开启
+        assert text == "REST" and calls == ["/v1/speech:recognize"]
+        monkeypatch.setattr(gs, "GOOGLE_STREAMING_ENABLED", True)
+        monkeypatch.setattr(gs, "GOOGLE_STREAMING_MAX_SECONDS", 20)
+        text, _ = await af._transcribe_google(AUDIO, "a.webm", duration=30)   # 超过流式上限
+        assert text == "REST" and stand_in.configs == []
+    finally:
+        await http_client.aclose_all()
+
+
+async def test_gRPC替身端到端():
+    pytest.importorskip("grpc")
+    pytest.importorskip("google.cloud.speech_v1")
+    stand_in = gs.StandInSpeech(bytes_per_final=64 * 1024)
+    server, target = await gs.serve_stand_in(stand_in)
+    try:
+        transport = gs.GrpcSpeechTransport(target, insecure=True)
+        result, info = await gs.streaming_recognize(AUDIO, CONFIG, transport=transport)
+    finally:
+        await server.stop(None)
+    assert len(result["results"]) == 4 and result["results"][0]["isFinal"]
+    assert stand_in.configs[0]["config"]["languageCode"] == "zh-CN"
+    assert info["bytes"] == len(AUDIO)
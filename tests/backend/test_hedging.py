@@ -0,0 +1,113 @@
+"""
+🎯 对冲请求（后端 pytest）— v127 transcribe_with_fallback(hedge=True)
+
+覆盖：
+  · 主 API 超过对冲阈值未返回 → 并行启动下一个，先返回者胜出，落败者被取消
+  · 主 API 在阈值内返回 → 不启动对冲（不多花钱）
+  · 主 API 快速失败 → 不等阈值，立即顶上下一个
+  · 阈值取主 API 在该时长档位的历史分位耗时（样本足够时）
+  · 对冲模式下全部失败仍抛出与顺序模式相同的结构化异常
+
+做法：与 test_fallback_engine 相同，monkeypatch 掉 _transcribe_*，阈值调到几十毫秒。
+"""
+import asyncio
+
+import pytest
+
+import api_fallback as af
+from provider_health import PROVIDER_STATS
+
+
+@pytest.fixture(autouse=True)
+def reset_state(monkeypatch):
+    snap = dict(af.API_FALLBACK_STATUS)
+    for k in ("openai_quota_exceeded", "ai_builder_quota_exceeded", "deepgram_quota_exceeded"):
+        af.API_FALLBACK_STATUS[k] = False
+    monkeypatch.setattr(af, "HEDGE_DELAY_SECONDS", 0.05)
+    yield
+    af.API_FALLBACK_STATUS.clear()
+    af.API_FALLBACK_STATUS.update(snap)
+
+
+def _mock(name, events, delay=0.0, fail=None):
+    async def f(*a, **k):
+        events.append(("start", name))
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            events.append(("cancelled", name))
+            raise
+        if fail:
+            events.append(("fail", name))
+            raise Exception(fail)
+        events.append(("done", name))
+        return f"{name.upper()}_TEXT", {"mock": name}
+    return f
+
+
+def _patch(monkeypatch, openai, ai, google):
+    monkeypatch.setattr(af, "_transcribe_openai", openai)
+    monkeypatch.setattr(af, "_transcribe_ai_builder", ai)
+    monkeypatch.setattr(af, "_transcribe_google", google)
+
+
+async def test_慢主API触发对冲_快者胜出_慢者被取消(monkeypatch):
+    ev = []
+    _patch(monkeypatch,
+           openai=_mock("openai", ev, delay=2.0),
+           ai=_mock("ai", ev, delay=0.01),
+           google=_mock("google", ev))
+    text, api_used, meta = await af.transcribe_with_fallback(b"x", "f.wav", hedge=True)
+    assert api_used == "ai_builder"
+    assert text == "AI_TEXT"
+    assert ("cancelled", "openai") in ev
+    assert ("start", "google") not in ev  # 并行上限 2，不会把整条链打出去
+    assert meta["hedge"]["winner"] == "ai_builder"
+    assert meta["hedge"]["cancelled"] == ["openai"]
+    assert [x["reason"] for x in meta["hedge"]["launched"]] == ["primary", "hedge"]
+
+
+async def test_主API在阈值内返回_不启动对冲(monkeypatch):
+    ev = []
+    _patch(monkeypatch,
+           openai=_mock("openai", ev, delay=0.0),
+           ai=_mock("ai", ev),
+           google=_mock("google", ev))
+    text, api_used, meta = await af.transcribe_with_fallback(b"x", "f.wav", hedge=True)
+    assert api_used == "openai_whisper"
+    assert [e for e in ev if e[0] == "start"] == [("start", "openai")]
+
+
+async def test_主API快速失败_立即顶上下一个(monkeypatch):
+    monkeypatch.setattr(af, "HEDGE_DELAY_SECONDS", 10.0)  # 阈值很长：必须是"失败即切换"而非等阈值
+    ev = []
+    _patch(monkeypatch,
+           openai=_mock("openai", ev, fail="openai down"),
+           ai=_mock("ai", ev),
+           google=_mock("google", ev))
+    text, api_used, meta = await asyncio.wait_for(
+        af.transcribe_with_fallback(b"x", "f.wav", hedge=True), timeout=2)
+    assert api_used == "ai_builder"
+    assert meta["hedge"]["launched"][1]["reason"] == "fallback"
+
+
+def test_阈值取历史分位耗时_样本不足时用兜底值(monkeypatch):
+    monkeypatch.setattr(af, "HEDGE_MIN_SAMPLES", 5)
+    assert af._hedge_threshold("openai", 30) == 0.05
+    for latency in (1.0, 2.0, 3.0, 4.0, 5.0):
+        PROVIDER_STATS.record_success("openai", 30, latency)
+    assert af._hedge_threshold("openai", 30) == 5.0        # p95 of 5 samples
+    assert af._hedge_threshold("openai", 300) == 0.05      # 其它时长档位没有样本
+
+
+async def test_对冲模式全部失败仍抛结构化异常(monkeypatch):
+    ev = []
+    _patch(monkeypatch,
+           openai=_mock("openai", ev, fail="openai down"),
+           ai=_mock("ai", ev, fail="ai down"),
+           google=_mock("google", ev, fail="google down"))
+    with pytest.raises(Exception) as ei:
+        await af.transcribe_with_fallback(b"x", "f.wav", hedge=True)
+    assert "所有转录" in str(ei.value)
+    for name in ("OpenAI", "AI Builder", "Google"):
+        assert name in str(ei.value)
@@ -0,0 +1,87 @@
+"""
+🎯 异步 HTTP 客户端层（后端 pytest）— v126 http_client
+
+覆盖：
+  · 同一 provider 主机复用同一个连接池，不同主机各自独立
+  · 适配器（_transcribe_openai）走 http_client，并发请求真的并发——
+    不再像同步 requests.post 那样把事件循环卡死
+  · 网络层异常的报错文本带类型名（httpx 超时异常 str() 常为空）
+
+做法：把 http_client._TRANSPORT 换成 httpx.MockTransport，不打网络、不需要 key。
+
+运行：./venv/bin/pytest
+"""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import api_fallback as af
+import http_client
+
+
+@pytest.fixture(autouse=True)
+async def mock_transport(monkeypatch):
+    """每个用例各用一套干净的连接池 + 可替换的 handler。"""
+    state = {"handler": lambda req: httpx.Response(200, json={"text": "ok"})}
+
+    async def _dispatch(request):
+        result = state["handler"](request)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+    monkeypatch.setattr(http_client, "_TRANSPORT", httpx.MockTransport(_dispatch))
+    await http_client.aclose_all()
+    yield state
+    await http_client.aclose_all()
+
+
+async def test_同一主机复用连接池_不同主机各自独立():
+    a1 = http_client.get_client("https://api.openai.com/v1/audio/transcriptions")
+    a2 = http_client.get_client("https://api.openai.com/v1/other")
+    b = http_client.get_client("https://api.deepgram.com/v1/listen")
+    assert a1 is a2
+    assert a1 is not b
+    assert http_client.pool_stats()["hosts"] == ["https://api.deepgram.com", "https://api.openai.com"]
+
+
+async def test_分阶段超时可单独覆盖read():
+    t = http_client.make_timeout(read=120)
+    assert t.read == 120
+    assert t.connect == http_client.HTTP_CONNECT_TIMEOUT
+
+
+async def test_openai适配器走异步客户端且并发不阻塞(monkeypatch, mock_transport):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    seen = []
+
+    async def slow(request):
+        seen.append(request.url.host)
+        await asyncio.sleep(0.2)
+        return httpx.Response(200, json={"text": "你好世界"})
+
+    mock_transport["handler"] = slow
+
+    start = time.monotonic()
+    results = await asyncio.gather(*[
+        af._transcribe_openai(b"RIFF....WAVE", "a.wav") for _ in range(5)
+    ])
+    elapsed = time.monotonic() - start
+
+    assert [t for t, _ in results] == ["你好世界"] * 5
+    assert seen == ["api.openai.com"] * 5
+    # 同步 requests 时 5 个请求串行 ≥1.0s；异步并发应接近单个请求耗时
+    assert elapsed < 0.6
+
+
+async def test_网络异常文本带类型名(mock_transport):
+    def boom(request):
+        raise httpx.ReadTimeout("", request=request)
+
+    mock_transport["handler"] = boom
+    with pytest.raises(Exception) as ei:
+        await http_client.post("https://api.openai.com/v1/audio/transcriptions")
+    assert "ReadTimeout" in str(ei.value)
+    assert af.is_temporary_error(None, str(ei.value))
@@ -0,0 +1,165 @@
+"""
+🎯 按 provider 限制并发 + 有界排队（后端 pytest）— v145 provider_concurrency
+
+覆盖：
+  · 同时在飞的调用不超过并发上限，多出来的排队后仍由同一 provider 完成；排队耗时记进账本与指标
+  · 队列满 / 排队超时 / 预计排队超过可等时间 → 溢出到下一个 provider（ProviderBusy）
+  · FIFO：名额空出来交给队首；排队中被取消的让出位置，不占名额
+  · 指标：get_api_status()["concurrency"]（在飞数、队列深度、排队耗时、各原因溢出次数）
+  · 指定 preferred_api 也受并发名额、熔断约束：名额满溢出 / 熔断跳过后按正常链路兜底（v153）
+
+做法：monkeypatch 掉 _transcribe_*（带可控延迟）；并发上限、队列长度用 monkeypatch 调小。
+"""
+import asyncio
+
+import pytest
+
+import api_fallback as af
+import deadlines
+import provider_concurrency
+from deadlines import Deadline
+from provider_concurrency import ProviderBusy, ProviderSlots
+
+
+@pytest.fixture(autouse=True)
+def reset_status():
+    snap = dict(af.API_FALLBACK_STATUS)
+    for k in ("openai_quota_exceeded", "ai_builder_quota_exceeded", "deepgram_quota_exceeded"):
+        af.API_FALLBACK_STATUS[k] = False
+    yield
+    af.API_FALLBACK_STATUS.clear()
+    af.API_FALLBACK_STATUS.update(snap)
+
+
+def _patch(monkeypatch, calls, delay=0.05):
+    live = {"now": 0, "peak": 0}
+
+    def mock(name):
+        async def f(*a, **k):
+            calls.append(name)
+            if name == "openai":
+                live["now"] += 1
+                live["peak"] = max(live["peak"], live["now"])
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    live["now"] -= 1
+            return f"{name.upper()}_TEXT", {}
+        return f
+    monkeypatch.setattr(af, "_transcribe_openai", mock("openai"))
+    monkeypatch.setattr(af, "_transcribe_ai_builder", mock("ai"))
+    monkeypatch.setattr(af, "_transcribe_google", mock("google"))
+    return live
+
+
+async def _transcribe_with_deadline(seconds=30):
+    deadline = Deadline(seconds)
+    with deadlines.scope(deadline):
+        _, api_used, _ = await af.transcribe_with_fallback(b"x", "f.wav")
+    return api_used, deadline
+
+
+async def test_并发不超过上限_多出来的排队后仍由同一provider完成(monkeypatch):
+    monkeypatch.setitem(provider_concurrency.PROVIDER_MAX_CONCURRENCY, "openai", 2)
+    calls = []
+    live = _patch(monkeypatch, calls)
+    results = await asyncio.gather(*[_transcribe_with_deadline() for _ in range(5)])
+    assert [api for api, _ in results] == ["openai_whisper"] * 5
+    assert live["peak"] == 2 and calls == ["openai"] * 5
+    assert sum("queued" in d.attempts[-1] for _, d in results) == 3
+    metrics = af.get_api_status()["concurrency"]["openai"]
+    assert metrics["limit"] == 2 and metrics["active"] == 0 and metrics["queue_depth"] == 0
+    assert metrics["queued"] == 3 and metrics["max_queue_depth"] == 3 and metrics["wait_p95"] > 0
+
+
+async def test_队列满溢出到下一个provider(monkeypatch):
+    monkeypatch.setitem(provider_concurrency.PROVIDER_MAX_CONCURRENCY, "openai", 1)
+    monkeypatch.setattr(provider_concurrency, "PROVIDER_QUEUE_SIZE", 1)
+    calls = []
+    _patch(monkeypatch, calls)
+    results = await asyncio.gather(*[_transcribe_with_deadline() for _ in range(3)])
+    assert sorted(api for api, _ in results) == ["ai_builder", "openai_whisper", "openai_whisper"]
+    spilled = next(d for api, d in results if api == "ai_builder")
+    assert spilled.attempts[0]["outcome"] == "skipped" and "排队已满" in spilled.attempts[0]["busy"]
+    assert af.get_api_status()["concurrency"]["openai"]["spilled"]["queue_full"] == 1
+
+
+async def test_排队超时溢出到下一个provider(monkeypatch):
+    monkeypatch.setitem(provider_concurrency.PROVIDER_MAX_CONCURRENCY, "openai", 1)
+    monkeypatch.setattr(provider_concurrency, "PROVIDER_MAX_QUEUE_SECONDS", 0.05)
+    calls = []
+    _patch(monkeypatch, calls, delay=0.3)
+    first = asyncio.ensure_future(_transcribe_with_deadline())
+    await asyncio.sleep(0.01)
+    api_used, _ = await _transcribe_with_deadline()
+    assert api_used == "ai_builder"
+    assert af.get_api_status()["concurrency"]["openai"]["spilled"]["timeout"] == 1
+    assert (await first)[0] == "openai_whisper"
+
+
+async def test_可等时间不超过剩余截止时间():
+    slots = ProviderSlots("openai", limit=1, queue_size=10, max_wait=10)
+    await slots.acquire()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    with pytest.raises(ProviderBusy, match="仍未轮到"):
+        await slots.acquire(budget=0.05)
+    assert loop.time() - start < 1.0 and slots.depth() == 0
+
+
+async def test_预计排队超过可等时间直接溢出_不进队():
+    slots = ProviderSlots("openai", limit=1, queue_size=10, max_wait=10)
+    await slots.acquire()
+    slots.release(held=5.0)             # 平均占用 5s
+    await slots.acquire()
+    with pytest.raises(ProviderBusy, match="预计排队"):
+        await slots.acquire(budget=2.0)
+    assert slots.spilled["predicted"] == 1 and slots.depth() == 0 and slots.queued == 0
+
+
+async def test_FIFO交接_排队中取消的让出位置():
+    slots = ProviderSlots("openai", limit=1, queue_size=10, max_wait=10)
+    await slots.acquire()
+    order = []
+
+    async def wait(name):
+        await slots.acquire()
+        order.append(name)
+
+    a, b, c = (asyncio.ensure_future(wait(n)) for n in "abc")
+    await asyncio.sleep(0)
+    assert slots.depth() == 3
+    b.cancel()
+    await asyncio.sleep(0)
+    slots.release()
+    await a
+    slots.release()
+    await c
+    assert order == ["a", "c"] and slots.active == 1 and slots.depth() == 0
+    slots.release()
+    assert slots.active == 0
+
+
+async def test_指定API同样受并发名额约束_满了由链路兜底(monkeypatch):
+    monkeypatch.setitem(provider_concurrency.PROVIDER_MAX_CONCURRENCY, "openai", 1)
+    monkeypatch.setattr(provider_concurrency, "PROVIDER_QUEUE_SIZE", 0)
+    calls = []
+    live = _patch(monkeypatch, calls)
+    results = await asyncio.gather(*[af.transcribe_with_preferred_api(b"x", "f.wav", "openai") for _ in range(2)])
+    assert sorted(api for _, api, _ in results) == ["ai_builder", "openai"] and live["peak"] == 1
+    fallback = next(m for _, api, m in results if api == "ai_builder")
+    assert fallback["preferred_api"] == {"requested": "openai", "used": "ai_builder"}
+
+
+async def test_指定API熔断中直接跳过_走截止时间(monkeypatch):
+    calls = []
+    _patch(monkeypatch, calls)
+    af.get_breaker("google").trip(30, "测试")
+    text, api_used, _ = await af.transcribe_with_preferred_api(b"x", "f.wav", "gcp")
+    assert api_used == "openai_whisper" and calls == ["openai"]
+
+    deadline = Deadline(30)
+    deadline.cancel("client_disconnected")
+    with deadlines.scope(deadline), pytest.raises(Exception, match="都失败了"):
+        await af.transcribe_with_preferred_api(b"x", "f.wav", "openai")
+    assert calls == ["openai"]
@@ -0,0 +1,138 @@
+"""
+🎯 provider 错误分类与冷却（后端 pytest）— v143 provider_errors
+
+覆盖：
+  · 分类：rate_limited / quota_exhausted / auth / bad_input / transient
+  · 冷却时长解析：Retry-After 秒数与 HTTP 日期、retry-after-ms、OpenAI x-ratelimit-reset-*
+  · 429 突发限流 → 按响应头冷却几秒（不锁一小时），不计入熔断；冷却期过后恢复
+  · insufficient_quota → 仍锁 QUOTA_RECHECK_INTERVAL
+  · 401 → 鉴权冷却；400 → 不冷却
+  · Retry-After 很短的 429 → 同一 provider 等一下重试
+
+做法：monkeypatch 掉 _transcribe_*，抛带响应头的 ProviderError；冷却的时间源换成可控时钟。
+"""
+import email.utils
+
+import httpx
+import pytest
+
+import api_fallback as af
+import provider_errors as pe
+from provider_errors import ProviderError
+from provider_health import ProviderCooldowns, get_breaker
+
+
+@pytest.fixture(autouse=True)
+def reset_status(monkeypatch):
+    snap = dict(af.API_FALLBACK_STATUS)
+    for k in ("openai_quota_exceeded", "ai_builder_quota_exceeded", "deepgram_quota_exceeded"):
+        af.API_FALLBACK_STATUS[k] = False
+    now = [1000.0]
+    monkeypatch.setattr(af, "COOLDOWNS", ProviderCooldowns(clock=lambda: now[0]))
+    yield now
+    af.API_FALLBACK_STATUS.clear()
+    af.API_FALLBACK_STATUS.update(snap)
+
+
+def _response(status, text, headers=None):
+    return httpx.Response(status, text=text, headers=headers or {})
+
+
+def _raising(name, calls, responses):
+    """按顺序把 responses 转成 ProviderError 抛出，用完后成功。"""
+    responses = list(responses)
+
+    async def f(*a, **k):
+        calls.append(name)
+        if responses:
+            raise ProviderError.from_response(name, responses.pop(0))
+        return f"{name.upper()}_TEXT", {}
+    return f
+
+
+def _patch(monkeypatch, calls, openai=()):
+    monkeypatch.setattr(af, "_transcribe_openai", _raising("openai", calls, openai))
+    monkeypatch.setattr(af, "_transcribe_ai_builder", _raising("ai", calls, ()))
+    monkeypatch.setattr(af, "_transcribe_google", _raising("google", calls, ()))
+
+
+def test_错误分类():
+    assert pe.classify(429, "Rate limit reached for whisper-1") == pe.RATE_LIMITED
+    assert pe.classify(429, "You exceeded your current quota (insufficient_quota)") == pe.QUOTA_EXHAUSTED
+    assert pe.classify(429, "Quota exceeded for quota metric 'Requests' per minute") == pe.RATE_LIMITED
+    assert pe.classify(402, "payment declined") == pe.QUOTA_EXHAUSTED
+    assert pe.classify(401, "Incorrect API key provided") == pe.AUTH
+    assert pe.classify(None, "OPENAI_API_KEY 未配置") == pe.AUTH
+    assert pe.classify(400, "Invalid file format") == pe.BAD_INPUT
+    assert pe.classify(503, "unavailable") == pe.TRANSIENT
+    assert pe.classify(None, "ReadTimeout (https://api.openai.com)") == pe.TRANSIENT
+    assert pe.classify(None, "转录结果为空") is None
+
+
+def test_冷却时长解析():
+    now = 1_700_000_000.0
+    assert pe.parse_retry_after({"Retry-After": "7"}, now) == 7.0
+    date = email.utils.formatdate(now + 30, usegmt=True)
+    assert pe.parse_retry_after({"Retry-After": date}, now) == pytest.approx(30, abs=1)
+    assert pe.parse_retry_after({"retry-after-ms": "250", "retry-after": "1"}, now) == 0.25
+    # OpenAI：请求数已耗尽，以它的重置时间为准（而不是 tokens 的）
+    headers = {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "6m0s",
+               "x-ratelimit-remaining-tokens": "900", "x-ratelimit-reset-tokens": "120ms"}
+    assert pe.parse_retry_after(headers, now) == 360.0
+    assert pe.parse_retry_after({"x-ratelimit-reset": str(now + 12)}, now) == 12.0
+    assert pe.parse_retry_after({"content-type": "application/json"}, now) is None
+
+
+async def test_429突发限流按响应头冷却_不锁一小时_不计入熔断(monkeypatch, reset_status):
+    now = reset_status
+    calls = []
+    _patch(monkeypatch, calls, openai=[_response(429, "Rate limit reached", {"retry-after": "20"})])
+    _, api_used, _ = await af.transcribe_with_fallback(b"x", "f.wav")
+    assert api_used == "ai_builder" and calls == ["openai", "ai"]   # 20s 超过重试间隔上限，不原地等
+    assert af.API_FALLBACK_STATUS["openai_quota_exceeded"] is False
+    assert af.COOLDOWNS.describe("openai") == {"reason": pe.RATE_LIMITED, "remaining": 20.0}
+    assert get_breaker("openai").error_rate() is None              # 熔断窗口里没有记这次失败
+    assert af.should_retry_api("openai") is False
+    assert "限流冷却中" in af.skip_reason("openai")
+    status = af.get_api_status()["openai"]
+    assert status["available"] is False and status["cooldown"]["reason"] == pe.RATE_LIMITED
+
+    calls.clear()
+    _, api_used, _ = await af.transcribe_with_fallback(b"x", "f.wav")
+    assert api_used == "ai_builder" and calls == ["ai"]             # 冷却期内直接跳过
+    now[0] += 21
+    calls.clear()
+    _, api_used, _ = await af.transcribe_with_fallback(b"x", "f.wav")
+    assert api_used == "openai_whisper" and calls == ["openai"]
+
+
+async def test_余额耗尽仍锁一小时(monkeypatch):
+    calls = []
+    body = '{"error": {"code": "insufficient_quota", "message": "You exceeded your current quota"}}'
+    _patch(monkeypatch, calls, openai=[_response(429, body)])
+    await af.transcribe_with_fallback(b"x", "f.wav")
+    assert af.API_FALLBACK_STATUS["openai_quota_exceeded"] is True
+    assert af._quota_locked("openai") is True
+    assert af.skip_reason("openai") == "配额已耗尽"
+
+
+async def test_鉴权失败冷却_参数错误不冷却(monkeypatch):
+    calls = []
+    _patch(monkeypatch, calls, openai=[_response(401, "Incorrect API key provided")])
+    await af.transcribe_with_fallback(b"x", "f.wav")
+    assert af.COOLDOWNS.describe("openai")["reason"] == pe.AUTH
+    assert af.COOLDOWNS.remaining("openai") == pytest.approx(af.AUTH_COOLDOWN_SECONDS)
+
+    af.COOLDOWNS.reset()
+    _patch(monkeypatch, calls, openai=[_response(400, "Invalid file format")])
+    await af.transcribe_with_fallback(b"x", "f.wav")
+    assert af.COOLDOWNS.describe("openai") is None and af.should_retry_api("openai") is True
+
+
+async def test_短Retry_After的限流原地重试(monkeypatch):
+    calls = []
+    _patch(monkeypatch, calls, openai=[_response(429, "Rate limit reached", {"retry-after-ms": "5"})])
+    _, api_used, meta = await af.transcribe_with_fallback(b"x", "f.wav")
+    assert api_used == "openai_whisper" and calls == ["openai", "openai"]
+    assert meta["retries"][0]["delay"] >= 0.005
+    assert af.COOLDOWNS.describe("openai") is None
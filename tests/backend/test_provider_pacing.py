@@ -0,0 +1,123 @@
+"""
+🎯 限流响应头驱动的主动节流（后端 pytest）— v144 provider_pacing
+
+覆盖：
+  · 响应头解析：OpenAI x-ratelimit-*-{requests,tokens}、通用 X-RateLimit-*（含 Unix 时间戳）
+  · OpenAI 适配器每个响应都把限额记进 PACING
+  · 剩余名额只剩保留数 → 不等 429，直接溢出到下一个 provider（截止时间账本记 skipped / paced）
+  · 剩余不足一定比例 → 匀速放行，相邻两次间隔 = 距重置秒数 / 剩余名额；等不起的溢出且不占名额
+  · 放行时本地先扣剩余数（响应头滞后于并发请求）
+  · 窗口过了重置时刻即失效
+
+做法：ProviderPacer / PacingScheduler 用假时钟；端到端用例 monkeypatch 掉 _transcribe_*，
+适配器用例把 http_client._TRANSPORT 换成 httpx.MockTransport。
+"""
+import httpx
+import pytest
+
+import api_fallback as af
+import deadlines
+import http_client
+import provider_pacing
+from deadlines import Deadline
+from provider_pacing import PacingScheduler, ProviderPacer, parse_limits
+
+
+def _openai_headers(remaining, limit=100, reset="30s"):
+    return {"x-ratelimit-limit-requests": str(limit), "x-ratelimit-remaining-requests": str(remaining),
+            "x-ratelimit-reset-requests": reset}
+
+
+@pytest.fixture(autouse=True)
+def reset_status():
+    snap = dict(af.API_FALLBACK_STATUS)
+    for k in ("openai_quota_exceeded", "ai_builder_quota_exceeded", "deepgram_quota_exceeded"):
+        af.API_FALLBACK_STATUS[k] = False
+    yield
+    af.API_FALLBACK_STATUS.clear()
+    af.API_FALLBACK_STATUS.update(snap)
+
+
+def _patch(monkeypatch, calls):
+    def mock(name):
+        async def f(*a, **k):
+            calls.append(name)
+            return f"{name.upper()}_TEXT", {}
+        return f
+    monkeypatch.setattr(af, "_transcribe_openai", mock("openai"))
+    monkeypatch.setattr(af, "_transcribe_ai_builder", mock("ai"))
+    monkeypatch.setattr(af, "_transcribe_google", mock("google"))
+
+
+def test_响应头解析():
+    limits = parse_limits({**_openai_headers(7, reset="6m0s"), "x-ratelimit-limit-tokens": "50000",
+                           "x-ratelimit-remaining-tokens": "49000", "x-ratelimit-reset-tokens": "120ms"}, 1000.0)
+    assert limits["requests"] == {"limit": 100, "remaining": 7, "reset_at": 1360.0}
+    assert limits["tokens"]["reset_at"] == pytest.approx(1000.12)
+    generic = parse_limits({"X-RateLimit-Limit": "60", "X-RateLimit-Remaining": "3",
+                            "X-RateLimit-Reset": "1700000030"}, 1_700_000_000.0)
+    assert generic == {"requests": {"limit": 60, "remaining": 3, "reset_at": 1700000030.0}}
+    assert parse_limits({"content-type": "application/json"}, 0.0) == {}
+
+
+async def test_openai适配器把限额记进PACING(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(http_client, "_TRANSPORT", httpx.MockTransport(
+        lambda req: httpx.Response(200, json={"text": "你好"}, headers=_openai_headers(42))))
+    await http_client.aclose_all()
+    try:
+        await af._transcribe_openai(b"RIFF....WAVE", "a.wav")
+    finally:
+        await http_client.aclose_all()
+    window = af.get_api_status()["pacing"]["openai"]["windows"]["requests"]
+    assert window["limit"] == 100 and window["remaining"] == 42
+
+
+async def test_剩余只剩保留数_不等429直接溢出(monkeypatch):
+    calls = []
+    _patch(monkeypatch, calls)
+    provider_pacing.PACING.observe("openai", _openai_headers(1))
+    deadline = Deadline(30)
+    with deadlines.scope(deadline):
+        _, api_used, _ = await af.transcribe_with_fallback(b"x", "f.wav")
+    assert api_used == "ai_builder" and calls == ["ai"]
+    assert deadline.attempts[0]["outcome"] == "skipped" and deadline.attempts[0]["paced"] == "requests"
+    pacing = af.get_api_status()["pacing"]["openai"]
+    assert pacing["spilled"] == 1 and pacing["windows"]["requests"]["remaining"] == 1
+
+
+def test_接近限额时匀速放行_等不起的溢出且不占名额():
+    pacer = ProviderPacer()
+    pacer.observe(_openai_headers(10, reset="1s"), now=0.0)         # 10 < 100 × 20%：间隔 1s / 10
+    assert pacer.acquire(0.0, max_wait=0.15) == (True, 0.0, None)
+    ok, wait, _ = pacer.acquire(0.0, max_wait=0.15)
+    assert ok and wait == pytest.approx(0.1)
+    ok, wait, _ = pacer.acquire(0.0, max_wait=0.15)                 # 本地已扣到 9 个：再隔 1s / 9
+    assert not ok and wait == pytest.approx(0.1 + 1 / 9)
+    assert pacer.paced == 1 and pacer.spilled == 1
+    ok, wait, _ = pacer.acquire(0.0, max_wait=1.0)                   # 溢出的那次没占名额
+    assert ok and wait == pytest.approx(0.1 + 1 / 9)
+
+
+def test_放行时本地扣减剩余数():
+    now = [0.0]
+    scheduler = PacingScheduler(clock=lambda: now[0])
+    scheduler.observe("openai", _openai_headers(3, limit=10))
+    assert scheduler.acquire("openai")[0] is True                   # 3 → 2
+    assert scheduler.acquire("openai")[0] is True                   # 2 → 1
+    go, wait, window = scheduler.acquire("openai")                  # 只剩保留数：要等 30s
+    assert go is False and wait == pytest.approx(30.0) and window == "requests"
+    now[0] = 31.0                                                   # 窗口已重置
+    assert scheduler.acquire("openai") == (True, 0.0, None)
+    assert scheduler.snapshot()["openai"]["windows"] == {}
+
+
+async def test_短等待在原地匀速放行(monkeypatch):
+    calls = []
+    _patch(monkeypatch, calls)
+    provider_pacing.PACING.observe("openai", _openai_headers(10, reset="100ms"))
+    for _ in range(3):
+        _, api_used, _ = await af.transcribe_with_fallback(b"x", "f.wav")
+        assert api_used == "openai_whisper"
+    assert calls == ["openai"] * 3
+    assert af.get_api_status()["pacing"]["openai"]["paced"] == 2
@@ -1,5 +1,5 @@
 """
-🎯 限流 EVAL（后端 pytest）— server2.rate_limit_middleware
+🎯 限流 EVAL（后端 pytest）— server2 限流中间件（v150 起为纯 ASGI 的 RequestGate）
 
 覆盖 K1 / K2a / K2b / K3：
   K1   限流仅作用于 3 个付费路径；其它路径（如 /）无限放行
@@ -7,36 +7,40 @@
   K2b  多窗口限流通用逻辑（用 monkeypatch 降阈到 (3600, N) 验证小时窗口分支，不必真打 150 次）
   K3   按客户端 IP 隔离计数（不同 XFF → 各自独立，一个耗尽不影响另一个）
 
-做法：直接调用中间件（传轻量假 request + call_next），测试间重置 _rate_hits。
+做法：直接调用中间件（传最小 ASGI scope + 只记一声的内层 app），测试间重置 RATE_LIMITER（v146 起取代 _rate_hits）。
 进程内、非 flaky、不打真实端点、不消耗 API 配额。
 
 运行：./venv/bin/pytest
 """
 import pytest
+from starlette.datastructures import Headers
 
 import server2
 
 
-# ---- 轻量假 request（中间件只用到 .url.path / .headers.get / .client.host） ----
-class _URL:
-    def __init__(self, path):
-        self.path = path
+# ---- 直接跑纯 ASGI 的限流中间件（v150 起取代 @app.middleware）：内层 app 只记一声 "PASSED" ----
+class _Resp:
+    def __init__(self, message):
+        self.status_code = message["status"]
+        self.headers = Headers(raw=message["headers"])
 
 
-class _Client:
-    def __init__(self, host):
-        self.host = host
+async def _run_gate(path, headers=None, host="1.1.1.1"):
+    scope = {"type": "http", "method": "POST", "path": path, "query_string": b"",
+             "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+             "client": (host, 50000)}
+    out = []
 
+    async def inner(scope, receive, send):
+        out.append("PASSED")
 
-class _Req:
-    def __init__(self, path, headers=None, host="1.1.1.1"):
-        self.url = _URL(path)
-        self.headers = headers or {}
-        self.client = _Client(host)
+    async def send(message):
+        if message["type"] == "http.response.start":
+            out.append(_Resp(message))
 
-
-async def _call_next(req):
-    return "PASSED"
+    gate = server2.RequestGate(inner, check=server2._rate_limit_response, applies=server2._is_rate_limited)
+    await gate(scope, None, send)
+    return out[0]
 
 
 PAID = "/transcribe-segment"
@@ -45,15 +49,17 @@ PAID = "/transcribe-segment"
 @pytest.fixture(autouse=True)
 def reset_rate_state():
     """每个用例前清空限流计数，保证独立、非 flaky。"""
-    server2._rate_hits.clear()
+    server2.RATE_LIMITER.reset()
+    server2.COST_LIMITER.reset()
     snap = list(server2.RATE_LIMITS)
     yield
-    server2._rate_hits.clear()
+    server2.RATE_LIMITER.reset()
+    server2.COST_LIMITER.reset()
     server2.RATE_LIMITS = snap
 
 
 async def _hit(path, host="9.9.9.9", headers=None):
-    return await server2.rate_limit_middleware(_Req(path, headers=headers, host=host), _call_next)
+    return await _run_gate(path, headers=headers, host=host)
 
 
 # ---------------------------------------------------------------- K2a
@@ -76,9 +82,11 @@ async def test_k1_non_paid_path_never_limited():
         assert r == "PASSED", f"非付费路径第 {i+1} 次不应被限流"
 
 
-def test_k1_rate_limited_paths_are_exactly_the_three_paid():
-    assert server2.RATE_LIMITED_PATHS == {
+def test_k1_rate_limited_paths_are_exactly_the_paid():
+    # v133: 异步任务提交同样直打付费 API，纳入限流；v148 起是 路径 → 加权令牌桶配置 的 dict
+    assert set(server2.RATE_LIMITED_PATHS) == {
         "/transcribe-segment",
+        "/transcribe-jobs",
         "/speech-to-text",
         "/speech-to-text-aibuilder",
     }
@@ -101,7 +109,8 @@ async def test_k3_per_client_isolation_via_xff():
 async def test_k2b_multi_window_generic_enforcement(monkeypatch):
     # 把限流降到 (3600s, 3)，验证小时窗口分支（不必真打 150 次）
     monkeypatch.setattr(server2, "RATE_LIMITS", [(3600, 3)])
-    server2._rate_hits.clear()
+    server2.RATE_LIMITER.reset()
+    server2.COST_LIMITER.reset()
     for i in range(3):
         assert await _hit(PAID, host="50.0.0.1") == "PASSED", f"第 {i+1} 次应放行"
     r = await _hit(PAID, host="50.0.0.1")
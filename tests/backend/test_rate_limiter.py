@@ -0,0 +1,83 @@
+"""
+🎯 O(1) 滑动窗口限流（后端 pytest）— v146 rate_limiter
+
+覆盖：
+  · 滑动窗口近似：上一窗口的计数按仍落在区间里的比例折算，跨窗口边界不会"清零再放一整批"
+  · Retry-After：按同一公式反解，到点恰好能再放行一次（早一点仍被拒）
+  · 多窗口：任一窗口超限即拒；被拒的请求不计数
+  · 时间轮过期：几千个一次性 IP 到期后被摘掉；每次检查只推进走过的轮槽
+  · 分片：客户端均匀落到各片
+
+做法：RateLimiter 直接传 now，不依赖真实时钟。
+"""
+import pytest
+
+from rate_limiter import RateLimiter, TimingWheel
+
+LIMITS = [(60, 20)]
+
+
+def _fill(limiter, client, n, now):
+    for _ in range(n):
+        assert limiter.hit(client, LIMITS, now=now)[0] is True
+
+
+def test_滑动窗口近似_跨边界不清零():
+    limiter = RateLimiter()
+    _fill(limiter, "a", 20, now=50.0)               # 窗口 [0, 60) 打满
+    assert limiter.hit("a", LIMITS, now=59.0)[0] is False
+    # 新窗口开头：上一窗口 20 × (1 - 1/60) ≈ 19.7 仍算在区间里，只多放 1 个，不会立刻再放 20 个
+    assert limiter.hit("a", LIMITS, now=61.0)[0] is True
+    assert limiter.hit("a", LIMITS, now=61.0)[0] is False
+    # 过了半个窗口：20 × 0.5 + 1 = 11，还能再放 9 个
+    _fill(limiter, "a", 9, now=90.0)
+    assert limiter.hit("a", LIMITS, now=90.0)[0] is False
+
+
+def test_Retry_After按公式反解_到点恰好放行():
+    limiter = RateLimiter()
+    _fill(limiter, "a", 20, now=30.0)
+    allowed, retry_after, (window, limit, estimate) = limiter.hit("a", LIMITS, now=30.0)
+    assert not allowed and (window, limit, estimate) == (60, 20, 20)
+    # 等到下一窗口（30s）+ 上一窗口份额降到 19 以下（60 × (1 - 20/20) = 0）
+    assert retry_after == pytest.approx(30.0)
+    assert limiter.hit("a", LIMITS, now=30.0 + retry_after - 0.5)[0] is False
+    assert limiter.hit("a", LIMITS, now=30.0 + retry_after + 0.01)[0] is True
+
+
+def test_多窗口任一超限即拒_被拒不计数():
+    limiter = RateLimiter()
+    limits = [(60, 20), (3600, 3)]
+    for _ in range(3):
+        assert limiter.hit("a", limits, now=10.0)[0] is True
+    allowed, _, blocked_by = limiter.hit("a", limits, now=10.0)
+    assert not allowed and blocked_by[0] == 3600
+    assert limiter.stats()["allowed"] == 3 and limiter.stats()["blocked"] == 1
+
+
+def test_时间轮过期_一次性IP到期后被摘掉():
+    limiter = RateLimiter(shards=8)
+    for i in range(3000):
+        limiter.hit(f"10.0.{i // 256}.{i % 256}", [(60, 20), (3600, 150)], now=100.0)
+    assert limiter.clients() == 3000
+    shard_sizes = [len(shard.clients) for shard in limiter._shards]
+    assert min(shard_sizes) > 3000 / 8 / 2                # 分片大致均匀
+    # 还在 2 个最长窗口内：都留着
+    for shard in limiter._shards:
+        limiter._expire(shard, 7100.0)
+    assert limiter.clients() == 3000
+    # 过了 2 个最长窗口：各片各自推进时间轮，全部摘掉
+    for shard in limiter._shards:
+        limiter._expire(shard, 7201.0)
+    assert limiter.clients() == 0 and limiter.stats()["expired"] == 3000
+
+
+def test_时间轮只推进走过的轮槽():
+    wheel = TimingWheel(tick=1.0)
+    wheel.schedule("a", 5.0)
+    slot = wheel.schedule("b", 5.0)
+    wheel.schedule("b", 9.0, previous=slot)              # 重新挂到更晚的槽
+    assert wheel.advance(0.0) == []
+    assert wheel.advance(6.0) == ["a"]
+    assert wheel.advance(8.0) == []
+    assert wheel.advance(1000.0) == ["b"] and len(wheel) == 0
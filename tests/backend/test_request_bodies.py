@@ -0,0 +1,158 @@
+"""
+🎯 出站请求体零拷贝构造（后端 pytest）— v136 request_bodies
+
+覆盖：
+  · GoogleRecognizeBody：分块 base64 拼出来的 JSON 与整段编码完全一致；Content-Length 事先算准
+  · MultipartBody：与 httpx `files=` / `data=` 在同一 boundary 下逐字节相同
+  · 同一个 body 可以反复迭代（重试时原样再发）；StreamingBody 是抽象基类，不实现 _generate 不能实例化
+  · 适配器：Google / OpenAI 走流式 body，带 Content-Length、不走 chunked；AI Builder 冷启动
+    重试两次发出的请求体一致；旧版 /speech-to-text 同样改走流式 body
+  · 旧版 /speech-to-text-aibuilder：上传分块读取（大文件落盘）、流式 multipart 发出，用完关闭（v157）
+
+做法：HTTP 走 httpx.MockTransport；旧路由走 ASGITransport。
+"""
+import base64
+import json
+
+import httpx
+import pytest
+
+import api_fallback as af
+import http_client
+import request_bodies
+import server2
+from upload_intake import AudioSource
+
+AUDIO = bytes(range(256)) * 800 + b"\x01"   # 200KB + 1：故意不是 3 的整数倍
+
+
+async def test_google请求体与整段编码一致():
+    config = {"encoding": "LINEAR16", "languageCode": "zh-CN", "alternativeLanguageCodes": ["en-US"]}
+    body = request_bodies.GoogleRecognizeBody(config, memoryview(AUDIO))
+    data = await body.to_bytes()
+    assert len(data) == body.content_length
+    sent = json.loads(data)
+    assert sent["config"] == config
+    assert sent["audio"]["content"] == base64.b64encode(AUDIO).decode()
+
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3, request_bodies.BASE64_CHUNK_BYTES + 1])
+async def test_google请求体长度边界(size):
+    body = request_bodies.GoogleRecognizeBody({}, AUDIO[:size])
+    data = await body.to_bytes()
+    assert len(data) == body.content_length
+    assert base64.b64decode(json.loads(data)["audio"]["content"]) == AUDIO[:size]
+
+
+async def test_multipart与httpx逐字节相同():
+    fields = {"model": "whisper-1", "temperature": 0, "language": None, "prompt": 'a "b" \\ c'}
+    body = request_bodies.MultipartBody(fields, "file", 'x"y.wav', "audio/wav", AUDIO, boundary="b0undary")
+    expected = httpx.Request(
+        "POST", "https://example.com",
+        data={k: v for k, v in fields.items() if v is not None},
+        files={"file": ('x"y.wav', AUDIO, "audio/wav")},
+        headers={"Content-Type": body.content_type},
+    )
+    expected.read()
+    data = await body.to_bytes()
+    assert data == expected.content
+    assert body.content_length == len(data)
+
+
+async def test_同一个body可以反复发送():
+    src = AudioSource.from_bytes(AUDIO)
+    body = request_bodies.MultipartBody({"model": "whisper-1"}, "file", "a.wav", "audio/wav", src)
+    assert await body.to_bytes() == await body.to_bytes()
+
+
+def test_StreamingBody是抽象基类():
+    with pytest.raises(TypeError):
+        request_bodies.StreamingBody()
+
+
+# ---------- 适配器 ----------
+
+@pytest.fixture
+async def captured(monkeypatch):
+    seen = []
+
+    async def handler(request):
+        seen.append({"body": await request.aread(), "headers": request.headers})
+        if request.url.host == "speech.googleapis.com":
+            return httpx.Response(200, json={"results": [{"alternatives": [{"transcript": "你好"}]}]})
+        if "ai-builders" in request.url.host and len(seen) == 1:
+            return httpx.Response(200, json={"text": ""})   # 冷启动：第一次返回空文本
+        return httpx.Response(200, json={"text": "你好", "segments": None})
+
+    monkeypatch.setattr(http_client, "_TRANSPORT", httpx.MockTransport(handler))
+    await http_client.aclose_all()
+    yield seen
+    await http_client.aclose_all()
+
+
+async def test_google适配器流式发送带长度(monkeypatch, captured):
+    monkeypatch.setattr(server2.GOOGLE_TOKENS, "current_token", lambda: "token")
+    monkeypatch.setattr(server2, "get_project_id", lambda: "proj")
+    await af._transcribe_google(AUDIO, "a.wav", language="zh")
+    req = captured[0]
+    assert req["headers"]["content-length"] == str(len(req["body"]))
+    assert "transfer-encoding" not in req["headers"]
+    assert req["headers"]["content-type"] == "application/json"
+    sent = json.loads(req["body"])
+    assert base64.b64decode(sent["audio"]["content"]) == AUDIO
+    assert sent["config"]["languageCode"] == "zh-CN"
+
+
+async def test_openai适配器multipart带长度(monkeypatch, captured):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    await af._transcribe_openai(AUDIO, "a.wav", language="en")
+    req = captured[0]
+    assert req["headers"]["content-length"] == str(len(req["body"]))
+    assert req["headers"]["content-type"].startswith("multipart/form-data; boundary=")
+    assert AUDIO in req["body"] and b'name="language"\r\n\r\nen\r\n' in req["body"]
+
+
+async def _no_sleep(_seconds):
+    return None
+
+
+async def test_aibuilder冷启动重试复用同一请求体(monkeypatch, captured):
+    monkeypatch.setattr(server2, "AI_BUILDER_TOKEN", "tok")
+    monkeypatch.setattr(af.asyncio, "sleep", _no_sleep)
+    text, _ = await af._transcribe_ai_builder(AUDIO, "a.wav")
+    assert text == "你好"
+    assert len(captured) == 2
+    assert captured[0]["body"] == captured[1]["body"]
+    assert b'name="audio_file"; filename="a.wav"' in captured[0]["body"]
+
+
+async def test_旧版speech_to_text走流式body(monkeypatch, captured):
+    monkeypatch.setattr(server2.GOOGLE_TOKENS, "current_token", lambda: "token")
+    server2.RATE_LIMITER.reset()
+    server2.COST_LIMITER.reset()
+    transport = httpx.ASGITransport(app=server2.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as c:
+        r = await c.post("/speech-to-text", files={"audio_file": ("a.wav", AUDIO, "audio/wav")})
+    assert r.status_code == 200 and r.json()["text"] == "你好"
+    sent = json.loads(captured[0]["body"])
+    assert base64.b64decode(sent["audio"]["content"]) == AUDIO
+    assert sent["config"]["encoding"] == "LINEAR16"
+
+
+async def test_旧版aibuilder路由分块读取_流式multipart(monkeypatch, captured):
+    monkeypatch.setattr(server2, "AI_BUILDER_TOKEN", "token")
+    closed = []
+    real_close = AudioSource.close
+    monkeypatch.setattr(AudioSource, "close", lambda self: closed.append(self.spooled) or real_close(self))
+    audio = AUDIO * 6                              # 1.2MB：超过落盘阈值
+    server2.RATE_LIMITER.reset()
+    server2.COST_LIMITER.reset()
+    transport = httpx.ASGITransport(app=server2.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as c:
+        r = await c.post("/speech-to-text-aibuilder", files={"audio_file": ("a.wav", audio, "audio/wav")})
+    assert r.status_code == 200
+    req = captured[0]
+    assert req["headers"]["content-length"] == str(len(req["body"]))
+    assert "transfer-encoding" not in req["headers"]
+    assert audio in req["body"] and b'name="audio_file"; filename="a.wav"' in req["body"]
+    assert closed == [True]
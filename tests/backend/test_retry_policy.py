@@ -0,0 +1,126 @@
+"""
+🎯 临时错误快速重试（后端 pytest）— v142 retry_policy
+
+覆盖：
+  · 偶发 502 / 连接重置 → 同一 provider 重试成功，不降级；重试记录写进 metadata["retries"] 与截止时间账本
+  · 非临时错误（400、空文本）不重试，直接落到下一个 provider
+  · 每个 provider 的重试次数上限
+  · decorrelated jitter：间隔落在 [base, 上次 × 3] 且不超过 cap
+  · 全局重试预算：窗口内重试 ≤ 调用 × ratio + 保底；预算用完就不重试，过了窗口恢复
+  · 剩余截止时间不够等下一次间隔时不重试
+
+做法：monkeypatch 掉 _transcribe_*；重试间隔由 conftest 压到毫秒级。
+"""
+import pytest
+
+import api_fallback as af
+import deadlines
+import retry_policy
+from deadlines import Deadline
+from retry_policy import RetryBudget, RetryPolicy
+
+
+@pytest.fixture(autouse=True)
+def reset_status():
+    snap = dict(af.API_FALLBACK_STATUS)
+    for k in ("openai_quota_exceeded", "ai_builder_quota_exceeded", "deepgram_quota_exceeded"):
+        af.API_FALLBACK_STATUS[k] = False
+    yield
+    af.API_FALLBACK_STATUS.clear()
+    af.API_FALLBACK_STATUS.update(snap)
+
+
+def _flaky(name, calls, errors):
+    """按顺序抛出 errors 里的异常，用完后成功。"""
+    errors = list(errors)
+
+    async def f(*a, **k):
+        calls.append(name)
+        if errors:
+            raise Exception(errors.pop(0))
+        return f"{name.upper()}_TEXT", {}
+    return f
+
+
+def _patch(monkeypatch, calls, openai_errors=(), ai_errors=()):
+    monkeypatch.setattr(af, "_transcribe_openai", _flaky("openai", calls, openai_errors))
+    monkeypatch.setattr(af, "_transcribe_ai_builder", _flaky("ai", calls, ai_errors))
+    monkeypatch.setattr(af, "_transcribe_google", _flaky("google", calls, ()))
+
+
+async def test_偶发502重试成功_不降级(monkeypatch):
+    calls = []
+    _patch(monkeypatch, calls, openai_errors=["OpenAI API 错误 [502]: Bad Gateway",
+                                              "ReadError (https://api.openai.com): connection reset"])
+    deadline = Deadline(30)
+    with deadlines.scope(deadline):
+        text, api_used, meta = await af.transcribe_with_fallback(b"x", "f.wav", duration=30)
+    assert api_used == "openai_whisper" and calls == ["openai"] * 3
+    assert [r["attempt"] for r in meta["retries"]] == [1, 2]
+    assert "502" in meta["retries"][0]["error"]
+    assert [a["outcome"] for a in deadline.attempts] == ["retried", "retried", "ok"]
+
+
+async def test_非临时错误不重试(monkeypatch):
+    calls = []
+    _patch(monkeypatch, calls, openai_errors=["OpenAI API 错误 [400]: Invalid file format"])
+    _, api_used, meta = await af.transcribe_with_fallback(b"x", "f.wav")
+    assert api_used == "ai_builder" and calls == ["openai", "ai"]
+    assert "retries" not in meta
+
+
+async def test_重试次数有上限(monkeypatch):
+    calls = []
+    _patch(monkeypatch, calls, openai_errors=["OpenAI API 错误 [503]: unavailable"] * 10)
+    monkeypatch.setitem(retry_policy.PROVIDER_MAX_RETRIES, "openai", 2)
+    _, api_used, _ = await af.transcribe_with_fallback(b"x", "f.wav")
+    assert api_used == "ai_builder"
+    assert calls == ["openai"] * 3 + ["ai"]
+
+
+def test_decorrelated_jitter间隔范围():
+    bounds = []
+
+    def rng(low, high):
+        bounds.append((low, high))
+        return high           # 总取上界，看封顶
+
+    policy = RetryPolicy(3, base=0.1, cap=1.0, rng=rng)
+    delays = [policy.next_delay(None)]
+    for _ in range(3):
+        delays.append(policy.next_delay(delays[-1]))
+    assert bounds[0] == (0.1, pytest.approx(0.3))
+    assert bounds[1] == (0.1, pytest.approx(0.9))
+    assert delays == [pytest.approx(0.3), pytest.approx(0.9), 1.0, 1.0]
+
+
+def test_全局重试预算按比例与窗口():
+    now = [0.0]
+    budget = RetryBudget(ratio=0.1, min_retries=1, window=60, clock=lambda: now[0])
+    for _ in range(20):
+        budget.record_call()
+    # 20 次调用 × 10% + 保底 1 = 3 次重试
+    assert [budget.try_acquire() for _ in range(4)] == [True, True, True, False]
+    assert budget.snapshot()["denied"] == 1
+    now[0] = 61.0             # 窗口滑过：旧调用与旧重试都不算了，只剩保底
+    assert budget.try_acquire() is True
+    assert budget.try_acquire() is False
+
+
+async def test_预算用完不再重试(monkeypatch):
+    calls = []
+    _patch(monkeypatch, calls, openai_errors=["OpenAI API 错误 [503]: unavailable"] * 10)
+    monkeypatch.setattr(retry_policy, "RETRY_BUDGET", RetryBudget(ratio=0.0, min_retries=1))
+    _, api_used, _ = await af.transcribe_with_fallback(b"x", "f.wav")
+    assert calls == ["openai", "openai", "ai"]      # 预算只够一次重试
+    assert af.get_api_status()["retry"]["budget"]["denied"] == 1
+
+
+async def test_截止时间不够等下一次间隔时不重试(monkeypatch):
+    calls = []
+    _patch(monkeypatch, calls, openai_errors=["OpenAI API 错误 [503]: unavailable"])
+    monkeypatch.setattr(retry_policy, "RETRY_BASE_DELAY_SECONDS", 5.0)
+    monkeypatch.setattr(retry_policy, "RETRY_MAX_DELAY_SECONDS", 5.0)
+    with deadlines.scope(Deadline(2.0)):
+        _, api_used, _ = await af.transcribe_with_fallback(b"x", "f.wav")
+    assert api_used == "ai_builder" and calls == ["openai", "ai"]
@@ -0,0 +1,143 @@
+"""
+🎯 在途请求合并（后端 pytest）— v132 transcription_cache.SingleFlight
+
+覆盖：
+  · 同 key 并发 → 只跑一次，其余请求拿到同一结果（标 dedup: joined）
+  · 失败也共享：所有等待者都收到同一个异常，且失败后 key 释放、下一次重新调用
+  · 发起者断线（被取消）不会取消底层调用，重传请求照样拿到结果
+  · Idempotency-Key：音频字节不同但 key 相同 → 合并；不同客户端同 key → 不合并
+  · /transcribe-segment 端点：两个相同音频并发提交，provider 只被调用一次
+
+运行：./venv/bin/pytest
+"""
+import asyncio
+import io
+
+import pytest
+from starlette.datastructures import UploadFile
+
+import api_fallback as af
+import server2
+import transcription_cache as tc
+from transcription_cache import SingleFlight, TranscriptionCache
+
+
+async def test_同key并发只执行一次():
+    sf = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "结果"
+
+    results = await asyncio.gather(*[sf.do(["k"], work) for _ in range(4)])
+    assert [r for r, _ in results] == ["结果"] * 4
+    assert sorted(j for _, j in results) == [False, True, True, True]
+    assert len(calls) == 1
+    assert sf.stats() == {"in_flight": 0, "started": 1, "joined": 3, "orphaned": 0, "cancelled": 0}
+
+
+async def test_失败共享且之后key释放():
+    sf = SingleFlight()
+    calls = []
+
+    async def boom():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        raise Exception("所有转录 API 都失败了")
+
+    results = await asyncio.gather(sf.do(["k"], boom), sf.do(["k"], boom), return_exceptions=True)
+    assert all("都失败了" in str(r) for r in results)
+    assert len(calls) == 1
+
+    with pytest.raises(Exception):
+        await sf.do(["k"], boom)
+    assert len(calls) == 2
+
+
+async def test_发起者断线不取消底层调用_重传拿到结果():
+    sf = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "结果"
+
+    leader = asyncio.ensure_future(sf.do(["k"], work))
+    await asyncio.sleep(0.02)
+    leader.cancel()                      # 浏览器 120s 超时断开
+    retry_result, joined = await sf.do(["k"], work)   # 重传请求
+    assert (retry_result, joined) == ("结果", True)
+    assert len(calls) == 1
+
+
+async def test_任一key命中即合并():
+    sf = SingleFlight()
+    gate = asyncio.Event()
+
+    async def work():
+        await gate.wait()
+        return "结果"
+
+    first = asyncio.ensure_future(sf.do(["idem:c1:abc", "content:111"], work))
+    await asyncio.sleep(0)
+    assert sf.pending("idem:c1:abc") and sf.pending("content:111")
+    second = asyncio.ensure_future(sf.do(["idem:c1:abc", "content:222"], work))
+    await asyncio.sleep(0)
+    gate.set()
+    assert (await second) == ("结果", True)
+    assert (await first) == ("结果", False)
+    assert not sf.pending("content:111")
+
+
+# ---------- 端点 ----------
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    monkeypatch.setattr(server2, "TRANSCRIPTION_CACHE", TranscriptionCache(disk_dir=None))
+    monkeypatch.setattr(server2, "IN_FLIGHT", SingleFlight())
+    monkeypatch.setattr(tc, "CACHE_ENABLED", True)
+    calls = []
+
+    async def slow(**kw):
+        calls.append(kw["audio_content"])
+        await asyncio.sleep(0.05)
+        return "转录结果", "openai_whisper", {}
+
+    monkeypatch.setattr(af, "transcribe_with_fallback", slow)
+    return calls
+
+
+class _FakeRequest:
+    def __init__(self, host):
+        self.headers = {}
+        self.client = type("C", (), {"host": host})()
+
+
+async def _post(audio, idem=None, host="1.1.1.1"):
+    upload = UploadFile(file=io.BytesIO(audio), filename="a.webm")
+    return await server2.transcribe_segment(
+        audio_file=upload, duration=30, needs_segmentation=None, language=None,
+        audio_source="microphone", preferred_api=None,
+        idempotency_key=idem, request=_FakeRequest(host),
+    )
+
+
+async def test_端点并发相同音频只调一次provider(endpoint):
+    audio = b"\x1aE\xdf\xa3" + b"\x02" * 64
+    a, b = await asyncio.gather(_post(audio), _post(audio))
+    assert a["text"] == b["text"] == "转录结果"
+    assert len(endpoint) == 1
+    assert {a["metadata"].get("dedup"), b["metadata"].get("dedup")} == {None, "joined"}
+
+
+async def test_端点幂等key合并_按客户端隔离(endpoint):
+    # 重传时前端重新编码，字节不同，但带同一个 Idempotency-Key
+    await asyncio.gather(_post(b"one" * 30, idem="rec-1"), _post(b"two" * 30, idem="rec-1"))
+    assert len(endpoint) == 1
+    # 别的客户端猜到同一个 key 也拿不到别人的结果
+    await asyncio.gather(_post(b"three" * 30, idem="rec-2", host="1.1.1.1"),
+                         _post(b"four" * 30, idem="rec-2", host="2.2.2.2"))
+    assert len(endpoint) == 3
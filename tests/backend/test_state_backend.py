@@ -0,0 +1,223 @@
+"""
+🎯 共享状态后端（后端 pytest）— v147 state_backend
+
+覆盖：
+  · 四种后端同一套契约：incr / get_many / set / delete / clear，TTL 到期即消失，incr 不续期
+  · 两个"worker"（同一文件的两个后端实例 / 真正 fork 出的子进程）合计一个限额、一份计数
+  · 一个进程判定配额耗尽 / 熔断 / 限流冷却，别的进程直接跳过；探测成功后熔断标记一起清掉
+  · Redis 不可用时限流退回进程内，照常限流，不放开也不全拒
+  · Redis 一批命令中途回 -ERR（如 AUTH 失败）后关掉连接重连，后续命令不会读到错位的回复
+  · clear(namespace) 只清那一类键；Redis 只 SCAN + DEL 本服务前缀下的键，同库别的服务的键不动（v154）
+  · 事件循环上不直接碰 SQLite / Redis：限流整次检查放到专用线程；熔断 / 冷却读镜像、写入排队，
+    后台同步一次批量刷出 / 读回；慢后端不卡住别的协程（v154）
+
+做法：shm / sqlite 落在 tmp_path；Redis 连 serve_stand_in() 起的本机 RESP 替身；
+"另一个进程"用新的 CircuitBreaker / ProviderCooldowns 实例 + 清空的本地标记模拟，计数用 fork 的子进程。
+"""
+import asyncio
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+import api_fallback as af
+import provider_errors
+import state_backend
+from provider_health import CircuitBreaker, ProviderCooldowns, get_breaker
+from rate_limiter import SharedRateLimiter
+from state_backend import MemoryBackend, RedisBackend, SharedMemoryBackend, SQLiteBackend, serve_stand_in
+
+
+@pytest.fixture(scope="module")
+def resp_stand_in():
+    server, url = serve_stand_in()
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["memory", "shm", "sqlite", "redis"])
+def backend(request, tmp_path, resp_stand_in):
+    if request.param == "memory":
+        return MemoryBackend()
+    if request.param == "shm":
+        return SharedMemoryBackend(str(tmp_path / "state.shm"), slots=1024)
+    if request.param == "sqlite":
+        return SQLiteBackend(str(tmp_path / "state.sqlite3"))
+    b = RedisBackend(resp_stand_in, timeout=1.0)
+    b.clear()
+    return b
+
+
+@pytest.fixture
+def shared(monkeypatch, tmp_path):
+    """把全局状态后端换成共享的 SQLite（模拟多 worker 部署）。"""
+    monkeypatch.setattr(state_backend, "STATE", SQLiteBackend(str(tmp_path / "shared.sqlite3")))
+    snap = dict(af.API_FALLBACK_STATUS)
+    af.API_FALLBACK_STATUS["openai_quota_exceeded"] = False
+    yield state_backend.STATE
+    af.API_FALLBACK_STATUS.clear()
+    af.API_FALLBACK_STATUS.update(snap)
+
+
+def test_后端契约(backend):
+    assert backend.incr("a") == 1 and backend.incr("a", 2.5) == 3.5
+    backend.set("b", 7, ttl=0.05)
+    assert backend.get_many(["a", "b", "missing"]) == [3.5, 7, None]
+    backend.incr("c", 1, ttl=0.05)
+    time.sleep(0.02)
+    backend.incr("c", 1, ttl=10)                    # 已存在的键不续期
+    time.sleep(0.06)
+    assert backend.get("b") is None and backend.get("c") is None
+    assert backend.incr("c") == 1                   # 过期后从 0 重新计
+    backend.delete("a")
+    assert backend.get("a") is None
+    backend.clear()
+    assert backend.get("c") is None
+
+
+@pytest.mark.parametrize("kind", ["shm", "sqlite"])
+def test_两个worker合计一个限额(kind, tmp_path):
+    path = str(tmp_path / f"limits.{kind}")
+    make = (lambda: SharedMemoryBackend(path, slots=1024)) if kind == "shm" else (lambda: SQLiteBackend(path))
+    worker_a, worker_b = SharedRateLimiter(make()), SharedRateLimiter(make())
+    limits = [(60, 4)]
+    results = [(worker_a if i % 2 else worker_b).hit("1.2.3.4", limits, now=30.0)[0] for i in range(6)]
+    assert results == [True] * 4 + [False] * 2
+
+
+def _incr_many(path, n):
+    backend = SharedMemoryBackend(path, slots=1024)
+    for _ in range(n):
+        backend.incr("usage:openai")
+
+
+def test_fork出的子进程与父进程共用计数(tmp_path):
+    path = str(tmp_path / "usage.shm")
+    parent = SharedMemoryBackend(path, slots=1024)
+    child = multiprocessing.get_context("fork").Process(target=_incr_many, args=(path, 200))
+    child.start()
+    for _ in range(200):
+        parent.incr("usage:openai")
+    child.join(10)
+    assert child.exitcode == 0
+    assert parent.get("usage:openai") == 400
+
+
+def test_配额耗尽_熔断_冷却跨进程可见(shared):
+    af._apply_error_class("openai", provider_errors.QUOTA_EXHAUSTED, None)
+    af.API_FALLBACK_STATUS["openai_quota_exceeded"] = False     # 另一个 worker：本地什么都不知道
+    assert af._quota_locked("openai") and af.should_retry_api("openai") is False
+    assert af.skip_reason("openai") == "配额已耗尽"
+    assert af.get_api_status()["openai"]["quota_exceeded"] is True
+
+    get_breaker("google").trip(30, "测试")
+    other = CircuitBreaker("google")
+    assert other.allow_request() is False and other.acquire() is False
+    assert other.snapshot()["shared_open"] is True
+    get_breaker("google")._close()                              # 探测成功的进程清掉共享标记
+    assert other.allow_request() is True
+
+    af.COOLDOWNS.set("deepgram", 20, provider_errors.RATE_LIMITED)
+    assert ProviderCooldowns().describe("deepgram")["reason"] == provider_errors.RATE_LIMITED
+
+
+def test_用量计数各worker合计(shared):
+    af._count_usage("openai")
+    af.API_FALLBACK_STATUS["api_usage_count"]["openai"] = 0     # 另一个 worker
+    af._count_usage("openai")
+    status = af.get_api_status()
+    assert status["state_backend"] == "sqlite" and status["openai"]["usage_count_all_workers"] == 2
+
+
+def test_Redis不可用时退回进程内限流():
+    limiter = SharedRateLimiter(RedisBackend("redis://127.0.0.1:1/0", timeout=0.05))
+    limits = [(60, 2)]
+    assert [limiter.hit("a", limits)[0] for _ in range(3)] == [True, True, False]
+    assert limiter.stats()["backend_errors"] == 3
+
+
+def test_clear只清本命名空间(backend):
+    backend.set("rl:1.2.3.4:60:0", 3)
+    backend.set("breaker:google", 1)
+    backend.clear("rl")
+    assert backend.get_many(["rl:1.2.3.4:60:0", "breaker:google"]) == [None, 1]
+
+
+def test_Redis只删本服务前缀下的键(resp_stand_in):
+    ours, neighbour = RedisBackend(resp_stand_in), RedisBackend(resp_stand_in, key_prefix="billing:")
+    neighbour.set("invoice", 42)
+    ours.set("breaker:google", 1)
+    limiter = SharedRateLimiter(ours)
+    limiter.hit("a", [(60, 5)])
+    limiter.reset()
+    assert ours.get("breaker:google") == 1 and neighbour.get("invoice") == 42
+    ours.clear()
+    assert ours.get("breaker:google") is None and neighbour.get("invoice") == 42
+
+
+class _SlowSQLite(SQLiteBackend):
+    def __init__(self, path, delay):
+        super().__init__(path)
+        self.delay = delay
+        self.threads = set()
+
+    def get_many(self, keys):
+        self.threads.add(threading.current_thread().name)
+        time.sleep(self.delay)
+        return super().get_many(keys)
+
+
+async def test_慢后端不阻塞事件循环(tmp_path):
+    slow = _SlowSQLite(str(tmp_path / "slow.sqlite3"), delay=0.2)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    t = asyncio.ensure_future(ticker())
+    allowed, _, _ = await SharedRateLimiter(slow).ahit("a", [(60, 5)])
+    t.cancel()
+    assert allowed and ticks >= 10
+    assert slow.threads == {"state-backend_0"}
+
+
+async def test_熔断冷却读镜像_后台批量同步(shared, monkeypatch):
+    mirror = state_backend.StateMirror(interval=0)
+    monkeypatch.setattr(state_backend, "MIRROR", mirror)
+    reads = []
+    real_get_many = shared.get_many
+    monkeypatch.setattr(shared, "get_many", lambda keys: reads.append(
+        (threading.current_thread().name, list(keys))) or real_get_many(keys))
+
+    get_breaker("google").trip(30, "测试")          # 本进程写：镜像立即可见，后端稍后由后台刷出
+    assert CircuitBreaker("google").allow_request() is False and reads == []
+    await mirror._sync_task
+    assert real_get_many(["breaker:google"]) == [1]
+
+    shared.set("cooldown:deepgram:rate_limited", time.time() + 20, ttl=20)     # 另一个 worker 写的
+    assert ProviderCooldowns().remaining("deepgram") == 0                      # 镜像里还没有，先不等
+    await mirror._sync_task
+    assert ProviderCooldowns().remaining("deepgram") > 19
+    assert {name for name, _ in reads} == {"state-backend_0"}
+    assert "breaker:google" in reads[-1][1] and "cooldown:deepgram:auth" in reads[-1][1]   # 一次批量读回
+
+
+def test_Redis错误回复后不读错位的回复(resp_stand_in, monkeypatch):
+    real_execute = state_backend._StandInHandler._execute
+
+    def wrong_password(self, store, name, args):
+        return b"-WRONGPASS invalid password\r\n" if name == "AUTH" else real_execute(self, store, name, args)
+
+    monkeypatch.setattr(state_backend._StandInHandler, "_execute", wrong_password)
+    url = resp_stand_in.replace("redis://", "redis://:secret@").rsplit("/", 1)[0] + "/1"
+    backend = RedisBackend(url, timeout=1.0)
+    with pytest.raises(state_backend.StateBackendError):
+        backend.get("rl:a")                   # AUTH 回错，SELECT 的 +OK 还在连接上
+    monkeypatch.setattr(state_backend._StandInHandler, "_execute", real_execute)
+    backend.set("rl:a", 3)
+    assert backend.get_many(["rl:a", "rl:b"]) == [3, None]
@@ -0,0 +1,100 @@
+"""
+🎯 系统音频竞速模式（后端 pytest）— v128 transcribe_system_audio(strategy="race")
+
+覆盖：
+  · 参赛者并行启动，最快的合格结果胜出，其余取消，胜者写入 metadata["race"] 与 race_wins
+  · 质量门槛：后处理后为空（幻觉套话）或 0 个说话人的结果不能赢，继续等其他参赛者
+  · 参赛者全部失败 → 未参赛的 Deepgram 按原顺序兜底
+  · 默认 sequential 行为不变（OpenAI Diarize 成功即返回，不碰 Google）
+
+做法：monkeypatch 掉 _transcribe_openai_diarize / _google / _deepgram，不打网络。
+"""
+import asyncio
+
+import pytest
+
+import api_fallback as af
+
+
+@pytest.fixture(autouse=True)
+def reset_state():
+    snap = dict(af.API_FALLBACK_STATUS)
+    af.API_FALLBACK_STATUS["deepgram_quota_exceeded"] = False
+    af.API_FALLBACK_STATUS["race_wins"] = {}
+    yield
+    af.API_FALLBACK_STATUS.clear()
+    af.API_FALLBACK_STATUS.update(snap)
+
+
+def _mock(name, events, delay=0.0, text=None, meta=None, fail=None):
+    async def f(*a, **k):
+        events.append(("start", name))
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            events.append(("cancelled", name))
+            raise
+        if fail:
+            raise Exception(fail)
+        return (text if text is not None else f"{name} 的转录"), dict(meta or {"num_speakers": 2})
+    return f
+
+
+def _patch(monkeypatch, diarize, google, deepgram):
+    monkeypatch.setattr(af, "_transcribe_openai_diarize", diarize)
+    monkeypatch.setattr(af, "_transcribe_google", google)
+    monkeypatch.setattr(af, "_transcribe_deepgram", deepgram)
+
+
+async def test_最快的合格结果胜出_其余取消(monkeypatch):
+    ev = []
+    _patch(monkeypatch,
+           diarize=_mock("openai_diarize", ev, delay=2.0),
+           google=_mock("google", ev, delay=0.01, meta={"speaker_count": 3}),
+           deepgram=_mock("deepgram", ev))
+    text, api_used, meta = await af.transcribe_system_audio(b"x", "f.webm", strategy="race")
+    assert api_used == "google"
+    assert ("start", "openai_diarize") in ev and ("start", "google") in ev
+    assert ("cancelled", "openai_diarize") in ev
+    assert ("start", "deepgram") not in ev  # 默认参赛者只有 openai_diarize + google
+    assert meta["race"]["winner"] == "google"
+    assert meta["race"]["speaker_count"] == 3
+    assert af.API_FALLBACK_STATUS["race_wins"] == {"google": 1}
+    assert af.get_api_status()["race_wins"] == {"google": 1}
+
+
+@pytest.mark.parametrize("bad", [
+    dict(text="请不吝点赞 订阅 转发 打赏支持明镜与点点"),   # 整段幻觉套话 → 后处理后为空
+    dict(meta={"speaker_count": 0}),                          # 开了 diarization 却 0 个说话人
+])
+async def test_不合格的快结果不能赢(monkeypatch, bad):
+    ev = []
+    _patch(monkeypatch,
+           diarize=_mock("openai_diarize", ev, delay=0.05),
+           google=_mock("google", ev, delay=0.0, **bad),
+           deepgram=_mock("deepgram", ev))
+    text, api_used, meta = await af.transcribe_system_audio(b"x", "f.webm", strategy="race")
+    assert api_used == "openai_diarize"
+    assert text == "openai_diarize 的转录"
+
+
+async def test_参赛者全部失败_未参赛者兜底(monkeypatch):
+    ev = []
+    _patch(monkeypatch,
+           diarize=_mock("openai_diarize", ev, fail="diarize down"),
+           google=_mock("google", ev, fail="google down"),
+           deepgram=_mock("deepgram", ev))
+    text, api_used, meta = await af.transcribe_system_audio(b"x", "f.webm", strategy="race")
+    assert api_used == "deepgram_nova2_chinese"
+    assert "race" not in meta
+
+
+async def test_默认顺序模式行为不变(monkeypatch):
+    ev = []
+    _patch(monkeypatch,
+           diarize=_mock("openai_diarize", ev),
+           google=_mock("google", ev),
+           deepgram=_mock("deepgram", ev))
+    text, api_used, meta = await af.transcribe_system_audio(b"x", "f.webm")
+    assert api_used == "openai_diarize"
+    assert [e for e in ev if e[0] == "start"] == [("start", "openai_diarize")]
@@ -0,0 +1,145 @@
+"""
+🎯 转录结果缓存（后端 pytest）— v131 transcription_cache
+
+覆盖：
+  · key：同音频同参数 → 同 key；language / audio_source / preferred_api 任一不同 → 不同 key
+  · 内存层 LRU 按字节封顶，淘汰最久未用的条目
+  · 磁盘层：跨实例命中（模拟重启/多 worker），TTL 过期即失效并删文件
+  · /transcribe-segment：第二次提交同一音频不再调 provider，metadata.cache == "hit"
+
+做法：时钟可注入；端点直接 await 路由函数，provider 调用 monkeypatch 掉。
+"""
+import io
+import os
+
+import pytest
+from starlette.datastructures import UploadFile
+
+import api_fallback as af
+import server2
+import transcription_cache as tc
+from transcription_cache import TranscriptionCache
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_key区分影响结果的参数():
+    base = tc.cache_key(b"audio", None, "microphone", None)
+    assert base == tc.cache_key(b"audio", None, None, None)  # audio_source 默认 microphone
+    assert base != tc.cache_key(b"audio!", None, "microphone", None)
+    assert base != tc.cache_key(b"audio", "en", "microphone", None)
+    assert base != tc.cache_key(b"audio", None, "system", None)
+    assert base != tc.cache_key(b"audio", None, "microphone", "google")
+
+
+def test_内存层按字节上限做LRU淘汰():
+    clock = _Clock()  # 固定时间戳，条目大小才一致
+    probe = TranscriptionCache(disk_dir=None, clock=clock)
+    probe.put("a", "字" * 30, "openai", {})
+    one = probe.stats()["bytes"]
+
+    c = TranscriptionCache(max_bytes=one * 3, disk_dir=None, clock=clock)  # 恰好放得下 3 条
+    for k in "abc":
+        c.put(k, "字" * 30, "openai", {})
+    c.get("a")  # a 变成最近使用
+    c.put("d", "字" * 30, "openai", {})
+    assert c.stats()["entries"] == 3 and c.stats()["bytes"] <= one * 3
+    assert c.get("a") is not None
+    assert c.get("b") is None  # 最久未用的先走
+    assert c.stats()["evictions"] >= 1
+
+
+def test_取出的元数据是副本():
+    c = TranscriptionCache(disk_dir=None)
+    meta = {"k": 1}
+    c.put("x", "t", "openai", meta)
+    meta["k"] = 2
+    got = c.get("x")[2]
+    got["cache"] = "hit"
+    assert c.get("x")[2] == {"k": 1}
+
+
+def test_磁盘层跨实例命中且TTL过期(tmp_path):
+    clock = _Clock()
+    c1 = TranscriptionCache(disk_dir=str(tmp_path), ttl_seconds=60, clock=clock)
+    c1.put("k", "你好", "google", {"speaker_count": 2})
+
+    c2 = TranscriptionCache(disk_dir=str(tmp_path), ttl_seconds=60, clock=clock)
+    text, api_used, meta, _ = c2.get("k")
+    assert (text, api_used, meta) == ("你好", "google", {"speaker_count": 2})
+    assert c2.stats()["disk_hits"] == 1
+
+    clock.now += 61
+    c3 = TranscriptionCache(disk_dir=str(tmp_path), ttl_seconds=60, clock=clock)
+    assert c3.get("k") is None
+    assert not os.path.exists(tmp_path / "k.json")
+
+
+def test_启动清理过期磁盘文件(tmp_path):
+    c = TranscriptionCache(disk_dir=str(tmp_path), ttl_seconds=60)
+    c.put("old", "t", "openai", {})
+    os.utime(tmp_path / "old.json", (0, 0))
+    c.put("new", "t", "openai", {})
+    assert c.purge_expired() == 1
+    assert sorted(os.listdir(tmp_path)) == ["new.json"]
+
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    cache = TranscriptionCache(disk_dir=None)
+    monkeypatch.setattr(server2, "TRANSCRIPTION_CACHE", cache)
+    monkeypatch.setattr(tc, "CACHE_ENABLED", True)
+    return cache
+
+
+async def _post(audio, **form):
+    upload = UploadFile(file=io.BytesIO(audio), filename="a.webm")
+    params = dict(duration=30, needs_segmentation=None, language=None,
+                  audio_source="microphone", preferred_api=None, idempotency_key=None, request=None)
+    params.update(form)
+    return await server2.transcribe_segment(audio_file=upload, **params)
+
+
+async def test_端点重复提交命中缓存不再调用provider(monkeypatch, fresh_cache):
+    calls = []
+
+    async def fake_fallback(**kw):
+        calls.append(kw["audio_content"])
+        return "转录结果", "openai_whisper", {"model": "whisper-1"}
+
+    monkeypatch.setattr(af, "transcribe_with_fallback", fake_fallback)
+    audio = b"\x1aE\xdf\xa3" + b"\x00" * 64
+
+    first = await _post(audio)
+    assert first["success"] and first["metadata"]["cache"] == "miss"
+
+    second = await _post(audio)
+    assert second["success"]
+    assert second["text"] == "转录结果" and second["api_used"] == "openai_whisper"
+    assert second["metadata"]["cache"] == "hit"
+    assert second["metadata"]["model"] == "whisper-1"
+    assert len(calls) == 1
+
+    # 参数不同就是另一条缓存
+    await _post(audio, language="en")
+    assert len(calls) == 2
+
+
+async def test_失败结果不缓存(monkeypatch, fresh_cache):
+    calls = []
+
+    async def failing(**kw):
+        calls.append(1)
+        raise Exception("所有转录 API 都失败了: boom")
+
+    monkeypatch.setattr(af, "transcribe_with_fallback", failing)
+    audio = b"\x1aE\xdf\xa3" + b"\x01" * 64
+    assert not (await _post(audio))["success"]
+    assert not (await _post(audio))["success"]
+    assert len(calls) == 2
@@ -0,0 +1,241 @@
+"""
+🎯 异步转录任务（后端 pytest）— v133 transcription_jobs + /transcribe-jobs
+
+覆盖：
+  · JobManager：worker 数封顶并发；队列满抛 JobQueueFull；结束的任务过 TTL 后清理
+  · 失败任务带 error，不影响 worker 继续处理后续任务
+  · 端点：POST 立即 202 返回 job_id（不等转录）→ GET 轮询到 succeeded 拿结果
+  · 端点：SSE 事件流按 queued → running → succeeded 推送并在结束时关闭
+  · 未知 job_id → 404；队列满 → 503 + Retry-After
+  · 没跑就结束的任务（换事件循环作废、关闭时还在排队）也调 on_done、记 finished_at，到期照常清理；
+    端点借此归还每客户端在途名额、关掉上传的临时文件（v156）
+
+做法：走 httpx.ASGITransport 打真实 app（含中间件），provider 调用 monkeypatch 掉。
+"""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import api_fallback as af
+import provider_concurrency
+import server2
+import upload_intake
+import transcription_cache as tc
+from transcription_cache import SingleFlight, TranscriptionCache
+from transcription_jobs import FAILED, SUCCEEDED, JobManager, JobQueueFull
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+async def _until_done(job, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not job.done:
+        assert asyncio.get_running_loop().time() < deadline, "任务没有按时结束"
+        await asyncio.sleep(0.01)
+
+
+# ---------- JobManager ----------
+
+async def test_worker数封顶并发():
+    jm = JobManager(workers=2, max_queue=10)
+    running, peak = 0, 0
+
+    async def work():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.03)
+        running -= 1
+        return "ok"
+
+    jobs = [jm.submit(work) for _ in range(6)]
+    for j in jobs:
+        await _until_done(j)
+    assert peak == 2
+    assert all(j.status == SUCCEEDED and j.result == "ok" for j in jobs)
+    await jm.stop()
+
+
+async def test_队列满拒绝():
+    jm = JobManager(workers=1, max_queue=1)
+    gate = asyncio.Event()
+
+    async def blocked():
+        await gate.wait()
+
+    jm.submit(blocked)
+    await asyncio.sleep(0)      # worker 取走第一个
+    jm.submit(blocked)          # 占满队列
+    with pytest.raises(JobQueueFull):
+        jm.submit(blocked)
+    gate.set()
+    await jm.stop()
+
+
+async def test_失败任务带error且worker继续工作():
+    jm = JobManager(workers=1)
+
+    async def boom():
+        raise Exception("所有转录 API 都失败了: x")
+
+    async def ok():
+        return "ok"
+
+    bad, good = jm.submit(boom), jm.submit(ok)
+    await _until_done(good)
+    assert bad.status == FAILED and "都失败了" in bad.error
+    assert good.status == SUCCEEDED
+    assert "error" in bad.to_dict() and "result" not in bad.to_dict()
+    await jm.stop()
+
+
+async def test_结束的任务过TTL清理():
+    clock = _Clock()
+    jm = JobManager(workers=1, ttl_seconds=60, clock=clock)
+
+    async def ok():
+        return "ok"
+
+    job = jm.submit(ok)
+    await _until_done(job)
+    clock.now += 30
+    assert jm.get(job.id) is job
+    clock.now += 31
+    assert jm.get(job.id) is None
+    await jm.stop()
+
+
+async def test_没跑就作废的任务也调on_done_到期清理():
+    clock = _Clock()
+    jm = JobManager(workers=1, ttl_seconds=60, clock=clock)
+    gate, done = asyncio.Event(), []
+
+    async def blocked():
+        await gate.wait()
+
+    running = jm.submit(blocked, on_done=done.append)
+    await asyncio.sleep(0)
+    queued = jm.submit(blocked, on_done=done.append)
+    for t in jm._tasks:             # 模拟旧事件循环没了：worker 不再存在，也没走 stop()
+        t.cancel()
+    await asyncio.gather(*jm._tasks, return_exceptions=True)
+    jm._loop = None
+    jm.submit(blocked)               # 下一次提交在"新循环"上重新拉起 worker
+    assert running.status == queued.status == FAILED
+    assert done == [running, queued] and queued.finished_at == clock.now
+    clock.now += 61
+    assert jm.get(queued.id) is None and jm.get(running.id) is None
+    gate.set()
+    await jm.stop()
+
+
+async def test_关闭时还在排队的任务调on_done():
+    jm = JobManager(workers=1)
+    gate, done = asyncio.Event(), []
+
+    async def blocked():
+        await gate.wait()
+
+    jobs = [jm.submit(blocked, on_done=done.append) for _ in range(3)]
+    await asyncio.sleep(0)
+    await jm.stop()
+    assert sorted(done, key=jobs.index) == jobs
+    assert all(j.status == FAILED and j.finished_at is not None for j in jobs)
+    assert "未执行" in jobs[2].error
+
+
+# ---------- 端点 ----------
+
+@pytest.fixture
+async def client(monkeypatch):
+    monkeypatch.setattr(server2, "JOB_MANAGER", JobManager(workers=2, max_queue=5))
+    monkeypatch.setattr(server2, "TRANSCRIPTION_CACHE", TranscriptionCache(disk_dir=None))
+    monkeypatch.setattr(server2, "IN_FLIGHT", SingleFlight())
+    monkeypatch.setattr(tc, "CACHE_ENABLED", True)
+    server2.RATE_LIMITER.reset()
+    server2.COST_LIMITER.reset()
+    state = {"gate": None, "calls": 0}
+
+    async def fake(**kw):
+        state["calls"] += 1
+        if state["gate"] is not None:
+            await state["gate"].wait()
+        return "任务结果", "openai_whisper", {"model": "whisper-1"}
+
+    monkeypatch.setattr(af, "transcribe_with_fallback", fake)
+    transport = httpx.ASGITransport(app=server2.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as c:
+        c.state = state
+        yield c
+    await server2.JOB_MANAGER.stop()
+
+
+async def _submit(c, audio=b"\x1aE\xdf\xa3" + b"\x03" * 64):
+    return await c.post("/transcribe-jobs", files={"audio_file": ("a.webm", audio, "audio/webm")},
+                        data={"duration": "30"})
+
+
+async def test_POST立即返回_轮询拿结果(client):
+    client.state["gate"] = asyncio.Event()   # provider 卡住，POST 也必须立刻返回
+    r = await _submit(client)
+    assert r.status_code == 202
+    body = r.json()
+    assert body["status"] == "queued" and body["poll_url"] == f"/transcribe-jobs/{body['job_id']}"
+
+    client.state["gate"].set()
+    for _ in range(100):
+        polled = (await client.get(body["poll_url"])).json()
+        if polled["status"] == "succeeded":
+            break
+        await asyncio.sleep(0.01)
+    assert polled["result"]["text"] == "任务结果"
+    assert polled["result"]["api_used"] == "openai_whisper"
+
+
+async def test_SSE推送状态直到结束(client):
+    r = await _submit(client)
+    events = (await client.get(r.json()["events_url"])).text
+    names = [line.split(": ", 1)[1] for line in events.splitlines() if line.startswith("event: ")]
+    assert names[-1] == "succeeded"
+    last = json.loads([l for l in events.splitlines() if l.startswith("data: ")][-1][6:])
+    assert last["result"]["text"] == "任务结果"
+
+
+async def test_未知job返回404(client):
+    r = await client.get("/transcribe-jobs/doesnotexist")
+    assert r.status_code == 404
+
+
+async def test_队列满返回503(client, monkeypatch):
+    monkeypatch.setattr(server2, "JOB_MANAGER", JobManager(workers=1, max_queue=1))
+    client.state["gate"] = asyncio.Event()
+    codes = []
+    for i in range(4):
+        codes.append((await _submit(client, audio=bytes([i]) * 100)).status_code)
+        await asyncio.sleep(0.01)          # 让 worker 取走已入队的任务（不依赖中间件里顺带的调度点）
+    assert codes[:2] == [202, 202] and 503 in codes
+    client.state["gate"].set()
+    await server2.JOB_MANAGER.stop()
+
+
+async def test_关闭时排队中的任务归还在途名额_关掉临时文件(client, monkeypatch):
+    monkeypatch.setattr(server2, "JOB_MANAGER", JobManager(workers=1, max_queue=5))
+    closed = []
+    real_close = upload_intake.AudioSource.close
+    monkeypatch.setattr(upload_intake.AudioSource, "close", lambda self: closed.append(self) or real_close(self))
+    client.state["gate"] = asyncio.Event()
+    for i in range(3):
+        assert (await _submit(client, audio=bytes([i]) * 100)).status_code == 202
+    await asyncio.sleep(0.01)
+    assert provider_concurrency.CLIENT_IN_FLIGHT.snapshot()["in_flight"] == 3
+    await server2.JOB_MANAGER.stop()                 # 1 个在跑被取消，2 个还在排队、从没跑过
+    assert provider_concurrency.CLIENT_IN_FLIGHT.snapshot()["in_flight"] == 0
+    assert len({id(source) for source in closed}) == 3
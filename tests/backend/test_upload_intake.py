@@ -0,0 +1,233 @@
+"""
+🎯 上传接收与承载（后端 pytest）— v135 upload_intake
+
+覆盖：
+  · AudioSource：小文件留内存、大文件落临时文件；大小/SHA-256 边读边算；独立 reader 互不干扰
+  · 落盘的音频按位置读走 mmap，不依赖 os.pread（Windows 没有）；读完 close() 照样解除 mmap、关文件
+  · 超过上限立即停止读取（不会把剩下的都读完）
+  · 大文件借用 Starlette 已落盘的临时文件（dup fd，不复制第二份）；retain / close 计数，最后一个释放才关
+  · 端点用完即关：/transcribe-segment 返回后临时文件已关闭
+  · 中间件：Content-Length 超限时一个字节都不读就 413；没带长度时边收边数、超限中断
+  · provider 适配器接受 AudioSource / memoryview：multipart、Deepgram 流式 content、Google base64
+    发出去的字节与原音频一致
+  · 缓存 key 与 bytes 时完全一致（v131 缓存不失效）
+
+做法：UploadFile 用内存文件构造；HTTP 走 httpx.MockTransport / ASGITransport。
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+import tempfile
+
+import httpx
+import pytest
+from starlette.datastructures import UploadFile
+
+import api_fallback as af
+import http_client
+import server2
+import transcription_cache as tc
+import upload_intake
+from upload_intake import AudioSource, UploadLimitMiddleware, UploadTooLarge
+
+AUDIO = bytes(range(256)) * 800   # 200KB
+
+
+class _CountingUpload:
+    def __init__(self, data):
+        self._file = io.BytesIO(data)
+        self.reads = 0
+
+    async def read(self, n=-1):
+        self.reads += 1
+        return self._file.read(n)
+
+
+async def test_小文件留内存_大文件落盘():
+    small = await AudioSource.from_upload(_CountingUpload(AUDIO), spool_threshold=1024 * 1024)
+    big = await AudioSource.from_upload(_CountingUpload(AUDIO), spool_threshold=64 * 1024)
+    assert not small.spooled and big.spooled
+    for src in (small, big):
+        assert len(src) == len(AUDIO)
+        assert src.sha256().hexdigest() == hashlib.sha256(AUDIO).hexdigest()
+        assert src[:4] == AUDIO[:4] and src[1000:1010] == AUDIO[1000:1010]
+        assert bytes(src.buffer()) == AUDIO
+    big.close()
+
+
+async def test_多个reader各自独立():
+    src = await AudioSource.from_upload(_CountingUpload(AUDIO), spool_threshold=1)
+    a, b = src.open(), src.open()
+    assert a.read(10) == AUDIO[:10]
+    assert b.read(20) == AUDIO[:20]
+    assert a.read(10) == AUDIO[10:20]
+    a.seek(0, io.SEEK_END)
+    assert a.tell() == len(AUDIO) and a.read(10) == b""
+
+
+async def test_没有pread也能按位置读落盘音频(monkeypatch):
+    monkeypatch.delattr(os, "pread", raising=False)          # Windows
+    src = await AudioSource.from_upload(_CountingUpload(AUDIO), spool_threshold=1)
+    assert src[:4] == AUDIO[:4] and src[len(AUDIO) - 3:] == AUDIO[-3:]
+    a, b = src.open(), src.open()
+    assert a.read(10) == AUDIO[:10] and b.read() == AUDIO and a.read(10) == AUDIO[10:20]
+    src.close()
+    assert src._mmap is None and src._file.closed
+
+
+async def test_超限立即停止读取():
+    upload = _CountingUpload(AUDIO)
+    with pytest.raises(UploadTooLarge) as ei:
+        await AudioSource.from_upload(upload, max_bytes=100 * 1024)
+    assert ei.value.status_code == 413
+    assert upload.reads <= 100 * 1024 // upload_intake.UPLOAD_READ_CHUNK + 1
+    assert "超过限制" in ei.value.message
+
+
+async def test_借用Starlette的临时文件_不复制第二份():
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024)
+    spooled.write(AUDIO)
+    spooled.seek(0)
+    upload = UploadFile(file=spooled, filename="a.wav")
+    src = await AudioSource.from_upload(upload, spool_threshold=64 * 1024)
+    assert os.fstat(src._file.fileno()).st_ino == os.fstat(spooled.fileno()).st_ino
+    await upload.close()                         # FastAPI 请求结束关掉自己的那份
+    assert src[:4] == AUDIO[:4] and bytes(src.buffer()) == AUDIO
+    src.close()
+    assert src._file.closed
+
+
+async def test_retain之后最后一个close才关文件():
+    src = await AudioSource.from_upload(_CountingUpload(AUDIO), spool_threshold=1)
+    src.retain()
+    src.close()
+    assert src.open().read(4) == AUDIO[:4]
+    src.close()
+    assert src._file.closed
+
+
+async def test_端点用完即关闭临时文件(monkeypatch):
+    seen = []
+
+    async def fake(**kw):
+        seen.append(kw["audio_content"])
+        return "你好", "openai_whisper", {}
+
+    monkeypatch.setattr(af, "transcribe_with_fallback", fake)
+    monkeypatch.setattr(server2, "TRANSCRIPTION_CACHE", tc.TranscriptionCache(disk_dir=None))
+    monkeypatch.setattr(server2, "IN_FLIGHT", tc.SingleFlight())
+    audio = os.urandom(2 * 1024 * 1024)
+    result = await server2.transcribe_segment(
+        audio_file=UploadFile(file=io.BytesIO(audio), filename="a.webm"), duration=30, needs_segmentation=None,
+        language=None, audio_source="microphone", preferred_api=None, idempotency_key=None, request=None)
+    assert result["success"] and seen[0].spooled and seen[0]._file.closed
+
+
+def test_缓存key与bytes一致():
+    src = AudioSource.from_bytes(AUDIO)
+    assert tc.cache_key(src, "en", "microphone", None) == tc.cache_key(AUDIO, "en", "microphone", None)
+
+
+# ---------- 中间件 ----------
+
+async def test_ContentLength超限不读请求体直接413():
+    app_called = False
+    body_reads = 0
+
+    async def inner(scope, receive, send):
+        nonlocal app_called
+        app_called = True
+
+    async def receive():
+        nonlocal body_reads
+        body_reads += 1
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    mw = UploadLimitMiddleware(inner, max_body_bytes=1000)
+    scope = {"type": "http", "path": "/transcribe-segment",
+             "headers": [(b"content-length", b"5000")]}
+    await mw(scope, receive, send)
+    assert not app_called and body_reads == 0
+    assert sent[0]["status"] == 413
+    assert json.loads(sent[1]["body"])["success"] is False
+
+
+async def test_无长度的大上传边收边数_超限413(monkeypatch):
+    monkeypatch.setattr(upload_intake, "UPLOAD_MAX_BYTES", 64 * 1024)
+    mw = next(m for m in server2.app.user_middleware if m.cls is UploadLimitMiddleware)
+    monkeypatch.setitem(mw.options, "max_body_bytes", 64 * 1024)
+    server2.app.middleware_stack = None          # 让改动后的上限生效
+    server2.RATE_LIMITER.reset()
+    server2.COST_LIMITER.reset()
+
+    boundary = b"x-boundary"
+
+    async def body():
+        yield b"--" + boundary + b'\r\nContent-Disposition: form-data; name="audio_file"; filename="a.wav"\r\n\r\n'
+        for _ in range(10):
+            yield b"\x00" * 16 * 1024
+        yield b"\r\n--" + boundary + b"--\r\n"
+
+    transport = httpx.ASGITransport(app=server2.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as c:
+            r = await c.post("/transcribe-segment", content=body(),
+                             headers={"Content-Type": "multipart/form-data; boundary=x-boundary"})
+    finally:
+        server2.app.middleware_stack = None
+    assert r.status_code == 413
+    assert r.json()["success"] is False
+
+
+# ---------- provider 适配器 ----------
+
+@pytest.fixture
+async def captured(monkeypatch):
+    seen = {}
+
+    async def handler(request):
+        seen["body"] = await request.aread()
+        seen["headers"] = request.headers
+        seen["host"] = request.url.host
+        if request.url.host == "api.deepgram.com":
+            return httpx.Response(200, json={"results": {"channels": [{"alternatives": [{"transcript": "你好"}]}]}})
+        if request.url.host == "speech.googleapis.com":
+            return httpx.Response(200, json={"results": [{"alternatives": [{"transcript": "你好"}]}]})
+        return httpx.Response(200, json={"text": "你好", "segments": None})
+
+    monkeypatch.setattr(http_client, "_TRANSPORT", httpx.MockTransport(handler))
+    await http_client.aclose_all()
+    yield seen
+    await http_client.aclose_all()
+
+
+async def test_openai适配器流式发送落盘音频(monkeypatch, captured):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    src = await AudioSource.from_upload(_CountingUpload(AUDIO), spool_threshold=1)
+    await af._transcribe_openai(src, "a.wav")
+    assert AUDIO in captured["body"]
+
+
+async def test_deepgram适配器接受memoryview(monkeypatch, captured):
+    monkeypatch.setattr(server2, "DEEPGRAM_API_KEY", "dg-test")
+    await af._transcribe_deepgram(memoryview(AUDIO), "a.wav")
+    assert captured["body"] == AUDIO
+    assert captured["headers"]["content-length"] == str(len(AUDIO))
+    assert "transfer-encoding" not in captured["headers"]
+
+
+async def test_google适配器对落盘音频做base64(monkeypatch, captured):
+    monkeypatch.setattr(server2.GOOGLE_TOKENS, "current_token", lambda: "token")
+    monkeypatch.setattr(server2, "get_project_id", lambda: "proj")
+    src = await AudioSource.from_upload(_CountingUpload(AUDIO), spool_threshold=1)
+    await af._transcribe_google(src, "a.wav")
+    sent = json.loads(captured["body"])
+    assert base64.b64decode(sent["audio"]["content"]) == AUDIO
@@ -0,0 +1,300 @@
+"""
+转录结果缓存（v131）—— 按内容寻址
+
+问题：同一段音频经常被重复提交——历史记录里的重试按钮、`uploadForTranscription` 超时后的
+自动重试、用户连点两次"转录"。每次重复都是一次实打实的付费 provider 调用。
+
+做法：key = SHA-256(音频字节) + language + audio_source + preferred_api。
+  · 内存层：OrderedDict 做 LRU，按条目字节数（转录文本 + 元数据的 JSON 长度）封顶；
+  · 磁盘层（可选，设 TRANSCRIPTION_CACHE_DIR 才开）：每条一个 JSON 文件，超过 TTL 即删，
+    进程重启/多 worker 之间也能命中；磁盘命中会回填内存层。
+
+只存转录结果，不存音频本身（key 里只有哈希），与 PRIVACY.md "音频不落盘"的承诺一致。
+只缓存成功结果——失败/空文本下次还要真的再试。
+
+v132 加了"在途"一层（SingleFlight）：缓存只管已完成的结果，而浏览器 120s 超时重传时，
+第一次的 Whisper 调用往往还在跑。同 key 的并发请求挂到同一个 Future 上等，不再重复调 provider。
+"""
+
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+import upload_intake
+
+
+CACHE_ENABLED = os.environ.get("TRANSCRIPTION_CACHE_ENABLED", "true").strip().lower() not in ("0", "false", "no", "off")
+CACHE_MAX_BYTES = int(os.environ.get("TRANSCRIPTION_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_DIR = os.environ.get("TRANSCRIPTION_CACHE_DIR", "").strip() or None
+CACHE_TTL_SECONDS = float(os.environ.get("TRANSCRIPTION_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+
+def cache_key(audio_content, language: Optional[str] = None,
+              audio_source: Optional[str] = None, preferred_api: Optional[str] = None) -> str:
+    """音频内容 + 会改变转录结果的参数 → 缓存 key（十六进制）。
+
+    audio_content 可以是 bytes / memoryview / upload_intake.AudioSource（v135：后者直接复用
+    接收上传时边读边算的哈希，不再把音频读一遍）。
+    """
+    h = upload_intake.audio_sha256(audio_content)
+    # 参数放在音频哈希之后、用不会出现在参数里的分隔符隔开，避免拼接歧义
+    params = "\x1f".join(str(v or "") for v in (language, audio_source or "microphone", preferred_api))
+    h.update(b"\x1e" + params.encode("utf-8"))
+    return h.hexdigest()
+
+
+class TranscriptionCache:
+    """两级缓存：内存 LRU（字节上限）+ 可选磁盘层（TTL）。"""
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, disk_dir: Optional[str] = CACHE_DIR,
+                 ttl_seconds: float = CACHE_TTL_SECONDS, clock=time.time):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (entry, size)
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    # ---------- 对外接口 ----------
+
+    def get(self, key: str) -> Optional[Tuple[str, str, Dict[str, Any], float]]:
+        """命中返回 (text, api_used, metadata, cached_at)，否则 None。"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                entry = item[0]
+                if self._expired(entry):
+                    self._drop(key)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._unpack(entry)
+
+        entry = self._disk_read(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._insert(key, entry)
+        return self._unpack(entry)
+
+    def put(self, key: str, text: str, api_used: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+        entry = {
+            "text": text,
+            "api_used": api_used,
+            "metadata": dict(metadata or {}),
+            "cached_at": self._clock(),
+        }
+        with self._lock:
+            self._insert(key, entry)
+        self._disk_write(key, entry)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.disk_hits = self.misses = self.evictions = 0
+
+    def purge_expired(self) -> int:
+        """删除磁盘层里过期的文件，返回删除数量。"""
+        if not self.disk_dir:
+            return 0
+        removed = 0
+        cutoff = self._clock() - self.ttl_seconds
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": CACHE_ENABLED,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_dir": self.disk_dir,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+    # ---------- 内部 ----------
+
+    @staticmethod
+    def _unpack(entry: Dict[str, Any]) -> Tuple[str, str, Dict[str, Any], float]:
+        return entry["text"], entry["api_used"], dict(entry["metadata"]), entry["cached_at"]
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return self._clock() - entry["cached_at"] > self.ttl_seconds
+
+    def _insert(self, key: str, entry: Dict[str, Any]) -> None:
+        size = len(json.dumps(entry, ensure_ascii=False, default=str).encode("utf-8"))
+        if size > self.max_bytes:
+            return  # 单条就超过上限，不进内存层（磁盘层照存）
+        self._drop(key)
+        self._entries[key] = (entry, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, old_size) = self._entries.popitem(last=False)
+            self._bytes -= old_size
+            self.evictions += 1
+
+    def _drop(self, key: str) -> None:
+        item = self._entries.pop(key, None)
+        if item is not None:
+            self._bytes -= item[1]
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_read(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(entry):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _disk_write(self, key: str, entry: Dict[str, Any]) -> None:
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False, default=str)
+            os.replace(tmp, path)  # 原子替换，多 worker 并发写同一 key 也不会读到半截文件
+        except OSError as e:
+            print(f"[v131-CACHE] ⚠️ 写磁盘缓存失败（忽略）: {e}")
+
+
+TRANSCRIPTION_CACHE = TranscriptionCache()
+
+
+# ============================================================
+# v132: 在途请求合并（single-flight）
+# ============================================================
+# 每组在途转录是一个独立的 asyncio.Task，调用方通过 asyncio.shield 等它：
+#   · 发起者断线（请求被取消）不会取消底层调用——结果仍会写缓存，也仍会交给挂在上面的重传请求；
+#   · 一组可以登记多个 key（内容哈希 + 客户端给的 Idempotency-Key），命中任意一个都算同一组。
+# v141：记录每组的等待者数。等待者因客户端断线离开时调用 abandon()：已经没人在等了就先通知发起者
+# （on_orphan，停止启动新的 provider），宽限期内仍没有重传请求合并进来、结果也没到，才取消底层调用。
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: Dict[str, "asyncio.Task"] = {}
+        self._waiters: Dict["asyncio.Task", int] = {}
+        self._on_orphan: Dict["asyncio.Task", Callable[[], None]] = {}
+        self.started = 0
+        self.joined = 0
+        self.orphaned = 0
+        self.cancelled = 0
+
+    def pending(self, key: str) -> bool:
+        task = self._flights.get(key)
+        return task is not None and not task.done()
+
+    async def do(self, keys: Iterable[Optional[str]], factory: Callable[[], Awaitable[Any]],
+                 on_orphan: Optional[Callable[[], None]] = None) -> Tuple[Any, bool]:
+        """同组已在途就等它的结果，否则新起一组。返回 (结果, 是否合并到了已有的一组)。
+
+        on_orphan：新起一组时登记，该组因断线没人再等时由 abandon() 调用。
+        """
+        keys = [k for k in keys if k]
+        for key in keys:
+            if self.pending(key):
+                self.joined += 1
+                print(f"[v132-DEDUP] 🔗 合并到在途请求 {key[:24]}…")
+                return await self._wait(self._flights[key]), True
+
+        task = asyncio.ensure_future(factory())
+        self.started += 1
+        for key in keys:
+            self._flights[key] = task
+        if on_orphan is not None:
+            self._on_orphan[task] = on_orphan
+        task.add_done_callback(lambda t: self._forget(keys, t))
+        return await self._wait(task), False
+
+    async def _wait(self, task):
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if task in self._waiters:        # 组已结束时 _forget 可能先一步清掉了
+                self._waiters[task] -= 1
+
+    def abandon(self, keys: Iterable[Optional[str]], grace: float = 0.0) -> bool:
+        """等待者断线离开后调用。该组已没有等待者时通知发起者（on_orphan），grace 秒后仍没人等、
+        也还没完成就取消底层调用。返回该组是否成了孤儿。"""
+        task = next((self._flights[k] for k in keys if k and self.pending(k)), None)
+        if task is None or self._waiters.get(task, 0) > 0:
+            return False
+        self.orphaned += 1
+        on_orphan = self._on_orphan.pop(task, None)
+        if on_orphan is not None:
+            on_orphan()
+        asyncio.get_running_loop().call_later(grace, self._cancel_orphan, task)
+        return True
+
+    def _cancel_orphan(self, task) -> None:
+        if not task.done() and self._waiters.get(task, 0) == 0:
+            self.cancelled += 1
+            print(f"[v141-DISCONNECT] 🛑 没有请求再等这次转录，取消在途调用")
+            task.cancel()
+
+    def _forget(self, keys, task) -> None:
+        for key in keys:
+            if self._flights.get(key) is task:
+                del self._flights[key]
+        self._waiters.pop(task, None)
+        self._on_orphan.pop(task, None)
+        # 所有等待者都断线时没人取结果，这里取一下，免得 asyncio 报 "exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len({id(t) for t in self._flights.values()}),
+            "started": self.started,
+            "joined": self.joined,
+            "orphaned": self.orphaned,
+            "cancelled": self.cancelled,
+        }
+
+
+IN_FLIGHT = SingleFlight()
@@ -0,0 +1,234 @@
+"""
+异步转录任务（v133）
+
+问题：`/transcribe-segment` 在整个 fallback 链跑完之前一直占着 HTTP 连接——每个 provider 最长 300s，
+最坏要好几分钟；手机网络一切换、浏览器一超时，连接就断了，结果白算。
+
+做法：任务模式——
+  · POST 只负责收下音频、入队，立刻返回 job_id；
+  · 固定数量的后台 worker（JOB_WORKERS）从队列取任务执行。provider 并发由 worker 数封顶，
+    与 HTTP 并发连接数脱钩；队列满（JOB_MAX_QUEUE）直接拒绝，不无限堆积；
+  · 客户端轮询 GET，或订阅 SSE 事件流拿状态变化；
+  · 结束的任务保留 JOB_RESULT_TTL_SECONDS 供取回，过期惰性清理。
+
+本模块只管排队/执行/状态，不关心"转录"本身——要跑什么由调用方传进来的协程工厂决定。
+
+v137：任务执行期间，调用链深处（如 Google long-running 轮询）可以调 report_progress() 把进度
+写进当前任务，GET / SSE 随状态一起返回；不在任务里调用时什么都不做。
+
+v156：submit(on_done=...) 在任务进入终态时恰好调用一次——不管是跑完、失败、被取消，还是压根没跑
+（换了事件循环作废、关闭时还在排队）。调用方占用的资源（每客户端在途名额、上传的临时文件）挂在这里释放，
+不能只放在任务协程的 finally 里：协程没跑，finally 也就不会执行。
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_MAX_QUEUE = int(os.environ.get("JOB_MAX_QUEUE", "100"))
+JOB_RESULT_TTL_SECONDS = float(os.environ.get("JOB_RESULT_TTL_SECONDS", "600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TERMINAL_STATES = (SUCCEEDED, FAILED)
+
+
+class JobQueueFull(Exception):
+    """队列已满，调用方应返回 503 让客户端稍后再试。"""
+
+
+# 当前正在执行的任务。worker 在调用任务协程前设置；任务里 ensure_future 出去的子任务
+# （如 v132 single-flight 的那一组）创建时复制上下文，也能看到它
+_CURRENT_JOB: "contextvars.ContextVar[Optional[Job]]" = contextvars.ContextVar("current_job", default=None)
+
+
+def report_progress(**fields: Any) -> None:
+    """把进度字段合并进当前任务的 progress（有变化才通知订阅者）；不在任务里时忽略。"""
+    job = _CURRENT_JOB.get()
+    if job is None or job.done:
+        return
+    if all(job.progress.get(k) == v for k, v in fields.items()):
+        return
+    job.progress.update(fields)
+    job._touch()
+
+
+class Job:
+    def __init__(self, fn: Callable[[], Awaitable[Any]], info: Optional[Dict[str, Any]] = None, clock=time.time,
+                 on_done: Optional[Callable[["Job"], None]] = None):
+        self.id = uuid.uuid4().hex   # 不可猜：job_id 即取结果的凭证
+        self.status = QUEUED
+        self.info = info or {}
+        self.progress: Dict[str, Any] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = clock()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.version = 0
+        self._fn = fn
+        self._on_done = on_done
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATES
+
+    def _finish(self, status: str, error: Optional[str], now: float, notify: bool = True) -> None:
+        """进入终态：记结束时间（TTL 清理按它算）、丢掉闭包、调 on_done（只调一次）。"""
+        self.status, self.error, self.finished_at = status, error, now
+        self._fn = None   # 释放闭包里的音频字节
+        on_done, self._on_done = self._on_done, None
+        if on_done is not None:
+            try:
+                on_done(self)
+            except Exception as e:
+                print(f"[v156-JOBS] ⚠️ {self.id[:8]} on_done 出错: {e}")
+        if notify:
+            self._touch()
+
+    def _touch(self) -> None:
+        # 每次状态变化换一个新 Event，唤醒所有正在等旧 Event 的 SSE 订阅者
+        self.version += 1
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait_change(self, since_version: int, timeout: float) -> bool:
+        """等到 version 超过 since_version；超时返回 False（SSE 借此发心跳）。"""
+        if self.version > since_version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "info": self.info,
+        }
+        if self.progress:
+            data["progress"] = dict(self.progress)
+        if self.status == SUCCEEDED:
+            data["result"] = self.result
+        elif self.status == FAILED:
+            data["error"] = self.error
+        return data
+
+
+class JobManager:
+    def __init__(self, workers: int = JOB_WORKERS, max_queue: int = JOB_MAX_QUEUE,
+                 ttl_seconds: float = JOB_RESULT_TTL_SECONDS, clock=time.time):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._loop = None
+
+    # ---------- 生命周期 ----------
+
+    def _ensure_started(self) -> None:
+        """worker 与事件循环绑定；首次提交或换了循环（测试、热重载）时（重新）拉起。"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._tasks:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.ensure_future(self._worker(i)) for i in range(self.workers)]
+        # 旧循环里没跑完的任务随旧循环一起作废（旧循环上的订阅者已不在，不再通知）
+        for job in self._jobs.values():
+            if not job.done:
+                job._finish(FAILED, "服务重启，任务已丢失", self._clock(), notify=False)
+        print(f"[v133-JOBS] 启动 {self.workers} 个 worker（队列上限 {self.max_queue}）")
+
+    async def stop(self) -> None:
+        tasks, self._tasks = self._tasks, []
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # 正在跑的由 _run 收尾；还在排队的不会再有 worker 取走，在这里结束
+        while self._queue is not None and not self._queue.empty():
+            job = self._queue.get_nowait()
+            if not job.done:
+                job._finish(FAILED, "服务正在关闭，任务未执行", self._clock())
+
+    # ---------- 对外接口 ----------
+
+    def submit(self, fn: Callable[[], Awaitable[Any]], info: Optional[Dict[str, Any]] = None,
+               on_done: Optional[Callable[[Job], None]] = None) -> Job:
+        """入队。on_done(job) 在任务进入终态时调用一次；队列满抛 JobQueueFull 时不会调用（任务没被收下）。"""
+        self._ensure_started()
+        self.purge_expired()
+        job = Job(fn, info, clock=self._clock, on_done=on_done)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"任务队列已满（{self.max_queue}）")
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self.purge_expired()
+        return self._jobs.get(job_id)
+
+    def purge_expired(self) -> int:
+        now = self._clock()
+        expired = [jid for jid, j in self._jobs.items()
+                   if j.done and j.finished_at is not None and now - j.finished_at > self.ttl_seconds]
+        for jid in expired:
+            del self._jobs[jid]
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for j in self._jobs.values():
+            counts[j.status] = counts.get(j.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "max_queue": self.max_queue,
+            "jobs": counts,
+        }
+
+    # ---------- worker ----------
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        job.status, job.started_at = RUNNING, self._clock()
+        job._touch()
+        token = _CURRENT_JOB.set(job)
+        status, error = FAILED, "任务被取消（服务正在关闭）"
+        try:
+            job.result = await job._fn()
+            status, error = SUCCEEDED, None
+        except Exception as e:
+            error = str(e)
+        finally:
+            _CURRENT_JOB.reset(token)
+            job._finish(status, error, self._clock())
+            print(f"[v133-JOBS] {job.id[:8]} {job.status}，耗时 {job.finished_at - job.started_at:.2f}s")
+
+
+JOB_MANAGER = JobManager()
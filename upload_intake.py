@@ -0,0 +1,353 @@
+"""
+上传音频的接收与承载（v135）
+
+问题：`transcribe_segment` 先 `await audio_file.read()` 把整个文件读进内存，然后才检查 25MB 上限——
+超大/恶意上传要先完整进 RAM 才被拒；20 个并发 25MB 上传就是 500MB 常驻内存，这还没算
+Google 路径 base64 再翻一倍。
+
+做法：
+  · UploadLimitMiddleware（纯 ASGI）：上传路径先看 Content-Length，超限直接 413，一个字节都不读；
+    没带 Content-Length（chunked）时边收边数，超限立刻中断；
+  · AudioSource：按 64KB 分块从 UploadFile 读出，边读边算 SHA-256、边计数（超限即停）；
+    小于 UPLOAD_SPOOL_THRESHOLD 的留在内存，更大的直接借用 Starlette 已经落盘的那个临时文件
+    （dup 一个 fd，不再复制第二份；FastAPI 请求结束关掉它自己的 fd 不影响我们）；
+  · 生命周期：请求 / 任务用完在 finally 里 close()；在途合并（v132）的底层转录另行 retain()，
+    全部持有者都释放了才真正关文件、解除 mmap——发起请求断线离开，组里别的请求照样读得到；
+  · provider 适配器不再要求 bytes：open_reader() 给每次调用一个独立的只读文件对象（multipart
+    流式发送；对冲/竞速时几路并发互不干扰），as_buffer() 给 memoryview（临时文件走 mmap，按需分页）。
+    bytes / memoryview / AudioSource 三种都接受，老代码和测试传 bytes 照常工作。
+
+于是每个请求的常驻内存基本与上传大小无关。
+"""
+
+import io
+import os
+import mmap
+import hashlib
+import tempfile
+from typing import AsyncIterator, Optional, Union
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_SPOOL_THRESHOLD = int(os.environ.get("UPLOAD_SPOOL_THRESHOLD", str(1024 * 1024)))
+UPLOAD_READ_CHUNK = 64 * 1024
+# Content-Length 是整个 multipart 请求体：除音频外还有边界、各表单字段，给一点余量
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+UPLOAD_LIMITED_PATHS = {
+    "/transcribe-segment",
+    "/transcribe-jobs",
+    "/speech-to-text",
+    "/speech-to-text-aibuilder",
+}
+
+
+class UploadTooLarge(HTTPException):
+    """上传超过上限。继承 HTTPException：在表单解析途中抛出时 FastAPI 会原样透传，不会被包成 400。"""
+
+    def __init__(self, received: int, limit: int = UPLOAD_MAX_BYTES):
+        self.received = received
+        self.limit = limit
+        super().__init__(status_code=413, detail=f"上传超过限制（已收到 {received} 字节 > {limit} 字节）")
+
+    @property
+    def message(self) -> str:
+        return f"音频文件太大，超过限制 ({self.limit / 1024 / 1024:.0f} MB)。请尝试转录更短的片段。"
+
+
+class AudioSource:
+    """一段上传音频：小的是内存里的 bytes，大的是匿名临时文件。len() 即字节数。"""
+
+    def __init__(self, data: Optional[bytes] = None, file=None, size: int = 0, hasher=None):
+        self._data = data
+        self._file = file
+        self._size = len(data) if data is not None else size
+        self._hasher = hasher
+        self._mmap = None
+        self._refs = 1
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "AudioSource":
+        return cls(data=bytes(data), hasher=hashlib.sha256(data))
+
+    @classmethod
+    async def from_upload(cls, upload, max_bytes: int = UPLOAD_MAX_BYTES,
+                          spool_threshold: int = UPLOAD_SPOOL_THRESHOLD) -> "AudioSource":
+        """分块读取 UploadFile；超过 max_bytes 立即停止并抛 UploadTooLarge。
+
+        超过 spool_threshold 时借用 upload.file 底下的临时文件（dup 一个 fd），之后只读不存；
+        拿不到 fd 的（测试里的 BytesIO 之类）才复制到自己的临时文件。
+        """
+        hasher = hashlib.sha256()
+        buf = bytearray()
+        file = None
+        copying = False
+        size = 0
+        try:
+            while True:
+                chunk = await upload.read(UPLOAD_READ_CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(size, max_bytes)
+                hasher.update(chunk)
+                if file is None and size > spool_threshold:
+                    file = _borrow_file(getattr(upload, "file", None))
+                    if file is None:
+                        file = tempfile.TemporaryFile(prefix="voicespark-upload-")
+                        file.write(buf)
+                        copying = True
+                    buf = None
+                if copying:
+                    file.write(chunk)
+                elif file is None:
+                    buf += chunk
+        except BaseException:
+            if file is not None:
+                file.close()
+            raise
+        if file is None:
+            return cls(data=bytes(buf), hasher=hasher)
+        file.flush()
+        return cls(file=file, size=size, hasher=hasher)
+
+    @property
+    def spooled(self) -> bool:
+        return self._file is not None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, key):
+        """只支持切片（读文件头用）：source[:4]、source[8:12]。"""
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("AudioSource 只支持连续切片")
+        start, stop, _ = key.indices(self._size)
+        if stop <= start:
+            return b""
+        if self._data is not None:
+            return self._data[start:stop]
+        with self.buffer() as view:
+            return bytes(view[start:stop])
+
+    def sha256(self):
+        """已算好的 SHA-256 状态（副本，调用方可以继续 update）。"""
+        return self._hasher.copy()
+
+    def open(self) -> io.RawIOBase:
+        """新开一个独立的只读文件对象（各自维护读位置）。"""
+        if self._data is not None:
+            return io.BytesIO(self._data)   # bytes 不会被复制
+        return _PositionalReader(self)
+
+    def buffer(self) -> memoryview:
+        """整段内容的 memoryview；临时文件走 mmap，不整体读进内存。"""
+        if self._data is not None:
+            return memoryview(self._data)
+        if self._size == 0:
+            return memoryview(b"")
+        if self._mmap is None:
+            self._mmap = mmap.mmap(self._file.fileno(), self._size, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
+
+    async def aiter_chunks(self, chunk_size: int = UPLOAD_READ_CHUNK) -> AsyncIterator[bytes]:
+        reader = self.open()
+        while True:
+            chunk = reader.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self) -> bytes:
+        """完整复制成 bytes（只给确实需要 bytes 的老代码兜底用）。"""
+        if self._data is not None:
+            return self._data
+        return bytes(self.buffer())
+
+    def retain(self) -> "AudioSource":
+        """多一个持有者（在途合并的底层转录），对应一次 close()。"""
+        self._refs += 1
+        return self
+
+    def close(self) -> None:
+        """释放一次持有；最后一个持有者释放时才关临时文件、解除 mmap。"""
+        self._refs -= 1
+        if self._refs > 0:
+            return
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                return  # 还有 memoryview 在用，交给 GC
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+
+
+def _borrow_file(file):
+    """Starlette 的 SpooledTemporaryFile 已落盘（或可以落盘）时 dup 出一个独立的只读 fd；不行返回 None。"""
+    try:
+        file.flush()
+        fd = os.dup(file.fileno())          # 还在内存里的 SpooledTemporaryFile 会在这里落盘
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return None
+    return open(fd, "rb", buffering=0)
+
+
+class _PositionalReader(io.RawIOBase):
+    """临时文件的只读视图：共享同一个 mmap，但各自有独立读位置，互不干扰。
+
+    按位置从 mmap 切片读，不用 os.pread（Windows 没有），也不动共享 fd 的文件指针。
+    每次读完立即释放 memoryview，不妨碍 AudioSource.close() 解除 mmap。
+    """
+
+    def __init__(self, source: AudioSource):
+        self._source = source   # 持有引用，保证临时文件活得比读者久
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._source)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def readinto(self, b) -> int:
+        n = min(len(b), max(0, len(self._source) - self._pos))
+        if n:
+            with self._source.buffer() as view, view[self._pos:self._pos + n] as chunk:
+                b[:n] = chunk
+        self._pos += n
+        return n
+
+
+class _MemoryviewReader(io.RawIOBase):
+    """memoryview 的只读文件视图：按块切片发送，不先拷贝成 bytes。"""
+
+    def __init__(self, view: memoryview):
+        self._view = view.cast("B") if view.format != "B" or view.ndim != 1 else view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def readinto(self, b) -> int:
+        chunk = self._view[self._pos:self._pos + len(b)]
+        n = len(chunk)
+        b[:n] = chunk
+        self._pos += n
+        return n
+
+
+AudioLike = Union[bytes, bytearray, memoryview, AudioSource]
+
+
+def open_reader(audio: AudioLike):
+    """给 multipart 上传用的独立文件对象。"""
+    if isinstance(audio, AudioSource):
+        return audio.open()
+    if isinstance(audio, memoryview):
+        return _MemoryviewReader(audio)
+    return io.BytesIO(audio)
+
+
+def as_buffer(audio: AudioLike):
+    """给 base64 等需要缓冲区协议的地方用（bytes / memoryview 原样返回）。"""
+    if isinstance(audio, AudioSource):
+        return audio.buffer()
+    return audio
+
+
+def as_content(audio: AudioLike):
+    """给 httpx `content=` 用：bytes 原样；其余按块异步迭代（调用方需自带 Content-Length 头）。"""
+    if isinstance(audio, (bytes, bytearray)):
+        return bytes(audio)
+    if isinstance(audio, memoryview):
+        reader = _MemoryviewReader(audio)
+
+        async def _chunks():
+            while True:
+                chunk = reader.read(UPLOAD_READ_CHUNK)
+                if not chunk:
+                    return
+                yield chunk
+        return _chunks()
+    return audio.aiter_chunks()
+
+
+def audio_sha256(audio: AudioLike):
+    """音频内容的 SHA-256 状态；AudioSource 直接复用读取时算好的结果。"""
+    if isinstance(audio, AudioSource):
+        return audio.sha256()
+    return hashlib.sha256(audio)
+
+
+# ============================================================
+# 请求体上限（纯 ASGI 中间件）
+# ============================================================
+# 收到一半才超限时在 receive 里抛 UploadTooLarge：此时处于 FastAPI 表单解析途中，异常一路透传到
+# server2 注册的 exception handler，由它回 413；Content-Length 一看就超限的，这里直接回 413。
+
+def too_large_response(exc: UploadTooLarge) -> JSONResponse:
+    return JSONResponse(status_code=413, content={
+        "success": False,
+        "message": exc.message,
+        "text": "",
+    })
+
+
+class UploadLimitMiddleware:
+    def __init__(self, app, max_body_bytes: int = UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES,
+                 paths=UPLOAD_LIMITED_PATHS):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        declared = None
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                declared = value
+                break
+        if declared is not None and declared.isdigit() and int(declared) > self.max_body_bytes:
+            print(f"[v135-INTAKE] 🚫 Content-Length {int(declared)} > {self.max_body_bytes}，未读请求体直接拒绝")
+            response = too_large_response(UploadTooLarge(int(declared), UPLOAD_MAX_BYTES))
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    print(f"[v135-INTAKE] 🚫 请求体已收 {received} 字节，超限中断")
+                    raise UploadTooLarge(received, UPLOAD_MAX_BYTES)
+            return message
+
+        await self.app(scope, limited_receive, send)